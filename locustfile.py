@@ -1,12 +1,32 @@
-from locust import HttpUser, User, task, constant_throughput, between
+from locust import HttpUser, FastHttpUser, User, task, constant, between, events
+from locust.clients import HttpSession
+from locust.contrib.fasthttp import FastHttpSession
+from locust.exception import StopUser
+from requests.adapters import HTTPAdapter
 from requests_toolbelt.adapters.source import SourceAddressAdapter
-import random, os, time, json, logging
-import dns.message
+import random, os, time, logging
+import gevent.pool
+import dns.exception
+import dns.rcode
 import dns.rdatatype
-import dns.query
-from pathlib import Path
-from utils.ip_manager import get_source_ip  # 從 utils 模組導入
+from utils.ip_manager import get_source_ip, install_ip_allocation_view, release_source_ip  # 從 utils 模組導入
 from utils.target_server import get_target_servers  # 導入目標伺服器管理器
+from utils.profiles import ProfileRegistry, get_user_profile  # 每個行程只載入一次的設定檔
+from utils.side_metrics import SideMetrics, install_side_metrics  # 不進入 Locust stats 樹的細部統計
+from utils.partition import install_partitioning, worker_partition  # 分散式執行時由 master 分配各 worker 的 IP 區段
+from utils.ip_health import install_ip_health  # 來源 IP 健康監測與自動隔離
+from utils.http_pool import ConnectionPolicy  # 每個 User 或每個來源 IP 共用的連線池
+from utils.hls import PlaylistCache, parse_master_playlist, parse_media_playlist, parse_segment_durations  # playlist 解析與行程內快取
+from utils.abr import AbrPlayer, DEFAULT_RENDITIONS  # ABR 播放器模型（畫質選擇與 buffer）
+from utils.lrd import LrdSampler  # NumPy 批次產生的 ON/OFF 時間樣本
+from utils.trace import ReplayClock, iter_trace  # trace 檔串流讀取與重播排程
+from utils.dns_engine import DnsEngine, OpenLoopSender, TimerWheel  # 每個 (來源 IP, DNS 伺服器) 共用一個 UDP socket
+from utils.async_logging import install_async_logging, record_lifecycle  # 背景批次寫出日誌與 User 生命週期計數
+from utils.mqtt_engine import MqttEngine, MqttError, make_schedule  # 綁定來源 IP 的持久 MQTT 連線與 echo 配對
+from utils.swarm import STOPPED, SwarmScheduler, UeTable  # 單一 greenlet 排程大量虛擬 UE
+from utils.latency_matrix import install_latency_matrix  # 依來源 IP × 目標細分的延遲矩陣
+from utils.latency import IntendedSchedule, install_latency_recording, record_latency  # 從預定送出時間起算的延遲（修正 coordinated omission）
+from utils.saturation import install_saturation_monitor  # 事件迴圈延遲與產生器 CPU 飽和監測
 
 # 設定日誌格式，方便除錯
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -19,28 +39,54 @@ logger = logging.getLogger(__name__)
 # 建議範圍 1.2 (強) ~ 1.6 (中)
 PARETO_ALPHA_SESSION = 1.4  # 用於決定看多久 (ON Period)
 PARETO_ALPHA_WAIT = 1.4     # 用於決定休息多久 (OFF Period)
-
-def _load_user_config():
-    """載入 config-users.json 配置檔案"""
-    base_dir = Path(__file__).parent
-    config_file = base_dir / 'profiles' / 'config-users.json'
-    try:
-        with open(config_file, 'r') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"[Config] Error loading config-users.json: {e}")
-        return []
+# 取樣器的亂數種子（環境變數 LRD_SEED），每個 worker 另以 worker index 區分
+LRD_SEED_ENV = 'LRD_SEED'
 
 def _get_target_count_for_user(user_class_name: str) -> int:
     """從配置中獲取特定 User 類型的 target_server_count"""
-    config = _load_user_config()
-    for user_config in config:
-        if user_config.get('user_class_name') == user_class_name:
-            return user_config.get('target_server_count', 0)
-    return 0
+    return get_user_profile(user_class_name).get('target_server_count', 0)
 
-class SocialUser(HttpUser):
-    """社群互動用戶：使用 requests.Session 綁定來源 IP"""
+
+@events.init.add_listener
+def _on_locust_init(environment, **kwargs):
+    """安裝 SIGHUP 處理器：收到訊號時重新載入 profiles/ 下的設定檔，並註冊非同步日誌、side metrics、修正後延遲、延遲矩陣、產生器飽和監測、IP 區段分配、IP 分配表與 IP 健康監測"""
+    install_async_logging(environment)
+    ProfileRegistry().install_reload_signal()
+    install_side_metrics(environment)
+    install_latency_recording(environment)
+    install_latency_matrix(environment)
+    install_saturation_monitor(environment)
+    install_partitioning(environment)
+    install_ip_allocation_view(environment)
+    install_ip_health(environment)
+
+
+@events.test_start.add_listener
+def _on_test_start(environment, **kwargs):
+    """每次測試開始時，若設定檔有變更才重新載入（不會在每個 User 建立時讀檔）"""
+    ProfileRegistry().reload_if_changed()
+    
+    # 重新設定 LRD 取樣器：同一個 LRD_SEED 下每個 worker 的序列可重現且互不相同
+    seed = os.environ.get(LRD_SEED_ENV)
+    sampler = LrdSampler()
+    sampler.seed(int(seed) if seed else None, getattr(environment.runner, 'worker_index', 0))
+    envelope = (get_user_profile('VideoUser').get('lrd_envelope')
+                or get_user_profile('FastVideoUser').get('lrd_envelope'))
+    if envelope:
+        sampler.configure_envelope(hurst=envelope.get('hurst', 0.8),
+                                   sigma=envelope.get('sigma', 0.3),
+                                   duration=envelope.get('duration', 3600),
+                                   step=envelope.get('step', 1.0),
+                                   origin=time.time())
+
+class SocialUserBase(User):
+    """
+    社群互動用戶的行為，與 HTTP client 無關。
+    
+    實際執行的是 SocialUser（HttpUser，requests）與 FastSocialUser（FastHttpUser，geventhttpclient），
+    兩者都由 ConnectionPolicy 綁定來源 IP，可在 config-users.json 中擇一或同時使用。
+    """
+    abstract = True
     wait_time = between(30, 100)  # 在 30 到 100 秒之間隨機等待
     
     def __init__(self, *args, **kwargs):
@@ -51,16 +97,36 @@ class SocialUser(HttpUser):
         # 獲取目標伺服器列表
         target_count = _get_target_count_for_user(self.__class__.__name__)
         self.target_servers = get_target_servers(self.__class__.__name__, target_count)
-        print(f"[SocialUser] Initialized with source IP: {self.source_ip}, "
-              f"target servers: {self.target_servers}")
+        logger.debug("[%s] Initialized with source IP: %s, target servers: %s",
+                     self.__class__.__name__, self.source_ip, self.target_servers)
+        
+        # 連線池模式：per_user（預設）、shared（同一來源 IP 的 User 共用）或 per_session
+        self.connections = ConnectionPolicy(get_user_profile(self.__class__.__name__).get('connection_pool'))
     
     def on_start(self):
         """在 on_start 中掛載 SourceAddressAdapter"""
-        print(f"[SocialUser] 🔧 Mounting SourceAddressAdapter for IP: {self.source_ip}")
-        adapter = SourceAddressAdapter((self.source_ip, 0))
-        self.client.mount("http://", adapter)
-        self.client.mount("https://", adapter)
-        print(f"[SocialUser] ✅ Adapter mounted. All requests from this user will use {self.source_ip}")
+        if self.source_ip is None:
+            # 所有來源 IP 都已達到上限
+            record_lifecycle(self.__class__.__name__, 'no_source_ip')
+            raise StopUser()
+        self.connections.mount(self.client, self.source_ip)
+        record_lifecycle(self.__class__.__name__, 'started')
+        logger.debug("[%s] Mounted source IP %s (%s)", self.__class__.__name__, self.source_ip, self.connections.mode)
+    
+    def on_stop(self):
+        """釋放來源 IP，讓之後建立的 User 平均分配"""
+        release_source_ip(self.__class__.__name__, self.source_ip)
+        record_lifecycle(self.__class__.__name__, 'stopped')
+    
+    def on_source_ip_changed(self, old_ip: str, new_ip: str):
+        """來源 IP 被隔離後改綁到 new_ip，重新掛載 adapter"""
+        logger.info("[%s] Source IP %s quarantined, moving to %s", self.__class__.__name__, old_ip, new_ip)
+        record_lifecycle(self.__class__.__name__, 'migrated')
+        self.connections.mount(self.client, new_ip)
+    
+    def context(self):
+        """request 事件帶上來源 IP，供 IP 健康監測統計"""
+        return {'source_ip': self.source_ip}
     
     def _get_target_host(self):
         """從目標伺服器列表中隨機選擇一個，返回不含 http:// 前綴的主機地址"""
@@ -79,24 +145,43 @@ class SocialUser(HttpUser):
         # 圖片/短片混合
         target_host = self._get_target_host()
         url = f"http://{target_host}/feed?since={random.randint(1, 1_000_000_000)}"
-        logger.debug(f"[SocialUser] Requesting: {url}")
+        logger.debug("[SocialUser] Requesting: %s", url)
         self.client.get(url, name="SOCIAL:feed")
         # 小上傳（評論/按讚）
         if random.random()<0.3:
             url = f"http://{target_host}/react"
-            logger.debug(f"[SocialUser] Posting to: {url}")
+            logger.debug("[SocialUser] Posting to: %s", url)
             self.client.post(url, json={"pid":random.randint(1, 1_000_000)}, name="SOCIAL:react")
+        self.connections.end_session(self.client)
     
     @task(4)  # 其他：瀏覽/搜尋
     def browse(self):
         target_host = self._get_target_host()
         url = f"http://{target_host}/"
-        logger.debug(f"[SocialUser] Browsing: {url}")
+        logger.debug("[SocialUser] Browsing: %s", url)
         self.client.get(url, name="WEB:index")
+        self.connections.end_session(self.client)
+
+
+class SocialUser(SocialUserBase, HttpUser):
+    """社群互動用戶：使用 requests.Session 綁定來源 IP"""
+
 
+class FastSocialUser(SocialUserBase, FastHttpUser):
+    """社群互動用戶：使用 FastHttpSession（geventhttpclient）綁定來源 IP，每個請求的 CPU 用量較低"""
+    # 只有 config-users.json 中有 FastSocialUser 的設定時才執行
+    abstract = not get_user_profile('FastSocialUser')
 
-class VideoUser(HttpUser):
-    """影音串流用戶：模擬 LRD 特性的長時間連續 session"""
+
+class VideoUserBase(User):
+    """
+    影音串流用戶的行為：模擬 LRD 特性的長時間連續 session，與 HTTP client 無關。
+    
+    實際執行的是 VideoUser（HttpUser）與 FastVideoUser（FastHttpUser）。
+    """
+    abstract = True
+    # segment 請求的額外參數（requests 的讀取逾時）
+    segment_request_kwargs = {'timeout': 30}
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -106,16 +191,62 @@ class VideoUser(HttpUser):
         # 獲取目標伺服器列表
         target_count = _get_target_count_for_user(self.__class__.__name__)
         self.target_servers = get_target_servers(self.__class__.__name__, target_count)
-        print(f"[VideoUser] Initialized with source IP: {self.source_ip}, "
-              f"target servers: {self.target_servers}")
+        logger.debug("[%s] Initialized with source IP: %s, target servers: %s",
+                     self.__class__.__name__, self.source_ip, self.target_servers)
+        
+        # segment 下載模式：stream（預設，分塊讀取後丟棄）或 buffered（整段讀進記憶體）
+        profile = get_user_profile(self.__class__.__name__)
+        self.segment_fetch = profile.get('segment_fetch', 'stream')
+        self.stream_chunk_size = profile.get('stream_chunk_size', 64 * 1024)
+        self._chunk_buffer = None
+        
+        # 連線池模式：per_user（預設）、shared（同一來源 IP 的 User 共用）或 per_session
+        self.connections = ConnectionPolicy(profile.get('connection_pool'))
+        
+        # playlist 快取模式：cold（預設，每次都下載）或 warm（行程內共用快取，TTL 內不重新下載）
+        self.playlist_cache = profile.get('playlist_cache', 'cold')
+        if self.playlist_cache == 'warm':
+            PlaylistCache().configure(max_entries=profile.get('playlist_cache_size'),
+                                      ttl=profile.get('playlist_cache_ttl'))
+        
+        # ON/OFF 時間取樣：python（預設，每次呼叫 random.paretovariate 後截斷）
+        # 或 batched（行程內共用的 NumPy 截斷 Pareto 環狀緩衝區，可用 LRD_SEED 重現）
+        self.lrd_sampler = profile.get('lrd_sampler', 'python')
+        
+        # ABR 播放器模式：設定 abr 區塊後依 buffer 與下載速率選擇畫質，取代固定 720p 與隨機間隔
+        abr = profile.get('abr') or {}
+        self.abr_enabled = bool(abr) and abr.get('enabled', True)
+        self.abr_renditions = abr.get('renditions', DEFAULT_RENDITIONS)
+        self.abr_master_playlist = abr.get('master_playlist')
+        self.abr_options = {key: abr[key] for key in AbrPlayer.OPTIONS if key in abr}
 
     def on_start(self):
         """在 on_start 中掛載 SourceAddressAdapter"""
-        print(f"[VideoUser] 🔧 Mounting SourceAddressAdapter for IP: {self.source_ip}")
-        adapter = SourceAddressAdapter((self.source_ip, 0))
-        self.client.mount("http://", adapter)
-        self.client.mount("https://", adapter)
-        print(f"[VideoUser] ✅ Adapter mounted. All requests from this user will use {self.source_ip}")
+        if self.source_ip is None:
+            # 所有來源 IP 都已達到上限
+            record_lifecycle(self.__class__.__name__, 'no_source_ip')
+            raise StopUser()
+        self.connections.mount(self.client, self.source_ip)
+        record_lifecycle(self.__class__.__name__, 'started')
+        logger.debug("[%s] Mounted source IP %s (%s)", self.__class__.__name__, self.source_ip, self.connections.mode)
+        if self.segment_fetch == 'stream':
+            # 每個 User 重複使用同一塊緩衝區，segment 內容讀完即丟棄
+            self._chunk_buffer = memoryview(bytearray(self.stream_chunk_size))
+    
+    def on_stop(self):
+        """釋放來源 IP，讓之後建立的 User 平均分配"""
+        release_source_ip(self.__class__.__name__, self.source_ip)
+        record_lifecycle(self.__class__.__name__, 'stopped')
+    
+    def on_source_ip_changed(self, old_ip: str, new_ip: str):
+        """來源 IP 被隔離後改綁到 new_ip，重新掛載 adapter"""
+        logger.info("[%s] Source IP %s quarantined, moving to %s", self.__class__.__name__, old_ip, new_ip)
+        record_lifecycle(self.__class__.__name__, 'migrated')
+        self.connections.mount(self.client, new_ip)
+    
+    def context(self):
+        """request 事件帶上來源 IP，供 IP 健康監測統計"""
+        return {'source_ip': self.source_ip}
     
     def _get_target_host(self):
         """從目標伺服器列表中隨機選擇一個，返回不含 http:// 前綴的主機地址"""
@@ -129,29 +260,143 @@ class VideoUser(HttpUser):
             host = host[8:]
         return host
     
-    def _parse_playlist(self, playlist_content: str) -> list:
+    def _fetch_segment(self, seg_url: str, seg_filename: str):
+        """
+        下載一個 segment，依 segment_fetch 設定選擇模式。
+        
+        Returns:
+            (HTTP 狀態碼, 收到的位元組數, 下載秒數)
+        """
+        if self.segment_fetch == 'stream':
+            return self._fetch_segment_stream(seg_url, seg_filename)
+        
+        start_time = time.perf_counter()
+        with self.client.get(seg_url, name="VIDEO:hls_seg", catch_response=True,
+                             **self.segment_request_kwargs) as resp:
+            if resp.status_code != 200:
+                logger.error("[VideoUser] ❌ Segment request failed: %s - Status: %s", seg_url, resp.status_code)
+                resp.failure(f"Segment {seg_filename} failed with status {resp.status_code}")
+            else:
+                logger.debug("[VideoUser] ✅ Segment %s downloaded successfully (%d bytes)",
+                             seg_filename, len(resp.content or b''))
+            return resp.status_code, len(resp.content or b''), time.perf_counter() - start_time
+    
+    def _fetch_segment_stream(self, seg_url: str, seg_filename: str):
+        """
+        串流下載 segment：以固定大小分塊讀進重複使用的緩衝區後丟棄，不保留整段內容。
+        
+        Locust stats 只記一筆 VIDEO:hls_seg（完整下載時間與實際收到的位元組數），其餘記錄在 side metrics：
+        - video_ttfb          收到回應 header 的時間（time-to-first-byte，毫秒）
+        - video_throughput    下載速率（Mbit/s）
+        """
+        start_time = time.perf_counter()
+        total_bytes = 0
+        failed = False
+        
+        with self.client.get(seg_url, name="VIDEO:hls_seg", stream=True,
+                             catch_response=True, **self.segment_request_kwargs) as resp:
+            # client.get 在收到 header 時返回，request_meta 的 response_time 即為 TTFB
+            ttfb_ms = resp.request_meta['response_time']
+            if resp.status_code != 200:
+                logger.error("[VideoUser] ❌ Segment request failed: %s - Status: %s", seg_url, resp.status_code)
+                resp.failure(f"Segment {seg_filename} failed with status {resp.status_code}")
+                failed = True
+            else:
+                try:
+                    for n in self._iter_stream(resp):
+                        total_bytes += n
+                except Exception as e:
+                    resp.failure(e)
+                    failed = True
+            elapsed = time.perf_counter() - start_time
+            # 離開 with 時才送出 request 事件：改記完整下載時間與位元組數
+            resp.request_meta['response_time'] = elapsed * 1000
+            resp.request_meta['response_length'] = total_bytes
+        
+        metrics = SideMetrics()
+        metrics.record("video_ttfb", "VIDEO:hls_seg (ms)", ttfb_ms, failed=failed)
+        if not failed and elapsed > 0:
+            metrics.record("video_throughput", "VIDEO:hls_seg (Mbit/s)",
+                           total_bytes * 8 / elapsed / 1_000_000)
+        logger.debug("[VideoUser] Segment %s: %d bytes in %.3fs", seg_filename, total_bytes, elapsed)
+        return resp.status_code, total_bytes, elapsed
+    
+    def _iter_stream(self, resp):
+        """把串流回應的內容讀進重複使用的緩衝區，逐塊回傳讀到的位元組數。"""
+        buffer = self._chunk_buffer
+        readinto = resp.raw.readinto
+        while True:
+            n = readinto(buffer)
+            if not n:
+                return
+            yield n
+    
+    def _parse_playlist(self, playlist_content) -> list:
         """
         Parse M3U8 playlist and return a list of segment filenames.
 
         Args:
-            playlist_content: playlist text content
+            playlist_content: playlist content (bytes or text)
 
         Returns:
             list of segment filenames (basename only)
         """
-        segments = []
-        for line in playlist_content.split('\n'):
-            line = line.strip()
-            # 跳過註解和空行
-            if line and not line.startswith('#'):
-                # 處理相對路徑（例如：../../seg-734.ts）
-                if line.startswith('../'):
-                    # 移除 ../ 前綴，只保留檔名
-                    filename = line.split('/')[-1]
-                    segments.append(filename)
-                else:
-                    segments.append(line)
-        return segments
+        return parse_media_playlist(playlist_content)
+    
+    def _load_playlist(self, playlist_url: str, playlist_path: str, with_durations: bool = False):
+        """
+        取得 playlist 的 segment 列表，失敗時回傳 None。
+        with_durations 為 True 時回傳 (segment 列表, #EXTINF 秒數列表)。
+        
+        playlist_cache 為 cold 時每次都下載（模擬冷啟動的播放器）；
+        為 warm 時使用行程內共用的快取，TTL 內不發出請求，過期後以 ETag / If-Modified-Since 重新驗證。
+        """
+        entry = None
+        if self.playlist_cache == 'warm':
+            cache = PlaylistCache()
+            entry = cache.get(playlist_path)
+            if entry is not None and cache.is_fresh(entry):
+                logger.debug("[VideoUser] Playlist cache hit: %s", playlist_path)
+                return self._playlist_result(entry['segments'], entry['durations'], with_durations)
+        
+        headers = PlaylistCache.conditional_headers(entry)
+        with self.client.get(playlist_url, name="VIDEO:playlist", headers=headers, catch_response=True) as resp:
+            if resp.status_code == 304 and entry is not None:
+                # 內容未變更，沿用快取的 segment 列表
+                PlaylistCache().touch(playlist_path)
+                resp.success()
+                return self._playlist_result(entry['segments'], entry['durations'], with_durations)
+            
+            if resp.status_code != 200:
+                logger.error("[VideoUser] ❌ Playlist request failed: %s - Status: %s, Response: %.200s",
+                             playlist_url, resp.status_code, resp.text)
+                resp.failure(f"Playlist failed with status {resp.status_code}")
+                return None
+            
+            # 解析 playlist 獲取實際的 segment 列表
+            if self.playlist_cache == 'warm':
+                entry = PlaylistCache().put(
+                    playlist_path, resp.content,
+                    etag=resp.headers.get('ETag'),
+                    last_modified=resp.headers.get('Last-Modified'),
+                )
+                segments, durations = list(entry['segments']), entry['durations']
+            else:
+                segments = self._parse_playlist(resp.content)
+                durations = parse_segment_durations(resp.content) if with_durations else None
+            logger.info("[VideoUser] 📝 Parsed %d segments from playlist", len(segments))
+            
+            if not segments:
+                logger.warning("[VideoUser] ⚠️ No segments found in playlist: %s", playlist_url)
+                resp.failure("No segments found in playlist")
+                return None
+            return self._playlist_result(segments, durations, with_durations)
+    
+    @staticmethod
+    def _playlist_result(segments, durations, with_durations: bool):
+        if with_durations:
+            return list(segments), list(durations)
+        return list(segments)
     
     # =================================================================
     # [LRD 修改點 1] OFF Period (Inter-session time) - Pareto 分布
@@ -163,70 +408,214 @@ class VideoUser(HttpUser):
         """
         # 基礎休息時間 (Scale)
         scale = 5.0 
-        # 生成 Pareto 隨機數
-        wait = random.paretovariate(PARETO_ALPHA_WAIT) * scale
         # 為了避免線程睡死 (例如睡 10 小時)，設定一個合理的上限 (例如 5 分鐘)
         max_wait = 300.0
-        actual_wait = min(wait, max_wait)
-        logger.debug(f"[VideoUser] ⏰ Pareto Wait Time: {actual_wait:.2f}s (raw: {wait:.2f}s)")
+        if self.lrd_sampler == 'batched':
+            # 截斷 Pareto 樣本，再依 fGn 速率包絡調整（包絡倍率高時休息較短，總請求速率較高）
+            sampler = LrdSampler()
+            wait = sampler.pareto(PARETO_ALPHA_WAIT, scale, max_wait)
+            actual_wait = min(wait / sampler.envelope_factor(time.time()), max_wait)
+        else:
+            # 生成 Pareto 隨機數
+            wait = random.paretovariate(PARETO_ALPHA_WAIT) * scale
+            actual_wait = min(wait, max_wait)
+        logger.debug("[VideoUser] ⏰ Pareto Wait Time: %.2fs (raw: %.2fs)", actual_wait, wait)
         return actual_wait
 
     # 將這個方法指派給 Locust 的 wait_time
     wait_time = pareto_wait_time
     
+    def _pick_watch_window(self, total_segments: int):
+        """
+        決定這個 session 要看幾個 segment 以及從哪裡開始，回傳 (watch_segments, start_idx)。
+        """
+        # =================================================================
+        # [LRD 修改點 2] ON Period (Session Length) - Pareto 分布
+        # =================================================================
+        # 使用 Pareto 分佈決定要看幾個片段
+        # Scale = 10，代表最少傾向於看 10 段左右，但有機會看非常多
+        if self.lrd_sampler == 'batched':
+            # 截斷在 20（即 200 段），與下方的上限一致
+            pareto_val = LrdSampler().pareto(PARETO_ALPHA_SESSION, 1.0, 20.0)
+        else:
+            pareto_val = random.paretovariate(PARETO_ALPHA_SESSION)
+        num_segments_to_watch = int(pareto_val * 10)
+        
+        # 限制範圍：至少看 1 段，最多把整部片看完 (或設定上限如 200)
+        watch_segments = min(max(1, num_segments_to_watch), total_segments, 200)
+        
+        logger.info("[VideoUser] 📺 Pareto Decision: Will watch %d segments "
+                    "(Pareto value: %.2f, Total available: %d)", watch_segments, pareto_val, total_segments)
+        
+        # 3. 從 playlist 中隨機選擇起始位置
+        if total_segments > watch_segments:
+            start_idx = random.randint(0, total_segments - watch_segments)
+        else:
+            start_idx = 0
+        return watch_segments, start_idx
+    
+    def _abr_renditions(self, target_host: str, video_id: int) -> list:
+        """
+        取得畫質階梯：有設定 master_playlist 時從 master playlist 的 #EXT-X-STREAM-INF 讀取，
+        rendition 名稱取 variant URI 的第一層目錄（伺服器目錄結構為 /video/{rendition}/...）；
+        未設定或讀取失敗時使用設定檔的 renditions。
+        """
+        if not self.abr_master_playlist:
+            return self.abr_renditions
+        master_url = f"http://{target_host}{self.abr_master_playlist.format(video_id=video_id)}"
+        with self.client.get(master_url, name="VIDEO:master", catch_response=True) as resp:
+            if resp.status_code != 200:
+                resp.failure(f"Master playlist failed with status {resp.status_code}")
+                return self.abr_renditions
+            renditions = [
+                {'name': variant['uri'].lstrip('./').split('/', 1)[0], 'bandwidth': variant['bandwidth']}
+                for variant in parse_master_playlist(resp.content)
+                if variant['bandwidth'] > 0
+            ]
+            if not renditions:
+                resp.failure("No variants found in master playlist")
+                return self.abr_renditions
+            return renditions
+    
+    def _fire_player_event(self, name: str, response_time: float):
+        """播放器事件（rebuffer、畫質切換）以 PLAYER 類型記入 Locust stats。"""
+        self.environment.events.request.fire(
+            request_type="PLAYER",
+            name=name,
+            response_time=response_time,
+            response_length=0,
+            exception=None,
+            context={},
+        )
+    
+    def _abr_watch_session(self, target_host: str, video_id: int):
+        """
+        ABR 播放 session：每個 segment 前由 AbrPlayer 選擇畫質，
+        下一次請求的時機由 buffer 佔用決定，取代固定 720p 與 2.3~5.3 秒的隨機間隔。
+        
+        記錄的指標：
+        - VIDEO:rebuffer                    卡頓（response time 為卡頓毫秒數）
+        - VIDEO:switch_up / switch_down     畫質切換次數
+        - video_abr（side metrics）         每個 segment 的畫質 bitrate 與每個 session 的卡頓比例
+        """
+        try:
+            player = AbrPlayer(self._abr_renditions(target_host, video_id), **self.abr_options)
+        except Exception as e:
+            logger.exception("[VideoUser] ❌ Exception while preparing ABR session: %s", e)
+            return
+        playlists = {}
+        
+        def playlist_for(rendition_name: str):
+            if rendition_name not in playlists:
+                playlist_path = f"/video/{rendition_name}/video-{video_id}/playlist.m3u8"
+                playlist_url = f"http://{target_host}{playlist_path}"
+                try:
+                    playlists[rendition_name] = self._load_playlist(playlist_url, playlist_path,
+                                                                    with_durations=True)
+                except Exception as e:
+                    logger.exception("[VideoUser] ❌ Exception while fetching playlist %s: %s", playlist_url, e)
+                    playlists[rendition_name] = None
+            return playlists[rendition_name]
+        
+        player.choose_rendition()
+        first = playlist_for(player.rendition['name'])
+        if first is None:
+            return
+        watch_segments, start_idx = self._pick_watch_window(len(first[0]))
+        metrics = SideMetrics()
+        watched_time = 0.0
+        
+        for i in range(watch_segments):
+            if i > 0:
+                previous = player.choose_rendition()
+                if player.current != previous:
+                    self._fire_player_event(
+                        "VIDEO:switch_up" if player.current > previous else "VIDEO:switch_down", 0)
+            rendition = player.rendition
+            playlist = playlist_for(rendition['name'])
+            if playlist is None:
+                break
+            segments, durations = playlist
+            seg_idx = (start_idx + i) % len(segments)
+            seg_filename = segments[seg_idx]
+            seg_url = f"http://{target_host}/video/{rendition['name']}/{seg_filename}"
+            
+            logger.debug("[VideoUser] 📦 Fetching segment [%d/%d] @%s: %s",
+                         i + 1, watch_segments, rendition['name'], seg_url)
+            try:
+                status_code, nbytes, elapsed = self._fetch_segment(seg_url, seg_filename)
+                if status_code >= 500:
+                    logger.warning("[VideoUser] 🛑 Stopping session due to server error")
+                    break
+            except Exception as e:
+                logger.exception("[VideoUser] ❌ Exception while fetching segment %s: %s", seg_url, e)
+                break
+            
+            if not 200 <= status_code < 300:
+                # 失敗的 segment（404、連線錯誤為 0）不增加 buffer，也不計入下載速率，記為卡頓
+                self._fire_player_event("VIDEO:rebuffer", player.on_segment_failed(elapsed) * 1000)
+                continue
+            
+            duration = durations[seg_idx] or 0.0
+            watched_time += duration
+            stall = player.on_segment_downloaded(duration, nbytes, elapsed)
+            if stall > 0:
+                self._fire_player_event("VIDEO:rebuffer", stall * 1000)
+            metrics.record("video_abr", "rendition bitrate (Mbit/s)", rendition['bandwidth'] / 1_000_000)
+            
+            # buffer 放得下下一個 segment 才送出請求
+            delay = player.delay_before_next_request(duration)
+            if delay > 0:
+                logger.debug("[VideoUser] ⏸️ Buffer %.1fs, waiting %.2fs", player.buffer_level, delay)
+                time.sleep(delay)
+            
+            # 模擬極小機率的隨機中斷（模擬斷網，1% 機率）
+            if random.random() < 0.01:
+                logger.info("[VideoUser] 🔌 Network interruption - stopping after %d segments", i + 1)
+                break
+        
+        if watched_time > 0:
+            metrics.record("video_abr", "rebuffer ratio (%)",
+                           100.0 * player.rebuffer_time / (watched_time + player.rebuffer_time))
+        logger.info("[VideoUser] ✅ ABR session completed: %d switches, %d rebuffers (%.2fs)",
+                    player.switch_count, player.rebuffer_count, player.rebuffer_time)
+    
     @task
     def video_watch_session(self):
+        try:
+            self._watch_video()
+        finally:
+            self.connections.end_session(self.client)
+    
+    def _watch_video(self):
         target_host = self._get_target_host()
         
         # 1. 抓 playlist（模擬播放器初始化）
         # DN 伺服器只有 video-1 到 video-100（共 101 個）
         video_id = random.randint(1, 100)
-        playlist_url = f"http://{target_host}/video/720p/video-{video_id}/playlist.m3u8"
+        if self.abr_enabled:
+            self._abr_watch_session(target_host, video_id)
+            return
+        
+        playlist_path = f"/video/720p/video-{video_id}/playlist.m3u8"
+        playlist_url = f"http://{target_host}{playlist_path}"
         
-        logger.info(f"[VideoUser] 🎬 Starting video session - Playlist URL: {playlist_url}")
+        logger.info("[VideoUser] 🎬 Starting video session - Playlist URL: %s", playlist_url)
         
         try:
-            with self.client.get(playlist_url, name="VIDEO:playlist", catch_response=True) as resp:
-                if resp.status_code != 200:
-                    logger.error(f"[VideoUser] ❌ Playlist request failed: {playlist_url} - "
-                               f"Status: {resp.status_code}, Response: {resp.text[:200]}")
-                    resp.failure(f"Playlist failed with status {resp.status_code}")
-                    return  # 如果 playlist 失敗，直接結束 session
-                
-                # 解析 playlist 獲取實際的 segment 列表
-                segments = self._parse_playlist(resp.text)
-                logger.info(f"[VideoUser] 📝 Parsed {len(segments)} segments from playlist")
-                
-                if not segments:
-                    logger.warning(f"[VideoUser] ⚠️ No segments found in playlist: {playlist_url}")
-                    resp.failure("No segments found in playlist")
-                    return
+            segments = self._load_playlist(playlist_url, playlist_path)
+            if segments is None:
+                return  # 如果 playlist 失敗，直接結束 session
         
         except Exception as e:
-            logger.exception(f"[VideoUser] ❌ Exception while fetching playlist {playlist_url}: {e}")
+            logger.exception("[VideoUser] ❌ Exception while fetching playlist %s: %s", playlist_url, e)
             return
         
-        # =================================================================
-        # [LRD 修改點 2] ON Period (Session Length) - Pareto 分布
-        # =================================================================
-        # 使用 Pareto 分佈決定要看幾個片段
-        # Scale = 10，代表最少傾向於看 10 段左右，但有機會看非常多
-        pareto_val = random.paretovariate(PARETO_ALPHA_SESSION)
-        num_segments_to_watch = int(pareto_val * 10)
-        
-        # 限制範圍：至少看 1 段，最多把整部片看完 (或設定上限如 200)
-        watch_segments = min(max(1, num_segments_to_watch), len(segments), 200)
+        watch_segments, start_idx = self._pick_watch_window(len(segments))
         
-        logger.info(f"[VideoUser] 📺 Pareto Decision: Will watch {watch_segments} segments "
-                   f"(Pareto value: {pareto_val:.2f}, Total available: {len(segments)})")
-        
-        # 3. 從 playlist 中隨機選擇起始位置
-        if len(segments) > watch_segments:
-            start_idx = random.randint(0, len(segments) - watch_segments)
-        else:
-            start_idx = 0
-        
-        # 4. 連續抓取 segments
+        # 4. 連續抓取 segments：每個 segment 的預定時間為上一個的預定時間加間隔，
+        # 下載變慢時下一個 segment 立即送出，延遲從預定時間起算
+        schedule = IntendedSchedule()
         for i in range(watch_segments):
             seg_idx = (start_idx + i) % len(segments)
             seg_filename = segments[seg_idx]
@@ -234,25 +623,20 @@ class VideoUser(HttpUser):
             # 構建完整的 segment URL（根據 playlist 中的相對路徑）
             seg_url = f"http://{target_host}/video/720p/{seg_filename}"
             
-            logger.debug(f"[VideoUser] 📦 Fetching segment [{i+1}/{watch_segments}]: {seg_url}")
+            logger.debug("[VideoUser] 📦 Fetching segment [%d/%d]: %s", i + 1, watch_segments, seg_url)
             
             try:
-                with self.client.get(seg_url, name="VIDEO:hls_seg", catch_response=True, timeout=30) as resp:
-                    if resp.status_code != 200:
-                        logger.error(f"[VideoUser] ❌ Segment request failed: {seg_url} - "
-                                   f"Status: {resp.status_code}")
-                        resp.failure(f"Segment {seg_filename} failed with status {resp.status_code}")
-                        
-                        # 遇到 5xx 錯誤就中斷 session（模擬播放器停止）
-                        if resp.status_code >= 500:
-                            logger.warning(f"[VideoUser] 🛑 Stopping session due to server error")
-                            break
-                    else:
-                        logger.debug(f"[VideoUser] ✅ Segment {seg_filename} downloaded successfully "
-                                   f"({len(resp.content)} bytes)")
+                intended_ns = schedule.intended()
+                sent_ns = time.perf_counter_ns()
+                status_code, _, _ = self._fetch_segment(seg_url, seg_filename)
+                record_latency("VIDEO:hls_seg", intended_ns, sent_ns)
+                # 遇到 5xx 錯誤就中斷 session（模擬播放器停止）
+                if status_code >= 500:
+                    logger.warning("[VideoUser] 🛑 Stopping session due to server error")
+                    break
             
             except Exception as e:
-                logger.exception(f"[VideoUser] ❌ Exception while fetching segment {seg_url}: {e}")
+                logger.exception("[VideoUser] ❌ Exception while fetching segment %s: %s", seg_url, e)
                 # 可選：遇到異常也中斷 session
                 break
             
@@ -261,18 +645,45 @@ class VideoUser(HttpUser):
             # =================================================================
             # 目標：平均 Bitrate 3~7 Mbps
             # 平均檔案大小 16Mb (2MB) / 平均間隔 3.2s = 5 Mbps
-            # 設定範圍：2.3s ~ 5.3s
-            sleep_time = random.uniform(2.3, 5.3)
-            logger.debug(f"[VideoUser] ⏸️ Sleeping {sleep_time:.2f}s before next segment")
+            # 設定範圍：2.3s ~ 5.3s（相鄰兩個 segment 預定時間的間隔）
+            sleep_time = schedule.advance(random.uniform(2.3, 5.3))
+            logger.debug("[VideoUser] ⏸️ Sleeping %.2fs before next segment", sleep_time)
             time.sleep(sleep_time)
             
             # 可選：模擬極小機率的隨機中斷（模擬斷網，1% 機率）
             # 移除舊的 5% 跳出率，因為已經用 Pareto 決定了 session 長度
             if random.random() < 0.01:
-                logger.info(f"[VideoUser] 🔌 Network interruption - stopping after {i+1} segments")
+                logger.info("[VideoUser] 🔌 Network interruption - stopping after %d segments", i + 1)
                 break
         
-        logger.info(f"[VideoUser] ✅ Video session completed")
+        logger.info("[VideoUser] ✅ Video session completed")
+
+
+class VideoUser(VideoUserBase, HttpUser):
+    """影音串流用戶：使用 requests.Session 綁定來源 IP"""
+
+
+class FastVideoUser(VideoUserBase, FastHttpUser):
+    """影音串流用戶：使用 FastHttpSession（geventhttpclient）綁定來源 IP，每個請求的 CPU 用量較低"""
+    # 只有 config-users.json 中有 FastVideoUser 的設定時才執行
+    abstract = not get_user_profile('FastVideoUser')
+    # FastHttpSession 不接受 timeout 參數（會被當成 query string），改用 User 層級的逾時
+    segment_request_kwargs = {}
+    network_timeout = 30.0
+    
+    def _iter_stream(self, resp):
+        # geventhttpclient 的回應沒有 readinto，以 stream_chunk_size 分塊讀取
+        for chunk in resp.iter_content(self.stream_chunk_size):
+            yield len(chunk)
+
+
+# DnsLoad 的 Locust stats 名稱粒度
+DNS_STATS_NAME_POLICIES = ('qtype', 'resolver', 'domain_group', 'full')
+
+
+def _domain_group(query_name: str) -> str:
+    """取網域的最後兩層作為群組，例如 www.google.com -> google.com"""
+    return '.'.join(query_name.rstrip('.').split('.')[-2:])
 
 
 class DnsLoad(User):
@@ -286,28 +697,58 @@ class DnsLoad(User):
         # 獲取目標伺服器列表（DNS 伺服器）
         target_count = _get_target_count_for_user(self.__class__.__name__)
         self.target_servers = get_target_servers(self.__class__.__name__, target_count)
-        print(f"[DnsLoad] Initialized with source IP: {self.source_ip}, "
-              f"target DNS servers: {self.target_servers}")
+        logger.debug("[DnsLoad] Initialized with source IP: %s, target DNS servers: %s",
+                     self.source_ip, self.target_servers)
 
         # If the user config contains an explicit dns_server for DnsLoad, prefer that
-        try:
-            cfg = _load_user_config()
-            for item in cfg:
-                if item.get('user_class_name') == self.__class__.__name__:
-                    # override defaults if present
-                    if item.get('dns_server'):
-                        self.dns_server = item.get('dns_server')
-                    if item.get('dns_port'):
-                        self.dns_port = item.get('dns_port')
-                    break
-        except Exception:
-            # keep defaults if config can't be read
-            pass
+        profile = get_user_profile(self.__class__.__name__)
+        if profile.get('dns_server'):
+            self.dns_server = profile['dns_server']
+        if profile.get('dns_port'):
+            self.dns_port = profile['dns_port']
+        
+        # closed_loop 模式的查詢速率：每個查詢的預定時間為上一個的預定時間加 1/qps
+        if profile.get('qps'):
+            self.qps = profile['qps']
+        self.schedule = IntendedSchedule()
+        
+        # 查詢模式：closed_loop（預設，送出後等待回應）或 open_loop（依速率送出，不等待回應）
+        self.mode = profile.get('mode', 'closed_loop')
+        self.query_timeout = profile.get('timeout', 5)
+        self.open_loop_qps = profile.get('qps_per_ip', 100)
+        self.open_loop_max_in_flight = profile.get('max_in_flight', 1000)
+        if self.mode == 'open_loop':
+            # open-loop 模式只執行一個長時間的 task，由產生器持續送出查詢
+            self.tasks = [DnsLoad.open_loop_session]
+        
+        # Locust stats 名稱的粒度（qtype / resolver / domain_group / full），
+        # 每個網域的細部延遲另外記在 side metrics，不會讓 stats 樹膨脹
+        self.stats_name_policy = profile.get('stats_name', 'qtype')
+        if self.stats_name_policy not in DNS_STATS_NAME_POLICIES:
+            logger.warning("[DnsLoad] Unknown stats_name '%s', using 'qtype'", self.stats_name_policy)
+            self.stats_name_policy = 'qtype'
+        self.domain_breakdown = profile.get('domain_breakdown', True)
 
     # DNS 伺服器設定（可以在 config-users.json 中覆寫）
     dns_server = "1.1.1.1"  # 預設使用 Cloudflare DNS
     dns_port = 53
     
+    def on_start(self):
+        if self.source_ip is None:
+            # 所有來源 IP 都已達到上限
+            record_lifecycle(self.__class__.__name__, 'no_source_ip')
+            raise StopUser()
+        record_lifecycle(self.__class__.__name__, 'started')
+    
+    def on_stop(self):
+        """釋放來源 IP，讓之後建立的 User 平均分配"""
+        release_source_ip(self.__class__.__name__, self.source_ip)
+        record_lifecycle(self.__class__.__name__, 'stopped')
+    
+    def context(self):
+        """request 事件帶上來源 IP，供 IP 健康監測統計"""
+        return {'source_ip': self.source_ip}
+    
     def _get_target_dns_server(self):
         """從目標伺服器列表中隨機選擇一個 DNS 伺服器"""
         # Prefer an explicit configured DNS server (from config-users.json or default attribute).
@@ -321,8 +762,15 @@ class DnsLoad(User):
 
         return self.dns_server
     
-    # 等待時間
-    wait_time = constant_throughput(1)  # 每秒 1 個查詢
+    # 等待時間：每秒 qps 個查詢（與 constant_throughput 相同的速率）
+    qps = 1
+    
+    def wait_time(self):
+        """
+        等到下一個查詢的預定時間。constant_throughput 從上一個查詢開始的時間起算，
+        DNS 伺服器停頓時查詢數跟著減少；這裡從預定時間起算，落後時立即送出直到追上。
+        """
+        return self.schedule.advance(1.0 / self.qps)
     
     # 隨機域名列表（可以根據需求調整）
     domains = [
@@ -354,43 +802,89 @@ class DnsLoad(User):
         # 動態選擇目標 DNS 伺服器
         target_dns = self._get_target_dns_server()
         
-        start_time = time.time()
+        intended_ns = self.schedule.intended()
+        start_ns = time.perf_counter_ns()
         response_length = 0
         exception = None
         
         try:
-            # 建立 DNS 查詢
-            q = dns.message.make_query(query_name, query_type)
-            
-            # 發送 UDP 查詢，並綁定來源 IP，使用動態選擇的目標 DNS 伺服器
-            response = dns.query.udp(q, target_dns, timeout=5, port=self.dns_port, source=self.source_ip)
-            
-            # 計算響應長度
-            response_length = len(response.to_wire())
-            
-            # 計算響應時間（毫秒）
-            response_time = (time.time() - start_time) * 1000
+            # 使用共用的 DNS 引擎：socket 已綁定來源 IP，查詢的 wire format 已快取
+            engine = DnsEngine.get(self.source_ip, target_dns, self.dns_port)
+            rcode, response_length = engine.query(query_name, query_type, timeout=self.query_timeout)
             
             # 檢查響應碼
-            if response.rcode() != dns.rcode.NOERROR:
-                exception = Exception(f"DNS query failed with rcode: {dns.rcode.to_text(response.rcode())}")
+            if rcode != dns.rcode.NOERROR:
+                exception = Exception(f"DNS query failed with rcode: {dns.rcode.to_text(rcode)}")
             
         except dns.exception.Timeout as e:
-            response_time = (time.time() - start_time) * 1000
             exception = e
         except Exception as e:
-            response_time = (time.time() - start_time) * 1000
             exception = e
         
-        # 觸發 Locust 事件以記錄統計
+        # 計算響應時間（毫秒，單調時鐘）；修正後的延遲從預定時間起算
+        done_ns = time.perf_counter_ns()
+        record_latency(self._dns_stats_name(query_name, query_type_name, target_dns), intended_ns, start_ns, done_ns)
+        self._report_dns_result(query_name, query_type_name, target_dns,
+                                (done_ns - start_ns) / 1e6, response_length, exception)
+    
+    def _dns_stats_name(self, query_name: str, query_type_name: str, target_dns: str) -> str:
+        """依 stats_name 設定產生 Locust stats 名稱"""
+        policy = self.stats_name_policy
+        if policy == 'qtype':
+            return f"DNS:{query_type_name}"
+        if policy == 'resolver':
+            return f"DNS:{query_type_name}@{target_dns}"
+        if policy == 'domain_group':
+            return f"DNS:{query_type_name}:{_domain_group(query_name)}"
+        return f"DNS:{query_type_name}:{query_name}@{target_dns}"
+    
+    def _report_dns_result(self, query_name: str, query_type_name: str, target_dns: str,
+                           response_time: float, response_length: int, exception, source_ip: str = None):
+        """觸發 Locust 事件以記錄統計，並把每個網域的細部延遲記到 side metrics（source_ip 預設為 User 目前的 IP）"""
+        if self.domain_breakdown:
+            SideMetrics().record("dns_domain", f"{query_type_name}:{query_name}@{target_dns}",
+                                 response_time, failed=exception is not None)
         self.environment.events.request.fire(
             request_type="DNS",
-            name=f"DNS:{query_type_name}:{query_name}@{target_dns}",
+            name=self._dns_stats_name(query_name, query_type_name, target_dns),
             response_time=response_time,
             response_length=response_length,
             exception=exception,
-            context={}
+            context={'source_ip': source_ip or self.source_ip, 'target': target_dns}
+        )
+    
+    def _pick_open_loop_query(self):
+        """open-loop 模式的查詢選擇，比例與 random_a_query / custom_domain_query 的權重相同"""
+        domain = random.choice(self.domains)
+        if random.random() < 2 / 12:
+            domain = f"{random.choice(['www', 'mail', 'ftp', 'api', 'cdn', 'blog'])}.{domain}"
+        return domain, dns.rdatatype.A, "A"
+    
+    def open_loop_session(self):
+        """
+        open-loop 模式：以 qps_per_ip 的速率持續送出查詢，不等待回應。
+        同一個來源 IP 和 DNS 伺服器的 User 共用一個產生器，回應和逾時仍透過 events.request 回報。
+        來源 IP 被隔離而改綁時結束這次 session，下次執行時改用新 IP 的產生器。
+        """
+        target_dns = self._get_target_dns_server()
+        engine = DnsEngine.get(self.source_ip, target_dns, self.dns_port)
+        sender = OpenLoopSender.acquire(
+            engine,
+            rate=self.open_loop_qps,
+            pick_query=self._pick_open_loop_query,
+            on_result=lambda name, qtype_name, response_time, length, exception:
+                self._report_dns_result(name, qtype_name, target_dns, response_time, length, exception,
+                                        source_ip=engine.source_ip),
+            timeout=self.query_timeout,
+            max_in_flight=self.open_loop_max_in_flight,
         )
+        logger.info("[DnsLoad] Open-loop sender running for %s -> %s at %s qps",
+                    self.source_ip, target_dns, self.open_loop_qps)
+        try:
+            while self.source_ip == engine.source_ip:
+                time.sleep(1)
+        finally:
+            sender.release()
     
     @task(10)
     def random_a_query(self):
@@ -408,3 +902,468 @@ class DnsLoad(User):
         full_domain = f"{subdomain}.{domain}"
         # Ensure only A queries are sent
         self._send_dns_query(full_domain, dns.rdatatype.A, "A")
+
+
+class MqttUser(User):
+    """
+    MQTT 裝置用戶：依排程 publish 到 broker 的 echo 服務（topic → topic/reply），量測 publish 到收到 echo 的往返延遲。
+    
+    連線綁定來源 IP 並保持；同一個來源 IP 的 User 預設共用一條連線（shared_connection: false 時每個 User 各一條）。
+    回覆依 payload 中的相關 ID 配對，不會為每則訊息阻塞等待；排程（schedule）可為 constant、burst 或 pareto。
+    """
+    # 只有 config-users.json 中有 MqttUser 的設定時才執行
+    abstract = not get_user_profile('MqttUser')
+    # 連線中斷或來源 IP 改綁時結束 session，等待後重新連線
+    wait_time = constant(1)
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.source_ip = get_source_ip(self.__class__.__name__)
+        target_count = _get_target_count_for_user(self.__class__.__name__)
+        self.target_servers = get_target_servers(self.__class__.__name__, target_count)
+        
+        # broker 設定（可以在 config-users.json 中覆寫）；沒有指定 broker 時使用目標伺服器或 host
+        profile = get_user_profile(self.__class__.__name__)
+        self.broker = profile.get('broker')
+        self.broker_port = profile.get('broker_port', 1883)
+        self.topic = profile.get('topic', 'hello world')
+        self.reply_topic = profile.get('reply_topic', f"{self.topic}/reply")
+        self.qos = profile.get('qos', 0)
+        if self.qos not in (0, 1):
+            logger.warning("[MqttUser] Unsupported qos %s, using 0", self.qos)
+            self.qos = 0
+        self.payload_size = profile.get('payload_size', 64)
+        self.message_timeout = profile.get('timeout', 5)
+        self.keepalive = profile.get('keepalive', 60)
+        self.shared_connection = profile.get('shared_connection', True)
+        self.max_in_flight = profile.get('max_in_flight', 1000)
+        self.schedule = profile.get('schedule', {'type': 'constant', 'rate': 1})
+        self.stats_name = f"{self.topic} qos{self.qos}"
+        logger.debug("[MqttUser] Initialized with source IP: %s, broker: %s", self.source_ip,
+                     self.broker or self.target_servers)
+    
+    def on_start(self):
+        if self.source_ip is None:
+            # 所有來源 IP 都已達到上限
+            record_lifecycle(self.__class__.__name__, 'no_source_ip')
+            raise StopUser()
+        record_lifecycle(self.__class__.__name__, 'started')
+    
+    def on_stop(self):
+        """釋放來源 IP（連線在 publish_session 結束時釋放）"""
+        release_source_ip(self.__class__.__name__, self.source_ip)
+        record_lifecycle(self.__class__.__name__, 'stopped')
+    
+    def on_source_ip_changed(self, old_ip: str, new_ip: str):
+        """來源 IP 被隔離後改綁到 new_ip，目前的 session 結束後以新 IP 重新連線"""
+        logger.info("[MqttUser] Source IP %s quarantined, moving to %s", old_ip, new_ip)
+        record_lifecycle(self.__class__.__name__, 'migrated')
+    
+    def context(self):
+        """request 事件帶上來源 IP，供 IP 健康監測統計"""
+        return {'source_ip': self.source_ip}
+    
+    def _get_broker(self):
+        """broker 位址：明確設定的 broker，其次隨機選擇目標伺服器，最後使用 host（移除 http:// 前綴）"""
+        if self.broker:
+            return self.broker
+        if self.target_servers:
+            return random.choice(self.target_servers)
+        return (self.host or '').strip().split('://')[-1].rstrip('/')
+    
+    def _report(self, name: str, response_time: float, response_length: int, exception, source_ip: str):
+        self.environment.events.request.fire(
+            request_type="MQTT",
+            name=name,
+            response_time=response_time,
+            response_length=response_length,
+            exception=exception,
+            context={'source_ip': source_ip}
+        )
+    
+    @task
+    def publish_session(self):
+        """
+        建立（或共用）連線後依排程持續 publish，直到連線中斷或來源 IP 改綁。
+        echo 回覆與逾時由引擎的背景 greenlet 回報到 events.request，響應時間從排程時間算起。
+        """
+        source_ip = self.source_ip
+        start_time = time.perf_counter()
+        try:
+            engine = MqttEngine.acquire(source_ip, self._get_broker(), self.broker_port,
+                                        shared=self.shared_connection, keepalive=self.keepalive,
+                                        max_in_flight=self.max_in_flight)
+        except Exception as e:
+            self._report("CONNECT", (time.perf_counter() - start_time) * 1000, 0, e, source_ip)
+            return
+        
+        on_result = lambda response_time, length, exception: self._report(
+            self.stats_name, response_time, length, exception, source_ip)
+        gaps = make_schedule(self.schedule)
+        next_send = time.perf_counter()
+        try:
+            while not engine.closed and self.source_ip == source_ip:
+                now = time.perf_counter()
+                if now < next_send:
+                    # 長時間的 OFF 期間也定期檢查連線與來源 IP
+                    time.sleep(min(next_send - now, 1.0))
+                    continue
+                # 落後太多（例如行程被暫停）時不補送超過一秒的量
+                if now - next_send > 1.0:
+                    next_send = now - 1.0
+                try:
+                    engine.request(self.topic, self.reply_topic, on_result, qos=self.qos,
+                                   payload_size=self.payload_size, timeout=self.message_timeout,
+                                   scheduled=next_send)
+                except (MqttError, OSError) as e:
+                    self._report(self.stats_name, 0, 0, e, source_ip)
+                next_send += next(gaps)
+        finally:
+            engine.release()
+
+
+class SwarmUser(User):
+    """
+    由一個 Locust User 模擬大量虛擬 UE（SocialUser、DnsLoad 的行為）。
+    
+    每個 UE 只是 UeTable 中的一列（來源 IP 索引、目標伺服器索引、下次執行時間），
+    think time 放在同一個 timer heap，由單一 greenlet 排程；HTTP 請求在有上限的 greenlet pool 中執行，
+    同一個來源 IP 的 UE 共用一個 FastHttpSession（shared 連線池），DNS 查詢以共用的 DnsEngine 非同步送出。
+    Locust stats 名稱與 SocialUser / DnsLoad 相同，來源 IP 也以 SocialUser / DnsLoad 的名義分配。
+    """
+    # 只有 config-users.json 中有 SwarmUser 的設定時才執行（建議 fixed_count 為 1）
+    abstract = not get_user_profile('SwarmUser')
+    wait_time = constant(1)
+    
+    # 每種 UE 預設的 think time（秒），與 SocialUser 的 between(30, 100)、DnsLoad 的每秒 1 個查詢相同
+    DEFAULT_THINK_TIMES = {'SocialUser': [30, 100], 'DnsLoad': [1, 1]}
+    domains = DnsLoad.domains
+    _pick_dns_query = DnsLoad._pick_open_loop_query
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        profile = get_user_profile(self.__class__.__name__)
+        # 每種 UE 的數量，例如 {"SocialUser": 20000, "DnsLoad": 20000}
+        self.ue_counts = {name: count for name, count in (profile.get('ues') or {}).items()
+                          if name in self.DEFAULT_THINK_TIMES and count > 0}
+        self.think_times = {**self.DEFAULT_THINK_TIMES, **(profile.get('think_time') or {})}
+        self.spawn_rate = profile.get('spawn_rate', 1000)
+        self.max_concurrency = profile.get('max_concurrency', 1000)
+        self.connections = ConnectionPolicy({**(profile.get('connection_pool') or {}), 'mode': 'shared'})
+        self.network_timeout = profile.get('network_timeout', 30.0)
+        
+        dns_profile = get_user_profile('DnsLoad')
+        self.dns_server = dns_profile.get('dns_server') or DnsLoad.dns_server
+        self.dns_port = dns_profile.get('dns_port', DnsLoad.dns_port)
+        self.query_timeout = dns_profile.get('timeout', 5)
+        
+        self.table = None
+        self.scheduler = None
+        self._kind_ids = {}
+        self._spawned = {name: 0 for name in self.ue_counts}
+        self._spawned_total = 0
+        self._sessions = {}
+        self._pool = None
+        # DNS 逾時：{(DnsEngine, DNS ID): (序號, UE, 預定時間, 開始時間, qtype 名稱)}
+        self._dns_outstanding = {}
+        # 每個 DnsEngine 的回應回呼（DnsEngine 的回呼只帶 DNS ID）
+        self._dns_callbacks = {}
+        self._dns_wheel = TimerWheel(OpenLoopSender.TICK, self.query_timeout)
+        self._dns_seq = 0
+    
+    def on_start(self):
+        if not self.ue_counts:
+            logger.error("[SwarmUser] ❌ No UEs configured ('ues' in config-users.json)")
+            raise StopUser()
+        kinds = list(self.ue_counts)
+        self._kind_ids = {name: index for index, name in enumerate(kinds)}
+        max_targets = max([_get_target_count_for_user(name) for name in kinds] + [1])
+        self.table = UeTable(kinds, sum(self.ue_counts.values()), max_targets)
+        self.scheduler = SwarmScheduler(self.table, self._dispatch, on_lag=self._record_lag)
+        self._pool = gevent.pool.Pool(self.max_concurrency)
+        record_lifecycle(self.__class__.__name__, 'started')
+    
+    def on_stop(self):
+        """停止所有 HTTP 請求並釋放每個 UE 的來源 IP"""
+        if self._pool is not None:
+            self._pool.kill(block=False)
+        table = self.table
+        if table is not None:
+            for ue in range(table.size):
+                if table.kind[ue] != STOPPED:
+                    release_source_ip(table.kind_name(ue), table.source_ip(ue))
+                    table.kind[ue] = STOPPED
+        record_lifecycle(self.__class__.__name__, 'stopped')
+    
+    def migrate_source_ip(self, old_ip: str):
+        """
+        來源 IP 被隔離時，把使用它的 UE 改綁到健康的 IP（由 ip_health 呼叫）。
+        
+        Returns:
+            (改綁的 UE 數, 沒有可用 IP 而保留原 IP 的 UE 數)
+        """
+        migrated = stranded = 0
+        for ue in self.table.ues_on_ip(old_ip) if self.table is not None else ():
+            kind_name = self.table.kind_name(ue)
+            new_ip = get_source_ip(kind_name)
+            if new_ip is None:
+                stranded += 1
+                continue
+            release_source_ip(kind_name, old_ip)
+            self.table.set_source_ip(ue, new_ip)
+            migrated += 1
+        self._sessions.pop(old_ip, None)
+        return migrated, stranded
+    
+    def _spawn_ues(self, count: int):
+        """依序建立 UE：分配來源 IP 與目標伺服器，第一次執行時間在 think time 內隨機分散"""
+        table = self.table
+        now = time.perf_counter()
+        for _ in range(count):
+            kind_name = next((name for name, total in self.ue_counts.items() if self._spawned[name] < total), None)
+            if kind_name is None:
+                return
+            self._spawned[kind_name] += 1
+            self._spawned_total += 1
+            source_ip = get_source_ip(kind_name)
+            if source_ip is None:
+                record_lifecycle(kind_name, 'no_source_ip')
+                continue
+            targets = get_target_servers(kind_name, _get_target_count_for_user(kind_name))
+            ue = table.add(self._kind_ids[kind_name], source_ip, targets)
+            record_lifecycle(kind_name, 'started')
+            self.scheduler.schedule(ue, random.uniform(0, self.think_times[kind_name][1]), now)
+    
+    def _record_lag(self, lag: float):
+        # 只記錄明顯的延誤，避免每次執行都進 side metrics
+        if lag > 0.1:
+            SideMetrics().record("swarm", "scheduling lag (ms)", lag * 1000)
+    
+    def _think(self, ue: int, kind_name: str, intended: float = None):
+        """動作完成後排定下一次；有 intended 時與 DnsLoad 相同，從這次的預定時間起算（落後時立即執行）"""
+        low, high = self.think_times[kind_name]
+        self.scheduler.schedule(ue, random.uniform(low, high), intended)
+    
+    def _dispatch(self, ue: int, when: float):
+        kind_name = self.table.kind_name(ue)
+        if kind_name == 'DnsLoad':
+            self._send_dns(ue, when)
+        else:
+            self._pool.spawn(self._social_action, ue)
+    
+    # ---------- SocialUser 行為 ----------
+    
+    def _http_session(self, source_ip: str):
+        session = self._sessions.get(source_ip)
+        if session is None:
+            session = FastHttpSession(base_url=self.host, request_event=self.environment.events.request,
+                                      user=None, network_timeout=self.network_timeout)
+            self.connections.mount(session, source_ip)
+            self._sessions[source_ip] = session
+        return session
+    
+    def _social_action(self, ue: int):
+        """與 SocialUser 的 feed_scroll（權重 6）/ browse（權重 4）相同的請求與 stats 名稱"""
+        table = self.table
+        source_ip = table.source_ip(ue)
+        target_host = table.random_target(ue) or (self.host or '').split('://')[-1].rstrip('/')
+        session = self._http_session(source_ip)
+        context = {'source_ip': source_ip}
+        try:
+            if random.random() < 0.6:
+                session.get(f"http://{target_host}/feed?since={random.randint(1, 1_000_000_000)}",
+                            name="SOCIAL:feed", context=context)
+                if random.random() < 0.3:
+                    session.post(f"http://{target_host}/react", json={"pid": random.randint(1, 1_000_000)},
+                                 name="SOCIAL:react", context=context)
+            else:
+                session.get(f"http://{target_host}/", name="WEB:index", context=context)
+        finally:
+            if table.kind[ue] != STOPPED:
+                self._think(ue, 'SocialUser')
+    
+    # ---------- DnsLoad 行為 ----------
+    
+    def _send_dns(self, ue: int, intended: float):
+        source_ip = self.table.source_ip(ue)
+        query_name, query_type, query_type_name = self._pick_dns_query()
+        started = time.perf_counter()
+        try:
+            engine = DnsEngine.get(source_ip, self.dns_server, self.dns_port)
+            callback = self._dns_callbacks.get(engine)
+            if callback is None:
+                callback = self._dns_callbacks[engine] = \
+                    lambda qid, result, engine=engine: self._on_dns_response(engine, qid, result)
+            qid = engine.send_async(query_name, query_type, callback)
+        except Exception as e:
+            self._report_dns(query_type_name, 0, 0, e, source_ip)
+            self._think(ue, 'DnsLoad', intended)
+            return
+        self._dns_seq += 1
+        self._dns_outstanding[(engine, qid)] = (self._dns_seq, ue, intended, started, query_type_name)
+        self._dns_wheel.schedule(started + self.query_timeout, (engine, qid, self._dns_seq))
+    
+    def _report_dns(self, query_type_name: str, response_time: float, response_length: int, exception,
+                    source_ip: str):
+        self.environment.events.request.fire(
+            request_type="DNS",
+            name=f"DNS:{query_type_name}",
+            response_time=response_time,
+            response_length=response_length,
+            exception=exception,
+            context={'source_ip': source_ip, 'target': self.dns_server}
+        )
+    
+    def _finish_dns(self, key, response_length: int, exception):
+        _, ue, intended, started, query_type_name = self._dns_outstanding.pop(key)
+        done_ns = time.perf_counter_ns()
+        record_latency(f"DNS:{query_type_name}", int(intended * 1e9), int(started * 1e9), done_ns)
+        self._report_dns(query_type_name, (done_ns / 1e9 - started) * 1000, response_length, exception,
+                         key[0].source_ip)
+        if self.table.kind[ue] != STOPPED:
+            self._think(ue, 'DnsLoad', intended)
+    
+    def _on_dns_response(self, engine, qid: int, result):
+        if (engine, qid) not in self._dns_outstanding:
+            return
+        rcode, response_length = result
+        exception = None
+        if rcode != dns.rcode.NOERROR:
+            exception = Exception(f"DNS query failed with rcode: {dns.rcode.to_text(rcode)}")
+        self._finish_dns((engine, qid), response_length, exception)
+    
+    def _expire_dns(self, now: float):
+        for engine, qid, seq in self._dns_wheel.advance(now):
+            entry = self._dns_outstanding.get((engine, qid))
+            # 已經收到回應，或 DNS ID 已被新的查詢重複使用
+            if entry is None or entry[0] != seq:
+                continue
+            engine.cancel(qid)
+            self._finish_dns((engine, qid), 0, dns.exception.Timeout(timeout=self.query_timeout))
+    
+    @task
+    def run_swarm(self):
+        """依 spawn_rate 建立 UE，並由 timer heap 排程所有 UE 直到停止"""
+        total = self.table.capacity
+        spawn_started = time.perf_counter()
+        
+        def on_tick(now):
+            self._expire_dns(now)
+            if self._spawned_total < total:
+                due = min(total, int((now - spawn_started) * self.spawn_rate)) - self._spawned_total
+                if due > 0:
+                    self._spawn_ues(due)
+                    if self._spawned_total >= total:
+                        logger.info("[SwarmUser] Spawned UEs: %s", self.table.running())
+        
+        self.scheduler.run(on_tick)
+
+
+class TraceReplayUser(User):
+    """
+    trace 重播用戶：依 trace 檔記錄的時間、方法、路徑、目標與來源 IP 送出 HTTP 請求。
+    
+    trace 以 mmap 逐筆讀取，不會整個載入記憶體；分散式執行時依來源 IP 分片，
+    每個 worker 只重播自己的分片，因此建議以 fixed_count 讓每個 worker 只有一個 TraceReplayUser。
+    """
+    # 只有 config-users.json 中有 TraceReplayUser 的設定時才啟用
+    abstract = not get_user_profile('TraceReplayUser')
+    
+    # 每個行程同時只允許一個 User 重播，多出的 User 直接停止，避免同一個分片被送出兩次
+    _replaying = False
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        profile = get_user_profile(self.__class__.__name__)
+        self.trace_file = profile.get('trace_file')
+        self.speed = profile.get('speed', 1.0)
+        self.max_concurrency = profile.get('max_concurrency', 1000)
+        self.loop = profile.get('loop', False)
+        # 每個來源 IP 一個 HttpSession（各自綁定來源位址），統計仍記在 Locust stats
+        self._sessions = {}
+        logger.info("[TraceReplayUser] Initialized with trace: %s, speed: %sx", self.trace_file, self.speed)
+    
+    # worker 等待 master 指定區段的秒數
+    PARTITION_WAIT = 10.0
+    
+    def _shard(self):
+        """
+        分散式執行時使用 master 指定的區段（與 IP 區段分配相同的 index / count），單機執行時不分片。
+        --expect-workers 只傳給 master，worker 上無法得知 worker 數量，因此不能自行計算。
+        """
+        deadline = time.monotonic() + self.PARTITION_WAIT
+        partition = worker_partition(self.environment)
+        while partition is None and time.monotonic() < deadline:
+            gevent.sleep(0.1)
+            partition = worker_partition(self.environment)
+        if partition is None:
+            # 不分片重播會讓每個 worker 都送出整份 trace
+            logger.error("[TraceReplayUser] ❌ No partition from master after %.0fs, stopping", self.PARTITION_WAIT)
+            raise StopUser()
+        return partition
+    
+    def _session_for(self, source_ip):
+        session = self._sessions.get(source_ip)
+        if session is None:
+            session = HttpSession(base_url=self.host or "", request_event=self.environment.events.request,
+                                  user=self)
+            # 連線池大小跟著 max_concurrency，同一個目標的並行請求才不會頻繁重建連線
+            if source_ip:
+                adapter = SourceAddressAdapter((source_ip, 0), pool_maxsize=self.max_concurrency)
+            else:
+                adapter = HTTPAdapter(pool_maxsize=self.max_concurrency)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._sessions[source_ip] = session
+        return session
+    
+    def _send(self, record):
+        """送出一筆 trace 記錄的請求（在 pool 的 greenlet 中執行，不阻塞排程）"""
+        target = record.target or self.host or ""
+        if record.path.startswith(('http://', 'https://')):
+            url = record.path
+        elif target.startswith(('http://', 'https://')):
+            url = f"{target}{record.path}"
+        else:
+            url = f"http://{target}{record.path}"
+        try:
+            self._session_for(record.source_ip).request(
+                record.method, url,
+                name=record.name or f"TRACE:{record.method}",
+                data=bytes(record.body_size) if record.body_size else None,
+                timeout=30,
+            )
+        except Exception as e:
+            logger.error("[TraceReplayUser] ❌ Exception while replaying %s %s: %s", record.method, url, e)
+    
+    @task
+    def replay(self):
+        if TraceReplayUser._replaying:
+            logger.warning("[TraceReplayUser] Another user is already replaying in this process, stopping")
+            raise StopUser()
+        if not self.trace_file:
+            logger.error("[TraceReplayUser] ❌ No trace_file configured")
+            raise StopUser()
+        
+        shard_index, shard_count = self._shard()
+        TraceReplayUser._replaying = True
+        pool = gevent.pool.Pool(self.max_concurrency)
+        metrics = SideMetrics()
+        try:
+            while True:
+                clock = ReplayClock(self.speed)
+                count = 0
+                for record in iter_trace(self.trace_file, shard_index, shard_count):
+                    # 排程誤差記在 side metrics；pool 滿時 spawn 會等待，也會反映在 lag 上
+                    lag = clock.wait_until(record.offset)
+                    metrics.record("trace_replay", "dispatch lag (ms)", lag * 1000)
+                    pool.spawn(self._send, record)
+                    count += 1
+                logger.info("[TraceReplayUser] ✅ Dispatched %d requests (shard %d/%d)", count, shard_index, shard_count)
+                if not self.loop or count == 0:
+                    break
+            pool.join()
+        finally:
+            pool.kill(block=False)
+            TraceReplayUser._replaying = False
+        raise StopUser()
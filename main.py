@@ -1,6 +1,136 @@
-def main():
-    print("Hello from locust-user!")
+#!/usr/bin/env python
+"""
+多核心啟動器：在本機啟動一個 Locust master 與 N 個 worker，每個 worker 綁定一顆 CPU。
+
+單一 locust 行程受 GIL 與 gevent 限制只能用到一個核心；這裡以 locust.conf 的設定啟動 master，
+worker 數量預設為可用的 CPU 數。來源 IP 由 master 依 worker index 切分
+（ips.json 的 partition_across_workers，見 utils/partition.py），stats 由 master 彙整，
+results/ 下的 CSV、HTML 報告與 side metrics / IP 健康 CSV 都只由 master 輸出；
+每個 worker 的日誌寫到 results/worker-{index}.log。
+
+用法：
+  python main.py                              # 依 locust.conf，worker 數 = CPU 數
+  python main.py --workers 4 --no-pin         # 4 個 worker，不綁定 CPU
+  python main.py -- --headless -u 600 -t 10m  # -- 之後的參數傳給 master
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+project_root = Path(__file__).resolve().parent
+
+# master 結束後等待 worker 自行結束的秒數，逾時則強制終止
+WORKER_EXIT_TIMEOUT = 10.0
+
+
+def available_cpus() -> List[int]:
+    """目前行程可使用的 CPU（考慮 taskset / cgroup 的限制）。"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def assign_cpus(workers: int, cpus: List[int]) -> List[int]:
+    """第 i 個 worker 綁定的 CPU；worker 比 CPU 多時輪流分配。"""
+    return [cpus[i % len(cpus)] for i in range(workers)]
+
+
+def master_command(config: str, workers: int, master_port: int, extra: List[str]) -> List[str]:
+    return [sys.executable, '-m', 'locust', '--config', config,
+            '--master', '--master-bind-port', str(master_port),
+            '--expect-workers', str(workers), *extra]
+
+
+def worker_command(config: str, index: int, master_port: int, results_dir: str) -> List[str]:
+    # worker 不輸出 CSV / HTML（由 master 彙整），日誌各自一個檔案
+    return [sys.executable, '-m', 'locust', '--config', config,
+            '--worker', '--master-host', '127.0.0.1', '--master-port', str(master_port),
+            '--csv=', '--html=', '--logfile', os.path.join(results_dir, f'worker-{index}.log')]
+
+
+def pin(pid: int, cpu: int) -> bool:
+    """把行程綁定到單一 CPU；平台不支援時回傳 False。"""
+    if not hasattr(os, 'sched_setaffinity'):
+        return False
+    try:
+        os.sched_setaffinity(pid, {cpu})
+        return True
+    except OSError as e:
+        print(f"[Launcher] ⚠️ Failed to pin pid {pid} to CPU {cpu}: {e}")
+        return False
+
+
+def run(config: str, workers: int, master_port: int, results_dir: str, pin_workers: bool,
+        extra: List[str]) -> int:
+    os.makedirs(results_dir, exist_ok=True)
+    cpus = assign_cpus(workers, available_cpus())
+
+    master = subprocess.Popen(master_command(config, workers, master_port, extra), cwd=project_root)
+    print(f"[Launcher] Started master (pid {master.pid}), expecting {workers} workers")
+
+    worker_procs = []
+    for index, cpu in enumerate(cpus):
+        proc = subprocess.Popen(worker_command(config, index, master_port, results_dir), cwd=project_root)
+        pinned = pin_workers and pin(proc.pid, cpu)
+        worker_procs.append(proc)
+        print(f"[Launcher] Started worker {index} (pid {proc.pid})" + (f" on CPU {cpu}" if pinned else ""))
+
+    def forward(signum, frame):
+        # Ctrl+C 同時送到整個 process group，這裡只需轉送 SIGTERM 給 master
+        if signum != signal.SIGINT and master.poll() is None:
+            master.send_signal(signum)
+
+    signal.signal(signal.SIGINT, forward)
+    signal.signal(signal.SIGTERM, forward)
+
+    try:
+        returncode = master.wait()
+    finally:
+        # master 結束時會通知 worker 停止；沒有停止的 worker 在逾時後強制終止
+        deadline = time.monotonic() + WORKER_EXIT_TIMEOUT
+        for proc in worker_procs:
+            try:
+                proc.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                print(f"[Launcher] Terminating worker pid {proc.pid}")
+                proc.terminate()
+        for proc in worker_procs:
+            proc.wait()
+        if master.poll() is None:
+            master.terminate()
+            master.wait()
+    print(f"[Launcher] Master exited with code {returncode}; results in {results_dir}")
+    return returncode
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    extra = []
+    if '--' in argv:
+        split = argv.index('--')
+        argv, extra = argv[:split], argv[split + 1:]
+
+    parser = argparse.ArgumentParser(description="Run a local Locust master with one worker per CPU")
+    parser.add_argument('--config', default='./locust.conf', help="Locust config file (default: ./locust.conf)")
+    parser.add_argument('--workers', type=int, default=len(available_cpus()),
+                        help="number of workers (default: number of available CPUs)")
+    parser.add_argument('--master-port', type=int, default=5557)
+    parser.add_argument('--results-dir', default='./results', help="directory for worker logs")
+    parser.add_argument('--no-pin', action='store_true', help="do not pin workers to CPUs")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    # 子行程在專案根目錄執行（locust.conf 內的相對路徑以此為準）
+    return run(os.path.abspath(args.config), args.workers, args.master_port,
+               os.path.abspath(args.results_dir), not args.no_pin, extra)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
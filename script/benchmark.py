@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+產生器負載的 benchmark：在 loopback 位址上啟動替身 HTTP / DNS 伺服器（獨立行程），
+逐一以無 UI 模式執行每個 User 類別固定時間（預設重複 3 次取中位數），記錄每核心每秒請求數、每個請求的 CPU 時間、
+每個 User 的 RSS 與事件迴圈延遲 p99，並與基準檔比較；任一指標退步超過容忍範圍時結束碼為 1。
+
+HTTP 替身監聽 127.0.1.1 ~ 127.0.1.6，來源 IP 為 127.0.0.2 起（Linux 不需另外設定 loopback alias）。
+
+用法：
+  python script/benchmark.py                           # 執行所有情境並與基準比較
+  python script/benchmark.py SocialUser DnsLoad -d 30  # 只執行部分情境，每個量測 30 秒
+  python script/benchmark.py DnsLoad --repeat 5        # 重複 5 次取中位數
+  python script/benchmark.py --update-baseline         # 以這次的結果更新基準
+  python script/benchmark.py serve                     # 只啟動替身伺服器
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.benchmark import (SCENARIOS, compare_with_baseline, load_baseline, median_metrics, run_scenario,
+                             save_baseline, serve_stand_ins, wait_for_stand_ins)
+
+DEFAULT_BASELINE = str(project_root / 'script' / 'benchmark_baseline.json')
+COLUMNS = ('rps', 'rps_per_core', 'cpu_per_request_us', 'rss_per_user_kb', 'lag_p99_ms', 'failure_ratio')
+
+
+def serve_command(args):
+    return [sys.executable, __file__, 'serve', '--http-port', str(args.http_port),
+            '--dns-port', str(args.dns_port), '--segment-size', str(args.segment_size)]
+
+
+def print_table(results):
+    print(f"{'scenario':<16}" + ''.join(f"{column:>20}" for column in COLUMNS))
+    for scenario, metrics in results.items():
+        print(f"{scenario:<16}" + ''.join(f"{metrics[column]:>20}" for column in COLUMNS))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark load-generator overhead against local stand-in servers")
+    parser.add_argument('scenarios', nargs='*', help=f"user classes to run, or 'serve' (default: {', '.join(SCENARIOS)})")
+    parser.add_argument('-d', '--duration', type=float, default=20.0, help="measured seconds per scenario (default: 20)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="runs per scenario; each metric is the median over the runs (default: 3)")
+    parser.add_argument('--warmup', type=float, default=None, help="seconds after spawning before measuring")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative regression (default: 0.25)")
+    parser.add_argument('--update-baseline', action='store_true', help="write the results as the new baseline")
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    parser.add_argument('--http-port', type=int, default=18080)
+    parser.add_argument('--dns-port', type=int, default=15353)
+    parser.add_argument('--segment-size', type=int, default=256 * 1024, help="stand-in video segment bytes")
+    args = parser.parse_args(argv)
+
+    if args.scenarios == ['serve']:
+        serve_stand_ins(args.http_port, args.dns_port, args.segment_size)
+        return 0
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    scenarios = args.scenarios or list(SCENARIOS)
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    # 替身伺服器在獨立行程中執行，其 CPU 不計入 Locust 行程
+    server = subprocess.Popen(serve_command(args))
+    results = {}
+    try:
+        if not wait_for_stand_ins(args.http_port):
+            print("[Benchmark] ❌ Stand-in servers did not start")
+            return 2
+        for scenario in scenarios:
+            runs = []
+            for run in range(1, args.repeat + 1):
+                print(f"[Benchmark] Running {scenario} for {args.duration:.0f}s ({run}/{args.repeat})...", flush=True)
+                metrics, output = run_scenario(scenario, args.http_port, args.dns_port, args.duration, args.warmup)
+                if metrics is None:
+                    print(f"[Benchmark] ❌ {scenario} produced no measurement; Locust output:\n{output}")
+                    return 2
+                runs.append(metrics)
+            results[scenario] = median_metrics(runs)
+    finally:
+        server.terminate()
+        server.wait()
+
+    print_table(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.update_baseline:
+        save_baseline(args.baseline, results, args.duration, args.repeat)
+        print(f"[Benchmark] Baseline updated: {args.baseline}")
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    missing = [scenario for scenario in results if scenario not in baseline]
+    if missing:
+        print(f"[Benchmark] ⚠️ No baseline for {', '.join(missing)}")
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"[Benchmark] ❌ Regression: {regression}")
+    if not regressions:
+        print("[Benchmark] ✅ No regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,20 @@
+"""
+benchmark 量測用的附加 locustfile，由 script/benchmark.py 與主 locustfile 一起載入：
+  locust -f locustfile.py,script/benchmark_probe.py ...
+沒有 User 類別，只在 BENCHMARK_RESULT 環境變數存在時安裝量測（見 utils/benchmark.py）。
+"""
+
+import sys
+from pathlib import Path
+
+from locust import events
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.benchmark import install_benchmark_probe
+
+
+@events.init.add_listener
+def _on_locust_init(environment, **kwargs):
+    install_benchmark_probe(environment)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+估計請求速率序列的 Hurst 參數，確認 PARETO_ALPHA_SESSION / PARETO_ALPHA_WAIT 產生預期的長相依性。
+
+用法：
+  # 以與 VideoUser 相同的 ON/OFF 模型模擬 N 個用戶（alpha 預設讀取 locustfile.py 的設定）
+  python script/hurst_check.py simulate --users 1000 --duration 7200 --seed 1
+
+  # 分析實際測試的 Locust stats history（--csv-full-history 產生的 *_stats_history.csv）
+  python script/hurst_check.py csv results/run_stats_history.csv
+"""
+
+import argparse
+import ast
+import csv
+import sys
+from pathlib import Path
+
+import numpy as np
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.lrd import (expected_hurst, hurst_aggregated_variance, hurst_rescaled_range,
+                       truncated_pareto)
+
+
+def read_locustfile_alphas(path: Path):
+    """從 locustfile.py 讀出 PARETO_ALPHA_SESSION / PARETO_ALPHA_WAIT（不匯入 locustfile）。"""
+    values = {}
+    for node in ast.parse(path.read_text()).body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            if name in ('PARETO_ALPHA_SESSION', 'PARETO_ALPHA_WAIT'):
+                values[name] = ast.literal_eval(node.value)
+    return values.get('PARETO_ALPHA_SESSION', 1.4), values.get('PARETO_ALPHA_WAIT', 1.4)
+
+
+def simulate_rate(users: int, duration: float, alpha_on: float, alpha_off: float,
+                  seed=None, bin_size: float = 1.0) -> np.ndarray:
+    """
+    模擬 VideoUser 的 ON/OFF 行為，回傳每個 bin 的請求數：
+    ON 為 int(Pareto * 10) 個 segment（截斷在 200），segment 間隔 U(2.3, 5.3) 秒；
+    OFF 為 Pareto * 5 秒（截斷在 300）。
+    """
+    rng = np.random.default_rng(seed)
+    bins = int(duration / bin_size)
+    counts = np.zeros(bins, dtype=np.int64)
+    block = 256
+    for _ in range(users):
+        # 每個用戶從隨機相位開始，避免所有用戶同時啟動
+        now = -rng.uniform(0, 300)
+        while now < duration:
+            sessions = np.maximum(1, (truncated_pareto(rng, alpha_on, 1.0, 20.0, block) * 10).astype(int))
+            waits = truncated_pareto(rng, alpha_off, 5.0, 300.0, block)
+            for segments, wait in zip(sessions, waits):
+                gaps = rng.uniform(2.3, 5.3, segments)
+                times = now + np.concatenate(([0.0], np.cumsum(gaps[:-1])))
+                valid = times[(times >= 0) & (times < duration)]
+                np.add.at(counts, (valid / bin_size).astype(int), 1)
+                now += gaps.sum() + wait
+                if now >= duration:
+                    break
+    return counts
+
+
+def read_stats_history(path: str) -> np.ndarray:
+    """讀取 Locust *_stats_history.csv 中 Aggregated 列的 Requests/s。"""
+    rates = []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            if row.get('Name') == 'Aggregated':
+                rates.append(float(row['Requests/s']))
+    return np.asarray(rates)
+
+
+def report(series: np.ndarray, expected: float = None):
+    print(f"samples:              {series.size}")
+    print(f"mean rate:            {series.mean():.2f}")
+    print(f"H (aggregated var.):  {hurst_aggregated_variance(series):.3f}")
+    print(f"H (R/S):              {hurst_rescaled_range(series):.3f}")
+    if expected is not None:
+        print(f"H (expected, ON/OFF): {expected:.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estimate the Hurst parameter of a request-rate series")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    alpha_on, alpha_off = read_locustfile_alphas(project_root / 'locustfile.py')
+    simulate = sub.add_parser('simulate', help="simulate VideoUser ON/OFF sources")
+    simulate.add_argument('--users', type=int, default=500)
+    simulate.add_argument('--duration', type=float, default=3600, help="seconds")
+    simulate.add_argument('--alpha-on', type=float, default=alpha_on)
+    simulate.add_argument('--alpha-off', type=float, default=alpha_off)
+    simulate.add_argument('--seed', type=int, default=None)
+
+    from_csv = sub.add_parser('csv', help="analyse a Locust *_stats_history.csv")
+    from_csv.add_argument('path')
+
+    args = parser.parse_args(argv)
+    if args.command == 'simulate':
+        series = simulate_rate(args.users, args.duration, args.alpha_on, args.alpha_off, args.seed)
+        report(series, expected_hurst(args.alpha_on, args.alpha_off))
+    else:
+        report(read_stats_history(args.path))
+
+
+if __name__ == '__main__':
+    main()
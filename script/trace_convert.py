@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+"""
+把 JSONL trace 轉成 TraceReplayUser 使用的二進位格式（讀取較快、檔案較小）。
+
+用法：
+  python script/trace_convert.py traces/prod.jsonl traces/prod.bin
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.trace import convert_jsonl_to_binary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a JSONL request trace to the binary trace format")
+    parser.add_argument('source', help="JSONL trace file")
+    parser.add_argument('destination', help="binary trace file to write")
+    args = parser.parse_args(argv)
+    count = convert_jsonl_to_binary(args.source, args.destination)
+    print(f"[TraceConvert] Wrote {count} records to {args.destination}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+from typing import Dict, List, Optional
+
+# 未提供 master playlist 或 renditions 設定時使用的畫質階梯（bandwidth 單位 bit/s）
+DEFAULT_RENDITIONS = [
+    {'name': '360p', 'bandwidth': 1_000_000},
+    {'name': '480p', 'bandwidth': 2_500_000},
+    {'name': '720p', 'bandwidth': 5_000_000},
+    {'name': '1080p', 'bandwidth': 8_000_000},
+]
+
+class AbrPlayer:
+    """
+    ABR（adaptive bitrate）播放器模型，供 VideoUser 決定畫質與請求時機。
+
+    特性：
+    1. 以 EWMA 估計下載速率
+    2. 畫質選擇規則：
+       - throughput：選擇不超過 safety * 估計速率的最高畫質
+       - bba：buffer-based（BBA-0），buffer 低於 reservoir 時選最低畫質，
+         超過 reservoir + cushion 時選最高畫質，中間依 buffer 線性對應到速率
+    3. buffer 佔用模型：下載期間 buffer 持續消耗，消耗完即為 rebuffer（卡頓）
+    4. 下一次請求的時機由 buffer 決定：buffer 已滿時等到有空間再下載，而不是固定的隨機等待
+
+    renditions 依頻寬由低到高排序，每個項目至少包含 'name' 與 'bandwidth'（bit/s）。
+    """
+
+    POLICIES = ('throughput', 'bba')
+    # 可由設定檔 abr 區塊覆寫的參數
+    OPTIONS = ('policy', 'safety', 'max_buffer', 'startup_buffer', 'reservoir', 'cushion', 'ewma_alpha')
+
+    def __init__(self, renditions: List[Dict], policy: str = 'throughput',
+                 safety: float = 0.8, max_buffer: float = 30.0, startup_buffer: float = 4.0,
+                 reservoir: float = 5.0, cushion: float = 15.0, ewma_alpha: float = 0.3):
+        if not renditions:
+            raise ValueError("AbrPlayer needs at least one rendition")
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown ABR policy '{policy}', expected one of {self.POLICIES}")
+        self.renditions = sorted(renditions, key=lambda r: r['bandwidth'])
+        self.policy = policy
+        self.safety = safety
+        self.max_buffer = max_buffer
+        self.startup_buffer = startup_buffer
+        self.reservoir = reservoir
+        self.cushion = cushion
+        self.ewma_alpha = ewma_alpha
+
+        self.buffer_level = 0.0           # 目前 buffer 中可播放的秒數
+        self.playing = False              # 是否已開始播放（startup 完成）
+        self.throughput: Optional[float] = None  # 估計的下載速率（bit/s）
+        self.current = 0                  # 目前畫質在 renditions 中的索引
+        self.rebuffer_count = 0
+        self.rebuffer_time = 0.0
+        self.switch_count = 0
+
+    @property
+    def rendition(self) -> Dict:
+        return self.renditions[self.current]
+
+    def _throughput_choice(self) -> int:
+        if self.throughput is None:
+            return 0
+        budget = self.safety * self.throughput
+        choice = 0
+        for index, rendition in enumerate(self.renditions):
+            if rendition['bandwidth'] <= budget:
+                choice = index
+        return choice
+
+    def _bba_choice(self) -> int:
+        if self.buffer_level <= self.reservoir:
+            return 0
+        if self.buffer_level >= self.reservoir + self.cushion:
+            return len(self.renditions) - 1
+        low = self.renditions[0]['bandwidth']
+        high = self.renditions[-1]['bandwidth']
+        rate = low + (high - low) * (self.buffer_level - self.reservoir) / self.cushion
+        choice = 0
+        for index, rendition in enumerate(self.renditions):
+            if rendition['bandwidth'] <= rate:
+                choice = index
+        return choice
+
+    def choose_rendition(self) -> int:
+        """
+        為下一個 segment 選擇畫質。
+
+        Returns:
+            變更前的畫質索引（與 current 不同代表發生切換）
+        """
+        previous = self.current
+        if self.policy == 'bba':
+            self.current = self._bba_choice()
+        else:
+            self.current = self._throughput_choice()
+        if self.current != previous:
+            self.switch_count += 1
+        return previous
+
+    def _drain(self, seconds: float) -> float:
+        """播放 seconds 秒，回傳因 buffer 用完而卡頓的秒數。"""
+        if not self.playing or seconds <= 0:
+            return 0.0
+        if seconds <= self.buffer_level:
+            self.buffer_level -= seconds
+            return 0.0
+        stall = seconds - self.buffer_level
+        self.buffer_level = 0.0
+        return stall
+
+    def on_segment_downloaded(self, duration: float, nbytes: int, download_time: float) -> float:
+        """
+        更新下載速率估計和 buffer 狀態。
+
+        Args:
+            duration: segment 的播放長度（秒）
+            nbytes: 下載的位元組數
+            download_time: 下載花費的時間（秒）
+
+        Returns:
+            這次下載期間的卡頓秒數（0 表示沒有 rebuffer）
+        """
+        if download_time > 0 and nbytes > 0:
+            sample = nbytes * 8 / download_time
+            if self.throughput is None:
+                self.throughput = sample
+            else:
+                self.throughput = self.ewma_alpha * sample + (1 - self.ewma_alpha) * self.throughput
+
+        stall = self._drain(download_time)
+        if stall > 0:
+            self.rebuffer_count += 1
+            self.rebuffer_time += stall
+            # 卡頓後需要重新累積 startup buffer
+            self.playing = False
+
+        self.buffer_level += duration
+        if not self.playing and self.buffer_level >= self.startup_buffer:
+            self.playing = True
+        return stall
+
+    def on_segment_failed(self, download_time: float) -> float:
+        """
+        segment 下載失敗（非 2xx 或連線錯誤）：不更新下載速率估計，buffer 也不增加。
+        失敗請求期間照常播放，之後缺少這段內容，一律記為一次卡頓並重新累積 startup buffer。
+
+        Returns:
+            這次請求期間的卡頓秒數
+        """
+        stall = self._drain(download_time)
+        self.rebuffer_count += 1
+        self.rebuffer_time += stall
+        self.playing = False
+        return stall
+
+    def delay_before_next_request(self, next_duration: float) -> float:
+        """
+        依 buffer 決定下一次請求前要等待的秒數，並把等待期間的播放計入 buffer。
+        buffer 放得下下一個 segment 時立即請求。
+        """
+        if not self.playing:
+            return 0.0
+        delay = max(0.0, self.buffer_level + next_duration - self.max_buffer)
+        self._drain(delay)
+        return delay
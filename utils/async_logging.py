@@ -0,0 +1,303 @@
+import logging
+import os
+import time
+from collections import deque
+from logging.handlers import QueueHandler
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+import gevent
+from gevent import monkey
+
+logger = logging.getLogger(__name__)
+
+# gevent monkey patch 後 threading.Thread 會變成 greenlet、鎖與 sleep 也會讓出事件迴圈，
+# 背景寫入需要真正的原生執行緒與原生的鎖
+_start_native_thread = monkey.get_original('_thread', 'start_new_thread')
+_native_lock = monkey.get_original('_thread', 'allocate_lock')
+_native_sleep = monkey.get_original('time', 'sleep')
+
+# 以環境變數調整（預設值）：
+# 每個訊息樣板（logger 名稱 + 未格式化的訊息）每個時間窗最多輸出幾筆
+LOG_RATE_LIMIT_ENV = 'LOG_RATE_LIMIT'
+DEFAULT_RATE_LIMIT = 20
+# 速率限制的時間窗（秒）
+LOG_RATE_WINDOW_ENV = 'LOG_RATE_WINDOW'
+DEFAULT_RATE_WINDOW = 10.0
+# 背景寫入的間隔（秒），每次把累積的記錄一次寫出
+LOG_FLUSH_INTERVAL_ENV = 'LOG_FLUSH_INTERVAL'
+DEFAULT_FLUSH_INTERVAL = 0.5
+# User 生命週期統計的輸出間隔（秒）
+LIFECYCLE_INTERVAL_ENV = 'LOG_LIFECYCLE_INTERVAL'
+DEFAULT_LIFECYCLE_INTERVAL = 10.0
+# 佇列上限，超過時丟棄並計數（避免寫入跟不上時記憶體無限成長）
+MAX_QUEUE = 100_000
+
+
+def _env_number(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    try:
+        return type(default)(value) if value else default
+    except ValueError:
+        logger.warning("[AsyncLogging] Invalid %s=%r, using %s", name, value, default)
+        return default
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    依訊息樣板限制輸出速率：同一個呼叫點（logger 名稱 + 未格式化的 msg）每 window 秒最多 limit 筆，
+    超過的記錄不進佇列，只計數（所有等級都一樣），被省略的筆數由 BatchWriter 在下一次寫入時輸出。
+    """
+
+    def __init__(self, limit: int = DEFAULT_RATE_LIMIT, window: float = DEFAULT_RATE_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        # 呼叫端（greenlet）與 BatchWriter（原生執行緒）都會使用，需要原生的鎖
+        self._lock = _native_lock()
+        # {(logger 名稱, msg): [時間窗開始時間, 已輸出筆數, 被省略筆數]}
+        self._windows: Dict[Tuple[str, str], List] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.limit <= 0:
+            return True
+        key = (record.name, str(record.msg))
+        now = record.created
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None:
+                self._windows[key] = [now, 1, 0]
+                return True
+            if now - state[0] >= self.window:
+                state[0], state[1] = now, 0
+            if state[1] < self.limit:
+                state[1] += 1
+                return True
+            state[2] += 1
+            return False
+
+    def take_suppressed(self) -> List[Tuple[str, str, int]]:
+        """取出並清除被省略的筆數 [(logger 名稱, msg, 筆數)]，同時移除已過期的時間窗。"""
+        now = time.time()
+        suppressed = []
+        with self._lock:
+            for key, state in list(self._windows.items()):
+                if state[2]:
+                    suppressed.append((key[0], key[1], state[2]))
+                    state[2] = 0
+                elif now - state[0] >= self.window:
+                    del self._windows[key]
+        return suppressed
+
+
+class BatchingQueueHandler(QueueHandler):
+    """
+    把記錄放進佇列，由 BatchWriter 在背景執行緒格式化並批次寫出。
+
+    與標準的 QueueHandler 不同，prepare() 不在呼叫端格式化訊息：
+    格式化（% 參數、traceback）延後到背景執行緒，呼叫端只付出建立 LogRecord 的成本。
+    """
+
+    def __init__(self, max_queue: int = MAX_QUEUE):
+        # collections.deque 的 append / popleft 不需鎖，也不受 gevent monkey patch 影響，可跨原生執行緒使用
+        super().__init__(deque())
+        self.max_queue = max_queue
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if len(self.queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        self.queue.append(record)
+
+
+class BatchWriter:
+    """
+    背景的原生執行緒（不是 greenlet），每 flush_interval 秒取出佇列中的所有記錄，
+    依原本 handler 的 formatter 格式化後，每個輸出串流只 write / flush 一次，
+    終端機或磁碟 I/O 阻塞時不會卡住 gevent 的事件迴圈。
+    """
+
+    def __init__(self, queue_handler: BatchingQueueHandler, targets: List[logging.Handler],
+                 rate_filter: Optional[RateLimitFilter] = None, flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        self.queue_handler = queue_handler
+        self.targets = targets
+        self.rate_filter = rate_filter
+        self.flush_interval = flush_interval
+        self.stopped = False
+        self._flush_lock = _native_lock()
+
+    def start(self):
+        _start_native_thread(self._run, ())
+
+    def _run(self):
+        while not self.stopped:
+            _native_sleep(self.flush_interval)
+            self.flush()
+
+    def stop(self):
+        """停止背景執行緒並寫出剩餘的記錄。"""
+        self.stopped = True
+        self.flush()
+
+    def _summary_records(self) -> List[logging.LogRecord]:
+        records = []
+        if self.rate_filter is not None:
+            for name, msg, count in self.rate_filter.take_suppressed():
+                records.append(logging.LogRecord(
+                    name, logging.INFO, __file__, 0,
+                    "[AsyncLogging] Suppressed %d messages like: %s", (count, msg), None))
+        dropped, self.queue_handler.dropped = self.queue_handler.dropped, 0
+        if dropped:
+            records.append(logging.LogRecord(
+                __name__, logging.WARNING, __file__, 0,
+                "[AsyncLogging] Log queue full, dropped %d messages", (dropped,), None))
+        return records
+
+    def flush(self) -> int:
+        """取出佇列中的記錄並寫出，回傳寫出的筆數。"""
+        with self._flush_lock:
+            queue = self.queue_handler.queue
+            records = []
+            try:
+                while True:
+                    records.append(queue.popleft())
+            except IndexError:
+                pass
+            records.extend(self._summary_records())
+            if not records:
+                return 0
+            for target in self.targets:
+                self._write(target, records)
+            return len(records)
+
+    @staticmethod
+    def _write(target: logging.Handler, records: List[logging.LogRecord]):
+        stream = getattr(target, 'stream', None)
+        if stream is None or not isinstance(target, logging.StreamHandler):
+            # 非串流的 handler（例如 syslog）逐筆交給原本的 handler
+            for record in records:
+                if record.levelno >= target.level:
+                    target.handle(record)
+            return
+        lines = []
+        for record in records:
+            if record.levelno < target.level or not target.filter(record):
+                continue
+            try:
+                lines.append(target.format(record))
+            except Exception:
+                target.handleError(record)
+        if not lines:
+            return
+        try:
+            stream.write(target.terminator.join(lines) + target.terminator)
+            stream.flush()
+        except Exception:
+            target.handleError(records[-1])
+
+
+class LifecycleCounters:
+    """
+    User 生命週期事件（建立、掛載來源 IP、停止、沒有可用 IP 等）的計數，
+    取代每個 User 各自輸出的訊息，由 install_async_logging() 定期輸出一行摘要。
+    """
+    _instance = None
+    _manager_lock = Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._manager_lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if hasattr(self, '_initialized'):
+            return
+
+        with self._manager_lock:
+            if hasattr(self, '_initialized'):
+                return
+            self._lock = Lock()
+            # {(User 類別, 事件): 次數}，上次摘要之後的增量
+            self._counts: Dict[Tuple[str, str], int] = {}
+            self._initialized = True
+
+    def record(self, user_class_name: str, event: str):
+        key = (user_class_name, event)
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def take(self) -> Dict[str, Dict[str, int]]:
+        """取出並清除上次之後的計數 {User 類別: {事件: 次數}}。"""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        summary: Dict[str, Dict[str, int]] = {}
+        for (user_class_name, event), count in sorted(counts.items()):
+            summary.setdefault(user_class_name, {})[event] = count
+        return summary
+
+    def log_summary(self) -> bool:
+        summary = self.take()
+        for user_class_name, events in summary.items():
+            logger.info("[Lifecycle] %s: %s", user_class_name,
+                        ', '.join(f"{event} +{count}" for event, count in events.items()))
+        return bool(summary)
+
+
+def record_lifecycle(user_class_name: str, event: str):
+    """記錄一次 User 生命週期事件的便捷函數"""
+    LifecycleCounters().record(user_class_name, event)
+
+
+def install_async_logging(environment, root: Optional[logging.Logger] = None) -> Optional[BatchWriter]:
+    """
+    把 root logger 的 handler 換成 BatchingQueueHandler + 背景 BatchWriter，
+    並定期輸出 User 生命週期摘要。結束時（quitting）換回原本的 handler 並寫出剩餘的記錄。
+
+    環境變數 LOG_RATE_LIMIT=0 可關閉速率限制；LOG_FLUSH_INTERVAL 調整批次寫入間隔。
+    """
+    if getattr(environment, '_async_logging_installed', False):
+        return None
+    environment._async_logging_installed = True
+
+    root = root or logging.getLogger()
+    targets = [handler for handler in root.handlers if not isinstance(handler, BatchingQueueHandler)]
+    if not targets:
+        return None
+
+    rate_filter = RateLimitFilter(int(_env_number(LOG_RATE_LIMIT_ENV, DEFAULT_RATE_LIMIT)),
+                                  _env_number(LOG_RATE_WINDOW_ENV, DEFAULT_RATE_WINDOW))
+    queue_handler = BatchingQueueHandler()
+    queue_handler.addFilter(rate_filter)
+    writer = BatchWriter(queue_handler, targets, rate_filter,
+                         _env_number(LOG_FLUSH_INTERVAL_ENV, DEFAULT_FLUSH_INTERVAL))
+    for handler in targets:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    writer.start()
+
+    interval = _env_number(LIFECYCLE_INTERVAL_ENV, DEFAULT_LIFECYCLE_INTERVAL)
+
+    def lifecycle_loop():
+        while True:
+            gevent.sleep(interval)
+            LifecycleCounters().log_summary()
+
+    lifecycle_greenlet = gevent.spawn(lifecycle_loop)
+
+    @environment.events.quitting.add_listener
+    def _on_quitting(**kwargs):
+        lifecycle_greenlet.kill(block=False)
+        LifecycleCounters().log_summary()
+        # 之後的訊息（例如 Locust 結束時的日誌）直接由原本的 handler 輸出
+        root.removeHandler(queue_handler)
+        for handler in targets:
+            root.addHandler(handler)
+        writer.stop()
+
+    return writer
@@ -0,0 +1,439 @@
+import ipaddress
+import json
+import os
+import re
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import gevent
+from gevent import socket as gsocket
+from gevent.pywsgi import WSGIServer
+
+from utils.histogram import LogHistogram
+
+project_root = Path(__file__).resolve().parent.parent
+
+# benchmark 行程與 Locust 子行程之間以環境變數傳遞設定
+BENCHMARK_RESULT_ENV = 'BENCHMARK_RESULT'
+BENCHMARK_WARMUP_ENV = 'BENCHMARK_WARMUP'
+BENCHMARK_DURATION_ENV = 'BENCHMARK_DURATION'
+BENCHMARK_WAIT_TIME_ENV = 'BENCHMARK_WAIT_TIME'
+
+# 本機替身伺服器：HTTP 監聽 127.0.1.x（target.json 的子網），UE 來源 IP 為 127.0.0.x
+HTTP_SUBNET = '127.0.1.0/29'
+SOURCE_IP_COUNT = 32
+DNS_HOST = '127.0.0.1'
+
+# 各 User 類別的 benchmark 情境：
+# users / spawn_rate 為 Locust 的 -u / -r，population 為計算 RSS 的 UE 數（預設為 users），
+# wait_time 取代類別的 think time（None 表示沿用），profile 合併進該類別的 config-users 設定。
+# 負載刻意低於單核心上限：行程飽和時事件迴圈延遲只反映排隊，看不出熱路徑上的阻塞
+SCENARIOS: Dict[str, Dict] = {
+    'SocialUser': {'users': 200, 'spawn_rate': 200, 'wait_time': 1.0,
+                   'profile': {'target_server_count': 4}},
+    'FastSocialUser': {'users': 200, 'spawn_rate': 200, 'wait_time': 1.0,
+                       'profile': {'target_server_count': 4}},
+    'VideoUser': {'users': 200, 'spawn_rate': 200, 'wait_time': 0.5,
+                  'profile': {'target_server_count': 1}},
+    'FastVideoUser': {'users': 200, 'spawn_rate': 200, 'wait_time': 0.5,
+                      'profile': {'target_server_count': 1}},
+    'DnsLoad': {'users': 1000, 'spawn_rate': 1000, 'wait_time': 0.5, 'profile': {}},
+    'SwarmUser': {'users': 1, 'spawn_rate': 1, 'population': 40000, 'warmup': 8.0,
+                  'profile': {'ues': {'SocialUser': 20000, 'DnsLoad': 20000}, 'spawn_rate': 20000,
+                              'think_time': {'DnsLoad': [5, 15]}}},
+}
+
+# 比較的指標與方向：True 表示越大越好
+METRICS = {
+    'rps_per_core': True,
+    'cpu_per_request_us': False,
+    'rss_per_user_kb': False,
+    'lag_p99_ms': False,
+}
+# 數值很小時的絕對容忍量，避免雜訊造成誤判
+METRIC_SLACK = {'rss_per_user_kb': 1.0, 'lag_p99_ms': 2.0}
+# 替身伺服器不應該回應失敗；失敗比例超過此值表示環境有問題
+MAX_FAILURE_RATIO = 0.01
+
+
+# =================================================================
+# 本機替身伺服器
+# =================================================================
+
+class StandInHttpApp:
+    """
+    替代測試環境 HTTP 服務的 WSGI 應用：/、/feed、/react，
+    以及 /video/<畫質>/video-<id>/playlist.m3u8 與 /video/<畫質>/seg-<n>.ts。
+    回應內容在建立時產生一次，之後每個請求只回傳同一個 bytes 物件。
+    """
+
+    PLAYLIST_RE = re.compile(r'^/video/[^/]+/video-(\d+)/playlist\.m3u8$')
+    SEGMENT_RE = re.compile(r'^/video/[^/]+/seg-\d+\.ts$')
+
+    def __init__(self, segment_size: int = 256 * 1024, segments: int = 30, segment_duration: float = 4.0):
+        self.index = b'<html><body>' + b'x' * 2048 + b'</body></html>'
+        self.feed = json.dumps({"items": [{"id": i, "media": f"/media/{i}.jpg"} for i in range(100)]}).encode()
+        self.react = b'{"ok": true}'
+        self.segment = b'\x47' * segment_size
+        self.segments = segments
+        self.segment_duration = segment_duration
+        self._playlists: Dict[int, bytes] = {}
+
+    def playlist(self, video_id: int) -> bytes:
+        body = self._playlists.get(video_id)
+        if body is None:
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{int(self.segment_duration)}',
+                     '#EXT-X-MEDIA-SEQUENCE:0']
+            first = video_id * self.segments
+            for n in range(first, first + self.segments):
+                lines += [f'#EXTINF:{self.segment_duration:.3f},', f'seg-{n}.ts']
+            lines.append('#EXT-X-ENDLIST')
+            body = self._playlists[video_id] = ('\n'.join(lines) + '\n').encode()
+        return body
+
+    def __call__(self, environ, start_response):
+        path = environ['PATH_INFO']
+        if environ['REQUEST_METHOD'] == 'POST':
+            # 讀完 request body，連線才能重複使用
+            environ['wsgi.input'].read()
+        content_type = 'application/octet-stream'
+        if path == '/':
+            body, content_type = self.index, 'text/html'
+        elif path == '/feed':
+            body, content_type = self.feed, 'application/json'
+        elif path == '/react':
+            body, content_type = self.react, 'application/json'
+        elif self.SEGMENT_RE.match(path):
+            body, content_type = self.segment, 'video/mp2t'
+        else:
+            match = self.PLAYLIST_RE.match(path)
+            if match is None:
+                start_response('404 Not Found', [('Content-Length', '0')])
+                return [b'']
+            body, content_type = self.playlist(int(match.group(1))), 'application/vnd.apple.mpegurl'
+        start_response('200 OK', [('Content-Type', content_type), ('Content-Length', str(len(body)))])
+        return [body]
+
+
+class StandInDns:
+    """
+    替代 DNS 伺服器的 UDP 回應器：不解析查詢，只把 header 的 QR 與 RA 位元設起來後原樣送回
+    （rcode 為 NOERROR、沒有 answer），每個查詢的處理成本固定。
+    """
+
+    def __init__(self, host: str = DNS_HOST, port: int = 0):
+        self._socket = gsocket.socket(gsocket.AF_INET, gsocket.SOCK_DGRAM)
+        self._socket.bind((host, port))
+        self.port = self._socket.getsockname()[1]
+        self.answered = 0
+        self._greenlet = None
+
+    def _serve(self):
+        sock = self._socket
+        while True:
+            data, address = sock.recvfrom(4096)
+            if len(data) < 12:
+                continue
+            sock.sendto(data[:2] + bytes((data[2] | 0x80, data[3] | 0x80)) + data[4:], address)
+            self.answered += 1
+
+    def start(self) -> 'StandInDns':
+        self._greenlet = gevent.spawn(self._serve)
+        return self
+
+    def stop(self):
+        if self._greenlet is not None:
+            self._greenlet.kill()
+        self._socket.close()
+
+
+def http_hosts(subnet: str = HTTP_SUBNET) -> List[str]:
+    """替身 HTTP 伺服器監聽的 loopback 位址（與 target.json 的子網主機一致）。"""
+    return [str(host) for host in ipaddress.ip_network(subnet).hosts()]
+
+
+def source_ips(count: int = SOURCE_IP_COUNT) -> List[str]:
+    """benchmark 使用的來源 IP（127.0.0.2 起，Linux 上整個 127/8 都可直接綁定）。"""
+    return [f'127.0.0.{i}' for i in range(2, 2 + count)]
+
+
+def serve_stand_ins(http_port: int, dns_port: int, segment_size: int, subnet: str = HTTP_SUBNET):
+    """在每個 loopback 位址上啟動 HTTP 替身，並啟動 DNS 替身，持續執行直到行程結束。"""
+    app = StandInHttpApp(segment_size=segment_size)
+    servers = [WSGIServer((host, http_port), app, log=None) for host in http_hosts(subnet)]
+    for server in servers:
+        server.start()
+    dns = StandInDns(DNS_HOST, dns_port).start()
+    print(f"[Benchmark] Stand-in HTTP on {len(servers)} loopback addresses port {http_port}, "
+          f"DNS on {DNS_HOST}:{dns.port}", flush=True)
+    gevent.wait()
+
+
+def wait_for_stand_ins(http_port: int, timeout: float = 10.0) -> bool:
+    """等待替身 HTTP 伺服器可以連線（由 benchmark 主行程在啟動子行程後呼叫）。"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((http_hosts()[-1], http_port), timeout=1.0).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+# =================================================================
+# Locust 行程內的量測
+# =================================================================
+
+def current_rss_kb() -> int:
+    """目前行程的 RSS（KB）；沒有 /proc 時改用 ru_maxrss。"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 的 ru_maxrss 單位為 bytes
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+class LoopLagProbe:
+    """
+    事件迴圈延遲探針：每 interval 秒 sleep 一次，記錄實際醒來時間比預期晚了多少（微秒）。
+    有 greenlet 長時間佔用 CPU 或事件迴圈過載時，所有排程（think time、計時器）都會延遲同樣的時間。
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.histogram = LogHistogram()
+        self._greenlet = None
+
+    def _run(self):
+        interval = self.interval
+        while True:
+            start = time.perf_counter()
+            gevent.sleep(interval)
+            self.histogram.record((time.perf_counter() - start - interval) * 1e6)
+
+    def start(self) -> 'LoopLagProbe':
+        self._greenlet = gevent.spawn(self._run)
+        return self
+
+    def stop(self):
+        if self._greenlet is not None:
+            self._greenlet.kill()
+
+    def reset(self):
+        self.histogram = LogHistogram()
+
+    def p99_ms(self) -> float:
+        return self.histogram.percentile(99) / 1000.0
+
+
+def install_benchmark_probe(environment):
+    """
+    在 benchmark 啟動的 Locust 行程中量測：所有 User 建立完成並暖機後，
+    記錄 duration 秒內的請求數、行程 CPU 時間、RSS 與事件迴圈延遲，寫成 JSON（BENCHMARK_RESULT）。
+    未設定 BENCHMARK_RESULT 時不做任何事。
+    """
+    result_path = os.environ.get(BENCHMARK_RESULT_ENV)
+    if not result_path or getattr(environment, '_benchmark_probe_installed', False):
+        return
+    environment._benchmark_probe_installed = True
+    warmup = float(os.environ.get(BENCHMARK_WARMUP_ENV, 5))
+    duration = float(os.environ.get(BENCHMARK_DURATION_ENV, 20))
+    wait_time = os.environ.get(BENCHMARK_WAIT_TIME_ENV)
+    if wait_time:
+        from locust import constant
+        for user_class in environment.user_classes:
+            user_class.wait_time = constant(float(wait_time))
+    rss_start = current_rss_kb()
+    probe = LoopLagProbe()
+
+    def measure():
+        gevent.sleep(warmup)
+        total = environment.stats.total
+        requests, failures = total.num_requests, total.num_failures
+        probe.reset()
+        probe.start()
+        cpu, started = time.process_time(), time.perf_counter()
+        gevent.sleep(duration)
+        cpu, elapsed = time.process_time() - cpu, time.perf_counter() - started
+        probe.stop()
+        result = {
+            'requests': total.num_requests - requests,
+            'failures': total.num_failures - failures,
+            'cpu_seconds': cpu,
+            'elapsed': elapsed,
+            'rss_start_kb': rss_start,
+            'rss_end_kb': current_rss_kb(),
+            'lag_p99_ms': probe.p99_ms(),
+            'lag_max_ms': (probe.histogram.max_value or 0) / 1000.0,
+            'users': environment.runner.user_count,
+        }
+        with open(result_path, 'w') as f:
+            json.dump(result, f)
+
+    @environment.events.spawning_complete.add_listener
+    def _on_spawning_complete(user_count, **kwargs):
+        gevent.spawn(measure)
+
+
+# =================================================================
+# 執行情境與比較基準
+# =================================================================
+
+def summarize(raw: Dict, population: int) -> Dict:
+    """把 Locust 行程的原始量測換算成比較用的指標。"""
+    requests = max(raw['requests'], 1)
+    cpu = max(raw['cpu_seconds'], 1e-9)
+    return {
+        'rps': round(raw['requests'] / raw['elapsed'], 1),
+        'rps_per_core': round(raw['requests'] / cpu, 1),
+        'cpu_per_request_us': round(cpu / requests * 1e6, 1),
+        'rss_per_user_kb': round(max(raw['rss_end_kb'] - raw['rss_start_kb'], 0) / max(population, 1), 2),
+        'lag_p99_ms': round(raw['lag_p99_ms'], 2),
+        'failure_ratio': round(raw['failures'] / requests, 4),
+    }
+
+
+def median_metrics(runs: List[Dict]) -> Dict:
+    """
+    同一情境重複執行多次時，各指標取中位數（偶數次取中間兩個的平均），
+    單次的排程或 GC 雜訊不會影響比較結果。
+    """
+    merged = {}
+    for name in runs[0]:
+        values = sorted(run[name] for run in runs)
+        middle = len(values) // 2
+        value = values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+        merged[name] = round(value, 4)
+    return merged
+
+
+def compare_with_baseline(results: Dict[str, Dict], baseline: Dict[str, Dict],
+                          tolerance: float = 0.25) -> List[str]:
+    """
+    比較各情境的結果與基準，回傳退步的說明（空列表表示全部通過）。
+    越小越好的指標超過 基準 × (1 + tolerance) + 絕對容忍量即為退步，越大越好的指標則低於 基準 × (1 - tolerance)。
+    失敗比例超過 MAX_FAILURE_RATIO 一律視為失敗；基準中沒有的情境或指標略過。
+    """
+    regressions = []
+    for scenario, metrics in results.items():
+        if metrics.get('failure_ratio', 0) > MAX_FAILURE_RATIO:
+            regressions.append(f"{scenario}: failure ratio {metrics['failure_ratio']:.2%}")
+        reference = baseline.get(scenario)
+        if not reference:
+            continue
+        for name, higher_is_better in METRICS.items():
+            if name not in metrics or name not in reference:
+                continue
+            value, base = metrics[name], reference[name]
+            if higher_is_better:
+                limit = base * (1 - tolerance)
+                failed = value < limit
+            else:
+                limit = base * (1 + tolerance) + METRIC_SLACK.get(name, 0.0)
+                failed = value > limit
+            if failed:
+                regressions.append(f"{scenario}: {name} {value} (baseline {base}, limit {limit:.2f})")
+    return regressions
+
+
+def load_baseline(path: str) -> Dict[str, Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f).get('scenarios', {})
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(path: str, results: Dict[str, Dict], duration: float, repeat: int = 1):
+    """把結果合併進基準檔（未執行的情境保留原本的基準）。"""
+    scenarios = load_baseline(path)
+    scenarios.update(results)
+    with open(path, 'w') as f:
+        json.dump({'duration': duration, 'repeat': repeat, 'cpu': _cpu_model(), 'scenarios': scenarios}, f,
+                  indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def _cpu_model() -> str:
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return ''
+
+
+def write_profiles(directory: str, scenario: str, http_port: int, dns_port: int) -> str:
+    """在 directory 下寫出情境使用的 config-users / ips / target 設定，回傳 config-users 的路徑。"""
+    spec = SCENARIOS[scenario]
+    users = {
+        'SocialUser': {'target_server_count': 4},
+        'DnsLoad': {'dns_server': DNS_HOST, 'dns_port': dns_port, 'timeout': 2},
+    }
+    users.setdefault(scenario, {}).update(spec.get('profile', {}))
+    config_users = [{'user_class_name': name, **profile} for name, profile in users.items()]
+    documents = {
+        'config-users.json': config_users,
+        'ips.json': {'source_ips': source_ips(), 'partition_across_workers': False},
+        'target.json': {'target_subnets': [{'subnet': HTTP_SUBNET, 'weight': 1, 'port': http_port,
+                                            'description': 'benchmark stand-in'}]},
+    }
+    for filename, document in documents.items():
+        with open(os.path.join(directory, filename), 'w') as f:
+            json.dump(document, f, indent=2)
+    return os.path.join(directory, 'config-users.json')
+
+
+def locust_command(scenario: str, config_users: str, http_port: int, run_time: int) -> List[str]:
+    spec = SCENARIOS[scenario]
+    locustfiles = f"{project_root / 'locustfile.py'},{project_root / 'script' / 'benchmark_probe.py'}"
+    return [sys.executable, '-m', 'locust', '-f', locustfiles, '--headless',
+            '-u', str(spec['users']), '-r', str(spec['spawn_rate']), '-t', f'{run_time}s',
+            '--config-users', config_users, '--host', f'http://{http_hosts()[0]}:{http_port}',
+            '--only-summary', '--loglevel', 'WARNING', '--stop-timeout', '0', scenario]
+
+
+def run_scenario(scenario: str, http_port: int, dns_port: int, duration: float,
+                 warmup: Optional[float] = None) -> Tuple[Optional[Dict], str]:
+    """
+    以無 UI 模式執行單一 User 類別，回傳 (指標, Locust 輸出)；沒有產生量測結果時指標為 None。
+    Locust 在暫存目錄中執行，不會讀取專案的 locust.conf，也不會寫出 results/。
+    """
+    spec = SCENARIOS[scenario]
+    warmup = spec.get('warmup', 5.0) if warmup is None else warmup
+    spawn_time = spec['users'] / spec['spawn_rate']
+    with tempfile.TemporaryDirectory(prefix=f'benchmark-{scenario}-') as directory:
+        config_users = write_profiles(directory, scenario, http_port, dns_port)
+        result_path = os.path.join(directory, 'result.json')
+        env = dict(os.environ)
+        env.update({
+            'PROFILES_DIR': directory,
+            BENCHMARK_RESULT_ENV: result_path,
+            BENCHMARK_WARMUP_ENV: str(warmup),
+            BENCHMARK_DURATION_ENV: str(duration),
+        })
+        env.pop(BENCHMARK_WAIT_TIME_ENV, None)
+        if spec.get('wait_time') is not None:
+            env[BENCHMARK_WAIT_TIME_ENV] = str(spec['wait_time'])
+        run_time = int(spawn_time + warmup + duration) + 3
+        proc = subprocess.run(locust_command(scenario, config_users, http_port, run_time), cwd=directory,
+                              env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        if not os.path.exists(result_path):
+            return None, proc.stdout
+        with open(result_path) as f:
+            raw = json.load(f)
+    return summarize(raw, spec.get('population', spec['users'])), proc.stdout
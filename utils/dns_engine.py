@@ -0,0 +1,355 @@
+import random
+import socket as _stdlib_socket
+import struct
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+
+import math
+import time
+from collections import deque
+
+import gevent
+from gevent import socket
+from gevent.event import AsyncResult
+import dns.exception
+import dns.message
+import dns.rcode
+
+_ID = struct.Struct('!H')
+
+
+class DnsEngine:
+    """
+    DNS 查詢引擎，每個 (來源 IP, DNS 伺服器, port) 只保留一個綁定好的 UDP socket。
+
+    特性：
+    1. socket 只建立、綁定一次，不會在每次查詢時重建
+    2. 查詢的 wire format 依 (qname, qtype) 快取，送出時只替換 16-bit 的 ID
+    3. 由背景 greenlet 接收回應，依 DNS ID 配對到等待中的查詢
+    4. 回應長度直接取自收到的 datagram，不需重新序列化
+    """
+    _engines: Dict[Tuple[str, str, int], 'DnsEngine'] = {}
+    _engines_lock = Lock()
+
+    _wire_cache: Dict[Tuple[str, int], bytes] = {}
+
+    @classmethod
+    def get(cls, source_ip: str, server: str, port: int = 53) -> 'DnsEngine':
+        """取得 (來源 IP, DNS 伺服器, port) 對應的引擎，不存在時才建立。"""
+        key = (source_ip, server, port)
+        engine = cls._engines.get(key)
+        if engine is None:
+            with cls._engines_lock:
+                engine = cls._engines.get(key)
+                if engine is None:
+                    engine = cls(source_ip, server, port)
+                    cls._engines[key] = engine
+        return engine
+
+    @classmethod
+    def close_all(cls):
+        """關閉所有引擎的 socket（測試結束時使用）。"""
+        with cls._engines_lock:
+            engines = list(cls._engines.values())
+            cls._engines.clear()
+        for engine in engines:
+            engine.close()
+
+    @classmethod
+    def wire_query(cls, qname: str, rdtype) -> bytes:
+        """回傳 (qname, qtype) 的查詢 wire format 範本（ID 為 0），只在第一次使用時建立。"""
+        key = (qname, int(rdtype))
+        wire = cls._wire_cache.get(key)
+        if wire is None:
+            query = dns.message.make_query(qname, rdtype)
+            query.id = 0
+            wire = query.to_wire()
+            cls._wire_cache[key] = wire
+        return wire
+
+    def __init__(self, source_ip: str, server: str, port: int = 53):
+        self.source_ip = source_ip
+        self.server = server
+        self.port = port
+
+        family = _stdlib_socket.AF_INET6 if ':' in server else _stdlib_socket.AF_INET
+        self.sock = socket.socket(family, _stdlib_socket.SOCK_DGRAM)
+        try:
+            self.sock.bind((source_ip or '', 0))
+            # connect 之後 kernel 只會交付來自該 DNS 伺服器的 datagram
+            self.sock.connect((server, port))
+        except OSError:
+            self.sock.close()
+            raise
+
+        # {DNS ID: 收到回應時呼叫的函數，參數為 (DNS ID, (rcode, 回應長度))}
+        self._pending: Dict[int, Callable[[int, Tuple[int, int]], None]] = {}
+        self._next_id = random.getrandbits(16)
+        self._closed = False
+        self._reader = gevent.spawn(self._read_loop)
+
+    def _allocate_id(self) -> int:
+        """配置一個目前沒有在等待中的 DNS ID。"""
+        if len(self._pending) >= 0xFFFF:
+            raise RuntimeError(f"No free DNS IDs on {self.source_ip} -> {self.server}")
+        qid = self._next_id
+        while qid in self._pending:
+            qid = (qid + 1) & 0xFFFF
+        self._next_id = (qid + 1) & 0xFFFF
+        return qid
+
+    def query(self, qname: str, rdtype, timeout: float = 5.0) -> Tuple[int, int]:
+        """
+        送出查詢並等待回應。
+
+        Returns:
+            (rcode, 回應長度)
+
+        Raises:
+            dns.exception.Timeout: 在 timeout 秒內沒有收到回應
+        """
+        waiter = AsyncResult()
+        qid = self.send_async(qname, rdtype, lambda _, result: waiter.set(result))
+        try:
+            return waiter.get(timeout=timeout)
+        except gevent.Timeout:
+            raise dns.exception.Timeout(timeout=timeout)
+        finally:
+            self._pending.pop(qid, None)
+
+    @property
+    def in_flight(self) -> int:
+        """目前等待回應中的查詢數量。"""
+        return len(self._pending)
+
+    def send_async(self, qname: str, rdtype, callback: Callable[[int, Tuple[int, int]], None]) -> int:
+        """
+        送出查詢但不等待回應，收到回應時以 (DNS ID, (rcode, 回應長度)) 呼叫 callback。
+        逾時由呼叫端以 cancel() 處理。
+
+        Returns:
+            這次查詢使用的 DNS ID
+        """
+        wire = self.wire_query(qname, rdtype)
+        qid = self._allocate_id()
+        self._pending[qid] = callback
+        try:
+            self.sock.send(_ID.pack(qid) + wire[2:])
+        except OSError:
+            self._pending.pop(qid, None)
+            raise
+        return qid
+
+    def cancel(self, qid: int):
+        """取消等待中的查詢，回傳其 callback；已收到回應或不存在時回傳 None。"""
+        return self._pending.pop(qid, None)
+
+    def _read_loop(self):
+        """背景接收回應，依 ID 交給等待中的查詢。"""
+        while not self._closed:
+            try:
+                data = self.sock.recv(65535)
+            except ConnectionRefusedError:
+                # ICMP port unreachable；對應的查詢會自行逾時
+                continue
+            except OSError:
+                if self._closed:
+                    return
+                # 避免持續性的錯誤造成忙碌迴圈
+                gevent.sleep(0.01)
+                continue
+
+            # 至少要有完整的 header，且 QR bit 必須是回應
+            if len(data) < 12 or not data[2] & 0x80:
+                continue
+            qid = _ID.unpack_from(data)[0]
+            callback = self._pending.pop(qid, None)
+            if callback is not None:
+                try:
+                    callback(qid, (data[3] & 0x0F, len(data)))
+                except Exception as e:
+                    # callback 的錯誤不能讓接收迴圈停止
+                    print(f"[DnsEngine] Error in response callback: {e}")
+
+    def close(self):
+        """停止接收並關閉 socket。"""
+        self._closed = True
+        self._reader.kill(block=False)
+        self.sock.close()
+
+
+class InFlightWindowFull(Exception):
+    """open-loop 模式下等待回應的查詢已達上限，這次查詢沒有送出。"""
+
+
+class TimerWheel:
+    """
+    簡易的計時輪，用來處理大量查詢的逾時。
+
+    每個 slot 代表一個 tick；排程和推進都是 O(1)（不計到期項目），
+    不需要為每個查詢建立計時器。超過一圈的項目會留在 slot 中，直到真正到期。
+    """
+
+    def __init__(self, tick: float, horizon: float):
+        self.tick = tick
+        self.num_slots = max(1, math.ceil(horizon / tick)) + 1
+        self._slots: List[deque] = [deque() for _ in range(self.num_slots)]
+        self._current_tick: Optional[int] = None
+
+    def schedule(self, deadline: float, key):
+        """在 deadline（perf_counter 秒）時讓 key 到期。"""
+        self._slots[int(deadline / self.tick) % self.num_slots].append((deadline, key))
+
+    def advance(self, now: float) -> List:
+        """推進到 now，回傳所有已到期的 key。"""
+        target_tick = int(now / self.tick)
+        if self._current_tick is None:
+            self._current_tick = target_tick - self.num_slots
+        # 落後超過一圈時，每個 slot 只需要檢查一次
+        start_tick = max(self._current_tick + 1, target_tick - self.num_slots + 1)
+        expired = []
+        for t in range(start_tick, target_tick + 1):
+            slot = self._slots[t % self.num_slots]
+            for _ in range(len(slot)):
+                deadline, key = slot.popleft()
+                if deadline <= now:
+                    expired.append(key)
+                else:
+                    slot.append((deadline, key))
+        self._current_tick = target_tick
+        return expired
+
+
+class OpenLoopSender:
+    """
+    open-loop 的 DNS 查詢產生器：以固定速率送出查詢，不等待回應。
+
+    特性：
+    1. 每個 DnsEngine（來源 IP + DNS 伺服器）共用一個產生器，速率以來源 IP 為單位
+    2. 送出時間依排程決定，與回應速度無關；伺服器變慢時送出速率不會下降
+    3. 等待中的查詢以 DNS ID 為 key，最多 max_in_flight 個
+    4. 逾時由計時輪處理；回應、逾時和窗口已滿都透過 on_result 回報
+
+    pick_query() 回傳 (qname, rdtype, qtype 名稱)；
+    on_result(qname, qtype 名稱, 響應時間毫秒, 回應長度, exception) 用來觸發 Locust 事件。
+    """
+    _senders: Dict['DnsEngine', 'OpenLoopSender'] = {}
+    _senders_lock = Lock()
+
+    TICK = 0.05  # 計時輪的精度（秒）
+
+    @classmethod
+    def acquire(cls, engine: 'DnsEngine', **kwargs) -> 'OpenLoopSender':
+        """取得引擎上的產生器（不存在時建立並啟動），並增加參照計數。"""
+        with cls._senders_lock:
+            sender = cls._senders.get(engine)
+            if sender is None:
+                sender = cls(engine, **kwargs)
+                cls._senders[engine] = sender
+                sender.start()
+            sender._refcount += 1
+            return sender
+
+    def release(self):
+        """減少參照計數；最後一個使用者釋放時停止產生器。"""
+        with self._senders_lock:
+            self._refcount -= 1
+            if self._refcount > 0:
+                return
+            if self._senders.get(self.engine) is self:
+                del self._senders[self.engine]
+        self.stop()
+
+    def __init__(self, engine: 'DnsEngine', rate: float, pick_query: Callable,
+                 on_result: Callable, timeout: float = 5.0, max_in_flight: int = 1000):
+        if rate <= 0:
+            raise ValueError(f"Open-loop rate must be positive, got {rate}")
+        self.engine = engine
+        self.rate = rate
+        self.pick_query = pick_query
+        self.on_result = on_result
+        self.timeout = timeout
+        self.max_in_flight = min(max_in_flight, 0xFFFF)
+        self._wheel = TimerWheel(self.TICK, timeout)
+        # {DNS ID: (序號, 排程送出時間, qname, qtype 名稱)}；序號用來區分重複使用的 DNS ID
+        self._outstanding: Dict[int, Tuple[int, float, str, str]] = {}
+        self._seq = 0
+        self._refcount = 0
+        self._greenlets: List[gevent.Greenlet] = []
+
+    @property
+    def in_flight(self) -> int:
+        """目前等待回應中的查詢數量。"""
+        return len(self._outstanding)
+
+    def start(self):
+        self._greenlets = [gevent.spawn(self._pace_loop), gevent.spawn(self._expire_loop)]
+
+    def stop(self):
+        """停止送出，並把尚未回應的查詢視為逾時回報。"""
+        gevent.killall(self._greenlets, block=False)
+        self._greenlets = []
+        for qid, entry in list(self._outstanding.items()):
+            self._expire(qid, entry[0])
+
+    def _pace_loop(self):
+        """依排程送出查詢；每次喚醒時把已到期的發送一次送完。"""
+        interval = 1.0 / self.rate
+        next_send = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            if now < next_send:
+                gevent.sleep(next_send - now)
+                now = time.perf_counter()
+            # 落後太多（例如行程被暫停）時不補送超過一秒的量，避免瞬間爆量
+            if now - next_send > 1.0:
+                next_send = now - 1.0
+            while next_send <= now:
+                self._send_one(next_send)
+                next_send += interval
+            # 讓出 CPU 給接收和其他 greenlet
+            gevent.sleep(0)
+
+    def _send_one(self, scheduled: float):
+        qname, rdtype, qtype_name = self.pick_query()
+        if len(self._outstanding) >= self.max_in_flight:
+            self.on_result(qname, qtype_name, 0, 0,
+                           InFlightWindowFull(f"{self.max_in_flight} queries in flight"))
+            return
+        try:
+            qid = self.engine.send_async(qname, rdtype, self._on_response)
+        except OSError as e:
+            self.on_result(qname, qtype_name, 0, 0, e)
+            return
+        # 延遲從排程時間算起，送出端的延誤也會反映在響應時間中
+        self._seq += 1
+        self._outstanding[qid] = (self._seq, scheduled, qname, qtype_name)
+        self._wheel.schedule(time.perf_counter() + self.timeout, (qid, self._seq))
+
+    def _on_response(self, qid: int, result: Tuple[int, int]):
+        entry = self._outstanding.pop(qid, None)
+        if entry is None:
+            return
+        _, scheduled, qname, qtype_name = entry
+        rcode, length = result
+        exception = None
+        if rcode != dns.rcode.NOERROR:
+            exception = Exception(f"DNS query failed with rcode: {dns.rcode.to_text(rcode)}")
+        self.on_result(qname, qtype_name, (time.perf_counter() - scheduled) * 1000, length, exception)
+
+    def _expire(self, qid: int, seq: int):
+        entry = self._outstanding.get(qid)
+        # 已經收到回應，或 DNS ID 已被新的查詢重複使用
+        if entry is None or entry[0] != seq:
+            return
+        del self._outstanding[qid]
+        self.engine.cancel(qid)
+        _, scheduled, qname, qtype_name = entry
+        self.on_result(qname, qtype_name, (time.perf_counter() - scheduled) * 1000, 0,
+                       dns.exception.Timeout(timeout=self.timeout))
+
+    def _expire_loop(self):
+        while True:
+            gevent.sleep(self.TICK)
+            for qid, seq in self._wheel.advance(time.perf_counter()):
+                self._expire(qid, seq)
@@ -0,0 +1,104 @@
+import logging
+import time
+from typing import Optional
+
+from geventhttpclient.client import HTTPClient, HTTPClientPool
+from geventhttpclient.url import URL
+
+logger = logging.getLogger(__name__)
+
+
+def bind_source_address(client: HTTPClient, source_ip: str) -> HTTPClient:
+    """
+    讓 geventhttpclient 的 HTTPClient 從 source_ip 建立連線（相當於 requests 的 SourceAddressAdapter）。
+
+    HTTPClient 的連線池類別是寫死的，因此直接替換連線池實例的 _create_tcp_socket，
+    在 connect 之前 bind((source_ip, 0))；同時在 socket 歸還時記錄時間，供 evict_idle() 使用。
+    """
+    connection_pool = client._connection_pool
+    create_tcp_socket = connection_pool._create_tcp_socket
+    get_socket = connection_pool.get_socket
+    return_socket = connection_pool.return_socket
+    # {閒置的 socket: 歸還時間}；gevent 的 socket 不能加屬性，取用時移除
+    idle_since = connection_pool._idle_since = {}
+
+    def create_bound_socket(family, socktype, protocol):
+        sock = create_tcp_socket(family, socktype, protocol)
+        try:
+            sock.bind((source_ip, 0))
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    def get_unstamped_socket():
+        sock = get_socket()
+        idle_since.pop(sock, None)
+        return sock
+
+    def return_stamped_socket(sock):
+        idle_since[sock] = time.monotonic()
+        return_socket(sock)
+
+    connection_pool._create_tcp_socket = create_bound_socket
+    connection_pool.get_socket = get_unstamped_socket
+    connection_pool.return_socket = return_stamped_socket
+    return client
+
+
+class SourceBoundClientPool(HTTPClientPool):
+    """
+    綁定來源 IP 的 HTTPClientPool，每個目標主機一個 HTTPClient，可直接給 FastHttpSession 使用。
+
+    Args:
+        source_ip: 來源 IP
+        max_hosts: 最多保留幾個目標主機的 HTTPClient，超過時移除最久未使用的並關閉其閒置連線
+        shared: 是否由多個 User 共用（共用的連線池不會因單一 User 改綁或結束 session 而關閉）
+        **kw: 傳給 HTTPClient 的參數；concurrency 為每個目標主機的連線數上限，
+              連線用完時請求等待連線歸還
+    """
+
+    def __init__(self, source_ip: str, max_hosts: int = 10, shared: bool = False, **kw):
+        # IPv4 來源位址無法連到 IPv6 目標，解析時只取 IPv4 位址
+        if ':' not in source_ip:
+            kw.setdefault('disable_ipv6', True)
+        super().__init__(**kw)
+        self.source_ip = source_ip
+        self.max_hosts = max_hosts
+        self.shared = shared
+
+    def get_client(self, url) -> HTTPClient:
+        if not isinstance(url, URL):
+            url = URL(url)
+        key = url.host, url.port
+        clients = self.clients
+        client = clients.pop(key, None)
+        if client is None:
+            if len(clients) >= self.max_hosts:
+                # 只關閉閒置連線：其他 greenlet 可能還在使用這個 client，使用中的連線歸還後隨 client 回收
+                oldest = next(iter(clients))
+                self._close_idle(clients.pop(oldest)._connection_pool, None, time.monotonic())
+            client = bind_source_address(HTTPClient.from_url(url, **self.client_args), self.source_ip)
+        # dict 保持插入順序，重新插入即移到最新
+        clients[key] = client
+        return client
+
+    @staticmethod
+    def _close_idle(connection_pool, idle_timeout: Optional[float], now: float) -> int:
+        # 連線池取用時會丟棄已關閉（fileno 為 -1）的 socket，因此只需關閉、不必移出佇列
+        closed = 0
+        idle_since = connection_pool._idle_since
+        for sock in list(connection_pool._socket_queue.queue):
+            if sock.fileno() < 0:
+                continue
+            if idle_timeout is None or now - idle_since.get(sock, now) >= idle_timeout:
+                sock.close()
+                idle_since.pop(sock, None)
+                closed += 1
+        return closed
+
+    def evict_idle(self, idle_timeout: float) -> int:
+        """關閉所有目標主機連線池中閒置超過 idle_timeout 秒的連線。"""
+        now = time.monotonic()
+        return sum(self._close_idle(client._connection_pool, idle_timeout, now)
+                   for client in list(self.clients.values()))
@@ -0,0 +1,129 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+
+class LogHistogram:
+    """
+    對數分桶（log-linear）的延遲直方圖，概念與 HdrHistogram 相同。
+
+    數值以整數單位記錄（例如微秒）。小於 2**precision_bits 的數值各自一桶；
+    之後每個 2 的次方區間再切成 2**(precision_bits - 1) 桶，
+    因此相對誤差固定在 2**-(precision_bits - 1) 以內，
+    記憶體只與數值的動態範圍有關，與樣本數無關。
+    計數以稀疏字典保存，只記錄有樣本的桶。
+    """
+
+    def __init__(self, precision_bits: int = 6):
+        if precision_bits < 2:
+            raise ValueError(f"precision_bits must be >= 2, got {precision_bits}")
+        self.precision_bits = precision_bits
+        self._linear = 1 << precision_bits
+        self._half = self._linear >> 1
+        self.counts: Dict[int, int] = {}
+        self.total_count = 0
+        self.total_sum = 0
+        self.min_value: Optional[int] = None
+        self.max_value: Optional[int] = None
+
+    def bucket_index(self, value: int) -> int:
+        """回傳數值所屬的桶索引。"""
+        if value < self._linear:
+            return max(value, 0)
+        shift = value.bit_length() - self.precision_bits
+        return self._linear + (shift - 1) * self._half + ((value >> shift) - self._half)
+
+    def bucket_bounds(self, index: int) -> Tuple[int, int]:
+        """回傳桶的數值範圍 [lower, upper]。"""
+        if index < self._linear:
+            return index, index
+        shift, offset = divmod(index - self._linear, self._half)
+        shift += 1
+        sub = offset + self._half
+        return sub << shift, ((sub + 1) << shift) - 1
+
+    def record(self, value: int, count: int = 1):
+        """記錄一個（或 count 個相同的）數值。"""
+        value = int(value)
+        index = self.bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.total_count += count
+        self.total_sum += value * count
+        if self.min_value is None or value < self.min_value:
+            self.min_value = value
+        if self.max_value is None or value > self.max_value:
+            self.max_value = value
+
+    def record_many(self, values: Iterable[int]):
+        """一次記錄多個數值：以 NumPy 向量化分桶後再合併計數，用於批次寫入。"""
+        values = np.asarray(values, dtype=np.int64)
+        if not len(values):
+            return
+        clamped = np.maximum(values, 0)
+        # bit_length：frexp 的指數（微秒數值遠小於 2**53，轉成 float64 沒有誤差）
+        shift = np.maximum(np.frexp(clamped.astype(np.float64))[1] - self.precision_bits, 1)
+        indices = np.where(clamped < self._linear, clamped,
+                           self._linear + (shift - 1) * self._half + ((clamped >> shift) - self._half))
+        counts = self.counts
+        for index, count in zip(*(array.tolist() for array in np.unique(indices, return_counts=True))):
+            counts[index] = counts.get(index, 0) + count
+        self.total_count += len(values)
+        self.total_sum += int(values.sum())
+        low, high = int(values.min()), int(values.max())
+        if self.min_value is None or low < self.min_value:
+            self.min_value = low
+        if self.max_value is None or high > self.max_value:
+            self.max_value = high
+
+    def merge(self, other: 'LogHistogram'):
+        """把另一個相同精度的直方圖合併進來。"""
+        if other.precision_bits != self.precision_bits:
+            raise ValueError("Cannot merge histograms with different precision_bits")
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total_count += other.total_count
+        self.total_sum += other.total_sum
+        if other.min_value is not None:
+            self.min_value = other.min_value if self.min_value is None else min(self.min_value, other.min_value)
+        if other.max_value is not None:
+            self.max_value = other.max_value if self.max_value is None else max(self.max_value, other.max_value)
+
+    def percentile(self, percent: float) -> int:
+        """回傳第 percent 百分位的數值（取該桶的上界，並以最大值為上限）。"""
+        if not self.total_count:
+            return 0
+        threshold = max(1, round(self.total_count * percent / 100.0))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= threshold:
+                return min(self.bucket_bounds(index)[1], self.max_value)
+        return self.max_value
+
+    def percentiles(self, percents: Iterable[float]) -> Dict[float, int]:
+        return {p: self.percentile(p) for p in percents}
+
+    @property
+    def mean(self) -> float:
+        return self.total_sum / self.total_count if self.total_count else 0.0
+
+    def to_dict(self) -> Dict:
+        """序列化成可透過 Locust 訊息傳送的字典。"""
+        return {
+            'precision_bits': self.precision_bits,
+            'counts': list(self.counts.items()),
+            'total_count': self.total_count,
+            'total_sum': self.total_sum,
+            'min': self.min_value,
+            'max': self.max_value,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'LogHistogram':
+        histogram = cls(data['precision_bits'])
+        histogram.counts = {int(index): count for index, count in data['counts']}
+        histogram.total_count = data['total_count']
+        histogram.total_sum = data['total_sum']
+        histogram.min_value = data['min']
+        histogram.max_value = data['max']
+        return histogram
@@ -0,0 +1,195 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional, Union
+
+
+def parse_media_playlist(playlist_content: Union[bytes, str]) -> List[str]:
+    """
+    Parse M3U8 playlist and return a list of segment filenames.
+
+    Args:
+        playlist_content: playlist content (bytes or text)
+
+    Returns:
+        list of segment filenames (basename only for relative paths)
+    """
+    if isinstance(playlist_content, bytes):
+        playlist_content = playlist_content.decode('utf-8', errors='replace')
+    segments = []
+    for line in playlist_content.splitlines():
+        line = line.strip()
+        # 跳過註解和空行
+        if line and not line.startswith('#'):
+            # 處理相對路徑（例如：../../seg-734.ts），只保留檔名
+            if line.startswith('../'):
+                line = line.rsplit('/', 1)[-1]
+            segments.append(line)
+    return segments
+
+
+def parse_segment_durations(playlist_content: Union[bytes, str]) -> List[float]:
+    """
+    Parse #EXTINF durations of a media playlist, in the same order as parse_media_playlist().
+
+    Returns:
+        list of segment durations in seconds
+    """
+    if isinstance(playlist_content, bytes):
+        playlist_content = playlist_content.decode('utf-8', errors='replace')
+    durations = []
+    pending = None
+    for line in playlist_content.splitlines():
+        line = line.strip()
+        if line.startswith('#EXTINF:'):
+            try:
+                pending = float(line[len('#EXTINF:'):].split(',', 1)[0])
+            except ValueError:
+                pending = None
+        elif line and not line.startswith('#'):
+            durations.append(pending if pending is not None else 0.0)
+            pending = None
+    return durations
+
+
+def _parse_attributes(text: str) -> Dict[str, str]:
+    """解析 KEY=VALUE,KEY="VALUE" 形式的屬性列表（引號內可含逗號）。"""
+    attributes = {}
+    key, value, in_quotes, reading_key = '', '', False, True
+    for char in text + ',':
+        if reading_key:
+            if char == '=':
+                reading_key = False
+            elif char != ',':
+                key += char
+        elif char == '"':
+            in_quotes = not in_quotes
+        elif char == ',' and not in_quotes:
+            attributes[key.strip()] = value
+            key, value, reading_key = '', '', True
+        else:
+            value += char
+    return attributes
+
+
+def parse_master_playlist(playlist_content: Union[bytes, str]) -> List[Dict]:
+    """
+    Parse a master playlist and return its variants sorted by bandwidth.
+
+    Returns:
+        list of {'uri', 'bandwidth', 'resolution'}
+    """
+    if isinstance(playlist_content, bytes):
+        playlist_content = playlist_content.decode('utf-8', errors='replace')
+    variants = []
+    pending = None
+    for line in playlist_content.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            pending = _parse_attributes(line[len('#EXT-X-STREAM-INF:'):])
+        elif line and not line.startswith('#') and pending is not None:
+            try:
+                bandwidth = int(pending.get('BANDWIDTH', 0))
+            except ValueError:
+                bandwidth = 0
+            variants.append({
+                'uri': line,
+                'bandwidth': bandwidth,
+                'resolution': pending.get('RESOLUTION'),
+            })
+            pending = None
+    variants.sort(key=lambda v: v['bandwidth'])
+    return variants
+
+
+class PlaylistCache:
+    """
+    行程內共用的 playlist LRU 快取，所有 VideoUser 實例共用。
+
+    特性：
+    1. 以 playlist 路徑（即影片 id）為 key，保存原始 bytes 和解析好的 segment 列表
+    2. 記錄 ETag / Last-Modified，過期後以條件式請求重新驗證
+    3. TTL 內不發出請求，超過 max_entries 時淘汰最久未使用的項目
+    """
+    _instance = None
+    _manager_lock = Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._manager_lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self, max_entries: int = 256, ttl: float = 300.0):
+        if hasattr(self, '_initialized'):
+            return
+
+        with self._manager_lock:
+            if hasattr(self, '_initialized'):
+                return
+            self.max_entries = max_entries
+            self.ttl = ttl
+            self._entries: 'OrderedDict[str, Dict]' = OrderedDict()
+            self._lock = Lock()
+            self._initialized = True
+
+    def configure(self, max_entries: int = None, ttl: float = None):
+        """調整容量與 TTL（由 User 依設定檔呼叫）。"""
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if ttl is not None:
+                self.ttl = ttl
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict]:
+        """取得快取項目（不論是否過期），並標記為最近使用。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def is_fresh(self, entry: Dict) -> bool:
+        return time.monotonic() - entry['fetched_at'] < self.ttl
+
+    def put(self, key: str, raw: bytes, etag: str = None, last_modified: str = None) -> Dict:
+        """保存新下載的 playlist，回傳快取項目。"""
+        entry = {
+            'raw': raw,
+            'segments': tuple(parse_media_playlist(raw)),
+            'durations': tuple(parse_segment_durations(raw)),
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': time.monotonic(),
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def touch(self, key: str):
+        """重新驗證成功（304）後更新取得時間。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry['fetched_at'] = time.monotonic()
+
+    @staticmethod
+    def conditional_headers(entry: Optional[Dict]) -> Dict[str, str]:
+        """依快取項目產生 If-None-Match / If-Modified-Since header。"""
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,283 @@
+import logging
+import time
+import weakref
+from contextlib import nullcontext
+from threading import BoundedSemaphore, Lock
+from typing import Dict, Optional, Tuple
+
+import gevent
+from locust.contrib.fasthttp import FastHttpSession
+from requests_toolbelt.adapters.source import SourceAddressAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util import parse_url
+
+from utils.fast_http import SourceBoundClientPool
+
+logger = logging.getLogger(__name__)
+
+
+class _IdleTrackingPool:
+    """連線放回連線池時記錄時間，供 evict_idle() 關閉閒置過久的連線。"""
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn._idle_since = time.monotonic()
+        super()._put_conn(conn)
+
+    def evict_idle(self, idle_timeout: float, now: float) -> int:
+        """關閉閒置超過 idle_timeout 秒的連線（以 None 佔位，下次取用時再建立新連線），回傳關閉數量。"""
+        queue = self.pool
+        if queue is None:
+            return 0
+        evicted = 0
+        # 標準庫的 LifoQueue 以 mutex 保護；gevent 的 LifoQueue（urllib3 在 monkey patch 後載入時）沒有 mutex，
+        # 迭代期間也不會切換 greenlet
+        with getattr(queue, 'mutex', None) or nullcontext():
+            items = queue.queue
+            for i, conn in enumerate(items):
+                if conn is not None and now - getattr(conn, '_idle_since', now) >= idle_timeout:
+                    conn.close()
+                    items[i] = None
+                    evicted += 1
+        return evicted
+
+
+class IdleTrackingHTTPConnectionPool(_IdleTrackingPool, HTTPConnectionPool):
+    pass
+
+
+class IdleTrackingHTTPSConnectionPool(_IdleTrackingPool, HTTPSConnectionPool):
+    pass
+
+
+class PooledSourceAdapter(SourceAddressAdapter):
+    """
+    綁定來源 IP 的 adapter，連線池有上限並記錄閒置時間。
+
+    Args:
+        source_ip: 來源 IP
+        max_per_host: 每個目標主機最多保留的連線數（urllib3 pool_maxsize）
+        max_hosts: 最多保留幾個目標主機的連線池，超過時關閉最久未使用的（urllib3 pool_connections）
+        shared: 是否由多個 User 共用。共用時每個目標主機同時最多 max_per_host 個請求，
+                其餘請求等待連線歸還，因此連線數不會超過上限；
+                共用的 adapter 也不會因單一 User 改綁或結束 session 而關閉
+    """
+
+    def __init__(self, source_ip: str, max_per_host: int = 10, max_hosts: int = 10, shared: bool = False):
+        self.shared = shared
+        self.max_per_host = max_per_host
+        # {(scheme, host, port): 同時請求數上限}；不用 urllib3 的 pool_block，
+        # 因為等待連線的 greenlet 被終止時 urllib3 會把 None 放回已滿的連線池而拋出 FullPoolError
+        self._host_slots: Dict[Tuple, BoundedSemaphore] = {}
+        super().__init__((source_ip, 0), pool_connections=max_hosts, pool_maxsize=max_per_host)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': IdleTrackingHTTPConnectionPool,
+            'https': IdleTrackingHTTPSConnectionPool,
+        }
+
+    def send(self, request, *args, **kwargs):
+        if not self.shared:
+            return super().send(request, *args, **kwargs)
+        url = parse_url(request.url)
+        key = (url.scheme, url.host, url.port)
+        slots = self._host_slots.get(key)
+        if slots is None:
+            slots = self._host_slots.setdefault(key, BoundedSemaphore(self.max_per_host))
+        slots.acquire()
+        try:
+            response = super().send(request, *args, **kwargs)
+        except BaseException:
+            slots.release()
+            raise
+
+        # 連線歸還連線池（讀完內容或關閉回應）時才釋放名額；回應未關閉就被回收時也會釋放
+        released = []
+        release_conn = response.raw.release_conn
+
+        def release_slot():
+            if not released:
+                released.append(True)
+                slots.release()
+
+        def release():
+            release_conn()
+            release_slot()
+        response.raw.release_conn = release
+        weakref.finalize(response.raw, release_slot)
+        return response
+
+    def evict_idle(self, idle_timeout: float) -> int:
+        """關閉所有目標主機連線池中閒置超過 idle_timeout 秒的連線。"""
+        pools = self.poolmanager.pools
+        # 直接讀取內部的 dict，避免 __getitem__ 改變 LRU 順序
+        with pools.lock:
+            host_pools = list(pools._container.values())
+        now = time.monotonic()
+        return sum(pool.evict_idle(idle_timeout, now) for pool in host_pools
+                   if isinstance(pool, _IdleTrackingPool))
+
+
+class SourceIpPools:
+    """
+    每個行程共用的來源 IP 連線池登記處。
+
+    特性：
+    1. shared 模式下，相同來源 IP（與相同上限設定）的 User 共用一個 PooledSourceAdapter
+       （FastHttpUser 則共用一個 SourceBoundClientPool）
+    2. 設定 idle_timeout 的 adapter 或連線池（包含每個 User 自己的）由背景 greenlet 定期關閉閒置連線
+    """
+    _instance = None
+    _manager_lock = Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._manager_lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if hasattr(self, '_initialized'):
+            return
+
+        with self._manager_lock:
+            if hasattr(self, '_initialized'):
+                return
+            self._lock = Lock()
+            # {(來源 IP, max_per_host, max_hosts): adapter}；FastHttpUser 的連線池鍵值另含逾時設定
+            self._shared: Dict[Tuple, object] = {}
+            # {adapter: idle_timeout}，User 結束後 adapter 被回收時自動移除
+            self._idle_timeouts = weakref.WeakKeyDictionary()
+            self._evictor: Optional[gevent.Greenlet] = None
+            self._initialized = True
+
+    def shared_adapter(self, source_ip: str, max_per_host: int, max_hosts: int) -> PooledSourceAdapter:
+        key = (source_ip, max_per_host, max_hosts)
+        with self._lock:
+            adapter = self._shared.get(key)
+            if adapter is None:
+                adapter = self._shared[key] = PooledSourceAdapter(source_ip, max_per_host, max_hosts, shared=True)
+            return adapter
+
+    def shared_client_pool(self, source_ip: str, max_per_host: int, max_hosts: int,
+                           client_args: dict) -> SourceBoundClientPool:
+        """FastHttpUser 用的共用連線池；逾時設定不同的 User 類別各自一個。"""
+        key = ('fast', source_ip, max_per_host, max_hosts,
+               client_args.get('connection_timeout'), client_args.get('network_timeout'))
+        with self._lock:
+            pool = self._shared.get(key)
+            if pool is None:
+                pool = self._shared[key] = SourceBoundClientPool(
+                    source_ip, max_hosts, shared=True, **{**client_args, 'concurrency': max_per_host})
+            return pool
+
+    def track_idle(self, adapter, idle_timeout: Optional[float]):
+        """登記 adapter（或 SourceBoundClientPool）的閒置逾時，並在需要時啟動背景清理。"""
+        if not idle_timeout:
+            return
+        with self._lock:
+            self._idle_timeouts[adapter] = idle_timeout
+            if self._evictor is None or self._evictor.dead:
+                self._evictor = gevent.spawn(self._evict_loop)
+
+    def evict_idle(self) -> int:
+        with self._lock:
+            adapters = list(self._idle_timeouts.items())
+        return sum(adapter.evict_idle(idle_timeout) for adapter, idle_timeout in adapters)
+
+    def _evict_loop(self):
+        while True:
+            with self._lock:
+                timeouts = list(self._idle_timeouts.values())
+            # 以最短逾時的一半為檢查間隔，最多 5 秒
+            gevent.sleep(min([timeout / 2 for timeout in timeouts] + [5.0]))
+            try:
+                evicted = self.evict_idle()
+                if evicted:
+                    logger.debug("[SourceIpPools] Closed %d idle connections", evicted)
+            except Exception:
+                logger.exception("[SourceIpPools] Failed to evict idle connections")
+
+    def close_all(self):
+        """關閉所有共用 adapter 與連線池（測試或重新設定時使用）。"""
+        with self._lock:
+            adapters = list(self._shared.values())
+            self._shared = {}
+        for adapter in adapters:
+            adapter.close()
+
+
+class ConnectionPolicy:
+    """
+    User 的連線方式，由 config-users.json 的 connection_pool 區塊設定：
+
+    - per_user（預設）：每個 User 有自己的連線池，連線在 session 之間保留（貼近實際 UE 的連線重用）
+    - shared：相同來源 IP 的 User 共用一個有上限的連線池，連線數達到 max_per_host 時請求等待，
+              檔案描述子與 ephemeral port 用量最低
+    - per_session：每個 User 有自己的連線池，每個 session 結束時關閉連線，下個 session 重新建立
+
+    其他設定：max_per_host（預設 10）、max_hosts（預設 10）、idle_timeout（秒，閒置連線的關閉時間，預設不關閉）。
+    HttpSession（requests）與 FastHttpSession（geventhttpclient）使用相同的設定與行為。
+    """
+    MODES = ('per_user', 'shared', 'per_session')
+
+    def __init__(self, options: Optional[dict] = None):
+        options = options or {}
+        self.mode = options.get('mode', 'per_user')
+        if self.mode not in self.MODES:
+            logger.warning("[ConnectionPolicy] Unknown connection_pool mode '%s', using 'per_user'", self.mode)
+            self.mode = 'per_user'
+        self.max_per_host = options.get('max_per_host', 10)
+        self.max_hosts = options.get('max_hosts', 10)
+        self.idle_timeout = options.get('idle_timeout')
+
+    def mount(self, client, source_ip: str):
+        """把 source_ip 的 adapter 掛到 HttpSession，並關閉舊的非共用 adapter（例如來源 IP 改綁時）。"""
+        if isinstance(client, FastHttpSession):
+            return self._mount_fast(client, source_ip)
+        pools = SourceIpPools()
+        if self.mode == 'shared':
+            adapter = pools.shared_adapter(source_ip, self.max_per_host, self.max_hosts)
+        else:
+            adapter = PooledSourceAdapter(source_ip, self.max_per_host, self.max_hosts)
+        pools.track_idle(adapter, self.idle_timeout)
+        for prefix in ("http://", "https://"):
+            old_adapter = client.adapters.get(prefix)
+            client.mount(prefix, adapter)
+            if old_adapter is not adapter and isinstance(old_adapter, SourceAddressAdapter) \
+                    and not getattr(old_adapter, 'shared', False):
+                # 關閉舊 IP 的連線池
+                old_adapter.close()
+        return adapter
+
+    def _mount_fast(self, client: FastHttpSession, source_ip: str) -> SourceBoundClientPool:
+        """把 source_ip 的連線池換給 FastHttpSession，並關閉舊的非共用連線池。"""
+        pools = SourceIpPools()
+        agent = client.client
+        old_pool = agent.clientpool
+        # 沿用 FastHttpUser 設定的逾時、SSL 等參數，連線數上限改用 max_per_host
+        client_args = {key: value for key, value in old_pool.client_args.items() if key != 'disable_ipv6'}
+        if self.mode == 'shared':
+            pool = pools.shared_client_pool(source_ip, self.max_per_host, self.max_hosts, client_args)
+        else:
+            pool = SourceBoundClientPool(source_ip, self.max_hosts, **{**client_args, 'concurrency': self.max_per_host})
+        pools.track_idle(pool, self.idle_timeout)
+        agent.clientpool = pool
+        if old_pool is not pool and not getattr(old_pool, 'shared', False):
+            old_pool.close()
+        return pool
+
+    def end_session(self, client):
+        """session 結束：per_session 模式關閉 User 的連線。"""
+        if self.mode != 'per_session':
+            return
+        if isinstance(client, FastHttpSession):
+            # HTTPClientPool.close() 之後仍可使用，下次請求重新建立連線
+            client.client.clientpool.close()
+            return
+        adapter = client.adapters.get("http://")
+        if adapter is not None:
+            adapter.close()
@@ -0,0 +1,417 @@
+import csv
+import errno
+import logging
+import os
+import socket
+from threading import Lock
+from typing import Dict, List, Optional
+
+import dns.exception
+import gevent
+from locust.runners import MasterRunner, WorkerRunner
+import requests
+import urllib3.exceptions
+
+from utils.ip_manager import SourceIpManager
+from utils.profiles import ProfileRegistry
+from utils.web_tables import register_web_table
+
+logger = logging.getLogger(__name__)
+
+# 來源 IP 無法綁定（介面不存在或已關閉）
+BIND_ERRNOS = frozenset({errno.EADDRNOTAVAIL, errno.ENODEV, errno.ENETDOWN})
+# 沒有對應的路由（policy routing 規則遺失）
+CONNECT_ERRNOS = frozenset({errno.ENETUNREACH, errno.EHOSTUNREACH})
+TIMEOUT_EXCEPTIONS = (urllib3.exceptions.ConnectTimeoutError, requests.exceptions.ConnectTimeout,
+                      dns.exception.Timeout)
+
+# ips.json 的 health 區塊預設值
+DEFAULT_HEALTH = {
+    'quarantine': True,        # 是否自動隔離失敗的 IP（false 時只統計）
+    'interval': 5.0,           # 判斷視窗長度（秒）
+    'min_requests': 10,        # 視窗內至少要有幾筆請求才判斷失敗率
+    'max_error_rate': 0.5,     # 視窗內連線層失敗率達到此值即隔離
+    'max_bind_failures': 3,    # 連續綁定失敗達到此值即隔離
+    'probe_interval': 10.0,    # 探測被隔離 IP 的間隔（秒）
+    'probe_target': None,      # "host:port"，設定時探測需成功建立 TCP 連線，否則只檢查能否綁定
+    'probe_timeout': 2.0,
+}
+
+COUNTERS = ('requests', 'failures', 'bind_failures', 'connect_failures', 'timeouts', 'quarantines')
+FAILURE_COUNTERS = {'bind': 'bind_failures', 'connect': 'connect_failures', 'timeout': 'timeouts'}
+
+
+def _exception_chain(exception):
+    """依序取出 exception 以及它包住的 exception（reason、__cause__、__context__、args）。"""
+    pending = [exception]
+    seen = set()
+    while pending:
+        current = pending.pop(0)
+        if not isinstance(current, BaseException) or id(current) in seen:
+            continue
+        seen.add(id(current))
+        yield current
+        pending.append(getattr(current, 'reason', None))
+        pending.append(current.__cause__)
+        pending.append(current.__context__)
+        pending.extend(current.args)
+
+
+def classify_failure(exception) -> Optional[str]:
+    """
+    判斷失敗是否與來源 IP 有關：
+    'bind'（IP 無法綁定）、'connect'（沒有路由）、'timeout'（連線或 DNS 逾時），
+    其餘失敗（HTTP 狀態碼、連線被拒、DNS rcode 等）屬於目標端，回傳 None。
+    """
+    if exception is None:
+        return None
+    chain = list(_exception_chain(exception))
+    for current in chain:
+        if isinstance(current, OSError) and current.errno is not None:
+            if current.errno in BIND_ERRNOS:
+                return 'bind'
+            if current.errno in CONNECT_ERRNOS:
+                return 'connect'
+            return None
+    if any(isinstance(current, TIMEOUT_EXCEPTIONS) for current in chain):
+        return 'timeout'
+    return None
+
+
+def probe(ip: str, target: Optional[str] = None, timeout: float = 2.0) -> bool:
+    """以來源 IP 綁定 socket；設定 target（"host:port"）時需再成功建立 TCP 連線。"""
+    try:
+        if target:
+            host, port = target.rsplit(':', 1)
+            sock = socket.create_connection((host, int(port)), timeout=timeout, source_address=(ip, 0))
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.bind((ip, 0))
+            except OSError:
+                sock.close()
+                raise
+        sock.close()
+        return True
+    except OSError:
+        return False
+
+
+def migrate_user(user, old_ip: str) -> bool:
+    """
+    把使用 old_ip 的 User 改綁到健康的 IP。
+    User 若有 on_source_ip_changed(old_ip, new_ip) 會被呼叫（例如重新掛載 adapter）。
+    沒有可用的 IP 時保留原本的 IP，回傳 False。
+    """
+    user_class_name = user.__class__.__name__
+    manager = SourceIpManager()
+    new_ip = manager.get_ip(user_class_name)
+    if new_ip is None:
+        return False
+    manager.release_ip(user_class_name, old_ip)
+    user.source_ip = new_ip
+    on_changed = getattr(user, 'on_source_ip_changed', None)
+    if on_changed is not None:
+        on_changed(old_ip, new_ip)
+    return True
+
+
+class IpHealthMonitor:
+    """
+    每個來源 IP 的健康狀態。
+
+    透過 request 事件的 context['source_ip'] 統計每個 IP 的請求數與失敗，
+    把綁定失敗、沒有路由、連線逾時視為 IP 本身的問題（見 classify_failure）。
+    每個判斷視窗結束時，連續綁定失敗或連線層失敗率偏高的 IP 會被隔離：
+    從 SourceIpManager 的分配中移除，使用中的 User 改綁到其他 IP；
+    被隔離的 IP 定期探測，成功後重新加入分配。
+
+    失敗率的判斷會與其他 IP 比較：所有 IP 同時大量失敗時多半是目標端的問題，不隔離。
+    """
+    _instance = None
+    _manager_lock = Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._manager_lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if hasattr(self, '_initialized'):
+            return
+
+        with self._manager_lock:
+            if hasattr(self, '_initialized'):
+                return
+            self._lock = Lock()
+            # {IP: 統計}，欄位見 _new_entry
+            self._stats: Dict[str, Dict] = {}
+            self.config = self._load_config()
+            ProfileRegistry().add_reload_listener(self._on_profiles_reloaded)
+            self._initialized = True
+
+    @staticmethod
+    def _load_config() -> Dict:
+        data = ProfileRegistry().get_document(ProfileRegistry.SOURCE_IPS_FILE) or {}
+        config = dict(DEFAULT_HEALTH)
+        config.update(data.get('health') or {})
+        return config
+
+    def _on_profiles_reloaded(self):
+        self.config = self._load_config()
+
+    @staticmethod
+    def _new_entry() -> Dict:
+        entry = {name: 0 for name in COUNTERS}
+        entry.update(window_requests=0, window_failures=0, consecutive_bind_failures=0,
+                     quarantined=False, last_error='')
+        return entry
+
+    def record(self, ip: str, exception=None):
+        """記錄一筆使用 ip 的請求結果。"""
+        kind = classify_failure(exception)
+        with self._lock:
+            entry = self._stats.get(ip)
+            if entry is None:
+                entry = self._stats[ip] = self._new_entry()
+            entry['requests'] += 1
+            entry['window_requests'] += 1
+            if exception is not None:
+                entry['failures'] += 1
+            if kind is None:
+                entry['consecutive_bind_failures'] = 0
+                return
+            entry[FAILURE_COUNTERS[kind]] += 1
+            entry['window_failures'] += 1
+            entry['last_error'] = f"{kind}: {exception}"[:200]
+            if kind == 'bind':
+                entry['consecutive_bind_failures'] += 1
+
+    def evaluate(self) -> List[str]:
+        """結束目前的判斷視窗，回傳應該隔離的 IP。"""
+        config = self.config
+        with self._lock:
+            windows = {ip: (entry['window_requests'], entry['window_failures'])
+                       for ip, entry in self._stats.items() if not entry['quarantined']}
+            result = [ip for ip, entry in self._stats.items()
+                      if not entry['quarantined']
+                      and entry['consecutive_bind_failures'] >= config['max_bind_failures']]
+            for entry in self._stats.values():
+                entry['window_requests'] = entry['window_failures'] = 0
+
+        total_requests = sum(count for count, _ in windows.values())
+        total_failures = sum(failures for _, failures in windows.values())
+        for ip, (count, failures) in windows.items():
+            if ip in result or count < config['min_requests'] or failures / count < config['max_error_rate']:
+                continue
+            other_requests = total_requests - count
+            other_failures = total_failures - failures
+            # 沒有其他 IP 可比較，或其他 IP 也大量失敗（多半是目標端的問題）時不隔離
+            if other_requests == 0 or other_failures / other_requests >= config['max_error_rate']:
+                continue
+            result.append(ip)
+        return result
+
+    def set_quarantined(self, ip: str, quarantined: bool):
+        with self._lock:
+            entry = self._stats.get(ip)
+            if entry is None:
+                entry = self._stats[ip] = self._new_entry()
+            if quarantined and not entry['quarantined']:
+                entry['quarantines'] += 1
+            entry['quarantined'] = quarantined
+            entry['consecutive_bind_failures'] = 0
+
+    def quarantined(self) -> List[str]:
+        with self._lock:
+            return [ip for ip, entry in self._stats.items() if entry['quarantined']]
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """回傳每個 IP 的累計統計：{IP: {計數欄位..., 'quarantined', 'last_error'}}。"""
+        with self._lock:
+            return {
+                ip: {**{name: entry[name] for name in COUNTERS},
+                     'quarantined': entry['quarantined'], 'last_error': entry['last_error']}
+                for ip, entry in self._stats.items()
+            }
+
+    def reset(self):
+        """清空累計統計，保留隔離狀態。"""
+        with self._lock:
+            for ip, entry in list(self._stats.items()):
+                quarantined = entry['quarantined']
+                self._stats[ip] = self._new_entry()
+                self._stats[ip]['quarantined'] = quarantined
+
+
+def quarantine_ip(environment, ip: str):
+    """隔離一個 IP：從分配中移除，並把使用它的 User 改綁到其他 IP。"""
+    if not SourceIpManager().quarantine(ip):
+        return
+    IpHealthMonitor().set_quarantined(ip, True)
+    migrated = stranded = 0
+    runner = environment.runner
+    for greenlet in list(runner.user_greenlets if runner else []):
+        user = greenlet.args[0] if greenlet.args else None
+        # 一個 User 代表多個虛擬 UE 時（SwarmUser），由 User 自行改綁使用該 IP 的 UE
+        migrate_source_ip = getattr(user, 'migrate_source_ip', None)
+        if migrate_source_ip is not None:
+            moved, left = migrate_source_ip(ip)
+            migrated += moved
+            stranded += left
+            continue
+        if getattr(user, 'source_ip', None) != ip:
+            continue
+        if migrate_user(user, ip):
+            migrated += 1
+        else:
+            stranded += 1
+    if stranded:
+        logger.warning("[IpHealth] Quarantined source IP %s: migrated %d users, %d users left without a healthy IP",
+                       ip, migrated, stranded)
+    else:
+        logger.warning("[IpHealth] Quarantined source IP %s: migrated %d users", ip, migrated)
+
+
+def readmit_ip(ip: str):
+    """探測成功後重新加入分配。"""
+    IpHealthMonitor().set_quarantined(ip, False)
+    SourceIpManager().readmit(ip)
+    logger.info("[IpHealth] Source IP %s passed probe, re-admitted", ip)
+
+
+def _merge_snapshots(snapshots) -> Dict[str, Dict]:
+    merged: Dict[str, Dict] = {}
+    for snapshot in snapshots:
+        for ip, stats in snapshot.items():
+            target = merged.get(ip)
+            if target is None:
+                merged[ip] = dict(stats)
+                continue
+            for name in COUNTERS:
+                target[name] += stats[name]
+            target['quarantined'] = target['quarantined'] or stats['quarantined']
+            target['last_error'] = stats['last_error'] or target['last_error']
+    return merged
+
+
+def health_rows(snapshot: Dict[str, Dict]) -> List[Dict]:
+    """把統計轉成表格資料，依 ips.json 的順序排列。"""
+    order = {ip: i for i, ip in enumerate(SourceIpManager().ips)}
+    rows = []
+    for ip, stats in sorted(snapshot.items(), key=lambda item: order.get(item[0], len(order))):
+        ip_failures = stats['bind_failures'] + stats['connect_failures'] + stats['timeouts']
+        rows.append({
+            'source_ip': ip,
+            'state': 'quarantined' if stats['quarantined'] else 'healthy',
+            'requests': stats['requests'],
+            'failures': stats['failures'],
+            'bind_failures': stats['bind_failures'],
+            'connect_failures': stats['connect_failures'],
+            'timeouts': stats['timeouts'],
+            'ip_error_rate': f"{ip_failures / stats['requests']:.1%}" if stats['requests'] else '',
+            'quarantines': stats['quarantines'],
+            'last_error': stats['last_error'],
+        })
+    return rows
+
+
+def install_ip_health(environment):
+    """
+    註冊來源 IP 健康監測：
+    worker（或單機）從 request 事件統計每個 IP，定期隔離失敗的 IP 並探測被隔離的 IP；
+    worker 在 report_to_master 附上統計，由 master 合併後顯示在 web UI 的「IP health」分頁，
+    結束時輸出 {csv_prefix}_ip_health.csv。
+    """
+    if getattr(environment, '_ip_health_installed', False):
+        return
+    environment._ip_health_installed = True
+    runner = environment.runner
+    monitor = IpHealthMonitor()
+    reports: Dict[str, Dict[str, Dict]] = {}
+
+    def snapshot():
+        if isinstance(runner, MasterRunner):
+            for client_id in list(reports):
+                if client_id not in runner.clients:
+                    reports.pop(client_id, None)
+            return _merge_snapshots(reports.values())
+        return monitor.snapshot()
+
+    @environment.events.quitting.add_listener
+    def _on_quitting(environment, **kwargs):
+        if isinstance(environment.runner, WorkerRunner):
+            return
+        csv_prefix = getattr(environment.parsed_options, 'csv_prefix', None)
+        rows = health_rows(snapshot())
+        if csv_prefix and rows:
+            directory = os.path.dirname(csv_prefix)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(f"{csv_prefix}_ip_health.csv", 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+                writer.writeheader()
+                writer.writerows(rows)
+
+    if isinstance(runner, MasterRunner):
+        @environment.events.worker_report.add_listener
+        def _on_worker_report(client_id, data, **kwargs):
+            if 'ip_health' in data:
+                reports[client_id] = data['ip_health']
+    else:
+        @environment.events.request.add_listener
+        def _on_request(context, exception, **kwargs):
+            ip = context.get('source_ip') if context else None
+            if ip:
+                monitor.record(ip, exception)
+
+        @environment.events.report_to_master.add_listener
+        def _on_report_to_master(client_id, data, **kwargs):
+            data['ip_health'] = monitor.snapshot()
+
+        @environment.events.reset_stats.add_listener
+        def _on_reset_stats(**kwargs):
+            monitor.reset()
+
+        def monitor_loop():
+            next_probe = 0.0
+            elapsed = 0.0
+            while True:
+                interval = monitor.config['interval']
+                gevent.sleep(interval)
+                elapsed += interval
+                try:
+                    if monitor.config['quarantine']:
+                        for ip in monitor.evaluate():
+                            quarantine_ip(environment, ip)
+                    else:
+                        monitor.evaluate()
+                    if elapsed >= next_probe:
+                        next_probe = elapsed + monitor.config['probe_interval']
+                        for ip in monitor.quarantined():
+                            if probe(ip, monitor.config['probe_target'], monitor.config['probe_timeout']):
+                                readmit_ip(ip)
+                except Exception:
+                    logger.exception("[IpHealth] Health check failed")
+
+        greenlet = gevent.spawn(monitor_loop)
+
+        @environment.events.quitting.add_listener
+        def _on_quitting_stop(**kwargs):
+            greenlet.kill(block=False)
+
+    if not isinstance(runner, WorkerRunner):
+        register_web_table(environment, 'ip_health', 'IP health', [
+            {'key': 'source_ip', 'title': 'Source IP'},
+            {'key': 'state', 'title': 'State'},
+            {'key': 'requests', 'title': 'Requests'},
+            {'key': 'failures', 'title': 'Failures'},
+            {'key': 'bind_failures', 'title': 'Bind failures'},
+            {'key': 'connect_failures', 'title': 'No route'},
+            {'key': 'timeouts', 'title': 'Timeouts'},
+            {'key': 'ip_error_rate', 'title': 'IP error rate'},
+            {'key': 'quarantines', 'title': 'Quarantines'},
+            {'key': 'last_error', 'title': 'Last IP error'},
+        ], lambda: health_rows(snapshot()))
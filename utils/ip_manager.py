@@ -1,14 +1,26 @@
-import json
-import os
-import itertools
+import logging
 from threading import Lock
-from pathlib import Path
+from typing import Dict, List, Optional
+
+from locust.runners import MasterRunner, WorkerRunner
+
+from utils.profiles import ProfileRegistry
+from utils.web_tables import register_web_table
+
+logger = logging.getLogger(__name__)
 
 class SourceIpManager:
     """
-    一個 IP 管理器，為不同類型的 User 創建和管理獨立的 IP 分配器。
-    它從設定檔 (profiles/ips.json) 讀取 IP 列表，並為每個 User 類型提供一個
-    獨立的、可循環的 IP 分配器。
+    一個 IP 管理器，從設定檔 (profiles/ips.json) 讀取 IP 列表，為 User 分配來源 IP。
+
+    特性：
+    1. 記錄每個 IP 上目前存活的 User 數量，User 停止時（on_stop）釋放
+    2. 以 bucket queue（依負載分桶）選出負載最低的 IP，負載相同時輪流分配
+    3. 可設定每個 IP 的 User 上限（max_users_per_ip）與每種 User 類型在單一 IP 上的配額（class_quotas）
+    4. 被隔離（quarantine）的 IP 不再分配，直到重新加入（readmit）
+
+    分散式執行時，master 會透過 set_partition() 為每個 worker 指定互不重疊的 IP 區段，
+    worker 只從自己的區段分配 IP。
     """
     _instance = None
     _manager_lock = Lock()
@@ -23,68 +35,255 @@ class SourceIpManager:
     def __init__(self):
         if hasattr(self, '_initialized'):
             return
-        
+
         with self._manager_lock:
             if hasattr(self, '_initialized'):
                 return
 
             print(f"[IpManager] Initializing...")
-            base_dir = Path(__file__).parent.parent
-            self.config_file = base_dir / 'profiles' / 'ips.json'
+            registry = ProfileRegistry()
+            self.config_file = registry.path_of(ProfileRegistry.SOURCE_IPS_FILE)
             self.ips = self._load_ips()
-            
+
             if not self.ips:
                 raise ValueError(f"IP list in '{self.config_file}' is empty or not found.")
-            
-            self._cyclers = {}
-            self._cycler_creation_lock = Lock()
+
+            self._lock = Lock()
+            # 每個 IP 的存活 User 數，以及 (User 類型, IP) 的存活 User 數
+            self._load: Dict[str, int] = {}
+            self._class_load: Dict[tuple, int] = {}
+            # bucket queue：_buckets[n] 為負載為 n 的 IP（dict 當作有序集合），_min_load 為最低的非空桶
+            self._buckets: List[Dict[str, None]] = []
+            self._min_load = 0
+            self.max_users_per_ip, self.class_quotas = self._load_limits()
+            # (worker 區段索引, 區段總數)，None 表示使用全部 IP
+            self._partition = None
+            self.active_ips = self.ips
+            # 健康監測隔離中的 IP
+            self._quarantined = set()
+            self._rebuild_buckets()
+            registry.add_reload_listener(self._on_profiles_reloaded)
             self._initialized = True
             print(f"[IpManager] Initialized with {len(self.ips)} IPs from '{self.config_file}': {self.ips}")
 
     def _load_ips(self):
-        """從 JSON 設定檔中讀取 IP 列表。"""
-        if not os.path.exists(self.config_file):
-            print(f"[IpManager] Error: Config file '{self.config_file}' not found.")
+        """從共用的設定檔註冊表中讀取 IP 列表。"""
+        data = ProfileRegistry().get_document(ProfileRegistry.SOURCE_IPS_FILE)
+        if data is None:
             return []
-        
+
         try:
-            with open(self.config_file, 'r') as f:
-                data = json.load(f)
             ips = data.get("source_ips", [])
             if not isinstance(ips, list) or not all(isinstance(ip, str) for ip in ips):
                 raise TypeError("'source_ips' must be a list of strings.")
             return [ip.strip() for ip in ips if ip.strip()]
-        except (json.JSONDecodeError, TypeError, KeyError) as e:
+        except (AttributeError, TypeError, KeyError) as e:
             print(f"[IpManager] Error: Invalid format in '{self.config_file}': {e}")
             return []
 
-    def get_ip(self, user_class_name: str):
+    def _load_limits(self):
+        """讀取 max_users_per_ip（None 表示不限）與 class_quotas（{User 類型: 單一 IP 上限}）。"""
+        data = ProfileRegistry().get_document(ProfileRegistry.SOURCE_IPS_FILE) or {}
+        return data.get("max_users_per_ip"), dict(data.get("class_quotas") or {})
+
+    def partition_enabled(self) -> bool:
+        """ips.json 的 partition_across_workers（預設 true）決定分散式執行時是否切分 IP。"""
+        data = ProfileRegistry().get_document(ProfileRegistry.SOURCE_IPS_FILE) or {}
+        return bool(data.get("partition_across_workers", True))
+
+    @staticmethod
+    def _slice(ips, partition):
+        """取出 worker 的連續 IP 區段；worker 數量多於 IP 時只能多個 worker 共用一個 IP。"""
+        if partition is None:
+            return ips
+        index, count = partition
+        if count <= 1:
+            return ips
+        if count > len(ips):
+            print(f"[IpManager] Warning: {count} workers share {len(ips)} IPs, IP ranges will overlap")
+            return [ips[index % len(ips)]]
+        return ips[len(ips) * index // count:len(ips) * (index + 1) // count]
+
+    def _rebuild_buckets(self):
+        """依目前的負載把可分配的 IP 放進 bucket queue（呼叫端需持有 _lock 或尚未開始分配）。"""
+        buckets: List[Dict[str, None]] = [{}]
+        for ip in self.active_ips:
+            if ip in self._quarantined:
+                continue
+            load = self._load.get(ip, 0)
+            while len(buckets) <= load:
+                buckets.append({})
+            buckets[load][ip] = None
+        self._buckets = buckets
+        self._min_load = 0
+        while self._min_load < len(buckets) - 1 and not buckets[self._min_load]:
+            self._min_load += 1
+
+    def set_partition(self, index: int, count: int):
         """
-        根據 User 的類別名稱，獲取下一個 IP。
-        每種類型的 User 都有自己獨立的 IP 循環。
+        只使用第 index 個（共 count 個）IP 區段。
+        之後建立的 User 才會使用新的區段，既有 User 保留原本的 IP，停止時仍會正確釋放。
         """
-        if user_class_name not in self._cyclers:
-            # 如果這個 User 類型的 IP 循環器還不存在，就創建一個新的
-            with self._cycler_creation_lock:
-                # 再次檢查，防止多個執行緒同時創建同一個循環器
-                if user_class_name not in self._cyclers:
-                    print(f"[IpManager] Creating new IP cycler for '{user_class_name}'")
-                    self._cyclers[user_class_name] = {
-                        "cycler": itertools.cycle(self.ips),
-                        "lock": Lock()
-                    }
-        
-        # 獲取該 User 類型專屬的循環器和鎖
-        cycler_info = self._cyclers[user_class_name]
-        
-        # 在該循環器的鎖保護下，獲取下一個 IP
-        with cycler_info["lock"]:
-            return next(cycler_info["cycler"])
+        with self._lock:
+            self._partition = (index, count)
+            self.active_ips = self._slice(self.ips, self._partition)
+            self._rebuild_buckets()
+        print(f"[IpManager] Using IP partition {index + 1}/{count}: {len(self.active_ips)} IPs "
+              f"({self.active_ips[0]} - {self.active_ips[-1]})")
+
+    def _on_profiles_reloaded(self):
+        """設定檔重新載入後更新 IP 列表與上限，保留既有 User 的負載記錄。"""
+        ips = self._load_ips()
+        if not ips:
+            print(f"[IpManager] Warning: Reloaded IP list is empty, keeping {len(self.ips)} existing IPs")
+            return
+        with self._lock:
+            self.ips = ips
+            self.active_ips = self._slice(ips, self._partition)
+            self.max_users_per_ip, self.class_quotas = self._load_limits()
+            self._rebuild_buckets()
+        print(f"[IpManager] Reloaded {len(self.ips)} IPs from '{self.config_file}'")
+
+    def quarantine(self, ip: str) -> bool:
+        """停止分配 ip（已分配的 User 不受影響，由呼叫端改綁）。ip 不在列表中或已隔離時回傳 False。"""
+        with self._lock:
+            if ip not in self.ips or ip in self._quarantined:
+                return False
+            self._quarantined.add(ip)
+            self._rebuild_buckets()
+        return True
+
+    def readmit(self, ip: str):
+        """重新分配被隔離的 ip。"""
+        with self._lock:
+            if ip not in self._quarantined:
+                return
+            self._quarantined.discard(ip)
+            self._rebuild_buckets()
+
+    def _move(self, ip: str, old_load: int, new_load: int):
+        """把 IP 從 old_load 桶移到 new_load 桶（放在桶尾，負載相同的 IP 因此輪流被選中）。"""
+        bucket = self._buckets[old_load]
+        if ip not in bucket:
+            # 不在可分配範圍內（例如已不屬於這個 worker 的區段），只更新負載
+            return
+        del bucket[ip]
+        while len(self._buckets) <= new_load:
+            self._buckets.append({})
+        self._buckets[new_load][ip] = None
+        if new_load < self._min_load:
+            self._min_load = new_load
+        while self._min_load < len(self._buckets) - 1 and not self._buckets[self._min_load]:
+            self._min_load += 1
+
+    def get_ip(self, user_class_name: str) -> Optional[str]:
+        """
+        為一個新的 User 分配負載最低的 IP，並記錄負載。
+        所有 IP 都達到上限（或該類型的配額）時回傳 None。
+        """
+        quota = self.class_quotas.get(user_class_name)
+        cap = self.max_users_per_ip
+        with self._lock:
+            for load in range(self._min_load, len(self._buckets)):
+                if cap is not None and load >= cap:
+                    break
+                for ip in self._buckets[load]:
+                    if quota is not None and self._class_load.get((user_class_name, ip), 0) >= quota:
+                        continue
+                    self._load[ip] = load + 1
+                    self._class_load[(user_class_name, ip)] = self._class_load.get((user_class_name, ip), 0) + 1
+                    self._move(ip, load, load + 1)
+                    return ip
+        logger.warning("[IpManager] No source IP available for %s (max_users_per_ip=%s, quota=%s)",
+                       user_class_name, cap, quota)
+        return None
+
+    def release_ip(self, user_class_name: str, ip: str):
+        """User 停止時釋放 IP 的負載。"""
+        if ip is None:
+            return
+        with self._lock:
+            load = self._load.get(ip, 0)
+            if load <= 0:
+                return
+            self._load[ip] = load - 1
+            class_key = (user_class_name, ip)
+            if self._class_load.get(class_key, 0) > 1:
+                self._class_load[class_key] -= 1
+            else:
+                self._class_load.pop(class_key, None)
+            self._move(ip, load, load - 1)
+
+    def allocation(self) -> Dict[str, Dict[str, int]]:
+        """回傳目前有存活 User 的 IP 與各 User 類型的數量：{IP: {User 類型: 數量}}。"""
+        with self._lock:
+            result: Dict[str, Dict[str, int]] = {}
+            for (user_class_name, ip), count in self._class_load.items():
+                result.setdefault(ip, {})[user_class_name] = count
+            return result
 
 # 導出一個 get_source_ip 函數，方便 locustfile 使用
 def get_source_ip(user_class_name: str):
     """
-    根據 User 類別名稱獲取一個來源 IP 位址。
+    根據 User 類別名稱獲取一個來源 IP 位址（負載最低的 IP），沒有可用 IP 時回傳 None。
     """
     manager = SourceIpManager()
     return manager.get_ip(user_class_name)
+
+
+def release_source_ip(user_class_name: str, ip: str):
+    """
+    User 停止時釋放來源 IP，讓之後的 User 能平均分配。
+    """
+    SourceIpManager().release_ip(user_class_name, ip)
+
+
+def install_ip_allocation_view(environment):
+    """
+    在 web UI 加入「IP allocation」分頁（JSON：/tables/ip_allocation），顯示每個來源 IP 的存活 User 數。
+    分散式執行時 worker 在 report_to_master 附上目前的分配狀態，由 master 加總。
+    """
+    if getattr(environment, '_ip_allocation_installed', False):
+        return
+    environment._ip_allocation_installed = True
+    runner = environment.runner
+    reports: Dict[str, Dict[str, Dict[str, int]]] = {}
+
+    @environment.events.report_to_master.add_listener
+    def _on_report_to_master(client_id, data, **kwargs):
+        data['ip_allocation'] = SourceIpManager().allocation()
+
+    @environment.events.worker_report.add_listener
+    def _on_worker_report(client_id, data, **kwargs):
+        if 'ip_allocation' in data:
+            reports[client_id] = data['ip_allocation']
+
+    def rows():
+        if isinstance(runner, MasterRunner):
+            merged: Dict[str, Dict[str, int]] = {}
+            for client_id, allocation in list(reports.items()):
+                if client_id not in runner.clients:
+                    reports.pop(client_id, None)
+                    continue
+                for ip, classes in allocation.items():
+                    target = merged.setdefault(ip, {})
+                    for user_class_name, count in classes.items():
+                        target[user_class_name] = target.get(user_class_name, 0) + count
+        else:
+            merged = SourceIpManager().allocation()
+        order = {ip: i for i, ip in enumerate(SourceIpManager().ips)}
+        return [
+            {
+                'source_ip': ip,
+                'users': sum(classes.values()),
+                'by_class': ', '.join(f"{name}: {count}" for name, count in sorted(classes.items())),
+            }
+            for ip, classes in sorted(merged.items(), key=lambda item: order.get(item[0], len(order)))
+        ]
+
+    if not isinstance(runner, WorkerRunner):
+        register_web_table(environment, 'ip_allocation', 'IP allocation', [
+            {'key': 'source_ip', 'title': 'Source IP'},
+            {'key': 'users', 'title': 'Live users'},
+            {'key': 'by_class', 'title': 'By user class'},
+        ], rows)
@@ -0,0 +1,216 @@
+import csv
+import logging
+import os
+import time
+from threading import Lock
+from typing import Dict, List, Optional
+
+from locust.runners import WorkerRunner
+
+from utils.histogram import LogHistogram
+from utils.web_tables import register_web_table
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 99, 99.9)
+# 累積這麼多個請求後一次寫入直方圖
+FLUSH_SIZE = 4096
+
+
+class IntendedSchedule:
+    """
+    自行控制節奏的 User 的預定送出時間（perf_counter_ns）。
+
+    下一次的預定時間由上一次的「預定」時間加上間隔，而不是上一次完成的時間：
+    目標停頓時，之後的請求仍以原本的預定時間計算延遲，並立即送出追上進度，
+    停頓期間「應該送出卻沒送出」的請求不會從統計中消失（coordinated omission）。
+    """
+
+    def __init__(self):
+        self.next_ns: Optional[int] = None
+        self._origin: Optional[int] = None
+
+    def intended(self) -> int:
+        """
+        目前這次請求的預定送出時間。還沒有呼叫過 advance() 時為現在
+        （例如 wait_time 被換掉時，修正後與未修正的延遲相同）。
+        """
+        if self.next_ns is None:
+            self._origin = time.perf_counter_ns()
+            return self._origin
+        return self.next_ns
+
+    def advance(self, gap: float) -> float:
+        """把預定時間往後推 gap 秒，回傳距離下一次預定時間還要等待的秒數（落後時為 0）。"""
+        now = time.perf_counter_ns()
+        base = self.next_ns if self.next_ns is not None else (self._origin or now)
+        self.next_ns = base + int(gap * 1e9)
+        return max(0.0, (self.next_ns - now) / 1e9)
+
+
+class LatencyRecorder:
+    """
+    同時記錄未修正與修正後的延遲：
+    - uncorrected：從實際送出到完成（與 Locust stats 相同）
+    - corrected：從預定送出時間到完成，包含因前一個請求變慢而延後送出的時間
+
+    每個名稱各一組對數直方圖（以微秒記錄），worker 透過 report_to_master 傳給 master 合併。
+    請求先累積在列表中，每 FLUSH_SIZE 個或讀取時才分桶寫入直方圖。
+    """
+    _instance = None
+    _manager_lock = Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._manager_lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if hasattr(self, '_initialized'):
+            return
+
+        with self._manager_lock:
+            if hasattr(self, '_initialized'):
+                return
+            self._lock = Lock()
+            # {名稱: (未修正, 修正後)}
+            self._histograms: Dict[str, tuple] = {}
+            # 尚未寫入直方圖的 (名稱, 未修正微秒, 修正後微秒)
+            self._pending: List[tuple] = []
+            self._initialized = True
+
+    def record(self, name: str, intended_ns: int, sent_ns: int, done_ns: int):
+        """
+        記錄一個完成的請求（三個時間點都是 perf_counter_ns）。
+        各 greenlet 在這裡不會切換，只在寫入直方圖（_flush）與取出資料時持有 _lock。
+        """
+        pending = self._pending
+        pending.append((name, (done_ns - sent_ns) // 1000, (done_ns - min(intended_ns, sent_ns)) // 1000))
+        if len(pending) >= FLUSH_SIZE:
+            with self._lock:
+                self._flush()
+
+    def _flush(self):
+        """把累積的請求依名稱分組寫入直方圖（呼叫端需持有 _lock）。"""
+        pending, self._pending = self._pending, []
+        groups: Dict[str, tuple] = {}
+        for name, uncorrected, corrected in pending:
+            group = groups.get(name)
+            if group is None:
+                group = groups[name] = ([], [])
+            group[0].append(uncorrected)
+            group[1].append(corrected)
+        for name, (uncorrected, corrected) in groups.items():
+            pair = self._histograms.get(name)
+            if pair is None:
+                pair = self._histograms[name] = (LogHistogram(), LogHistogram())
+            pair[0].record_many(uncorrected)
+            pair[1].record_many(corrected)
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._pending = []
+
+    def snapshot_and_reset(self) -> List:
+        """取出目前的統計並清空（worker 送給 master 時使用）。"""
+        with self._lock:
+            self._flush()
+            histograms, self._histograms = self._histograms, {}
+        return [(name, uncorrected.to_dict(), corrected.to_dict())
+                for name, (uncorrected, corrected) in histograms.items()]
+
+    def merge_snapshot(self, snapshot: List):
+        """合併 worker 送來的統計。"""
+        with self._lock:
+            for name, uncorrected, corrected in snapshot:
+                incoming = (LogHistogram.from_dict(uncorrected), LogHistogram.from_dict(corrected))
+                pair = self._histograms.get(name)
+                if pair is None:
+                    self._histograms[name] = incoming
+                else:
+                    pair[0].merge(incoming[0])
+                    pair[1].merge(incoming[1])
+
+    def rows(self) -> List[Dict]:
+        """每個名稱一列，未修正與修正後的百分位數（毫秒）並列。"""
+        with self._lock:
+            self._flush()
+            items = sorted(self._histograms.items())
+        rows = []
+        for name, (uncorrected, corrected) in items:
+            row = {'name': name, 'count': uncorrected.total_count}
+            for percent in PERCENTILES:
+                row[f'p{percent:g}'] = uncorrected.percentile(percent) / 1000
+                row[f'p{percent:g}_corrected'] = corrected.percentile(percent) / 1000
+            row['max'] = (uncorrected.max_value or 0) / 1000
+            row['max_corrected'] = (corrected.max_value or 0) / 1000
+            rows.append(row)
+        return rows
+
+    def write_csv(self, path: str):
+        rows = self.rows()
+        if not rows:
+            return
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        logger.info(f"[LatencyRecorder] Wrote {len(rows)} rows to {path}")
+
+
+def record_latency(name: str, intended_ns: int, sent_ns: int, done_ns: Optional[int] = None):
+    """
+    記錄一個請求的未修正與修正後延遲，done_ns 預設為現在。
+    """
+    LatencyRecorder().record(name, intended_ns, sent_ns, time.perf_counter_ns() if done_ns is None else done_ns)
+
+
+def install_latency_recording(environment):
+    """
+    註冊延遲記錄的 Locust 事件：worker 在 report_to_master 時附上資料，master 合併，
+    web UI 顯示未修正與修正後的百分位數，結束時輸出 {csv_prefix}_latency.csv。
+    """
+    if getattr(environment, '_latency_recording_installed', False):
+        return
+    environment._latency_recording_installed = True
+    recorder = LatencyRecorder()
+
+    @environment.events.report_to_master.add_listener
+    def _on_report_to_master(client_id, data, **kwargs):
+        snapshot = recorder.snapshot_and_reset()
+        if snapshot:
+            data['latency'] = snapshot
+
+    @environment.events.worker_report.add_listener
+    def _on_worker_report(client_id, data, **kwargs):
+        if data.get('latency'):
+            recorder.merge_snapshot(data['latency'])
+
+    @environment.events.reset_stats.add_listener
+    def _on_reset_stats(**kwargs):
+        recorder.reset()
+
+    @environment.events.quitting.add_listener
+    def _on_quitting(environment, **kwargs):
+        if isinstance(environment.runner, WorkerRunner):
+            return
+        csv_prefix = getattr(environment.parsed_options, 'csv_prefix', None)
+        if csv_prefix:
+            directory = os.path.dirname(csv_prefix)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            recorder.write_csv(f"{csv_prefix}_latency.csv")
+        for row in recorder.rows():
+            logger.info("[LatencyRecorder] %s: p99 %.1f ms, corrected p99 %.1f ms (%d requests)",
+                        row['name'], row['p99'], row['p99_corrected'], row['count'])
+
+    if not isinstance(environment.runner, WorkerRunner):
+        structure = [{'key': 'name', 'title': 'Name'}, {'key': 'count', 'title': 'Requests'}]
+        for percent in (50, 99, 99.9):
+            structure.append({'key': f'p{percent:g}', 'title': f'p{percent:g} (ms)'})
+            structure.append({'key': f'p{percent:g}_corrected', 'title': f'p{percent:g} corrected (ms)'})
+        structure += [{'key': 'max', 'title': 'Max (ms)'}, {'key': 'max_corrected', 'title': 'Max corrected (ms)'}]
+        register_web_table(environment, 'latency', 'Latency (corrected)', structure, recorder.rows)
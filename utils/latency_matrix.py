@@ -0,0 +1,443 @@
+import csv
+import logging
+import os
+import re
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from locust.runners import MasterRunner, WorkerRunner
+
+from utils.web_tables import register_web_table
+
+logger = logging.getLogger(__name__)
+
+# 環境變數
+LATENCY_MATRIX_ENV = 'LATENCY_MATRIX'          # 設為 0 時不記錄（預設 1）
+LATENCY_MATRIX_TOP_ENV = 'LATENCY_MATRIX_TOP'  # 結束時每個名稱列出最慢的前幾個目標與來源 IP（預設 10）
+
+# 對數分桶：小於 MIN_US 微秒為第 0 桶，之後每個 2 的次方區間切成 SUB_BUCKETS 桶，共 OCTAVES 個區間
+# （128 µs ~ 33 秒，相對誤差 25% 以內），超過範圍的數值記在最後一桶
+MIN_US = 128
+SUB_BUCKETS = 4
+OCTAVES = 18
+BUCKETS = 1 + SUB_BUCKETS * OCTAVES
+_MIN_BITS = MIN_US.bit_length()
+_SUB_BITS = SUB_BUCKETS.bit_length() - 1
+# 各桶的上界（毫秒），百分位數取所在桶的上界
+UPPER_MS = np.array([MIN_US / 1000] + [((SUB_BUCKETS + 1 + sub) << (octave + _MIN_BITS - 1 - _SUB_BITS)) / 1000
+                                       for octave in range(OCTAVES) for sub in range(SUB_BUCKETS)])
+
+# 最多保存的格數（每格約 300 bytes，約 150 MB）；超過時新的（來源 IP、目標、名稱）組合只計入 dropped
+MAX_CELLS = 500_000
+# 累積多少筆尚未寫入陣列的請求後一次寫入
+FLUSH_SIZE = 4096
+# 熱圖 CSV 的欄位只保留 p99 最慢的前幾個目標
+HEATMAP_TARGETS = 50
+
+
+def bucket_index(response_time_ms: float) -> int:
+    """回傳延遲（毫秒）所屬的桶索引。"""
+    us = int(response_time_ms * 1000)
+    if us < MIN_US:
+        return 0
+    bits = us.bit_length()
+    index = 1 + (bits - _MIN_BITS) * SUB_BUCKETS + ((us >> (bits - 1 - _SUB_BITS)) & (SUB_BUCKETS - 1))
+    return index if index < BUCKETS else BUCKETS - 1
+
+
+def bucket_indices(response_time_ms: np.ndarray) -> np.ndarray:
+    """bucket_index 的向量版本。"""
+    us = np.floor(np.asarray(response_time_ms, dtype=np.float64) * 1000)
+    mantissa, bits = np.frexp(np.maximum(us, 1))
+    index = 1 + (bits - _MIN_BITS) * SUB_BUCKETS + np.floor((mantissa * 2 - 1) * SUB_BUCKETS).astype(np.int64)
+    return np.where(us < MIN_US, 0, np.minimum(index, BUCKETS - 1))
+
+
+def percentiles(hist: np.ndarray, percent: float) -> np.ndarray:
+    """
+    對最後一個維度是桶計數的陣列計算百分位數（毫秒），沒有樣本的格為 NaN。
+    """
+    cumulative = np.cumsum(hist, axis=-1)
+    total = cumulative[..., -1]
+    threshold = np.maximum(np.ceil(total * percent / 100.0), 1)
+    index = np.argmax(cumulative >= threshold[..., None], axis=-1)
+    return np.where(total > 0, UPPER_MS[index], np.nan)
+
+
+def _url_host(url: str) -> Optional[str]:
+    """http://host:port/path 的 host:port。"""
+    parts = url.split('/', 3)
+    return parts[2] if len(parts) > 2 and parts[0].endswith(':') else None
+
+
+class LatencyMatrix:
+    """
+    依（來源 IP、目標伺服器、請求名稱）細分的延遲矩陣（side channel）。
+
+    Locust stats 只以名稱（例如 SOCIAL:feed）區分，把 IP 放進名稱會讓 stats 樹隨 IP 數量膨脹。
+    這裡只保存有樣本的格：每格是 (n_cells, BUCKETS) uint32 陣列中的一列對數分桶計數，
+    加上請求數、失敗數與延遲總和，每格約 300 bytes，與樣本數無關；
+    記憶體只與實際出現過的組合數成正比，不是來源 IP × 目標 × 名稱的乘積。
+    (來源 IP, 目標, 名稱) 在第一次出現時配置一列，陣列容量依需要增加為 1.5 倍（上限 MAX_CELLS）。
+    record() 只把列號與延遲加入清單，累積 FLUSH_SIZE 筆或讀取前再一次分桶、寫入陣列。
+    worker 只把有樣本的列送給 master，master 依標籤對應到自己的列後相加。
+    """
+    _instance = None
+    _manager_lock = Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._manager_lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if hasattr(self, '_initialized'):
+            return
+
+        with self._manager_lock:
+            if hasattr(self, '_initialized'):
+                return
+            self._lock = Lock()
+            self.max_cells = MAX_CELLS
+            self._clear()
+            self._initialized = True
+
+    def _clear(self, capacity: int = 1024):
+        self._pending: List[Tuple] = []
+        self._cells: Dict[Tuple[str, str, str], int] = {}
+        self.labels: Tuple[List[str], List[str], List[str]] = ([], [], [])
+        self._ids: Tuple[Dict[str, int], Dict[str, int], Dict[str, int]] = ({}, {}, {})
+        self.size = 0
+        # 每列的（來源 IP、目標、名稱）標籤索引
+        self.keys = np.zeros((capacity, 3), dtype=np.int32)
+        self.hist = np.zeros((capacity, BUCKETS), dtype=np.uint32)
+        self.count = np.zeros(capacity, dtype=np.uint32)
+        self.failures = np.zeros(capacity, dtype=np.uint32)
+        self.total_ms = np.zeros(capacity, dtype=np.float64)
+        self.dropped = 0
+
+    def _label(self, axis: int, label: str) -> int:
+        ids = self._ids[axis]
+        index = ids.get(label)
+        if index is None:
+            index = ids[label] = len(self.labels[axis])
+            self.labels[axis].append(label)
+        return index
+
+    def _row(self, key: Tuple[str, str, str]) -> int:
+        """(來源 IP, 目標, 名稱) 的列號，第一次出現時配置；超過 max_cells 時回傳 -1（呼叫端需持有 _lock）。"""
+        row = self._cells.get(key)
+        if row is not None:
+            return row
+        row = self.size
+        if row >= self.max_cells:
+            return -1
+        if row >= len(self.count):
+            capacity = min(max(row + 1, len(self.count) + len(self.count) // 2), self.max_cells)
+            for attr in ('keys', 'hist', 'count', 'failures', 'total_ms'):
+                old = getattr(self, attr)
+                new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:row] = old[:row]
+                setattr(self, attr, new)
+        self.keys[row] = [self._label(axis, label) for axis, label in enumerate(key)]
+        self._cells[key] = row
+        self.size = row + 1
+        return row
+
+    def record(self, source_ip: str, target: str, name: str, response_time_ms: float, failed: bool = False):
+        """
+        記錄一個完成的請求。
+        各 greenlet 在這裡不會切換，只在配置新列、寫入陣列（_flush）與取出資料時持有 _lock。
+        """
+        key = (source_ip, target, name)
+        row = self._cells.get(key)
+        if row is None:
+            with self._lock:
+                row = self._row(key)
+            if row < 0:
+                self.dropped += 1
+                return
+        pending = self._pending
+        pending.append((row, response_time_ms, failed))
+        if len(pending) >= FLUSH_SIZE:
+            with self._lock:
+                self._flush()
+
+    def _flush(self):
+        """把累積的請求寫入陣列（呼叫端需持有 _lock）。"""
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        columns = np.array(pending, dtype=np.float64)
+        rows = columns[:, 0].astype(np.intp)
+        # 合併同一格的請求，再一次加到陣列上
+        slots, counts = np.unique(rows * BUCKETS + bucket_indices(columns[:, 1]), return_counts=True)
+        self.hist.reshape(-1)[slots] += counts.astype(np.uint32)
+        cells, inverse, counts = np.unique(rows, return_inverse=True, return_counts=True)
+        self.count[cells] += counts.astype(np.uint32)
+        self.total_ms[cells] += np.bincount(inverse, weights=columns[:, 1])
+        self.failures[cells] += np.bincount(inverse, weights=columns[:, 2]).astype(np.uint32)
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def snapshot_and_reset(self) -> Optional[Dict]:
+        """
+        取出有樣本的列並歸零（worker 送給 master 時使用）。
+        陣列以 bytes 傳送，標籤只送用到的部分，cells 是對應到這些標籤的索引。
+        """
+        with self._lock:
+            self._flush()
+            rows = np.nonzero(self.count[:self.size])[0]
+            if not len(rows) and not self.dropped:
+                return None
+            snapshot = {
+                'hist': self.hist[rows].tobytes(),
+                'count': self.count[rows].tobytes(),
+                'failures': self.failures[rows].tobytes(),
+                'total_ms': self.total_ms[rows].tobytes(),
+                'dropped': self.dropped,
+            }
+            labels, indices = [], []
+            for axis in range(3):
+                used, local = np.unique(self.keys[rows, axis], return_inverse=True)
+                labels.append([self.labels[axis][i] for i in used])
+                indices.append(local.astype(np.int32))
+            snapshot['labels'] = labels
+            snapshot['cells'] = np.stack(indices).tobytes() if len(rows) else b''
+            self.hist[rows] = 0
+            self.count[rows] = 0
+            self.failures[rows] = 0
+            self.total_ms[rows] = 0
+            self.dropped = 0
+        return snapshot
+
+    def merge_snapshot(self, snapshot: Dict):
+        """合併 worker 送來的列。"""
+        with self._lock:
+            self.dropped += snapshot.get('dropped', 0)
+            if not snapshot['cells']:
+                return
+            self._flush()
+            local = np.frombuffer(snapshot['cells'], dtype=np.int32).reshape(3, -1)
+            sources, targets, names = snapshot['labels']
+            rows = np.array([self._row((sources[s], targets[t], names[n]))
+                             for s, t, n in zip(*local.tolist())], dtype=np.int64)
+            keep = rows >= 0
+            count = np.frombuffer(snapshot['count'], dtype=np.uint32)
+            self.dropped += int(count[~keep].sum())
+            rows = rows[keep]
+            # 同一個 snapshot 中每格只出現一次，可以直接以索引相加
+            self.hist[rows] += np.frombuffer(snapshot['hist'], dtype=np.uint32).reshape(-1, BUCKETS)[keep]
+            self.count[rows] += count[keep]
+            self.failures[rows] += np.frombuffer(snapshot['failures'], dtype=np.uint32)[keep]
+            self.total_ms[rows] += np.frombuffer(snapshot['total_ms'], dtype=np.float64)[keep]
+
+    def _view(self):
+        """目前使用中的列（呼叫端需持有 _lock）與標籤。"""
+        self._flush()
+        used = slice(0, self.size)
+        return (self.keys[used], self.hist[used], self.count[used], self.failures[used], self.total_ms[used],
+                tuple(list(labels) for labels in self.labels))
+
+    @staticmethod
+    def _group(groups: np.ndarray, *arrays: np.ndarray) -> List[np.ndarray]:
+        """依 groups（每列的群組編號）加總各陣列。"""
+        if not len(groups):
+            return [np.zeros((0,) + values.shape[1:], dtype=values.dtype) for values in arrays]
+        # groups 是 np.unique 的 inverse（0 ~ n-1 都有出現），排序後以 reduceat 一次加總每一段
+        order = np.argsort(groups, kind='stable')
+        starts = np.flatnonzero(np.r_[True, np.diff(groups[order]) != 0])
+        return [np.add.reduceat(values[order].astype(np.float64 if values.dtype.kind == 'f' else np.uint64),
+                                starts, axis=0) for values in arrays]
+
+    def top_rows(self, by: str = 'target', limit: int = 10, percent: float = 99) -> List[Dict]:
+        """
+        依 p{percent} 由慢到快排列的目標（by='target'）或來源 IP（by='source'），每個名稱最多 limit 列。
+        """
+        axis = 1 if by == 'target' else 0
+        with self._lock:
+            keys, hist, count, failures, total_ms, labels = self._view()
+            # 沿另一個維度加總，得到 (key, name) 的直方圖
+            width = max(len(labels[2]), 1)
+            groups, inverse = np.unique(keys[:, axis].astype(np.int64) * width + keys[:, 2], return_inverse=True)
+            hist, count, failures, total_ms = self._group(inverse, hist, count, failures, total_ms)
+        groups = np.stack([groups // width, groups % width], axis=1)
+        p50, slow = percentiles(hist, 50), percentiles(hist, percent)
+        mean = total_ms / np.maximum(count, 1)
+        rows = []
+        for n, name in enumerate(labels[2]):
+            members = np.nonzero(groups[:, 1] == n)[0]
+            # 依 p{percent} 由慢到快，相同時依平均值
+            ranked = members[np.lexsort((-mean[members], -slow[members]))]
+            for g in ranked[:limit]:
+                rows.append({
+                    'name': name,
+                    by: labels[axis][groups[g, 0]],
+                    'count': int(count[g]),
+                    'failures': int(failures[g]),
+                    'avg_ms': round(float(mean[g]), 3),
+                    'p50_ms': float(p50[g]),
+                    f'p{percent:g}_ms': float(slow[g]),
+                })
+        return rows
+
+    def heatmap(self, name: str, percent: float = 99,
+                targets: Optional[List[str]] = None) -> Tuple[List[str], List[str], np.ndarray]:
+        """
+        名稱 name 的（來源 IP × 目標）p{percent} 矩陣（毫秒），沒有樣本的格為 NaN。
+        只包含這個名稱有樣本的來源 IP；targets 指定欄位（預設為所有有樣本的目標）。
+        """
+        with self._lock:
+            keys, hist, _, _, _, labels = self._view()
+            n = self._ids[2].get(name)
+            members = np.nonzero(keys[:, 2] == n)[0] if n is not None else np.empty(0, dtype=np.intp)
+            if targets is not None:
+                wanted = [self._ids[1].get(target, -1) for target in targets]
+                members = members[np.isin(keys[members, 1], wanted)]
+            keys, hist = keys[members], hist[members]
+        source_ids, rows = np.unique(keys[:, 0], return_inverse=True)
+        if targets is None:
+            target_ids, columns = np.unique(keys[:, 1], return_inverse=True)
+            targets = [labels[1][t] for t in target_ids]
+        else:
+            position = {target_id: i for i, target_id in enumerate(wanted) if target_id >= 0}
+            columns = np.array([position[t] for t in keys[:, 1].tolist()], dtype=np.intp)
+        values = np.full((len(source_ids), len(targets)), np.nan)
+        values[rows.reshape(-1), columns.reshape(-1)] = percentiles(hist, percent)
+        return [labels[0][s] for s in source_ids], list(targets), values
+
+    def save(self, path: str):
+        """以 .npz 保存所有格與標籤，供事後分析（LatencyMatrix.load 讀回）。"""
+        with self._lock:
+            keys, hist, count, failures, total_ms, (sources, targets, names) = self._view()
+            keys, hist, count, failures, total_ms = keys.copy(), hist.copy(), count.copy(), failures.copy(), \
+                total_ms.copy()
+        np.savez_compressed(path, keys=keys, hist=hist, count=count, failures=failures, total_ms=total_ms,
+                            sources=np.array(sources, dtype=str), targets=np.array(targets, dtype=str),
+                            names=np.array(names, dtype=str), upper_ms=UPPER_MS)
+
+    def load(self, path: str):
+        """讀回 save() 的檔案，取代目前的內容。"""
+        with np.load(path) as data:
+            labels = [[str(value) for value in data[axis]] for axis in ('sources', 'targets', 'names')]
+            keys = data['keys']
+            with self._lock:
+                self._clear(max(len(keys), 1))
+                for s, t, n in keys.tolist():
+                    self._row((labels[0][s], labels[1][t], labels[2][n]))
+                used = slice(0, len(keys))
+                self.hist[used] = data['hist']
+                self.count[used] = data['count']
+                self.failures[used] = data['failures']
+                self.total_ms[used] = data['total_ms']
+
+    def write_reports(self, csv_prefix: str, limit: int = 10):
+        """
+        輸出 {csv_prefix}_latency_matrix.npz、最慢的目標與來源 IP（{csv_prefix}_matrix_top.csv），
+        以及每個名稱一個熱圖 CSV（{csv_prefix}_heatmap_<名稱>.csv，列為來源 IP、
+        欄為 p99 最慢的 HEATMAP_TARGETS 個目標，值為 p99 毫秒）。
+        """
+        with self._lock:
+            names = list(self.labels[2])
+            size = self.size
+        if not names:
+            return
+        self.save(f"{csv_prefix}_latency_matrix.npz")
+
+        rows = [dict(row, kind='target', key=row.pop('target')) for row in self.top_rows('target', limit)]
+        rows += [dict(row, kind='source', key=row.pop('source')) for row in self.top_rows('source', limit)]
+        fields = ['kind', 'name', 'key', 'count', 'failures', 'avg_ms', 'p50_ms', 'p99_ms']
+        with open(f"{csv_prefix}_matrix_top.csv", 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+
+        slowest = self.top_rows('target', HEATMAP_TARGETS)
+        for name in names:
+            targets = [row['target'] for row in slowest if row['name'] == name]
+            sources, targets, values = self.heatmap(name, targets=targets)
+            path = f"{csv_prefix}_heatmap_{re.sub(r'[^A-Za-z0-9_.-]+', '_', name)}.csv"
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['source_ip'] + targets)
+                for source, row in zip(sources, values):
+                    writer.writerow([source] + ['' if np.isnan(v) else f'{v:g}' for v in row])
+        logger.info(f"[LatencyMatrix] Wrote {size} cells ({len(names)} names) "
+                    f"to {csv_prefix}_latency_matrix.npz and heatmap CSVs")
+
+
+def install_latency_matrix(environment):
+    """
+    註冊延遲矩陣：執行 User 的行程以 request 事件記錄（context 的 source_ip，
+    目標取 context 的 target 或 URL 的 host:port，名稱去掉 @ 之後的部分），
+    worker 在 report_to_master 時附上有樣本的格，master 合併；
+    web UI 顯示最慢的目標，結束時輸出 npz、前 N 名 CSV 與熱圖 CSV。
+    """
+    if getattr(environment, '_latency_matrix_installed', False):
+        return
+    environment._latency_matrix_installed = True
+    if os.environ.get(LATENCY_MATRIX_ENV, '1') == '0':
+        return
+    matrix = LatencyMatrix()
+    try:
+        limit = int(os.environ.get(LATENCY_MATRIX_TOP_ENV, 10))
+    except ValueError:
+        limit = 10
+
+    if not isinstance(environment.runner, MasterRunner):
+        @environment.events.request.add_listener
+        def _on_request(request_type, name, response_time, context=None, exception=None, url=None, **kwargs):
+            if not context or response_time is None:
+                return
+            source_ip = context.get('source_ip')
+            target = context.get('target') or (_url_host(url) if url else None)
+            if source_ip is None or target is None:
+                return
+            if '@' in name:
+                name = name.split('@', 1)[0]
+            matrix.record(source_ip, target, name, response_time, exception is not None)
+
+    @environment.events.report_to_master.add_listener
+    def _on_report_to_master(client_id, data, **kwargs):
+        snapshot = matrix.snapshot_and_reset()
+        if snapshot:
+            data['latency_matrix'] = snapshot
+
+    @environment.events.worker_report.add_listener
+    def _on_worker_report(client_id, data, **kwargs):
+        if data.get('latency_matrix'):
+            matrix.merge_snapshot(data['latency_matrix'])
+
+    @environment.events.reset_stats.add_listener
+    def _on_reset_stats(**kwargs):
+        matrix.reset()
+
+    @environment.events.quitting.add_listener
+    def _on_quitting(environment, **kwargs):
+        if isinstance(environment.runner, WorkerRunner):
+            return
+        for row in matrix.top_rows('target', limit=1):
+            logger.info("[LatencyMatrix] Slowest target for %s: %s p99 %.1f ms (%d requests)",
+                        row['name'], row['target'], row['p99_ms'], row['count'])
+        if matrix.dropped:
+            logger.warning(f"[LatencyMatrix] {matrix.dropped} requests dropped (more than "
+                           f"{matrix.max_cells} source/target/name combinations)")
+        csv_prefix = getattr(environment.parsed_options, 'csv_prefix', None)
+        if csv_prefix:
+            directory = os.path.dirname(csv_prefix)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            matrix.write_reports(csv_prefix, limit)
+
+    if not isinstance(environment.runner, WorkerRunner):
+        structure = [{'key': 'name', 'title': 'Name'}, {'key': 'target', 'title': 'Target'},
+                     {'key': 'count', 'title': 'Requests'}, {'key': 'failures', 'title': 'Failures'},
+                     {'key': 'avg_ms', 'title': 'Avg (ms)'}, {'key': 'p50_ms', 'title': 'p50 (ms)'},
+                     {'key': 'p99_ms', 'title': 'p99 (ms)'}]
+        register_web_table(environment, 'slow_targets', 'Slow targets', structure,
+                           lambda: matrix.top_rows('target', limit))
@@ -0,0 +1,211 @@
+import math
+from threading import Lock
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+
+def truncated_pareto(rng: np.random.Generator, alpha: float, scale: float, upper: float,
+                     size: int) -> np.ndarray:
+    """
+    以反函數法一次產生 size 個截斷（bounded）Pareto 樣本，範圍為 [scale, upper]。
+
+    與「產生後再 min(x, upper)」不同，截斷分布不會在上限堆積機率質量。
+    """
+    if upper <= scale:
+        return np.full(size, float(scale))
+    u = rng.random(size)
+    tail = (scale / upper) ** alpha
+    return scale * (1.0 - u * (1.0 - tail)) ** (-1.0 / alpha)
+
+
+def fgn(rng: np.random.Generator, hurst: float, n: int) -> np.ndarray:
+    """
+    以 Davies-Harte（circulant embedding）產生長度 n 的 fractional Gaussian noise，
+    變異數為 1，Hurst 參數為 hurst。
+    """
+    if not 0 < hurst < 1:
+        raise ValueError(f"hurst must be in (0, 1), got {hurst}")
+    k = np.arange(n + 1, dtype=float)
+    two_h = 2.0 * hurst
+    autocov = 0.5 * (np.abs(k + 1) ** two_h - 2 * np.abs(k) ** two_h + np.abs(k - 1) ** two_h)
+    row = np.concatenate([autocov, autocov[-2:0:-1]])
+    eigenvalues = np.fft.fft(row).real
+    # 數值誤差可能產生極小的負值
+    eigenvalues = np.clip(eigenvalues, 0.0, None)
+    m = row.size
+    noise = rng.standard_normal(m) + 1j * rng.standard_normal(m)
+    return np.fft.fft(np.sqrt(eigenvalues / m) * noise).real[:n]
+
+
+def hurst_aggregated_variance(series: Sequence[float], min_block: int = 1,
+                              num_scales: int = 20) -> float:
+    """
+    以 aggregated variance 法估計 Hurst 參數：
+    區塊平均的變異數與區塊大小 m 的關係為 Var ~ m^(2H-2)，取 log-log 斜率。
+    """
+    x = np.asarray(series, dtype=float)
+    if x.size < 32:
+        raise ValueError(f"series too short to estimate Hurst parameter ({x.size} samples)")
+    max_block = x.size // 8
+    blocks = np.unique(np.logspace(math.log10(max(min_block, 1)), math.log10(max_block),
+                                   num_scales).astype(int))
+    log_m, log_var = [], []
+    for m in blocks:
+        count = x.size // m
+        means = x[:count * m].reshape(count, m).mean(axis=1)
+        variance = means.var()
+        if variance > 0:
+            log_m.append(math.log10(m))
+            log_var.append(math.log10(variance))
+    if len(log_m) < 2:
+        raise ValueError("series has no variance at the sampled block sizes")
+    slope = np.polyfit(log_m, log_var, 1)[0]
+    return 1.0 + slope / 2.0
+
+
+def hurst_rescaled_range(series: Sequence[float], min_block: int = 8, num_scales: int = 20) -> float:
+    """以 R/S（rescaled range）法估計 Hurst 參數：E[R/S] ~ n^H。"""
+    x = np.asarray(series, dtype=float)
+    if x.size < 32:
+        raise ValueError(f"series too short to estimate Hurst parameter ({x.size} samples)")
+    blocks = np.unique(np.logspace(math.log10(min_block), math.log10(x.size // 2),
+                                   num_scales).astype(int))
+    log_n, log_rs = [], []
+    for n in blocks:
+        count = x.size // n
+        chunks = x[:count * n].reshape(count, n)
+        deviations = np.cumsum(chunks - chunks.mean(axis=1, keepdims=True), axis=1)
+        ranges = deviations.max(axis=1) - deviations.min(axis=1)
+        stds = chunks.std(axis=1)
+        valid = stds > 0
+        if valid.any():
+            log_n.append(math.log10(n))
+            log_rs.append(math.log10((ranges[valid] / stds[valid]).mean()))
+    if len(log_n) < 2:
+        raise ValueError("series has no variance at the sampled block sizes")
+    return float(np.polyfit(log_n, log_rs, 1)[0])
+
+
+def expected_hurst(alpha_on: float, alpha_off: float) -> float:
+    """
+    ON/OFF 來源疊加的理論 Hurst 參數（Taqqu-Willinger-Sherman）：
+    H = (3 - min(alpha_on, alpha_off)) / 2，alpha 需介於 1 與 2 之間才具長相依性。
+    """
+    alpha = min(alpha_on, alpha_off)
+    if alpha >= 2:
+        return 0.5
+    return (3.0 - alpha) / 2.0
+
+
+class _SampleRing:
+    """單一分布的環狀緩衝區：用完一整塊後再以 NumPy 批次補滿。"""
+
+    def __init__(self, generate, block_size: int):
+        self._generate = generate
+        self._block_size = block_size
+        self._values = []
+        self._pos = 0
+        self._lock = Lock()
+
+    def next(self) -> float:
+        with self._lock:
+            if self._pos >= len(self._values):
+                # tolist() 轉成 Python float，之後逐一取用不再碰到 NumPy
+                self._values = self._generate(self._block_size).tolist()
+                self._pos = 0
+            value = self._values[self._pos]
+            self._pos += 1
+            return value
+
+    def invalidate(self):
+        with self._lock:
+            self._values = []
+            self._pos = 0
+
+
+class LrdSampler:
+    """
+    LRD（長相依）流量的 ON/OFF 時間取樣器，行程內所有 User 共用。
+
+    特性：
+    1. 每種分布（stream）以 NumPy 一次產生一整塊截斷 Pareto 樣本，User 從環狀緩衝區逐一取用
+    2. 以 (seed, worker_index) 建立亂數產生器，每個 worker 的序列可重現且互不相同
+    3. 可選的 fGn 速率包絡（rate envelope）：依時間回傳的倍率，用於調整 OFF 時間，
+       讓總請求速率額外帶有指定 Hurst 參數的長相依變動
+    """
+    _instance = None
+    _manager_lock = Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._manager_lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self, block_size: int = 4096):
+        if hasattr(self, '_initialized'):
+            return
+
+        with self._manager_lock:
+            if hasattr(self, '_initialized'):
+                return
+            self.block_size = block_size
+            self._lock = Lock()
+            self._rng = np.random.default_rng()
+            self._streams: Dict[tuple, _SampleRing] = {}
+            self._envelope: Optional[np.ndarray] = None
+            self._envelope_step = 1.0
+            self._envelope_origin = 0.0
+            self._initialized = True
+
+    def seed(self, seed: Optional[int] = None, worker_index: int = 0):
+        """重新設定亂數種子，丟棄已產生的樣本與包絡。seed 為 None 時使用系統亂數。"""
+        with self._lock:
+            if seed is None:
+                self._rng = np.random.default_rng()
+            else:
+                self._rng = np.random.default_rng([int(seed), int(worker_index)])
+            for stream in self._streams.values():
+                stream.invalidate()
+            self._envelope = None
+        print(f"[LrdSampler] Seeded with seed={seed}, worker_index={worker_index}")
+
+    def _generate_pareto(self, alpha: float, scale: float, upper: float, size: int) -> np.ndarray:
+        with self._lock:
+            return truncated_pareto(self._rng, alpha, scale, upper, size)
+
+    def pareto(self, alpha: float, scale: float, upper: float) -> float:
+        """取得一個截斷 Pareto 樣本，相同參數共用同一個環狀緩衝區。"""
+        key = (alpha, scale, upper)
+        stream = self._streams.get(key)
+        if stream is None:
+            with self._lock:
+                stream = self._streams.get(key)
+                if stream is None:
+                    stream = self._streams[key] = _SampleRing(
+                        lambda size: self._generate_pareto(alpha, scale, upper, size),
+                        self.block_size)
+        return stream.next()
+
+    def configure_envelope(self, hurst: float, sigma: float, duration: float,
+                           step: float = 1.0, origin: float = 0.0):
+        """
+        產生 fGn 速率包絡：factor(t) = max(0.05, 1 + sigma * fGn(t / step))，涵蓋 duration 秒，
+        超過後循環使用。
+        """
+        points = max(2, int(math.ceil(duration / step)))
+        with self._lock:
+            noise = fgn(self._rng, hurst, points)
+            self._envelope = np.maximum(0.05, 1.0 + sigma * noise)
+            self._envelope_step = step
+            self._envelope_origin = origin
+
+    def envelope_factor(self, now: float) -> float:
+        """回傳時間 now 的速率倍率，未設定包絡時為 1。"""
+        envelope = self._envelope
+        if envelope is None:
+            return 1.0
+        index = int((now - self._envelope_origin) / self._envelope_step) % envelope.size
+        return float(envelope[index])
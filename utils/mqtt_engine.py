@@ -0,0 +1,494 @@
+import logging
+import os
+import random
+import socket as _stdlib_socket
+import struct
+import time
+from threading import Lock
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import gevent
+from gevent import socket
+from gevent.lock import Semaphore
+
+from utils.dns_engine import TimerWheel
+from utils.lrd import LrdSampler
+
+logger = logging.getLogger(__name__)
+
+# MQTT 3.1.1 控制封包類型（固定標頭第一個 byte 的高 4 bits）
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+_U16 = struct.Struct('!H')
+_PINGREQ = bytes([PINGREQ << 4, 0])
+_DISCONNECT = bytes([DISCONNECT << 4, 0])
+
+
+class MqttError(Exception):
+    """MQTT 連線或協定錯誤（連線被拒、連線中斷、等待回覆的訊息已達上限等）。"""
+
+
+class MqttTimeout(MqttError):
+    """在 timeout 秒內沒有收到 echo 回覆。"""
+
+
+def encode_string(value: str) -> bytes:
+    data = value.encode('utf-8')
+    return _U16.pack(len(data)) + data
+
+
+def encode_packet(first_byte: int, body: bytes) -> bytes:
+    """加上固定標頭：控制封包類型與 flags，以及變長編碼的 remaining length。"""
+    header = bytearray([first_byte])
+    length = len(body)
+    while True:
+        byte, length = length & 0x7F, length >> 7
+        header.append(byte | 0x80 if length else byte)
+        if not length:
+            break
+    return bytes(header) + body
+
+
+def encode_publish(topic: str, payload: bytes, qos: int = 0, packet_id: int = 0) -> bytes:
+    body = encode_string(topic)
+    if qos:
+        body += _U16.pack(packet_id)
+    return encode_packet(PUBLISH << 4 | qos << 1, body + payload)
+
+
+def decode_publish(first_byte: int, body: bytes) -> Tuple[str, int, Optional[int], bytes]:
+    """解析 PUBLISH 封包內容，回傳 (topic, qos, packet id, payload)；QoS 0 沒有 packet id。"""
+    qos = (first_byte >> 1) & 0x03
+    topic_end = 2 + _U16.unpack_from(body)[0]
+    topic = body[2:topic_end].decode('utf-8')
+    packet_id = None
+    if qos:
+        packet_id = _U16.unpack_from(body, topic_end)[0]
+        topic_end += 2
+    return topic, qos, packet_id, body[topic_end:]
+
+
+def parse_packets(buffer: bytearray) -> Tuple[List[Tuple[int, bytes]], int]:
+    """
+    從接收緩衝區切出完整的封包，不完整的封包留給下一次。
+
+    Returns:
+        ([(固定標頭第一個 byte, 封包內容)], 已使用的 byte 數)
+    """
+    packets = []
+    pos, size = 0, len(buffer)
+    while pos + 2 <= size:
+        length, shift, index = 0, 0, pos + 1
+        while True:
+            if index >= size:
+                return packets, pos
+            byte = buffer[index]
+            length |= (byte & 0x7F) << shift
+            index += 1
+            if not byte & 0x80:
+                break
+            shift += 7
+            if shift > 21:
+                raise MqttError("Malformed remaining length")
+        end = index + length
+        if end > size:
+            break
+        packets.append((buffer[pos], bytes(buffer[index:end])))
+        pos = end
+    return packets, pos
+
+
+class MqttEngine:
+    """
+    MQTT 3.1.1 用戶端（QoS 0 / 1），每個引擎是一條綁定來源 IP 的持久 TCP 連線。
+
+    特性：
+    1. 連線只建立一次並保持，閒置時送出 PINGREQ；同一個 (來源 IP, broker, port) 可由多個 User 共用
+    2. 由背景 greenlet 接收並解析封包，處理 PUBACK / SUBACK，並把收到的 PUBLISH 交給該 topic 的 handler
+    3. request() 在 payload 中帶「client ID:相關 ID」後立即返回，echo 回覆依相關 ID 配對，
+       不需為每則訊息阻塞等待；共用同一個回覆 topic 的其他連線的回覆只計數、不解析
+    4. 逾時由計時輪處理，不需要為每則訊息建立計時器
+    """
+    _engines: Dict[Tuple[str, str, int], 'MqttEngine'] = {}
+    _engines_lock = Lock()
+
+    TICK = 0.05  # 計時輪的精度（秒）
+
+    @classmethod
+    def acquire(cls, source_ip: str, host: str, port: int = 1883, shared: bool = True, **kwargs) -> 'MqttEngine':
+        """
+        取得連線並增加參照計數。shared 時同一個 (來源 IP, broker, port) 共用一條連線，
+        否則每次都建立新的連線。其他參數傳給 MqttEngine()。
+
+        Raises:
+            OSError / MqttError: 無法建立連線或 broker 拒絕連線
+        """
+        key = (source_ip, host, port)
+        if shared:
+            with cls._engines_lock:
+                engine = cls._engines.get(key)
+                if engine is not None and not engine.closed:
+                    engine._refcount += 1
+                    return engine
+
+        # 建立連線需要等待網路，不在鎖內進行；同時建立的連線只保留先完成的一條
+        engine = cls(source_ip, host, port, **kwargs)
+        engine._refcount = 1
+        if not shared:
+            return engine
+        with cls._engines_lock:
+            existing = cls._engines.get(key)
+            if existing is None or existing.closed:
+                cls._engines[key] = engine
+                engine._key = key
+                return engine
+            existing._refcount += 1
+        engine.close()
+        return existing
+
+    def release(self):
+        """減少參照計數；最後一個使用者釋放時關閉連線。"""
+        with self._engines_lock:
+            self._refcount -= 1
+            if self._refcount > 0:
+                return
+            if self._key is not None and self._engines.get(self._key) is self:
+                del self._engines[self._key]
+        self.close()
+
+    @classmethod
+    def close_all(cls):
+        """關閉所有共用的連線（測試結束時使用）。"""
+        with cls._engines_lock:
+            engines = list(cls._engines.values())
+            cls._engines.clear()
+        for engine in engines:
+            engine.close()
+
+    def __init__(self, source_ip: str, host: str, port: int = 1883, client_id: Optional[str] = None,
+                 keepalive: int = 60, connect_timeout: float = 5.0, max_in_flight: int = 1000):
+        self.source_ip = source_ip
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.max_in_flight = max_in_flight
+        # client ID 也是 payload 中相關 ID 的前綴，只使用不需 JSON 跳脫的字元
+        self.client_id = client_id or f"locust-{os.getpid()}-{random.getrandbits(32):08x}"
+        self.closed = False
+        # 收到但不是這條連線送出的 echo 回覆（其他連線訂閱了同一個回覆 topic）
+        self.unmatched = 0
+        self._key: Optional[Tuple[str, str, int]] = None
+        self._refcount = 0
+        self._greenlets: List[gevent.Greenlet] = []
+
+        family = _stdlib_socket.AF_INET6 if ':' in host else _stdlib_socket.AF_INET
+        self.sock = socket.socket(family, _stdlib_socket.SOCK_STREAM)
+        self.sock.setsockopt(_stdlib_socket.IPPROTO_TCP, _stdlib_socket.TCP_NODELAY, 1)
+        try:
+            self.sock.settimeout(connect_timeout)
+            if source_ip:
+                self.sock.bind((source_ip, 0))
+            self.sock.connect((host, port))
+            # clean session；keepalive 0 表示不送 PINGREQ
+            self.sock.sendall(encode_packet(CONNECT << 4, encode_string('MQTT') + bytes([4, 0x02])
+                                            + _U16.pack(keepalive) + encode_string(self.client_id)))
+            self._buffer = self._read_connack()
+            self.sock.settimeout(None)
+        except BaseException:
+            self.sock.close()
+            raise
+
+        self._write_lock = Semaphore()
+        self._last_send = time.monotonic()
+        # {topic: 收到 PUBLISH 時呼叫的函數，參數為 payload}
+        self._handlers: Dict[str, Callable[[bytes], None]] = {}
+        self._subscribed: Dict[str, int] = {}
+        # {packet id: topic}，等待 PUBACK / SUBACK 的 QoS 1 PUBLISH 與 SUBSCRIBE
+        self._unacked: Dict[int, str] = {}
+        self._next_packet_id = 1
+        self._marker = f"{self.client_id}:".encode()
+        self._seq = 0
+        # {相關 ID: (響應時間的起點, packet id, timeout, callback)}
+        self._outstanding: Dict[int, Tuple[float, Optional[int], float, Callable]] = {}
+        self._wheel = TimerWheel(self.TICK, 10.0)
+        self._greenlets = [gevent.spawn(self._read_loop), gevent.spawn(self._expire_loop)]
+        if keepalive:
+            self._greenlets.append(gevent.spawn(self._keepalive_loop))
+
+    def _read_connack(self) -> bytearray:
+        buffer = bytearray()
+        while True:
+            data = self.sock.recv(4096)
+            if not data:
+                raise MqttError(f"Connection closed by {self.host}:{self.port} before CONNACK")
+            buffer += data
+            packets, used = parse_packets(buffer)
+            if packets:
+                break
+        first, body = packets[0]
+        if first >> 4 != CONNACK or len(body) < 2:
+            raise MqttError(f"Expected CONNACK, got packet type {first >> 4}")
+        if body[1]:
+            raise MqttError(f"Connection refused by {self.host}:{self.port}, return code {body[1]}")
+        # CONNACK 之後已收到的封包留給接收迴圈
+        return buffer[len(encode_packet(first, body)):]
+
+    @property
+    def in_flight(self) -> int:
+        """目前等待 echo 回覆中的訊息數量。"""
+        return len(self._outstanding)
+
+    def _send(self, data: bytes):
+        if self.closed:
+            raise MqttError(f"Connection to {self.host}:{self.port} is closed")
+        with self._write_lock:
+            self.sock.sendall(data)
+        self._last_send = time.monotonic()
+
+    def _allocate_packet_id(self) -> int:
+        """配置一個目前沒有在等待 PUBACK / SUBACK 的 packet id（1 ~ 65535）。"""
+        if len(self._unacked) >= 0xFFFF:
+            raise MqttError(f"No free packet IDs on {self.source_ip} -> {self.host}")
+        packet_id = self._next_packet_id
+        while packet_id in self._unacked:
+            packet_id = packet_id % 0xFFFF + 1
+        self._next_packet_id = packet_id % 0xFFFF + 1
+        return packet_id
+
+    def subscribe(self, topic: str, qos: int, handler: Callable[[bytes], None]):
+        """訂閱 topic（不等待 SUBACK），收到的訊息以 payload 呼叫 handler。"""
+        self._handlers[topic] = handler
+        if self._subscribed.get(topic, -1) >= qos:
+            return
+        self._subscribed[topic] = qos
+        packet_id = self._allocate_packet_id()
+        self._unacked[packet_id] = topic
+        self._send(encode_packet(SUBSCRIBE << 4 | 0x02, _U16.pack(packet_id) + encode_string(topic) + bytes([qos])))
+
+    def publish(self, topic: str, payload: bytes, qos: int = 0) -> Optional[int]:
+        """送出 PUBLISH，不等待 PUBACK；回傳 QoS 1 的 packet id。"""
+        if qos not in (0, 1):
+            raise ValueError(f"Unsupported QoS {qos}, only 0 and 1 are supported")
+        packet_id = None
+        if qos:
+            packet_id = self._allocate_packet_id()
+            self._unacked[packet_id] = topic
+        try:
+            self._send(encode_publish(topic, payload, qos, packet_id or 0))
+        except BaseException:
+            if packet_id is not None:
+                self._unacked.pop(packet_id, None)
+            raise
+        return packet_id
+
+    def request(self, topic: str, reply_topic: str, callback: Callable[[float, int, Optional[Exception]], None],
+                qos: int = 0, payload_size: int = 64, timeout: float = 5.0,
+                scheduled: Optional[float] = None) -> int:
+        """
+        送出帶相關 ID 的訊息但不等待回覆。在 reply_topic 收到對應的 echo 時以
+        (響應時間毫秒, 回覆長度, None) 呼叫 callback；逾時或連線中斷時 exception 為 MqttTimeout / MqttError。
+        響應時間從 scheduled（perf_counter 秒）算起，預設為送出時。
+
+        Returns:
+            這則訊息的相關 ID
+
+        Raises:
+            MqttError: 等待回覆的訊息已達 max_in_flight，或連線已關閉
+        """
+        if reply_topic not in self._handlers:
+            self.subscribe(reply_topic, qos, self._on_reply)
+        if len(self._outstanding) >= self.max_in_flight:
+            raise MqttError(f"{self.max_in_flight} messages in flight")
+
+        self._seq += 1
+        cid = self._seq
+        payload = b'%s%d ' % (self._marker, cid)
+        if len(payload) < payload_size:
+            payload += b'x' * (payload_size - len(payload))
+        start = time.perf_counter() if scheduled is None else scheduled
+        # 送出時可能讓出 CPU，先登記才不會漏掉很快回來的 echo
+        self._outstanding[cid] = (start, None, timeout, callback)
+        try:
+            packet_id = self.publish(topic, payload, qos)
+        except BaseException:
+            self._outstanding.pop(cid, None)
+            raise
+        if cid in self._outstanding:
+            self._outstanding[cid] = (start, packet_id, timeout, callback)
+        self._wheel.schedule(time.perf_counter() + timeout, cid)
+        return cid
+
+    def _on_reply(self, payload: bytes):
+        """依 payload 中的相關 ID 找到等待中的訊息；不需解析整個 JSON。"""
+        index = payload.find(self._marker)
+        if index < 0:
+            self.unmatched += 1
+            return
+        start = index + len(self._marker)
+        try:
+            cid = int(payload[start:payload.index(b' ', start)])
+        except ValueError:
+            self.unmatched += 1
+            return
+        entry = self._outstanding.pop(cid, None)
+        # 已經逾時的訊息
+        if entry is None:
+            return
+        started, packet_id, _, callback = entry
+        if packet_id is not None:
+            self._unacked.pop(packet_id, None)
+        callback((time.perf_counter() - started) * 1000, len(payload), None)
+
+    def _handle(self, first_byte: int, body: bytes):
+        kind = first_byte >> 4
+        if kind == PUBLISH:
+            topic, qos, packet_id, payload = decode_publish(first_byte, body)
+            if qos == 1:
+                self._send(encode_packet(PUBACK << 4, _U16.pack(packet_id)))
+            handler = self._handlers.get(topic)
+            if handler is not None:
+                try:
+                    handler(payload)
+                except Exception as e:
+                    # handler 的錯誤不能讓接收迴圈停止
+                    logger.error("[MqttEngine] Error in handler for %s: %s", topic, e)
+        elif kind in (PUBACK, SUBACK):
+            packet_id = _U16.unpack_from(body)[0]
+            topic = self._unacked.pop(packet_id, None)
+            if kind == SUBACK and body[2:3] == b'\x80':
+                logger.warning("[MqttEngine] Subscription to %s refused by %s", topic, self.host)
+        # PINGRESP 不需處理；不支援 QoS 2，也不會收到 PUBREC / PUBREL
+
+    def _read_loop(self):
+        """背景接收封包；連線中斷時把等待中的訊息以錯誤回報。"""
+        buffer = self._buffer
+        try:
+            while True:
+                packets, used = parse_packets(buffer)
+                if used:
+                    del buffer[:used]
+                for first_byte, body in packets:
+                    self._handle(first_byte, body)
+                data = self.sock.recv(65536)
+                if not data:
+                    raise MqttError(f"Connection closed by {self.host}:{self.port}")
+                buffer += data
+        except (OSError, MqttError) as e:
+            self._disconnect(e if isinstance(e, MqttError) else MqttError(f"Connection lost: {e}"))
+
+    def _keepalive_loop(self):
+        interval = self.keepalive / 2
+        while True:
+            gevent.sleep(interval)
+            if time.monotonic() - self._last_send >= interval:
+                try:
+                    self._send(_PINGREQ)
+                except (OSError, MqttError):
+                    return
+
+    def _expire_loop(self):
+        while True:
+            gevent.sleep(self.TICK)
+            for cid in self._wheel.advance(time.perf_counter()):
+                entry = self._outstanding.pop(cid, None)
+                if entry is None:
+                    continue
+                started, packet_id, timeout, callback = entry
+                if packet_id is not None:
+                    self._unacked.pop(packet_id, None)
+                callback((time.perf_counter() - started) * 1000, 0,
+                         MqttTimeout(f"No echo within {timeout}s"))
+
+    def _disconnect(self, exception: MqttError):
+        """停止背景 greenlet 並關閉 socket，等待中的訊息以 exception 回報。"""
+        if self.closed:
+            return
+        self.closed = True
+        current = gevent.getcurrent()
+        gevent.killall([g for g in self._greenlets if g is not current], block=False)
+        self.sock.close()
+        with self._engines_lock:
+            if self._key is not None and self._engines.get(self._key) is self:
+                del self._engines[self._key]
+        outstanding, self._outstanding = self._outstanding, {}
+        now = time.perf_counter()
+        for started, _, _, callback in outstanding.values():
+            callback((now - started) * 1000, 0, exception)
+
+    def close(self):
+        """送出 DISCONNECT 並關閉連線。"""
+        if self.closed:
+            return
+        try:
+            self._send(_DISCONNECT)
+        except (OSError, MqttError):
+            pass
+        self._disconnect(MqttError(f"Connection to {self.host}:{self.port} closed"))
+
+
+# ==========================================
+# publish 排程：每個產生器依序回傳兩則訊息之間的間隔（秒）
+# ==========================================
+
+def constant_gaps(rate: float) -> Iterator[float]:
+    """固定速率（每秒 rate 則）。"""
+    while True:
+        yield 1.0 / rate
+
+
+def burst_gaps(burst_size: int, burst_interval: float) -> Iterator[float]:
+    """每 burst_interval 秒連續送出 burst_size 則（之間不等待）。"""
+    while True:
+        for _ in range(burst_size - 1):
+            yield 0.0
+        yield burst_interval
+
+
+def pareto_gaps(rate: float, alpha_on: float, on_scale: float, alpha_off: float, off_scale: float,
+                max_period: float) -> Iterator[float]:
+    """
+    ON/OFF 排程：ON 期間以 rate 送出，ON 與 OFF 的長度皆為截斷 Pareto 分布（LrdSampler 批次產生），
+    多數時間短、偶爾很長，多個裝置疊加後的訊息速率帶有長相依（LRD）特性。
+    """
+    sampler = LrdSampler()
+    interval = 1.0 / rate
+    while True:
+        count = max(1, round(sampler.pareto(alpha_on, on_scale, max_period) * rate))
+        for _ in range(count - 1):
+            yield interval
+        yield interval + sampler.pareto(alpha_off, off_scale, max_period)
+
+
+def make_schedule(config: Optional[dict]) -> Iterator[float]:
+    """
+    依設定建立 publish 排程，config 例如：
+      {"type": "constant", "rate": 1}
+      {"type": "burst", "burst_size": 20, "burst_interval": 10}
+      {"type": "pareto", "rate": 5, "alpha_on": 1.4, "on_scale": 1, "alpha_off": 1.4, "off_scale": 5, "max_period": 300}
+
+    Raises:
+        ValueError: 未知的排程類型或速率不是正數
+    """
+    config = config or {}
+    kind = config.get('type', 'constant')
+    if kind == 'burst':
+        return burst_gaps(max(1, int(config.get('burst_size', 10))), float(config.get('burst_interval', 5.0)))
+    rate = float(config.get('rate', 1.0))
+    if rate <= 0:
+        raise ValueError(f"Publish rate must be positive, got {rate}")
+    if kind == 'constant':
+        return constant_gaps(rate)
+    if kind == 'pareto':
+        return pareto_gaps(rate,
+                           float(config.get('alpha_on', 1.4)), float(config.get('on_scale', 1.0)),
+                           float(config.get('alpha_off', 1.4)), float(config.get('off_scale', 5.0)),
+                           float(config.get('max_period', 300.0)))
+    raise ValueError(f"Unknown publish schedule type: {kind}")
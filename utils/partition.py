@@ -0,0 +1,108 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import gevent
+from locust.runners import STATE_MISSING, MasterRunner, WorkerRunner
+
+from utils.ip_manager import SourceIpManager
+from utils.target_server import TargetServerManager
+
+logger = logging.getLogger(__name__)
+
+PARTITION_MESSAGE = 'ip_partition'
+PARTITION_REQUEST_MESSAGE = 'ip_partition_request'
+# master 檢查 worker 加入 / 離開的間隔（秒）
+REBALANCE_INTERVAL = 1.0
+
+
+def assign_partitions(worker_ids: List[str], worker_index) -> Dict[str, Dict]:
+    """
+    依 worker index 排序後，為每個 worker 指定區段 {'index', 'count'}。
+    以 worker index 排序可讓既有 worker 在其他 worker 加入時盡量維持原本的順序。
+    """
+    ordered = sorted(worker_ids, key=worker_index)
+    return {worker_id: {'index': i, 'count': len(ordered)} for i, worker_id in enumerate(ordered)}
+
+
+def apply_partition(index: int, count: int):
+    """worker 收到區段後，依設定檔套用到來源 IP 與目標伺服器管理器。"""
+    ip_manager = SourceIpManager()
+    if ip_manager.partition_enabled():
+        ip_manager.set_partition(index, count)
+    target_manager = TargetServerManager()
+    if target_manager.partition_enabled():
+        target_manager.set_partition(index, count)
+
+
+def worker_partition(environment) -> Optional[Tuple[int, int]]:
+    """
+    這個行程的區段 (index, count)：單機執行為 (0, 1)，
+    worker 為 master 最近一次指定的區段，尚未收到時為 None。
+    """
+    if not isinstance(environment.runner, WorkerRunner):
+        return 0, 1
+    return getattr(environment, 'ip_partition', None)
+
+
+def install_partitioning(environment):
+    """
+    註冊分散式的 IP 區段分配：
+    worker 註冊訊息後向 master 要求區段，master 在 worker 加入或離開時重新計算區段，
+    透過自訂訊息送給每個 worker；worker 收到後只從自己的區段分配來源 IP（與目標，若 target.json 啟用）。
+    單機執行時不做任何事。
+    """
+    runner = environment.runner
+    if getattr(environment, '_partitioning_installed', False):
+        return
+    environment._partitioning_installed = True
+
+    if isinstance(runner, WorkerRunner):
+        def _on_partition(environment, msg, **kwargs):
+            # 記在 environment 上，其他依 worker 分片的功能（例如 TraceReplayUser）也使用同一個區段
+            environment.ip_partition = (msg.data['index'], msg.data['count'])
+            apply_partition(msg.data['index'], msg.data['count'])
+        runner.register_message(PARTITION_MESSAGE, _on_partition)
+        # worker 在 init 之前就已向 master 報到，等訊息註冊好才要求區段，避免區段送達時被當成未知訊息丟棄
+        runner.send_message(PARTITION_REQUEST_MESSAGE)
+        return
+
+    if not isinstance(runner, MasterRunner):
+        return
+
+    sent: Dict[str, Dict] = {}
+    # 已要求過區段的 worker（代表已可接收區段訊息）
+    requested = set()
+
+    def rebalance():
+        active = [worker_id for worker_id, node in runner.clients.items()
+                  if node.state != STATE_MISSING and worker_id in requested]
+        assignments = assign_partitions(active, runner.get_worker_index)
+        changed = [worker_id for worker_id, assignment in assignments.items() if sent.get(worker_id) != assignment]
+        for worker_id in changed:
+            runner.send_message(PARTITION_MESSAGE, assignments[worker_id], client_id=worker_id)
+        if changed:
+            logger.info(f"[Partition] Assigned IP partitions to {len(assignments)} workers "
+                        f"({len(changed)} updated)")
+        sent.clear()
+        sent.update(assignments)
+
+    def rebalance_loop():
+        while True:
+            gevent.sleep(REBALANCE_INTERVAL)
+            try:
+                rebalance()
+            except Exception:
+                logger.exception("[Partition] Failed to rebalance IP partitions")
+
+    def _on_partition_request(environment, msg, **kwargs):
+        # worker 註冊好訊息後才要求區段；新 worker 加入也會讓其他 worker 的區段一併更新
+        requested.add(msg.node_id)
+        sent.pop(msg.node_id, None)
+        rebalance()
+    runner.register_message(PARTITION_REQUEST_MESSAGE, _on_partition_request)
+
+    greenlet = gevent.spawn(rebalance_loop)
+
+    @environment.events.quitting.add_listener
+    def _on_quitting(**kwargs):
+        greenlet.kill(block=False)
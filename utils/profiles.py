@@ -0,0 +1,211 @@
+import json
+import os
+import signal
+import sys
+from threading import Lock
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import gevent
+
+
+# 設定檔目錄的環境變數，未設定時使用專案的 profiles/
+PROFILES_DIR_ENV = 'PROFILES_DIR'
+
+
+def _option_value(argv: List[str], name: str) -> Optional[str]:
+    """取得命令列參數的值（支援 `--name value` 與 `--name=value`）。"""
+    for index, arg in enumerate(argv):
+        if arg == name and index + 1 < len(argv):
+            return argv[index + 1]
+        if arg.startswith(name + '='):
+            return arg[len(name) + 1:]
+    return None
+
+
+def _locust_config_users() -> Optional[str]:
+    """
+    Locust 的 config-users 設定，依序為命令列 --config-users、環境變數 LOCUST_CONFIG_USERS、
+    --config（預設 ./locust.conf）中的 config-users；只處理指向 JSON 檔案的設定。
+    """
+    argv = sys.argv[1:]
+    value = _option_value(argv, '--config-users') or os.environ.get('LOCUST_CONFIG_USERS')
+    if value is None:
+        config = _option_value(argv, '--config') or os.environ.get('LOCUST_CONFIG') or 'locust.conf'
+        try:
+            with open(config, 'r') as f:
+                for line in f:
+                    key, sep, rest = line.split('#', 1)[0].partition('=')
+                    if sep and key.strip() == 'config-users':
+                        value = rest
+        except OSError:
+            return None
+    value = (value or '').strip()
+    return value if value.endswith('.json') else None
+
+
+class ProfileRegistry:
+    """
+    設定檔註冊表，在每個行程中只讀取並解析一次 profiles/ 下的設定檔。
+
+    特性：
+    1. config-users.json 依 user_class_name 建立索引，User 建立時不需再讀檔
+    2. ips.json / target.json 由 SourceIpManager 與 TargetServerManager 共用
+    3. 只在明確要求時重新載入（reload()、檔案 mtime 變更或 SIGHUP）
+    4. 重新載入後通知已註冊的監聽者（例如重建 IP 池）
+    """
+    _instance = None
+    _manager_lock = Lock()
+
+    USER_CONFIG_FILE = 'config-users.json'
+    SOURCE_IPS_FILE = 'ips.json'
+    TARGET_FILE = 'target.json'
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._manager_lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if hasattr(self, '_initialized'):
+            return
+
+        with self._manager_lock:
+            if hasattr(self, '_initialized'):
+                return
+
+            base_dir = Path(__file__).parent.parent
+            # 環境變數 PROFILES_DIR 可改用其他目錄（例如 benchmark 的本機設定）
+            self.profiles_dir = Path(os.environ.get(PROFILES_DIR_ENV) or base_dir / 'profiles')
+            # User 設定檔跟著 Locust 的 config-users（例如 ./profiles/mqtt_burst.json），
+            # 位於 profiles/ 下時以檔名表示，其他位置為絕對路徑
+            self.user_config_file = self.USER_CONFIG_FILE
+            configured = _locust_config_users()
+            if configured:
+                path = Path(configured).resolve()
+                self.user_config_file = path.name if path.parent == self.profiles_dir.resolve() else str(path)
+            self._documents = {}   # {檔名: 解析後的 JSON}
+            self._mtimes = {}      # {檔名: 載入時的 mtime}
+            self._user_profiles = {}
+            self._listeners = []
+            self._reload_lock = Lock()
+            self._signal_watcher = None   # install_reload_signal 的 gevent 訊號處理器
+            self._load_all()
+            self._initialized = True
+
+    def path_of(self, filename: str) -> Path:
+        """回傳設定檔的完整路徑；USER_CONFIG_FILE 對應到目前使用的 User 設定檔。"""
+        if filename == self.USER_CONFIG_FILE:
+            filename = self.user_config_file
+        return self.profiles_dir / filename
+
+    @staticmethod
+    def _mtime(path: Path) -> Optional[float]:
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _read_json(self, filename: str):
+        """讀取單一 JSON 設定檔，檔案不存在或格式錯誤時回傳 None。"""
+        path = self.path_of(filename)
+        if not os.path.exists(path):
+            print(f"[ProfileRegistry] Error: Config file '{path}' not found.")
+            return None
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[ProfileRegistry] Error: Invalid format in '{path}': {e}")
+            return None
+
+    def _load_all(self):
+        """載入所有設定檔並重建 User 設定索引。"""
+        documents = {}
+        mtimes = {}
+        for filename in (self.USER_CONFIG_FILE, self.SOURCE_IPS_FILE, self.TARGET_FILE):
+            mtimes[filename] = self._mtime(self.path_of(filename))
+            documents[filename] = self._read_json(filename)
+
+        user_profiles = {}
+        user_config = documents[self.USER_CONFIG_FILE]
+        if isinstance(user_config, list):
+            for item in user_config:
+                if isinstance(item, dict) and item.get('user_class_name'):
+                    user_profiles[item['user_class_name']] = item
+
+        # 一次性替換，讀取端不需要加鎖
+        self._documents = documents
+        self._mtimes = mtimes
+        self._user_profiles = user_profiles
+        print(f"[ProfileRegistry] Loaded profiles from '{self.profiles_dir}': "
+              f"{len(user_profiles)} user classes")
+
+    def get_user_profile(self, user_class_name: str) -> Dict:
+        """取得特定 User 類型的設定，未設定時回傳空字典。"""
+        return self._user_profiles.get(user_class_name, {})
+
+    def get_document(self, filename: str):
+        """取得已解析的設定檔內容（ips.json、target.json 等），讀取失敗時為 None。"""
+        return self._documents.get(filename)
+
+    def add_reload_listener(self, callback: Callable[[], None]):
+        """註冊重新載入後要呼叫的函數。"""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def reload(self):
+        """重新讀取所有設定檔，並通知監聽者。"""
+        with self._reload_lock:
+            self._load_all()
+            listeners: List[Callable[[], None]] = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[ProfileRegistry] Error in reload listener {callback!r}: {e}")
+
+    def changed_files(self) -> List[str]:
+        """回傳自上次載入後 mtime 有變更的設定檔。"""
+        return [filename for filename, mtime in self._mtimes.items()
+                if self._mtime(self.path_of(filename)) != mtime]
+
+    def reload_if_changed(self) -> bool:
+        """只有在設定檔 mtime 變更時才重新載入，回傳是否有重新載入。"""
+        changed = self.changed_files()
+        if not changed:
+            return False
+        print(f"[ProfileRegistry] Detected changes in {', '.join(changed)}, reloading...")
+        self.reload()
+        return True
+
+    def install_reload_signal(self, signum: Optional[int] = None) -> bool:
+        """
+        安裝訊號處理器（預設 SIGHUP），收到訊號時重新載入設定檔。
+        以 gevent 的訊號處理器在新的 greenlet 中執行 reload()，不在 Python 訊號處理的上下文中：
+        訊號在 reload() 持有 _reload_lock 時送達也只會等待，不會在同一個執行緒重複取得鎖而卡死，
+        監聽者重建 IP 與目標池時也不會打斷其他正在執行的程式。
+        平台不支援該訊號或不在主執行緒時回傳 False。
+        """
+        if signum is None:
+            signum = getattr(signal, 'SIGHUP', None)
+            if signum is None:
+                return False
+        try:
+            if self._signal_watcher is not None:
+                self._signal_watcher.cancel()
+            self._signal_watcher = gevent.signal_handler(signum, self.reload)
+        except (ValueError, OSError) as e:
+            print(f"[ProfileRegistry] Could not install reload signal handler: {e}")
+            return False
+        return True
+
+
+# 導出便利函數
+def get_user_profile(user_class_name: str) -> Dict:
+    """
+    根據 User 類別名稱取得 config-users.json 中的設定。
+    """
+    return ProfileRegistry().get_user_profile(user_class_name)
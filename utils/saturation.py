@@ -0,0 +1,395 @@
+import csv
+import logging
+import os
+import time
+import weakref
+from threading import Lock
+from typing import Dict, List
+
+import gevent
+import greenlet
+from locust import User
+from locust.runners import MasterRunner, WorkerRunner
+
+from utils.histogram import LogHistogram
+from utils.side_metrics import SideMetrics
+from utils.web_tables import register_web_table
+
+logger = logging.getLogger(__name__)
+
+# 環境變數
+SATURATION_INTERVAL_ENV = 'SATURATION_INTERVAL'    # 每筆取樣涵蓋的秒數（預設 1）
+SATURATION_LAG_MS_ENV = 'SATURATION_LAG_MS'        # 事件迴圈延遲 p99 達到此值（毫秒）才可能標記（預設 10）
+SATURATION_CPU_ENV = 'SATURATION_CPU'              # 行程 CPU 使用率達到此百分比視為飽和（預設 90）
+SATURATION_CLASS_CPU_ENV = 'SATURATION_CLASS_CPU'  # 設為 1 時以 greenlet 切換追蹤各 User 類別的 CPU（預設 0，每次切換約多 1.4µs）
+
+# 探針每隔多久醒來一次，量測延遲與待執行佇列
+PROBE_INTERVAL = 0.02
+# 事件迴圈延遲平均值佔請求平均延遲的比例超過此值時，量到的延遲主要來自產生器本身
+GENERATOR_SHARE_THRESHOLD = 0.5
+# 以延遲佔比判斷時，延遲平均值還必須達到延遲門檻的這個比例：
+# 單次 GC 停頓只拉高 p99，平均值仍然很小，回應在 1 ms 以下時不會因此被標記
+MIN_LAG_MEAN_FRACTION = 0.25
+
+# 固定的 CSV 欄位；各 User 類別的 CPU 另外加上 cpu_<類別>_percent 欄位
+FIELDS = ['time', 'worker', 'cpu_percent', 'lag_mean_ms', 'lag_p99_ms', 'lag_max_ms',
+          'run_queue_mean', 'run_queue_max', 'requests', 'response_mean_ms', 'generator_share',
+          'saturated', 'reason']
+
+
+class GreenletCpuTracer:
+    """
+    以 greenlet.settrace 在每次切換時讀取執行緒 CPU 時間，把差值記到切出的 greenlet 所屬的 User 類別。
+
+    Locust 的 User greenlet 以 User 實例為第一個參數（greenlet.args[0]）；
+    User 另外建立的 greenlet（例如 SwarmUser 的 pool）沿 spawning_greenlet 往上找到所屬的 User，
+    找不到時記為 other，事件迴圈本身記為 hub。
+    """
+
+    def __init__(self):
+        self.cpu_ns: Dict[str, int] = {}
+        self._owners = weakref.WeakKeyDictionary()
+        self._last = 0
+        self._previous = None
+        self._installed = False
+        self._hub = None
+
+    def owner_of(self, glet) -> str:
+        """greenlet 所屬的 User 類別名稱；結果存在 greenlet 上（無法設定屬性時存在弱參照字典）。"""
+        owner = getattr(glet, '_saturation_owner', None)
+        if owner is not None:
+            return owner
+        owner = self._owners.get(glet)
+        if owner is not None:
+            return owner
+        owner = 'other'
+        if glet is self._hub:
+            owner = 'hub'
+        current = glet
+        for _ in range(8):
+            args = getattr(current, 'args', None)
+            if args and isinstance(args[0], User):
+                owner = type(args[0]).__name__
+                break
+            parent = getattr(current, 'spawning_greenlet', None)
+            current = parent() if parent is not None else None
+            if current is None:
+                break
+        try:
+            glet._saturation_owner = owner
+        except AttributeError:
+            try:
+                self._owners[glet] = owner
+            except TypeError:
+                pass
+        return owner
+
+    def _trace(self, event, args):
+        if event == 'switch' or event == 'throw':
+            now = time.thread_time_ns()
+            origin = args[0]
+            owner = getattr(origin, '_saturation_owner', None) or self.owner_of(origin)
+            cpu_ns = self.cpu_ns
+            cpu_ns[owner] = cpu_ns.get(owner, 0) + now - self._last
+            self._last = now
+        if self._previous is not None:
+            self._previous(event, args)
+
+    def install(self):
+        if self._installed:
+            return
+        self._hub = gevent.get_hub()
+        self._last = time.thread_time_ns()
+        self._previous = greenlet.settrace(self._trace)
+        self._installed = True
+
+    def uninstall(self):
+        if self._installed:
+            greenlet.settrace(self._previous)
+            self._installed = False
+
+    def snapshot_and_reset(self) -> Dict[str, int]:
+        cpu_ns, self.cpu_ns = self.cpu_ns, {}
+        return cpu_ns
+
+
+def run_queue_depth(loop) -> int:
+    """已就緒、等待事件迴圈執行的 callback（包含要切換回去的 greenlet）與 watcher 數量。"""
+    try:
+        return len(loop._callbacks) + loop.pendingcnt
+    except (AttributeError, TypeError):
+        return 0
+
+
+def evaluate(row: Dict, lag_threshold_ms: float, cpu_threshold: float) -> Dict:
+    """
+    判斷取樣區間是否由產生器主導延遲：事件迴圈延遲 p99 達到門檻，
+    而且 CPU 使用率達到門檻，或延遲平均值持續偏高（至少為門檻的 MIN_LAG_MEAN_FRACTION）
+    且佔請求平均延遲的比例達到 GENERATOR_SHARE_THRESHOLD。
+    """
+    share = row['lag_mean_ms'] / row['response_mean_ms'] if row['response_mean_ms'] > 0 else 0.0
+    row['generator_share'] = round(min(share, 1.0), 3)
+    reasons = []
+    if row['lag_p99_ms'] >= lag_threshold_ms:
+        if row['cpu_percent'] >= cpu_threshold:
+            reasons.append(f"cpu {row['cpu_percent']:.0f}%")
+        if share >= GENERATOR_SHARE_THRESHOLD and row['lag_mean_ms'] >= lag_threshold_ms * MIN_LAG_MEAN_FRACTION:
+            reasons.append(f"loop lag {share:.0%} of response time")
+        if reasons:
+            reasons.insert(0, f"loop lag p99 {row['lag_p99_ms']:.1f} ms")
+    row['saturated'] = 1 if reasons else 0
+    row['reason'] = ', '.join(reasons)
+    return row
+
+
+class SaturationMonitor:
+    """
+    在執行 User 的行程中定期取樣產生器本身的負載：
+    事件迴圈延遲（探針 sleep 後晚醒的時間）、待執行佇列長度、行程 CPU 使用率與各 User 類別的 CPU，
+    並與同一區間的請求平均延遲比較，標記產生器成為瓶頸的區間。
+    """
+
+    def __init__(self, environment, interval: float = 1.0, lag_threshold_ms: float = 10.0,
+                 cpu_threshold: float = 90.0, class_cpu: bool = False):
+        self.environment = environment
+        self.interval = interval
+        self.lag_threshold_ms = lag_threshold_ms
+        self.cpu_threshold = cpu_threshold
+        self.tracer = GreenletCpuTracer() if class_cpu else None
+        self.pending: List[Dict] = []
+        self._greenlet = None
+        self._response_sum = 0.0
+        self._response_count = 0
+
+    def on_request(self, request_type, response_time, **kwargs):
+        if response_time is not None:
+            self._response_sum += response_time
+            self._response_count += 1
+
+    def start(self):
+        if self.tracer is not None:
+            self.tracer.install()
+        self._greenlet = gevent.spawn(self._run)
+
+    def stop(self):
+        if self._greenlet is not None:
+            self._greenlet.kill(block=False)
+        if self.tracer is not None:
+            self.tracer.uninstall()
+
+    def _run(self):
+        loop = gevent.get_hub().loop
+        while True:
+            histogram = LogHistogram()
+            queue_sum = queue_max = 0
+            wall, cpu = time.perf_counter(), time.process_time()
+            self._response_sum, self._response_count = 0.0, 0
+            if self.tracer is not None:
+                self.tracer.snapshot_and_reset()
+            end = wall + self.interval
+            while True:
+                before = time.perf_counter()
+                gevent.sleep(PROBE_INTERVAL)
+                now = time.perf_counter()
+                histogram.record((now - before - PROBE_INTERVAL) * 1e6)
+                depth = run_queue_depth(loop)
+                queue_sum += depth
+                queue_max = max(queue_max, depth)
+                if now >= end:
+                    break
+            elapsed = now - wall
+            row = self.sample(histogram, queue_sum, queue_max, elapsed, time.process_time() - cpu)
+            self.pending.append(row)
+            self.publish(row)
+
+    def sample(self, histogram: LogHistogram, queue_sum: int, queue_max: int, elapsed: float,
+               cpu_seconds: float) -> Dict:
+        """把一個區間的量測整理成一列（時間為區間結束的 Unix 秒數）。"""
+        count = max(histogram.total_count, 1)
+        row = {
+            'time': round(time.time(), 3),
+            'worker': getattr(self.environment.runner, 'worker_index', 0),
+            'cpu_percent': round(cpu_seconds / elapsed * 100, 1),
+            'lag_mean_ms': round(histogram.mean / 1000, 3),
+            'lag_p99_ms': round(histogram.percentile(99) / 1000, 3),
+            'lag_max_ms': round((histogram.max_value or 0) / 1000, 3),
+            'run_queue_mean': round(queue_sum / count, 2),
+            'run_queue_max': queue_max,
+            'requests': self._response_count,
+            'response_mean_ms': round(self._response_sum / self._response_count, 3) if self._response_count else 0.0,
+        }
+        evaluate(row, self.lag_threshold_ms, self.cpu_threshold)
+        if self.tracer is not None:
+            cpu_ns = self.tracer.snapshot_and_reset()
+            row['cpu_by_class'] = {name: round(ns / 1e9 / elapsed * 100, 1) for name, ns in sorted(cpu_ns.items())}
+        return row
+
+    def publish(self, row: Dict):
+        """
+        記錄到 side metrics（generator 類別），不進入 Locust stats：
+        不影響請求數、RPS、百分位數與失敗比例，數值也不會被當成毫秒。
+        """
+        metrics = SideMetrics()
+        metrics.record('generator', 'loop lag p99 (ms)', row['lag_p99_ms'], failed=bool(row['saturated']))
+        metrics.record('generator', 'cpu (%)', row['cpu_percent'])
+        metrics.record('generator', 'run queue (max)', row['run_queue_max'])
+        if row['saturated']:
+            logger.warning("[Saturation] Generator saturated on worker %s: %s", row['worker'], row['reason'])
+
+    def take_pending(self) -> List[Dict]:
+        rows, self.pending = self.pending, []
+        return rows
+
+
+class SaturationLog:
+    """master（或單機執行時的本行程）保存所有取樣列，輸出 CSV 與 web UI 表格。"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.rows: List[Dict] = []
+        self.latest: Dict[str, Dict] = {}
+
+    def add(self, rows: List[Dict]):
+        with self._lock:
+            for row in rows:
+                self.rows.append(row)
+                self.latest[str(row['worker'])] = row
+
+    def reset(self):
+        with self._lock:
+            self.rows = []
+            self.latest = {}
+
+    def saturated_count(self) -> int:
+        with self._lock:
+            return sum(row['saturated'] for row in self.rows)
+
+    @staticmethod
+    def flatten(row: Dict) -> Dict:
+        flat = {key: value for key, value in row.items() if key != 'cpu_by_class'}
+        for name, percent in (row.get('cpu_by_class') or {}).items():
+            flat[f'cpu_{name}_percent'] = percent
+        return flat
+
+    def table_rows(self) -> List[Dict]:
+        with self._lock:
+            latest = [self.latest[worker] for worker in sorted(self.latest)]
+            totals = {}
+            for row in self.rows:
+                totals[str(row['worker'])] = totals.get(str(row['worker']), 0) + row['saturated']
+        return [dict(self.flatten(row),
+                     cpu_by_class=', '.join(f"{name} {percent}%" for name, percent in
+                                            (row.get('cpu_by_class') or {}).items()),
+                     saturated_intervals=totals.get(str(row['worker']), 0))
+                for row in latest]
+
+    def write_csv(self, path: str):
+        with self._lock:
+            rows = [self.flatten(row) for row in self.rows]
+        if not rows:
+            return
+        class_fields = sorted({key for row in rows for key in row if key.startswith('cpu_') and key != 'cpu_percent'})
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS + class_fields, restval='')
+            writer.writeheader()
+            writer.writerows(rows)
+        logger.info(f"[Saturation] Wrote {len(rows)} rows to {path}")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        logger.warning(f"[Saturation] Invalid {name}={os.environ.get(name)!r}, using {default}")
+        return default
+
+
+def install_saturation_monitor(environment):
+    """
+    註冊產生器飽和監測：執行 User 的行程（單機或 worker）在測試期間每 SATURATION_INTERVAL 秒取樣一次，
+    記錄到 side metrics（不進入 Locust stats），並把取樣列送到 master；
+    master 在 web UI 顯示各 worker 最新的取樣，結束時輸出 {csv_prefix}_saturation.csv。
+    """
+    if getattr(environment, '_saturation_installed', False):
+        return
+    environment._saturation_installed = True
+    runner = environment.runner
+    log = SaturationLog()
+    environment.saturation_log = log
+
+    if not isinstance(runner, MasterRunner):
+        monitor = SaturationMonitor(
+            environment,
+            interval=_env_float(SATURATION_INTERVAL_ENV, 1.0),
+            lag_threshold_ms=_env_float(SATURATION_LAG_MS_ENV, 10.0),
+            cpu_threshold=_env_float(SATURATION_CPU_ENV, 90.0),
+            class_cpu=os.environ.get(SATURATION_CLASS_CPU_ENV, '0') == '1',
+        )
+        environment.events.request.add_listener(monitor.on_request)
+
+        @environment.events.test_start.add_listener
+        def _on_test_start(**kwargs):
+            monitor.stop()
+            monitor.start()
+
+        @environment.events.test_stop.add_listener
+        def _on_test_stop(**kwargs):
+            monitor.stop()
+            if not isinstance(runner, WorkerRunner):
+                log.add(monitor.take_pending())
+
+        @environment.events.report_to_master.add_listener
+        def _on_report_to_master(client_id, data, **kwargs):
+            rows = monitor.take_pending()
+            if rows:
+                data['saturation'] = rows
+
+        if not isinstance(runner, WorkerRunner):
+            # 單機執行：定期把取樣列搬到 log
+            def collect():
+                while True:
+                    gevent.sleep(monitor.interval)
+                    log.add(monitor.take_pending())
+            collector = gevent.spawn(collect)
+
+            @environment.events.quitting.add_listener
+            def _on_quitting_stop(**kwargs):
+                collector.kill(block=False)
+
+    @environment.events.worker_report.add_listener
+    def _on_worker_report(client_id, data, **kwargs):
+        if data.get('saturation'):
+            log.add(data['saturation'])
+
+    @environment.events.reset_stats.add_listener
+    def _on_reset_stats(**kwargs):
+        log.reset()
+
+    @environment.events.quitting.add_listener
+    def _on_quitting(environment, **kwargs):
+        if isinstance(environment.runner, WorkerRunner):
+            return
+        count = log.saturated_count()
+        if count:
+            logger.warning(f"[Saturation] Generator was saturated in {count} intervals; "
+                           f"latency in those intervals reflects the load generator, not the target")
+        csv_prefix = getattr(environment.parsed_options, 'csv_prefix', None)
+        if csv_prefix:
+            directory = os.path.dirname(csv_prefix)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            log.write_csv(f"{csv_prefix}_saturation.csv")
+
+    if not isinstance(runner, WorkerRunner):
+        register_web_table(environment, 'saturation', 'Generator', [
+            {'key': 'worker', 'title': 'Worker'},
+            {'key': 'cpu_percent', 'title': 'CPU %'},
+            {'key': 'lag_p99_ms', 'title': 'Loop lag p99 (ms)'},
+            {'key': 'lag_max_ms', 'title': 'Loop lag max (ms)'},
+            {'key': 'run_queue_max', 'title': 'Run queue max'},
+            {'key': 'response_mean_ms', 'title': 'Response mean (ms)'},
+            {'key': 'generator_share', 'title': 'Generator share'},
+            {'key': 'cpu_by_class', 'title': 'CPU by user class'},
+            {'key': 'saturated_intervals', 'title': 'Saturated intervals'},
+            {'key': 'reason', 'title': 'Last reason'},
+        ], log.table_rows)
@@ -0,0 +1,156 @@
+import csv
+import logging
+import os
+from threading import Lock
+from typing import Dict, List, Tuple
+
+from locust.runners import WorkerRunner
+
+from utils.histogram import LogHistogram
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class SideMetrics:
+    """
+    不進入 Locust stats 樹的細部統計（side channel）。
+
+    Locust 的每個 stats 名稱都有自己的 response time 字典與 CSV 歷史資料，
+    名稱數量一多，master 的記憶體與 CSV 寫入時間都會跟著增加。
+    需要細分（例如每個網域）的資料改記在這裡：
+    每個 (category, key) 只保留一個精簡的對數直方圖，
+    worker 透過 report_to_master 傳給 master 合併，測試結束時輸出成 CSV。
+    """
+    _instance = None
+    _manager_lock = Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._manager_lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if hasattr(self, '_initialized'):
+            return
+
+        with self._manager_lock:
+            if hasattr(self, '_initialized'):
+                return
+            self._lock = Lock()
+            self._histograms: Dict[Tuple[str, str], LogHistogram] = {}
+            self._failures: Dict[Tuple[str, str], int] = {}
+            self._initialized = True
+
+    def record(self, category: str, key: str, value: float, failed: bool = False):
+        """
+        記錄一筆數值，單位由 category 決定（延遲為毫秒）。
+        內部以 1/1000 單位的整數保存，例如毫秒會以微秒精度記錄。
+        """
+        name = (category, key)
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = LogHistogram()
+            histogram.record(int(value * 1000))
+            if failed:
+                self._failures[name] = self._failures.get(name, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._failures = {}
+
+    def snapshot_and_reset(self) -> List:
+        """取出目前的統計並清空（worker 送給 master 時使用）。"""
+        with self._lock:
+            histograms, failures = self._histograms, self._failures
+            self._histograms, self._failures = {}, {}
+        return [(category, key, histogram.to_dict(), failures.get((category, key), 0))
+                for (category, key), histogram in histograms.items()]
+
+    def merge_snapshot(self, snapshot: List):
+        """合併 worker 送來的統計。"""
+        with self._lock:
+            for category, key, data, failures in snapshot:
+                name = (category, key)
+                histogram = LogHistogram.from_dict(data)
+                if name in self._histograms:
+                    self._histograms[name].merge(histogram)
+                else:
+                    self._histograms[name] = histogram
+                if failures:
+                    self._failures[name] = self._failures.get(name, 0) + failures
+
+    def rows(self, category: str = None) -> List[Dict]:
+        """彙總成表格資料，數值換算回 category 的單位。"""
+        with self._lock:
+            items = sorted(self._histograms.items())
+            failures = dict(self._failures)
+        rows = []
+        for (row_category, key), histogram in items:
+            if category is not None and row_category != category:
+                continue
+            row = {
+                'category': row_category,
+                'key': key,
+                'count': histogram.total_count,
+                'failures': failures.get((row_category, key), 0),
+                'avg': histogram.mean / 1000,
+                'min': (histogram.min_value or 0) / 1000,
+                'max': (histogram.max_value or 0) / 1000,
+            }
+            for percent in PERCENTILES:
+                row[f'p{percent:g}'] = histogram.percentile(percent) / 1000
+            rows.append(row)
+        return rows
+
+    def write_csv(self, path: str):
+        rows = self.rows()
+        if not rows:
+            return
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        logger.info(f"[SideMetrics] Wrote {len(rows)} rows to {path}")
+
+
+def install_side_metrics(environment):
+    """
+    註冊 side metrics 的 Locust 事件：
+    worker 在 report_to_master 時附上資料，master 合併，結束時輸出 {csv_prefix}_side_metrics.csv。
+    """
+    if getattr(environment, '_side_metrics_installed', False):
+        return
+    environment._side_metrics_installed = True
+    metrics = SideMetrics()
+
+    @environment.events.report_to_master.add_listener
+    def _on_report_to_master(client_id, data, **kwargs):
+        snapshot = metrics.snapshot_and_reset()
+        if snapshot:
+            data['side_metrics'] = snapshot
+
+    @environment.events.worker_report.add_listener
+    def _on_worker_report(client_id, data, **kwargs):
+        if data.get('side_metrics'):
+            metrics.merge_snapshot(data['side_metrics'])
+
+    @environment.events.reset_stats.add_listener
+    def _on_reset_stats(**kwargs):
+        metrics.reset()
+
+    @environment.events.quitting.add_listener
+    def _on_quitting(environment, **kwargs):
+        if isinstance(environment.runner, WorkerRunner):
+            return
+        csv_prefix = getattr(environment.parsed_options, 'csv_prefix', None)
+        if csv_prefix:
+            directory = os.path.dirname(csv_prefix)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            metrics.write_csv(f"{csv_prefix}_side_metrics.csv")
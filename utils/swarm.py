@@ -0,0 +1,147 @@
+import heapq
+import random
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import gevent
+import numpy as np
+
+# UE 已停止（例如沒有可用的來源 IP），計時器到期時略過
+STOPPED = 255
+
+
+class UeTable:
+    """
+    虛擬 UE 的精簡狀態表：每個 UE 只佔陣列中的一列，不建立 Locust User、greenlet 或 HTTP session。
+
+    欄位：
+    - kind：UE 類型索引（對應 kinds 中的 User 類別名稱），STOPPED 表示已停止
+    - ip_index：來源 IP 在 ips 中的索引
+    - targets / target_count：目標伺服器在 hosts 中的索引（每個 UE 最多 max_targets 個）
+    - next_fire：下一次執行的時間（perf_counter 秒）
+
+    來源 IP 與目標伺服器字串在表內只保存一份（interning），UE 之間共用。
+    """
+
+    def __init__(self, kinds: Sequence[str], capacity: int, max_targets: int):
+        if len(kinds) >= STOPPED:
+            raise ValueError(f"At most {STOPPED - 1} UE kinds are supported")
+        self.kinds = list(kinds)
+        self.capacity = capacity
+        self.size = 0
+        self.kind = np.full(capacity, STOPPED, dtype=np.uint8)
+        self.ip_index = np.full(capacity, -1, dtype=np.int32)
+        self.targets = np.zeros((capacity, max(1, max_targets)), dtype=np.int32)
+        self.target_count = np.zeros(capacity, dtype=np.uint16)
+        self.next_fire = np.zeros(capacity, dtype=np.float64)
+        self.ips: List[str] = []
+        self.hosts: List[str] = []
+        self._ip_ids: Dict[str, int] = {}
+        self._host_ids: Dict[str, int] = {}
+
+    @staticmethod
+    def _intern(value: str, values: List[str], ids: Dict[str, int]) -> int:
+        index = ids.get(value)
+        if index is None:
+            index = ids[value] = len(values)
+            values.append(value)
+        return index
+
+    def add(self, kind: int, source_ip: str, targets: Sequence[str]) -> int:
+        """新增一個 UE，回傳其索引。targets 超過 max_targets 時只保留前面的部分。"""
+        if self.size >= self.capacity:
+            raise IndexError(f"UE table is full ({self.capacity} UEs)")
+        ue = self.size
+        self.size += 1
+        self.kind[ue] = kind
+        self.ip_index[ue] = self._intern(source_ip, self.ips, self._ip_ids)
+        count = min(len(targets), self.targets.shape[1])
+        for column in range(count):
+            self.targets[ue, column] = self._intern(targets[column], self.hosts, self._host_ids)
+        self.target_count[ue] = count
+        return ue
+
+    def kind_name(self, ue: int) -> str:
+        return self.kinds[self.kind[ue]]
+
+    def source_ip(self, ue: int) -> str:
+        return self.ips[self.ip_index[ue]]
+
+    def set_source_ip(self, ue: int, source_ip: str):
+        self.ip_index[ue] = self._intern(source_ip, self.ips, self._ip_ids)
+
+    def random_target(self, ue: int) -> Optional[str]:
+        """從 UE 的目標伺服器中隨機選一個，沒有目標時回傳 None。"""
+        count = self.target_count[ue]
+        if not count:
+            return None
+        return self.hosts[self.targets[ue, random.randrange(count)]]
+
+    def ues_on_ip(self, source_ip: str) -> np.ndarray:
+        """使用 source_ip 且仍在執行的 UE 索引。"""
+        ip_id = self._ip_ids.get(source_ip)
+        if ip_id is None:
+            return np.empty(0, dtype=np.int64)
+        size = self.size
+        return np.nonzero((self.ip_index[:size] == ip_id) & (self.kind[:size] != STOPPED))[0]
+
+    def running(self) -> Dict[str, int]:
+        """每種 UE 類型仍在執行的數量。"""
+        counts = np.bincount(self.kind[:self.size], minlength=len(self.kinds))
+        return {name: int(counts[index]) for index, name in enumerate(self.kinds) if counts[index]}
+
+
+class SwarmScheduler:
+    """
+    以單一 greenlet 排程大量虛擬 UE：所有 UE 的 think time 放在同一個 timer heap，
+    到期時呼叫 dispatch(ue, 排程時間)。dispatch 不應阻塞（例如交給 pool 或非同步送出），
+    動作完成後由呼叫端以 schedule() 排定下一次。
+    """
+
+    def __init__(self, table: UeTable, dispatch: Callable[[int, float], None],
+                 on_lag: Optional[Callable[[float], None]] = None, max_sleep: float = 0.05):
+        self.table = table
+        self.dispatch = dispatch
+        self.on_lag = on_lag
+        self.max_sleep = max_sleep
+        # (到期時間, UE 索引)
+        self._heap: List[Tuple[float, int]] = []
+        self.fired = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, ue: int, delay: float, now: Optional[float] = None):
+        """delay 秒後執行 UE（now 預設為目前時間）。"""
+        when = (time.perf_counter() if now is None else now) + delay
+        self.table.next_fire[ue] = when
+        heapq.heappush(self._heap, (when, ue))
+
+    def run_due(self, now: float) -> int:
+        """執行所有到期的 UE，回傳執行的數量。"""
+        heap = self._heap
+        kind = self.table.kind
+        fired = 0
+        while heap and heap[0][0] <= now:
+            when, ue = heapq.heappop(heap)
+            if kind[ue] == STOPPED:
+                continue
+            if self.on_lag is not None:
+                self.on_lag(now - when)
+            self.dispatch(ue, when)
+            fired += 1
+        self.fired += fired
+        return fired
+
+    def run(self, on_tick: Optional[Callable[[float], None]] = None):
+        """持續執行（直到 greenlet 被停止）；每次喚醒時先呼叫 on_tick(now)。"""
+        while True:
+            now = time.perf_counter()
+            if on_tick is not None:
+                on_tick(now)
+            self.run_due(now)
+            # dispatch 可能讓出 CPU，重新取得時間；最多睡 max_sleep 秒，讓 on_tick（例如逾時處理）準時執行
+            delay = self.max_sleep
+            if self._heap:
+                delay = min(delay, self._heap[0][0] - time.perf_counter())
+            gevent.sleep(max(0.0, delay))
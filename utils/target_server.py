@@ -1,10 +1,36 @@
-import json
-import os
 import random
+import bisect
+import heapq
+import math
+import itertools
 import ipaddress
+import logging
 from threading import Lock
-from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Tuple
+
+from utils.profiles import ProfileRegistry
+
+logger = logging.getLogger(__name__)
+
+
+def _host_range(subnet) -> Tuple[int, int]:
+    """
+    計算子網中可用主機的起始位址（整數）和數量，
+    規則與 ipaddress 的 hosts() 相同。
+    """
+    network = int(subnet.network_address)
+    max_prefixlen = subnet.max_prefixlen
+    if subnet.prefixlen == max_prefixlen:
+        # /32 (或 IPv6 /128)：單一主機
+        return network, 1
+    if subnet.prefixlen == max_prefixlen - 1:
+        # /31 (或 IPv6 /127)：點對點連結，兩個位址都可用
+        return network, 2
+    if subnet.version == 4:
+        # 排除網路地址和廣播地址
+        return network + 1, subnet.num_addresses - 2
+    # IPv6 只排除 Subnet-Router anycast（網路地址）
+    return network + 1, subnet.num_addresses - 1
 
 class TargetServerManager:
     """
@@ -16,6 +42,7 @@ class TargetServerManager:
     2. 根據配重進行加權隨機選擇
     3. 為每個 User 類型提供獨立的目標伺服器分配
     4. 執行緒安全的單例模式
+    5. 分散式執行時可由 set_partition() 讓每個 worker 只使用每個子網中間隔取出的一部分主機
     """
     _instance = None
     _manager_lock = Lock()
@@ -36,31 +63,37 @@ class TargetServerManager:
                 return
 
             print(f"[TargetServerManager] Initializing...")
-            base_dir = Path(__file__).parent.parent
-            self.config_file = base_dir / 'profiles' / 'target.json'
+            registry = ProfileRegistry()
+            self.config_file = registry.path_of(ProfileRegistry.TARGET_FILE)
             self.subnets = self._load_subnets()
             
             if not self.subnets:
                 raise ValueError(f"Subnet list in '{self.config_file}' is empty or not found.")
             
-            # 建立所有可用的 IP 地址池和對應的配重
-            self.ip_pools = []  # [(ip_address, weight), ...]
+            # (worker 區段索引, 區段總數)，(0, 1) 表示使用全部主機
+            self._partition = (0, 1)
+            
+            # 建立每個子網的 IP 地址池記錄和對應的配重
+            self.ip_pools = []  # [{'first_host', 'num_hosts', 'stride', 'weight', 'user_types', 'address_class'}, ...]
             self._build_ip_pools()
             
-            self._allocation_lock = Lock()
+            # 在載入時為每種 User 類型預先建立抽樣表，分配時不需要再過濾或加鎖
+            self._sampling_tables = {}
+            self._default_table = None
+            self._build_sampling_tables()
+            
+            registry.add_reload_listener(self._on_profiles_reloaded)
             self._initialized = True
             print(f"[TargetServerManager] Initialized with {len(self.subnets)} subnets, "
-                  f"total {len(self.ip_pools)} available IPs")
+                  f"total {self.total_hosts} available IPs")
 
     def _load_subnets(self) -> List[Dict]:
-        """從 JSON 設定檔中讀取子網列表。"""
-        if not os.path.exists(self.config_file):
-            print(f"[TargetServerManager] Error: Config file '{self.config_file}' not found.")
+        """從共用的設定檔註冊表中讀取子網列表。"""
+        data = ProfileRegistry().get_document(ProfileRegistry.TARGET_FILE)
+        if data is None:
             return []
         
         try:
-            with open(self.config_file, 'r') as f:
-                data = json.load(f)
             subnets = data.get("target_subnets", [])
             
             if not isinstance(subnets, list):
@@ -75,36 +108,211 @@ class TargetServerManager:
             
             return subnets
             
-        except (json.JSONDecodeError, TypeError, KeyError, ValueError) as e:
+        except (AttributeError, TypeError, KeyError, ValueError) as e:
             print(f"[TargetServerManager] Error: Invalid format in '{self.config_file}': {e}")
             return []
 
+    def _on_profiles_reloaded(self):
+        """設定檔重新載入後重建 IP 池和抽樣表，完成後才替換，分配端不會看到中間狀態。"""
+        subnets = self._load_subnets()
+        if not subnets:
+            print(f"[TargetServerManager] Warning: Reloaded subnet list is empty, keeping existing pools")
+            return
+        
+        previous = (self.subnets, self.ip_pools, self._sampling_tables, self._default_table)
+        self.subnets = subnets
+        self.ip_pools = []
+        self._build_ip_pools()
+        if not self.ip_pools:
+            self.subnets, self.ip_pools, self._sampling_tables, self._default_table = previous
+            return
+        self._build_sampling_tables()
+        print(f"[TargetServerManager] Reloaded {len(self.subnets)} subnets, "
+              f"total {self.total_hosts} available IPs")
+
+    def partition_enabled(self) -> bool:
+        """target.json 的 partition_across_workers（預設 false）決定分散式執行時是否切分目標。"""
+        data = ProfileRegistry().get_document(ProfileRegistry.TARGET_FILE) or {}
+        return bool(data.get("partition_across_workers", False))
+
+    def set_partition(self, index: int, count: int):
+        """
+        每個子網只使用主機偏移量 % count == index 的主機（以 stride / phase 表示，不展開主機列表），
+        重建 IP 池和抽樣表。主機數少於 count 的子網無法切分，仍由所有 worker 共用。
+        """
+        self._partition = (index, count)
+        pools, self.ip_pools = self.ip_pools, []
+        self._build_ip_pools()
+        if not self.ip_pools:
+            self.ip_pools = pools
+            return
+        self._build_sampling_tables()
+        print(f"[TargetServerManager] Using target partition {index + 1}/{count}: "
+              f"{self.total_hosts} available IPs")
+
     def _build_ip_pools(self):
-        """根據子網配置建立 IP 地址池。"""
+        """
+        根據子網配置建立 IP 地址池。
+
+        每個子網只保留一筆 (起始主機位址整數, 主機數量, 配重, 允許的 User 類型) 記錄，
+        實際的 IP 位址在抽樣時才由主機索引推算出來，
+        因此記憶體與啟動時間只與子網數量有關，而不是主機數量。
+        """
         for subnet_config in self.subnets:
             try:
                 subnet = ipaddress.ip_network(subnet_config['subnet'], strict=False)
                 weight = subnet_config['weight']
                 user_types = subnet_config.get('user_types', [])  # 獲取允許的 User 類型列表
                 
-                # 獲取子網中所有可用的主機 IP（排除網路地址和廣播地址）
+                # 可用主機範圍（排除網路地址和廣播地址）
                 # 對於 /28 子網，這會給出 14 個可用 IP
-                for ip in subnet.hosts():
-                    self.ip_pools.append({
-                        'ip': str(ip),
-                        'weight': weight,
-                        'user_types': user_types  # 記錄此 IP 允許分配給哪些 User 類型
-                    })
+                first_host, num_hosts = _host_range(subnet)
+                stride = 1
+                index, count = self._partition
+                if count > 1:
+                    if num_hosts >= count:
+                        # 從第 index 個主機開始，每隔 count 個取一個
+                        first_host += index
+                        num_hosts = (num_hosts - index + count - 1) // count
+                        stride = count
+                    else:
+                        print(f"[TargetServerManager] Warning: subnet {subnet_config['subnet']} has fewer "
+                              f"hosts than workers, sharing it across workers")
+                self.ip_pools.append({
+                    'first_host': first_host,
+                    'num_hosts': num_hosts,
+                    'stride': stride,
+                    'weight': weight,
+                    'user_types': frozenset(user_types),  # 記錄此子網允許分配給哪些 User 類型
+                    'address_class': type(subnet.network_address),
+                    # 指定 port 時回傳 host:port（例如本機替身伺服器不在 80 port）
+                    'suffix': f":{subnet_config['port']}" if subnet_config.get('port') else '',
+                })
                 
                 user_types_str = ', '.join(user_types) if user_types else '所有類型'
                 print(f"[TargetServerManager] Loaded subnet {subnet_config['subnet']} "
-                      f"with weight {weight}, {subnet.num_addresses - 2} hosts, "
+                      f"with weight {weight}, {num_hosts} hosts, "
                       f"for user types: {user_types_str}")
                       
             except (ValueError, KeyError) as e:
                 print(f"[TargetServerManager] Error processing subnet {subnet_config.get('subnet', 'unknown')}: {e}")
                 continue
 
+    @property
+    def total_hosts(self) -> int:
+        """所有子網的可用主機總數。"""
+        return sum(pool['num_hosts'] for pool in self.ip_pools)
+
+    def _available_pools(self, user_class_name: str) -> List[Dict]:
+        """過濾出允許此 User 類型使用的子網。"""
+        available_pools = []
+        for pool in self.ip_pools:
+            user_types = pool['user_types']
+            # 如果 user_types 為空，表示可用於所有類型；否則檢查是否在允許列表中
+            if not user_types or user_class_name in user_types:
+                available_pools.append(pool)
+        return available_pools
+
+    @staticmethod
+    def _make_sampling_table(pools: List[Dict]) -> Dict:
+        """
+        為一組子網建立抽樣表。
+
+        每個主機的配重為其子網的 weight，因此子網被選中的機率與 weight * 主機數成正比。
+        """
+        return {
+            'pools': tuple(pools),
+            'cum_weights': tuple(itertools.accumulate(
+                pool['weight'] * pool['num_hosts'] for pool in pools)),
+            'total_hosts': sum(pool['num_hosts'] for pool in pools),
+        }
+
+    def _build_sampling_tables(self):
+        """為設定檔中出現的每種 User 類型，以及未列出的類型，預先建立抽樣表。"""
+        user_types = set()
+        for pool in self.ip_pools:
+            user_types.update(pool['user_types'])
+        
+        tables = {}
+        for user_type in user_types:
+            pools = self._available_pools(user_type)
+            if pools:
+                tables[user_type] = self._make_sampling_table(pools)
+        
+        # 未列在任何 user_types 中的 User 類型只能使用不限類型的子網
+        default_pools = [pool for pool in self.ip_pools if not pool['user_types']]
+        default_table = self._make_sampling_table(default_pools) if default_pools else None
+        self._sampling_tables, self._default_table = tables, default_table
+
+    def _get_sampling_table(self, user_class_name: str):
+        """取得 User 類型的抽樣表，沒有可用子網時回傳 None。"""
+        return self._sampling_tables.get(user_class_name, self._default_table)
+
+    @staticmethod
+    def _pick_host(table: Dict) -> Tuple[Dict, int]:
+        """
+        依照累積配重選出一個子網，再隨機選出子網內的主機偏移量。
+
+        Returns:
+            (子網記錄, 主機偏移量)
+        """
+        cum_weights = table['cum_weights']
+        pool_idx = bisect.bisect(cum_weights, random.random() * cum_weights[-1])
+        # 浮點誤差保護
+        pool = table['pools'][min(pool_idx, len(cum_weights) - 1)]
+        return pool, random.randrange(pool['num_hosts'])
+
+    @staticmethod
+    def _sample_without_replacement(table: Dict, count: int) -> List[Tuple[Dict, int]]:
+        """
+        精確的加權不重複抽樣（Efraimidis–Spirakis）。
+
+        每個主機的 key 為 u ** (1 / weight)，取 key 最大的 count 個主機。
+        同一子網內的主機配重相同，因此子網內 key 的遞減序列就是 n 個均勻分佈的
+        順序統計量：U(1) = V ** (1/n)，U(k+1) = U(k) * V ** (1/(n-k))，可以逐一產生。
+        以 heap 合併各子網的序列，總成本為 O(子網數 + count * log 子網數)，
+        不需要重試，也不會展開整個子網。
+        被選中的子網再以稀疏 Fisher–Yates 洗牌取出不重複的主機偏移量。
+
+        Returns:
+            [(子網記錄, 主機偏移量), ...]，順序與依序加權抽樣相同
+        """
+        pools = table['pools']
+        # heap 項目：(-log key, 子網索引, log U(k))，以對數計算避免浮點下溢
+        heap = []
+        for pool_idx, pool in enumerate(pools):
+            log_u = math.log(1.0 - random.random()) / pool['num_hosts']
+            heap.append((-log_u / pool['weight'], pool_idx, log_u))
+        heapq.heapify(heap)
+        
+        drawn = [0] * len(pools)
+        swaps = [{} for _ in pools]
+        selected = []
+        while len(selected) < count:
+            _, pool_idx, log_u = heapq.heappop(heap)
+            pool = pools[pool_idx]
+            num_hosts = pool['num_hosts']
+            
+            # 稀疏 Fisher–Yates：在尚未抽出的主機中均勻選一個
+            j = drawn[pool_idx]
+            pool_swaps = swaps[pool_idx]
+            r = random.randrange(j, num_hosts)
+            selected.append((pool, pool_swaps.get(r, r)))
+            pool_swaps[r] = pool_swaps.get(j, j)
+            drawn[pool_idx] = j + 1
+            
+            remaining = num_hosts - drawn[pool_idx]
+            if remaining > 0:
+                log_u += math.log(1.0 - random.random()) / remaining
+                heapq.heappush(heap, (-log_u / pool['weight'], pool_idx, log_u))
+        
+        return selected
+
+    @staticmethod
+    def _host_address(pool: Dict, offset: int) -> str:
+        """由子網記錄和主機偏移量推算出 IP 位址字串。"""
+        return str(pool['address_class'](pool['first_host'] + offset * pool['stride'])) + pool.get('suffix', '')
+
     def get_target_servers(self, user_class_name: str, count: int) -> List[str]:
         """
         為指定的 User 類型分配目標伺服器列表。
@@ -120,54 +328,33 @@ class TargetServerManager:
             return []
         
         if not self.ip_pools:
-            print(f"[TargetServerManager] Warning: No IPs available for {user_class_name}")
+            logger.warning("[TargetServerManager] No IPs available for %s", user_class_name)
             return []
         
-        with self._allocation_lock:
-            # 過濾出允許此 User 類型使用的 IP
-            available_ips = []
-            for ip_info in self.ip_pools:
-                user_types = ip_info['user_types']
-                # 如果 user_types 為空，表示可用於所有類型；否則檢查是否在允許列表中
-                if not user_types or user_class_name in user_types:
-                    available_ips.append(ip_info)
-            
-            if not available_ips:
-                print(f"[TargetServerManager] Warning: No IPs available for user type {user_class_name}")
-                return []
-            
-            # 使用加權隨機選擇
-            # 如果請求的數量超過可用 IP 數量，則允許重複
-            selected_ips = []
-            
-            # 準備加權選擇的數據
-            ips = [ip_info['ip'] for ip_info in available_ips]
-            weights = [ip_info['weight'] for ip_info in available_ips]
-            
-            # 如果請求數量小於等於可用 IP 數量，嘗試不重複選擇
-            if count <= len(ips):
-                # 使用加權隨機選擇，不重複
-                selected_ips = random.choices(ips, weights=weights, k=count)
-                # 移除重複（如果有的話）並補充
-                selected_ips = list(dict.fromkeys(selected_ips))
-                while len(selected_ips) < count:
-                    additional = random.choices(ips, weights=weights, k=count - len(selected_ips))
-                    selected_ips.extend(additional)
-                    selected_ips = list(dict.fromkeys(selected_ips))
-                selected_ips = selected_ips[:count]
-            else:
-                # 如果請求數量超過可用 IP，允許重複
-                selected_ips = random.choices(ips, weights=weights, k=count)
-            
-            print(f"[TargetServerManager] Allocated {len(selected_ips)} target servers "
-                  f"for {user_class_name}: {selected_ips}")
-            
-            return selected_ips
+        table = self._get_sampling_table(user_class_name)
+        if table is None:
+            logger.warning("[TargetServerManager] No IPs available for user type %s", user_class_name)
+            return []
+        
+        # 使用加權隨機選擇
+        # 如果請求的數量超過可用 IP 數量，則允許重複
+        if count <= table['total_hosts']:
+            selected = self._sample_without_replacement(table, count)
+        else:
+            selected = [self._pick_host(table) for _ in range(count)]
+        
+        selected_ips = [self._host_address(pool, offset) for pool, offset in selected]
+        
+        # 每個 User 建立時都會呼叫，完整列表只在 DEBUG 時格式化
+        logger.debug("[TargetServerManager] Allocated %d target servers for %s: %s",
+                     len(selected_ips), user_class_name, selected_ips)
+        
+        return selected_ips
 
     def get_random_target_server(self, user_class_name: str) -> str:
         """
         為指定的 User 類型隨機返回一個目標伺服器。
-        適用於動態選擇場景。
+        適用於動態選擇場景：抽樣表已預先建立，每次呼叫只需 O(log 子網數) 且不需加鎖。
         
         Args:
             user_class_name: User 類別名稱（用於日誌記錄）
@@ -175,28 +362,12 @@ class TargetServerManager:
         Returns:
             單個目標伺服器 IP 地址
         """
-        if not self.ip_pools:
-            print(f"[TargetServerManager] Warning: No IPs available for {user_class_name}")
+        table = self._get_sampling_table(user_class_name)
+        if table is None:
+            logger.warning("[TargetServerManager] No IPs available for user type %s", user_class_name)
             return ""
         
-        with self._allocation_lock:
-            # 過濾出允許此 User 類型使用的 IP
-            available_ips = []
-            for ip_info in self.ip_pools:
-                user_types = ip_info['user_types']
-                # 如果 user_types 為空，表示可用於所有類型；否則檢查是否在允許列表中
-                if not user_types or user_class_name in user_types:
-                    available_ips.append(ip_info)
-            
-            if not available_ips:
-                print(f"[TargetServerManager] Warning: No IPs available for user type {user_class_name}")
-                return ""
-            
-            ips = [ip_info['ip'] for ip_info in available_ips]
-            weights = [ip_info['weight'] for ip_info in available_ips]
-            selected_ip = random.choices(ips, weights=weights, k=1)[0]
-            
-            return selected_ip
+        return self._host_address(*self._pick_host(table))
 
 
 # 導出便利函數
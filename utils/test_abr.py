@@ -0,0 +1,115 @@
+"""
+AbrPlayer 單元測試
+
+執行方式：python -m pytest utils/test_abr.py -v
+或：python -m unittest utils/test_abr.py
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.abr import AbrPlayer, DEFAULT_RENDITIONS
+
+
+LADDER = [
+    {'name': '720p', 'bandwidth': 5_000_000},
+    {'name': '360p', 'bandwidth': 1_000_000},
+    {'name': '1080p', 'bandwidth': 8_000_000},
+]
+
+
+class TestAbrPlayer(unittest.TestCase):
+    """AbrPlayer 單元測試類別"""
+
+    def test_01_invalid_arguments(self):
+        """測試空的畫質階梯與未知的 policy"""
+        with self.assertRaises(ValueError):
+            AbrPlayer([])
+        with self.assertRaises(ValueError):
+            AbrPlayer(DEFAULT_RENDITIONS, policy='unknown')
+
+    def test_02_throughput_rule(self):
+        """測試 throughput 規則：從最低畫質開始，依估計速率與 safety 選擇"""
+        player = AbrPlayer(LADDER, safety=0.8)
+        self.assertEqual([r['name'] for r in player.renditions], ['360p', '720p', '1080p'])
+        player.choose_rendition()
+        self.assertEqual(player.rendition['name'], '360p')
+
+        # 7 Mbit/s * 0.8 = 5.6 Mbit/s → 720p
+        player.on_segment_downloaded(4.0, 7_000_000 // 8, 1.0)
+        previous = player.choose_rendition()
+        self.assertEqual(previous, 0)
+        self.assertEqual(player.rendition['name'], '720p')
+        self.assertEqual(player.switch_count, 1)
+
+    def test_03_bba_rule(self):
+        """測試 BBA 規則：reservoir 內最低畫質，超過 reservoir + cushion 最高畫質"""
+        player = AbrPlayer(LADDER, policy='bba', reservoir=5, cushion=10)
+        player.buffer_level = 3
+        player.choose_rendition()
+        self.assertEqual(player.rendition['name'], '360p')
+        player.buffer_level = 10   # 線性對應到 4.5 Mbit/s
+        player.choose_rendition()
+        self.assertEqual(player.rendition['name'], '360p')
+        player.buffer_level = 12   # 5.9 Mbit/s
+        player.choose_rendition()
+        self.assertEqual(player.rendition['name'], '720p')
+        player.buffer_level = 16
+        player.choose_rendition()
+        self.assertEqual(player.rendition['name'], '1080p')
+
+    def test_04_startup_and_rebuffer(self):
+        """測試 startup 前不消耗 buffer，下載時間超過 buffer 即為卡頓"""
+        player = AbrPlayer(LADDER, startup_buffer=4)
+        self.assertEqual(player.on_segment_downloaded(2.0, 1000, 5.0), 0.0)
+        self.assertFalse(player.playing)
+        self.assertEqual(player.on_segment_downloaded(2.0, 1000, 1.0), 0.0)
+        self.assertTrue(player.playing)
+        self.assertEqual(player.buffer_level, 4.0)
+
+        stall = player.on_segment_downloaded(2.0, 1000, 6.5)
+        self.assertAlmostEqual(stall, 2.5)
+        self.assertEqual(player.rebuffer_count, 1)
+        self.assertFalse(player.playing)
+
+    def test_05_buffer_paced_requests(self):
+        """測試 buffer 放不下下一個 segment 時才等待，且等待期間 buffer 會消耗"""
+        player = AbrPlayer(LADDER, startup_buffer=4, max_buffer=10)
+        player.on_segment_downloaded(4.0, 1000, 0.1)
+        self.assertEqual(player.delay_before_next_request(4.0), 0.0)
+        player.on_segment_downloaded(4.0, 1000, 0.1)   # buffer 7.9
+        delay = player.delay_before_next_request(4.0)
+        self.assertAlmostEqual(delay, 1.9)
+        self.assertAlmostEqual(player.buffer_level, 6.0)
+
+    def test_06_failed_segment_is_a_stall(self):
+        """測試失敗的 segment 不增加 buffer、不更新下載速率，記為卡頓並重新累積 startup buffer"""
+        player = AbrPlayer(LADDER, startup_buffer=4)
+        player.on_segment_downloaded(4.0, 7_000_000 // 8, 1.0)
+        throughput = player.throughput
+        self.assertTrue(player.playing)
+
+        # 404 很快回來：buffer 只因請求期間的播放減少
+        self.assertEqual(player.on_segment_failed(0.5), 0.0)
+        self.assertEqual(player.buffer_level, 3.5)
+        self.assertEqual(player.throughput, throughput)
+        self.assertEqual(player.rebuffer_count, 1)
+        self.assertFalse(player.playing)
+
+        # 重新累積到 startup buffer 才繼續播放
+        player.on_segment_downloaded(4.0, 7_000_000 // 8, 1.0)
+        self.assertTrue(player.playing)
+        # 連線錯誤拖到 buffer 用完：卡頓時間計入
+        self.assertAlmostEqual(player.on_segment_failed(10.0), 2.5)
+        self.assertEqual(player.buffer_level, 0.0)
+        self.assertEqual(player.rebuffer_count, 2)
+        self.assertAlmostEqual(player.rebuffer_time, 2.5)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
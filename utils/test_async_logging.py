@@ -0,0 +1,121 @@
+"""
+非同步批次日誌與 User 生命週期計數單元測試
+
+執行方式：python -m pytest utils/test_async_logging.py -v
+或：python -m unittest utils/test_async_logging.py
+"""
+
+import io
+import logging
+import sys
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.async_logging import (BatchingQueueHandler, BatchWriter, LifecycleCounters, RateLimitFilter,
+                                 install_async_logging, record_lifecycle)
+
+from locust.event import Events
+
+
+class CountingStream(io.StringIO):
+    """記錄 write() 被呼叫次數的串流"""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        return super().write(text)
+
+
+class Lazy:
+    """被格式化時計數的參數"""
+
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return "lazy"
+
+
+def make_logger(name):
+    target = logging.StreamHandler(CountingStream())
+    target.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+    log = logging.getLogger(name)
+    log.handlers = [target]
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    return log, target
+
+
+class TestAsyncLogging(unittest.TestCase):
+    """RateLimitFilter / BatchingQueueHandler / BatchWriter 單元測試類別"""
+
+    def test_01_rate_limit_per_template(self):
+        """測試同一個訊息樣板超過上限後被省略並計數，其他樣板不受影響"""
+        rate_filter = RateLimitFilter(limit=3, window=60)
+        record = lambda msg, arg: logging.LogRecord('app', logging.INFO, __file__, 0, msg, (arg,), None)
+        passed = [rate_filter.filter(record("user %d started", i)) for i in range(10)]
+        self.assertEqual(passed.count(True), 3)
+        self.assertTrue(rate_filter.filter(record("other %d", 1)))
+        self.assertEqual(rate_filter.take_suppressed(), [('app', "user %d started", 7)])
+        self.assertEqual(rate_filter.take_suppressed(), [])
+
+    def test_02_lazy_formatting_and_batched_write(self):
+        """測試記錄在呼叫端不格式化，寫出時每個串流只 write 一次"""
+        log, target = make_logger('test_async_logging.batch')
+        queue_handler = BatchingQueueHandler()
+        writer = BatchWriter(queue_handler, [target])
+        log.handlers = [queue_handler]
+
+        lazy = Lazy()
+        for i in range(50):
+            log.info("segment %d from %s", i, lazy)
+        self.assertEqual(lazy.formatted, 0)
+        self.assertEqual(writer.flush(), 50)
+        self.assertEqual(lazy.formatted, 50)
+        self.assertEqual(target.stream.writes, 1)
+        self.assertEqual(target.stream.getvalue().splitlines()[-1], "INFO segment 49 from lazy")
+
+    def test_03_install_and_quit(self):
+        """測試安裝後經由佇列輸出、被省略的筆數有摘要，結束時換回原本的 handler"""
+        log, target = make_logger('test_async_logging.install')
+        events = Events()
+        environment = SimpleNamespace(events=events)
+        writer = install_async_logging(environment, root=log)
+        self.assertIsInstance(log.handlers[0], BatchingQueueHandler)
+        self.assertIsNone(install_async_logging(environment, root=log))
+
+        for i in range(30):
+            log.warning("no source IP for user %d", i)
+        events.quitting.fire(environment=environment)
+        self.assertEqual(log.handlers, [target])
+        self.assertTrue(writer.stopped)
+        lines = target.stream.getvalue().splitlines()
+        self.assertEqual(len([line for line in lines if line.startswith("WARNING no source IP")]), 20)
+        self.assertIn("INFO [AsyncLogging] Suppressed 10 messages like: no source IP for user %d", lines)
+
+    def test_04_lifecycle_counters(self):
+        """測試生命週期事件依 User 類別彙總，取出後歸零"""
+        LifecycleCounters._instance = None
+        for _ in range(3):
+            record_lifecycle("SocialUser", "started")
+        record_lifecycle("SocialUser", "stopped")
+        record_lifecycle("DnsLoad", "no_source_ip")
+        self.assertEqual(LifecycleCounters().take(), {
+            "DnsLoad": {"no_source_ip": 1},
+            "SocialUser": {"started": 3, "stopped": 1},
+        })
+        self.assertEqual(LifecycleCounters().take(), {})
+        LifecycleCounters._instance = None
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
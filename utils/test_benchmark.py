@@ -0,0 +1,137 @@
+"""
+benchmark 替身伺服器、量測與基準比較單元測試
+
+執行方式：python -m pytest utils/test_benchmark.py -v
+或：python -m unittest utils/test_benchmark.py
+"""
+
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import dns.message
+import gevent
+from gevent import monkey
+from gevent import socket as gsocket
+from gevent.pywsgi import WSGIServer
+from geventhttpclient import HTTPClient
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.benchmark import (LoopLagProbe, StandInDns, StandInHttpApp, compare_with_baseline, load_baseline,
+                             median_metrics, save_baseline, summarize, write_profiles)
+from utils.hls import parse_media_playlist
+
+
+class TestStandInServers(unittest.TestCase):
+    """替身 HTTP / DNS 伺服器單元測試類別"""
+
+    def test_01_http_paths(self):
+        """測試 /、/feed、/react、playlist 與 segment 的回應，未知路徑為 404"""
+        server = WSGIServer(('127.0.0.1', 0), StandInHttpApp(segment_size=1000, segments=5), log=None)
+        server.start()
+        client = HTTPClient('127.0.0.1', server.server_port)
+        try:
+            self.assertEqual(client.get('/').status_code, 200)
+            feed = client.get('/feed?since=123')
+            self.assertEqual(json.loads(feed.read())['items'][0]['id'], 0)
+            self.assertEqual(client.post('/react', body=b'{"pid": 1}').status_code, 200)
+
+            playlist = client.get('/video/720p/video-3/playlist.m3u8').read()
+            segments = parse_media_playlist(playlist)
+            self.assertEqual(segments, [f'seg-{n}.ts' for n in range(15, 20)])
+            self.assertEqual(len(client.get(f'/video/720p/{segments[0]}').read()), 1000)
+            response = client.get('/missing')
+            response.read()
+            self.assertEqual(response.status_code, 404)
+        finally:
+            client.close()
+            server.stop()
+
+    def test_02_dns_responder(self):
+        """測試 DNS 替身以相同 ID 回覆 NOERROR"""
+        responder = StandInDns('127.0.0.1', 0).start()
+        try:
+            query = dns.message.make_query('example.com', 'A')
+            # 替身在同一個事件迴圈中執行，用 gevent socket 送出查詢
+            client = gsocket.socket(gsocket.AF_INET, gsocket.SOCK_DGRAM)
+            client.settimeout(2)
+            client.sendto(query.to_wire(), ('127.0.0.1', responder.port))
+            response = dns.message.from_wire(client.recv(4096))
+            client.close()
+            self.assertEqual(response.id, query.id)
+            self.assertEqual(response.rcode(), 0)
+            self.assertEqual(responder.answered, 1)
+        finally:
+            responder.stop()
+
+
+class TestMeasurement(unittest.TestCase):
+    """量測與基準比較單元測試類別"""
+
+    def test_03_loop_lag_probe(self):
+        """測試阻塞事件迴圈的時間反映在延遲的最大值"""
+        probe = LoopLagProbe(interval=0.005).start()
+        gevent.sleep(0.05)
+        monkey.get_original('time', 'sleep')(0.05)
+        gevent.sleep(0.05)
+        probe.stop()
+        self.assertGreaterEqual(probe.histogram.max_value, 40000)
+        self.assertGreater(probe.histogram.total_count, 5)
+
+    def test_04_summarize(self):
+        """測試由原始量測換算每核心請求數、每請求 CPU 與每個 User 的 RSS"""
+        raw = {'requests': 1000, 'failures': 5, 'cpu_seconds': 0.5, 'elapsed': 10.0,
+               'rss_start_kb': 50000, 'rss_end_kb': 60000, 'lag_p99_ms': 1.234, 'lag_max_ms': 9.0}
+        metrics = summarize(raw, population=100)
+        self.assertEqual(metrics['rps'], 100.0)
+        self.assertEqual(metrics['rps_per_core'], 2000.0)
+        self.assertEqual(metrics['cpu_per_request_us'], 500.0)
+        self.assertEqual(metrics['rss_per_user_kb'], 100.0)
+        self.assertEqual(metrics['failure_ratio'], 0.005)
+
+    def test_05_compare_with_baseline(self):
+        """測試超過容忍範圍的指標與過高的失敗比例視為退步，沒有基準的情境略過"""
+        baseline = {'SocialUser': {'rps_per_core': 1000, 'cpu_per_request_us': 1000,
+                                   'rss_per_user_kb': 50, 'lag_p99_ms': 1.0}}
+        ok = {'rps_per_core': 900, 'cpu_per_request_us': 1100, 'rss_per_user_kb': 60, 'lag_p99_ms': 2.5,
+              'failure_ratio': 0}
+        self.assertEqual(compare_with_baseline({'SocialUser': ok}, baseline, tolerance=0.25), [])
+        worse = dict(ok, rps_per_core=700, cpu_per_request_us=1400, failure_ratio=0.5)
+        regressions = compare_with_baseline({'SocialUser': worse, 'DnsLoad': ok}, baseline, tolerance=0.25)
+        self.assertEqual(len(regressions), 3)
+        self.assertTrue(all(line.startswith('SocialUser') for line in regressions))
+        # 延遲的絕對容忍量只有 2 ms：基準 1 ms 時上限為 3.25 ms
+        self.assertEqual(len(compare_with_baseline({'SocialUser': dict(ok, lag_p99_ms=3.5)}, baseline)), 1)
+
+    def test_07_median_of_runs(self):
+        """測試重複執行時各指標取中位數，單次的離群值不影響結果"""
+        runs = [{'cpu_per_request_us': 73.0, 'lag_p99_ms': 3.6}, {'cpu_per_request_us': 110.0, 'lag_p99_ms': 9.8},
+                {'cpu_per_request_us': 75.0, 'lag_p99_ms': 3.9}]
+        self.assertEqual(median_metrics(runs), {'cpu_per_request_us': 75.0, 'lag_p99_ms': 3.9})
+        self.assertEqual(median_metrics(runs[:2])['cpu_per_request_us'], 91.5)
+        self.assertEqual(median_metrics(runs[:1]), runs[0])
+
+    def test_06_profiles_and_baseline_file(self):
+        """測試情境設定檔指向替身伺服器，基準檔更新時保留未執行的情境"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_profiles(directory, 'SwarmUser', http_port=18080, dns_port=15353)
+            users = {entry['user_class_name']: entry for entry in json.load(open(path))}
+            self.assertEqual(users['DnsLoad']['dns_port'], 15353)
+            self.assertIn('ues', users['SwarmUser'])
+            target = json.load(open(Path(directory) / 'target.json'))
+            self.assertEqual(target['target_subnets'][0]['port'], 18080)
+
+            baseline = str(Path(directory) / 'baseline.json')
+            save_baseline(baseline, {'SocialUser': {'rps_per_core': 1}}, duration=20)
+            save_baseline(baseline, {'DnsLoad': {'rps_per_core': 2}}, duration=20)
+            self.assertEqual(set(load_baseline(baseline)), {'SocialUser', 'DnsLoad'})
+            self.assertEqual(load_baseline(str(Path(directory) / 'missing.json')), {})
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
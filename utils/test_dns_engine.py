@@ -0,0 +1,226 @@
+"""
+DnsEngine 單元測試
+
+使用本機 UDP 回應器，不需要實際的 DNS 伺服器
+執行方式：python -m pytest utils/test_dns_engine.py -v
+或：python -m unittest utils/test_dns_engine.py
+"""
+
+import socket
+import sys
+import threading
+import unittest
+from pathlib import Path
+
+import gevent
+import dns.exception
+import dns.message
+import dns.rcode
+import dns.rdatatype
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.dns_engine import DnsEngine, OpenLoopSender, TimerWheel, InFlightWindowFull
+
+
+class LocalDnsResponder:
+    """在 127.0.0.1 上執行的簡易 DNS 回應器（獨立執行緒）"""
+
+    def __init__(self, rcode=dns.rcode.NOERROR, drop_names=()):
+        self.rcode = rcode
+        self.drop_names = set(drop_names)
+        self.received = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(65535)
+            except OSError:
+                return
+            self.received += 1
+            query = dns.message.from_wire(data)
+            if query.question[0].name.to_text(omit_final_dot=True) in self.drop_names:
+                continue
+            response = dns.message.make_response(query)
+            response.set_rcode(self.rcode)
+            self.sock.sendto(response.to_wire(), addr)
+
+    def close(self):
+        self.sock.close()
+
+
+class TestDnsEngine(unittest.TestCase):
+    """DnsEngine 單元測試類別"""
+
+    def tearDown(self):
+        DnsEngine.close_all()
+
+    def test_01_engine_is_shared(self):
+        """測試相同 (來源 IP, 伺服器, port) 共用同一個引擎"""
+        responder = LocalDnsResponder()
+        try:
+            engine1 = DnsEngine.get("127.0.0.1", "127.0.0.1", responder.port)
+            engine2 = DnsEngine.get("127.0.0.1", "127.0.0.1", responder.port)
+            self.assertIs(engine1, engine2)
+        finally:
+            responder.close()
+
+    def test_02_query_returns_rcode_and_length(self):
+        """測試查詢回傳 rcode 和 datagram 長度"""
+        responder = LocalDnsResponder()
+        try:
+            engine = DnsEngine.get("127.0.0.1", "127.0.0.1", responder.port)
+            rcode, length = engine.query("example.com", dns.rdatatype.A, timeout=2)
+            self.assertEqual(rcode, dns.rcode.NOERROR)
+            query = dns.message.make_query("example.com", dns.rdatatype.A)
+            self.assertEqual(length, len(dns.message.make_response(query).to_wire()))
+        finally:
+            responder.close()
+
+    def test_03_error_rcode(self):
+        """測試非 NOERROR 的回應碼"""
+        responder = LocalDnsResponder(rcode=dns.rcode.NXDOMAIN)
+        try:
+            engine = DnsEngine.get("127.0.0.1", "127.0.0.1", responder.port)
+            rcode, _ = engine.query("missing.example", dns.rdatatype.A, timeout=2)
+            self.assertEqual(rcode, dns.rcode.NXDOMAIN)
+        finally:
+            responder.close()
+
+    def test_04_concurrent_queries_matched_by_id(self):
+        """測試多個 greenlet 同時查詢時依 ID 配對回應"""
+        responder = LocalDnsResponder()
+        try:
+            engine = DnsEngine.get("127.0.0.1", "127.0.0.1", responder.port)
+            jobs = [gevent.spawn(engine.query, f"host{i}.example.com", dns.rdatatype.A, 2)
+                    for i in range(100)]
+            gevent.joinall(jobs, raise_error=True)
+            self.assertTrue(all(job.value[0] == dns.rcode.NOERROR for job in jobs))
+            self.assertEqual(responder.received, 100)
+            self.assertEqual(len(engine._pending), 0)
+        finally:
+            responder.close()
+
+    def test_05_timeout(self):
+        """測試沒有回應時拋出 dns.exception.Timeout"""
+        responder = LocalDnsResponder(drop_names={"slow.example"})
+        try:
+            engine = DnsEngine.get("127.0.0.1", "127.0.0.1", responder.port)
+            with self.assertRaises(dns.exception.Timeout):
+                engine.query("slow.example", dns.rdatatype.A, timeout=0.2)
+            self.assertEqual(len(engine._pending), 0)
+        finally:
+            responder.close()
+
+    def test_06_wire_query_cached(self):
+        """測試查詢 wire format 只建立一次"""
+        wire1 = DnsEngine.wire_query("cache.example", dns.rdatatype.A)
+        wire2 = DnsEngine.wire_query("cache.example", dns.rdatatype.A)
+        self.assertIs(wire1, wire2)
+        self.assertEqual(wire1[:2], b"\x00\x00")
+
+
+
+class TestTimerWheel(unittest.TestCase):
+    """TimerWheel 單元測試類別"""
+
+    def test_01_expire_in_order(self):
+        """測試項目在到期後才被取出"""
+        wheel = TimerWheel(tick=0.1, horizon=1.0)
+        wheel.advance(10.0)
+        wheel.schedule(10.25, "a")
+        wheel.schedule(10.55, "b")
+        self.assertEqual(wheel.advance(10.2), [])
+        self.assertEqual(wheel.advance(10.3), ["a"])
+        self.assertEqual(wheel.advance(10.6), ["b"])
+        self.assertEqual(wheel.advance(11.0), [])
+
+    def test_02_beyond_horizon(self):
+        """測試超過一圈的項目不會提早到期"""
+        wheel = TimerWheel(tick=0.1, horizon=0.5)
+        wheel.advance(0.0)
+        wheel.schedule(2.0, "late")
+        self.assertEqual(wheel.advance(1.0), [])
+        self.assertEqual(wheel.advance(2.05), ["late"])
+
+
+class TestOpenLoopSender(unittest.TestCase):
+    """OpenLoopSender 單元測試類別"""
+
+    def tearDown(self):
+        DnsEngine.close_all()
+
+    def _run_sender(self, responder, duration, **kwargs):
+        results = []
+        engine = DnsEngine.get("127.0.0.1", "127.0.0.1", responder.port)
+        sender = OpenLoopSender.acquire(
+            engine,
+            pick_query=lambda: ("example.com", dns.rdatatype.A, "A"),
+            on_result=lambda *args: results.append(args),
+            **kwargs,
+        )
+        gevent.sleep(duration)
+        sender.release()
+        return results
+
+    def test_01_rate_and_responses(self):
+        """測試依設定速率送出並回報回應"""
+        responder = LocalDnsResponder()
+        try:
+            results = self._run_sender(responder, 0.5, rate=200, timeout=1)
+        finally:
+            responder.close()
+        self.assertGreater(len(results), 70)
+        self.assertLess(len(results), 130)
+        # release() 時尚未回應的少數查詢會以逾時回報
+        succeeded = sum(exception is None for *_, exception in results)
+        self.assertGreater(succeeded, len(results) - 5)
+
+    def test_02_rate_holds_when_server_stalls(self):
+        """測試伺服器不回應時，送出速率不下降，且以逾時回報"""
+        responder = LocalDnsResponder(drop_names={"example.com"})
+        try:
+            results = self._run_sender(responder, 0.5, rate=200, timeout=0.2)
+        finally:
+            responder.close()
+        self.assertGreater(responder.received, 70)
+        self.assertGreater(len(results), 70)
+        self.assertTrue(all(isinstance(exception, dns.exception.Timeout) for *_, exception in results))
+
+    def test_03_in_flight_window(self):
+        """測試等待中的查詢達到上限時回報 InFlightWindowFull"""
+        responder = LocalDnsResponder(drop_names={"example.com"})
+        try:
+            results = self._run_sender(responder, 0.3, rate=200, timeout=5, max_in_flight=10)
+        finally:
+            responder.close()
+        self.assertEqual(responder.received, 10)
+        self.assertTrue(any(isinstance(exception, InFlightWindowFull) for *_, exception in results))
+
+    def test_04_shared_per_engine(self):
+        """測試同一個引擎上的 User 共用產生器"""
+        responder = LocalDnsResponder()
+        try:
+            engine = DnsEngine.get("127.0.0.1", "127.0.0.1", responder.port)
+            kwargs = dict(rate=10, pick_query=lambda: ("example.com", dns.rdatatype.A, "A"),
+                          on_result=lambda *args: None)
+            sender1 = OpenLoopSender.acquire(engine, **kwargs)
+            sender2 = OpenLoopSender.acquire(engine, **kwargs)
+            self.assertIs(sender1, sender2)
+            sender1.release()
+            self.assertIs(OpenLoopSender._senders.get(engine), sender2)
+            sender2.release()
+            self.assertNotIn(engine, OpenLoopSender._senders)
+        finally:
+            responder.close()
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,156 @@
+"""
+FastHttpSession 來源 IP 綁定單元測試
+
+使用本機 HTTP 伺服器，依用戶端的來源位址與 port 判斷綁定與連線重用
+執行方式：python -m pytest utils/test_fast_http.py -v
+或：python -m unittest utils/test_fast_http.py
+"""
+
+import http.server
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+# 先載入 utils（會載入 locust 並做 gevent monkey patch）
+from utils.fast_http import SourceBoundClientPool
+from utils.http_pool import ConnectionPolicy, SourceIpPools
+from utils.ip_health import classify_failure
+
+from locust.contrib.fasthttp import FastHttpSession
+from locust.event import Events
+
+
+# 本機沒有的位址，綁定時會失敗（EADDRNOTAVAIL）
+UNASSIGNED_IP = "192.0.2.77"
+
+
+class AddressRecordingHandler(http.server.BaseHTTPRequestHandler):
+    """回應 200，並記錄每個請求的用戶端位址"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.addresses.append(self.client_address)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+
+class TestFastHttpSourceBinding(unittest.TestCase):
+    """SourceBoundClientPool 與 ConnectionPolicy（FastHttpSession）單元測試類別"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), AddressRecordingHandler)
+        cls.server.daemon_threads = True
+        cls.server.addresses = []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.addresses.clear()
+        self.events = []
+
+    def tearDown(self):
+        SourceIpPools().close_all()
+
+    def _session(self):
+        request_event = Events().request
+        request_event.add_listener(lambda **kwargs: self.events.append(kwargs))
+        return FastHttpSession(self.url, request_event=request_event, user=None)
+
+    def _get(self, session, times=1, path="/"):
+        for _ in range(times):
+            self.assertEqual(session.get(path).status_code, 200)
+
+    @property
+    def ports(self):
+        return [port for _, port in self.server.addresses]
+
+    def test_01_binds_source_address(self):
+        """測試連線從指定的來源 IP 建立（127.0.0.0/8 都是本機位址）"""
+        session = self._session()
+        ConnectionPolicy().mount(session, '127.0.0.2')
+        self._get(session, 2)
+        self.assertEqual({host for host, _ in self.server.addresses}, {'127.0.0.2'})
+        self.assertEqual(len(set(self.ports)), 1)
+
+    def test_02_unassigned_source_ip(self):
+        """測試綁定本機沒有的來源 IP 時請求失敗，且被判斷為 bind 失敗"""
+        session = self._session()
+        ConnectionPolicy().mount(session, UNASSIGNED_IP)
+        session.get("/")
+        self.assertEqual(self.server.addresses, [])
+        self.assertEqual(classify_failure(self.events[-1]['exception']), "bind")
+
+    def test_03_shared_and_per_session(self):
+        """測試 shared 模式共用連線池，per_session 模式在 session 結束時關閉連線"""
+        shared = ConnectionPolicy({'mode': 'shared', 'max_per_host': 1})
+        sessions = [self._session() for _ in range(3)]
+        pools = {id(shared.mount(session, '127.0.0.1')) for session in sessions}
+        self.assertEqual(len(pools), 1)
+        for session in sessions:
+            self._get(session)
+        self.assertEqual(len(set(self.ports)), 1)
+
+        self.server.addresses.clear()
+        policy = ConnectionPolicy({'mode': 'per_session'})
+        session = self._session()
+        policy.mount(session, '127.0.0.1')
+        self._get(session, 2)
+        policy.end_session(session)
+        self._get(session)
+        ports = self.ports
+        self.assertEqual(ports[0], ports[1])
+        self.assertNotEqual(ports[1], ports[2])
+
+    def test_04_remount_closes_own_pool(self):
+        """測試改綁來源 IP 時換成新 IP 的連線池，並關閉舊的連線池"""
+        session = self._session()
+        policy = ConnectionPolicy()
+        old_pool = policy.mount(session, '127.0.0.1')
+        self._get(session)
+        new_pool = policy.mount(session, '127.0.0.3')
+        self.assertIsNot(old_pool, new_pool)
+        self.assertEqual(old_pool.clients, {})
+        self._get(session)
+        self.assertEqual([host for host, _ in self.server.addresses], ['127.0.0.1', '127.0.0.3'])
+
+    def test_05_max_hosts_and_idle_eviction(self):
+        """測試目標主機數超過 max_hosts 時移除最久未使用的，以及閒置連線的關閉"""
+        pool = SourceBoundClientPool('127.0.0.1', max_hosts=2)
+        first = pool.get_client("http://a.example/")
+        pool.get_client("http://b.example/")
+        pool.get_client("http://a.example/")
+        pool.get_client("http://c.example/")
+        self.assertEqual(sorted(host for host, _ in pool.clients), ['a.example', 'c.example'])
+        self.assertIs(pool.get_client("http://a.example/"), first)
+
+        session = self._session()
+        pool = ConnectionPolicy({'idle_timeout': 0.01}).mount(session, '127.0.0.1')
+        self._get(session)
+        time.sleep(0.02)
+        # 背景清理的 greenlet 可能已在 sleep 期間關閉連線
+        SourceIpPools().evict_idle()
+        idle = [sock for client in pool.clients.values() for sock in client._connection_pool._socket_queue.queue]
+        self.assertTrue(idle and all(sock.fileno() < 0 for sock in idle))
+        self._get(session)
+        self.assertEqual(len(set(self.ports)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
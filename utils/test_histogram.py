@@ -0,0 +1,112 @@
+"""
+LogHistogram / SideMetrics 單元測試
+
+執行方式：python -m pytest utils/test_histogram.py -v
+或：python -m unittest utils/test_histogram.py
+"""
+
+import random
+import sys
+import unittest
+from pathlib import Path
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.histogram import LogHistogram
+from utils.side_metrics import SideMetrics
+
+
+class TestLogHistogram(unittest.TestCase):
+    """LogHistogram 單元測試類別"""
+
+    def test_01_bucket_bounds_contain_value(self):
+        """測試每個數值都落在其桶的範圍內"""
+        histogram = LogHistogram(precision_bits=5)
+        for value in list(range(0, 2000)) + [10 ** 6, 10 ** 9, 2 ** 40 + 12345]:
+            lower, upper = histogram.bucket_bounds(histogram.bucket_index(value))
+            self.assertLessEqual(lower, value)
+            self.assertGreaterEqual(upper, value)
+
+    def test_02_relative_error(self):
+        """測試百分位數的相對誤差在精度範圍內"""
+        histogram = LogHistogram(precision_bits=6)
+        values = sorted(random.randint(1, 10 ** 7) for _ in range(10000))
+        for value in values:
+            histogram.record(value)
+        for percent in (50, 90, 99):
+            exact = values[round(len(values) * percent / 100) - 1]
+            self.assertLessEqual(abs(histogram.percentile(percent) - exact) / exact, 2 ** -5)
+        self.assertEqual(histogram.percentile(100), values[-1])
+        self.assertEqual(histogram.min_value, values[0])
+
+    def test_03_memory_bounded_by_range(self):
+        """測試桶數量只與數值範圍有關"""
+        histogram = LogHistogram(precision_bits=6)
+        for _ in range(100000):
+            histogram.record(random.randint(1, 10 ** 6))
+        self.assertLess(len(histogram.counts), 700)
+        self.assertEqual(histogram.total_count, 100000)
+
+    def test_04_merge_and_serialize(self):
+        """測試合併與序列化後的結果一致"""
+        a, b, combined = LogHistogram(), LogHistogram(), LogHistogram()
+        for value in range(1, 500):
+            a.record(value)
+            combined.record(value)
+        for value in range(1000, 5000, 7):
+            b.record(value)
+            combined.record(value)
+        merged = LogHistogram.from_dict(a.to_dict())
+        merged.merge(LogHistogram.from_dict(b.to_dict()))
+        self.assertEqual(merged.counts, combined.counts)
+        self.assertEqual(merged.total_count, combined.total_count)
+        self.assertEqual(merged.percentile(99), combined.percentile(99))
+        self.assertEqual(merged.max_value, 4997)
+
+    def test_05_record_many_matches_record(self):
+        """測試批次記錄與逐一記錄的桶、總和與最小最大值相同"""
+        values = [random.randint(0, 10 ** 7) for _ in range(5000)] + [0, 31, 32, 63, 64, 2 ** 40 + 12345]
+        for precision_bits in (2, 5, 6):
+            one, many = LogHistogram(precision_bits), LogHistogram(precision_bits)
+            for value in values:
+                one.record(value)
+            many.record_many(values[:100])
+            many.record_many(values[100:])
+            many.record_many([])
+            self.assertEqual(many.counts, one.counts)
+            self.assertEqual((many.total_count, many.total_sum, many.min_value, many.max_value),
+                             (one.total_count, one.total_sum, one.min_value, one.max_value))
+
+
+class TestSideMetrics(unittest.TestCase):
+    """SideMetrics 單元測試類別"""
+
+    def setUp(self):
+        SideMetrics._instance = None
+        self.metrics = SideMetrics()
+
+    def tearDown(self):
+        SideMetrics._instance = None
+
+    def test_01_worker_to_master_merge(self):
+        """測試 worker 的快照可以在 master 合併"""
+        self.metrics.record("dns_domain", "A:google.com@10.0.0.1", 12.5)
+        self.metrics.record("dns_domain", "A:google.com@10.0.0.1", 30.0, failed=True)
+        snapshot = self.metrics.snapshot_and_reset()
+        self.assertEqual(self.metrics.rows(), [])
+
+        SideMetrics._instance = None
+        master = SideMetrics()
+        master.merge_snapshot(snapshot)
+        master.merge_snapshot(snapshot)
+        rows = master.rows("dns_domain")
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['count'], 4)
+        self.assertEqual(rows[0]['failures'], 2)
+        self.assertAlmostEqual(rows[0]['max'], 30.0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
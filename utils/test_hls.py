@@ -0,0 +1,113 @@
+"""
+HLS playlist 解析與 PlaylistCache 單元測試
+
+執行方式：python -m pytest utils/test_hls.py -v
+或：python -m unittest utils/test_hls.py
+"""
+
+import sys
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.hls import PlaylistCache, parse_master_playlist, parse_media_playlist, parse_segment_durations
+
+
+SAMPLE_PLAYLIST = b"""#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-TARGETDURATION:4
+#EXTINF:4.000,
+../../seg-734.ts
+#EXTINF:4.000,
+../../seg-735.ts
+
+#EXTINF:3.200,
+seg-736.ts
+#EXT-X-ENDLIST
+"""
+
+SAMPLE_MASTER = b"""#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=5000000,RESOLUTION=1280x720,CODECS="avc1.4d401f,mp4a.40.2"
+720p/video-1/playlist.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=1000000,RESOLUTION=640x360
+360p/video-1/playlist.m3u8
+"""
+
+
+class TestParseMediaPlaylist(unittest.TestCase):
+    """parse_media_playlist 單元測試類別"""
+
+    def test_01_bytes_and_text(self):
+        """測試 bytes 與文字內容的解析結果相同"""
+        expected = ["seg-734.ts", "seg-735.ts", "seg-736.ts"]
+        self.assertEqual(parse_media_playlist(SAMPLE_PLAYLIST), expected)
+        self.assertEqual(parse_media_playlist(SAMPLE_PLAYLIST.decode()), expected)
+
+    def test_02_crlf(self):
+        """測試 CRLF 換行"""
+        self.assertEqual(parse_media_playlist(b"#EXTM3U\r\n../../seg-1.ts\r\n"), ["seg-1.ts"])
+
+    def test_03_segment_durations(self):
+        """測試 #EXTINF 秒數與 segment 一一對應"""
+        self.assertEqual(parse_segment_durations(SAMPLE_PLAYLIST), [4.0, 4.0, 3.2])
+
+    def test_04_master_playlist(self):
+        """測試 master playlist 的 variant 依頻寬排序，引號內的逗號不影響解析"""
+        variants = parse_master_playlist(SAMPLE_MASTER)
+        self.assertEqual([v['bandwidth'] for v in variants], [1000000, 5000000])
+        self.assertEqual(variants[0]['uri'], "360p/video-1/playlist.m3u8")
+        self.assertEqual(variants[1]['resolution'], "1280x720")
+
+
+class TestPlaylistCache(unittest.TestCase):
+    """PlaylistCache 單元測試類別"""
+
+    def setUp(self):
+        PlaylistCache._instance = None
+        self.cache = PlaylistCache(max_entries=2, ttl=60)
+
+    def tearDown(self):
+        PlaylistCache._instance = None
+
+    def test_01_shared_instance(self):
+        """測試所有 User 共用同一個快取"""
+        self.assertIs(PlaylistCache(), self.cache)
+
+    def test_02_put_and_get(self):
+        """測試保存原始 bytes 與解析後的 segment"""
+        self.cache.put("/video/720p/video-1/playlist.m3u8", SAMPLE_PLAYLIST, etag='"abc"')
+        entry = self.cache.get("/video/720p/video-1/playlist.m3u8")
+        self.assertEqual(entry['raw'], SAMPLE_PLAYLIST)
+        self.assertEqual(len(entry['segments']), 3)
+        self.assertTrue(self.cache.is_fresh(entry))
+        self.assertEqual(PlaylistCache.conditional_headers(entry), {'If-None-Match': '"abc"'})
+
+    def test_03_lru_eviction(self):
+        """測試超過容量時淘汰最久未使用的項目"""
+        self.cache.put("a", SAMPLE_PLAYLIST)
+        self.cache.put("b", SAMPLE_PLAYLIST)
+        self.cache.get("a")
+        self.cache.put("c", SAMPLE_PLAYLIST)
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("c"))
+
+    def test_04_ttl_and_touch(self):
+        """測試 TTL 過期與重新驗證後更新"""
+        with patch('utils.hls.time.monotonic', return_value=1000.0):
+            self.cache.put("a", SAMPLE_PLAYLIST, last_modified="Wed, 01 Jan 2025 00:00:00 GMT")
+        entry = self.cache.get("a")
+        with patch('utils.hls.time.monotonic', return_value=1061.0):
+            self.assertFalse(self.cache.is_fresh(entry))
+            self.assertEqual(PlaylistCache.conditional_headers(entry),
+                             {'If-Modified-Since': "Wed, 01 Jan 2025 00:00:00 GMT"})
+            self.cache.touch("a")
+            self.assertTrue(self.cache.is_fresh(entry))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,132 @@
+"""
+來源 IP 連線池單元測試
+
+使用本機 HTTP 伺服器，依用戶端的來源 port 判斷是否重用連線
+執行方式：python -m pytest utils/test_http_pool.py -v
+或：python -m unittest utils/test_http_pool.py
+"""
+
+import http.server
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+# 先載入 utils（會載入 gevent），再載入 requests
+from utils.http_pool import ConnectionPolicy, SourceIpPools
+
+import requests
+
+
+class PortRecordingHandler(http.server.BaseHTTPRequestHandler):
+    """回應 200，並記錄每個請求的用戶端 port"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.ports.append(self.client_address[1])
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+
+class TestConnectionPolicy(unittest.TestCase):
+    """ConnectionPolicy / SourceIpPools 單元測試類別"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), PortRecordingHandler)
+        cls.server.daemon_threads = True
+        cls.server.ports = []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}/"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.ports.clear()
+
+    def tearDown(self):
+        SourceIpPools().close_all()
+
+    def _get(self, session, times=1):
+        for _ in range(times):
+            session.get(self.url).raise_for_status()
+
+    def test_01_per_user_reuses_connection(self):
+        """測試 per_user 模式在 session 之間重用連線，不同 User 各自連線"""
+        policy = ConnectionPolicy()
+        first, second = requests.Session(), requests.Session()
+        policy.mount(first, '127.0.0.1')
+        policy.mount(second, '127.0.0.1')
+        self._get(first, 2)
+        policy.end_session(first)
+        self._get(first)
+        self._get(second)
+        self.assertEqual(len(set(self.server.ports)), 2)
+
+    def test_02_shared_pool(self):
+        """測試 shared 模式下相同來源 IP 的 User 共用同一條連線"""
+        policy = ConnectionPolicy({'mode': 'shared', 'max_per_host': 1})
+        sessions = [requests.Session() for _ in range(3)]
+        adapters = {id(policy.mount(session, '127.0.0.1')) for session in sessions}
+        self.assertEqual(len(adapters), 1)
+        for session in sessions:
+            self._get(session)
+        self.assertEqual(len(set(self.server.ports)), 1)
+
+    def test_03_per_session(self):
+        """測試 per_session 模式在 session 結束時關閉連線"""
+        policy = ConnectionPolicy({'mode': 'per_session'})
+        session = requests.Session()
+        policy.mount(session, '127.0.0.1')
+        self._get(session, 2)
+        policy.end_session(session)
+        self._get(session)
+        ports = self.server.ports
+        self.assertEqual(ports[0], ports[1])
+        self.assertNotEqual(ports[1], ports[2])
+
+    def test_04_idle_eviction(self):
+        """測試閒置逾時的連線會被關閉，之後重新建立"""
+        policy = ConnectionPolicy({'mode': 'shared', 'idle_timeout': 0.01})
+        session = requests.Session()
+        policy.mount(session, '127.0.0.1')
+        self._get(session)
+        time.sleep(0.02)
+        # 背景清理的 greenlet 可能已在 sleep 期間關閉連線，因此以之後是否重新連線判斷
+        SourceIpPools().evict_idle()
+        self._get(session)
+        self.assertEqual(len(set(self.server.ports)), 2)
+
+    def test_05_remount_keeps_shared_adapter(self):
+        """測試改綁來源 IP 時只關閉自己的 adapter，不影響共用的 adapter"""
+        shared = ConnectionPolicy({'mode': 'shared'})
+        other = requests.Session()
+        shared_adapter = shared.mount(other, '127.0.0.1')
+        self._get(other)
+        session = requests.Session()
+        shared.mount(session, '127.0.0.1')
+        ConnectionPolicy().mount(session, '127.0.0.2')
+        self.assertIs(other.adapters['http://'], shared_adapter)
+        self._get(other)
+        self.assertEqual(len(set(self.server.ports)), 1)
+
+    def test_06_unknown_mode(self):
+        """測試未知的模式使用 per_user"""
+        self.assertEqual(ConnectionPolicy({'mode': 'bogus'}).mode, 'per_user')
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,143 @@
+"""
+來源 IP 健康監測單元測試
+
+執行方式：python -m pytest utils/test_ip_health.py -v
+或：python -m unittest utils/test_ip_health.py
+"""
+
+import errno
+import sys
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+# 先載入 utils（會載入 locust 並做 gevent monkey patch），再載入 requests
+from utils.ip_health import DEFAULT_HEALTH, IpHealthMonitor, classify_failure, migrate_user, probe, quarantine_ip
+from utils.ip_manager import SourceIpManager
+
+import dns.exception
+import requests
+from requests_toolbelt.adapters.source import SourceAddressAdapter
+
+
+TEST_IPS = ["10.60.100.1", "10.60.100.2", "10.60.100.3"]
+# 本機沒有的位址，綁定時會失敗（EADDRNOTAVAIL）
+UNASSIGNED_IP = "192.0.2.77"
+
+
+class SocialUser:
+    """只有來源 IP 的 User 替身"""
+
+    def __init__(self, source_ip):
+        self.source_ip = source_ip
+        self.changes = []
+
+    def on_source_ip_changed(self, old_ip, new_ip):
+        self.changes.append((old_ip, new_ip))
+
+
+class TestClassifyFailure(unittest.TestCase):
+    """classify_failure 單元測試類別"""
+
+    def test_01_bind_failure(self):
+        """測試綁定本機沒有的來源 IP 時判斷為 bind"""
+        session = requests.Session()
+        session.mount("http://", SourceAddressAdapter((UNASSIGNED_IP, 0)))
+        with self.assertRaises(requests.exceptions.ConnectionError) as cm:
+            session.get("http://127.0.0.1:9/")
+        self.assertEqual(classify_failure(cm.exception), "bind")
+
+    def test_02_target_side_failures(self):
+        """測試連線被拒與一般失敗屬於目標端"""
+        with self.assertRaises(requests.exceptions.ConnectionError) as cm:
+            requests.get("http://127.0.0.1:9/")
+        self.assertIsNone(classify_failure(cm.exception))
+        self.assertIsNone(classify_failure(Exception("DNS query failed with rcode: SERVFAIL")))
+        self.assertIsNone(classify_failure(None))
+
+    def test_03_route_and_timeout(self):
+        """測試沒有路由與逾時"""
+        self.assertEqual(classify_failure(OSError(errno.ENETUNREACH, "Network is unreachable")), "connect")
+        self.assertEqual(classify_failure(dns.exception.Timeout(timeout=1)), "timeout")
+        self.assertEqual(classify_failure(requests.exceptions.ConnectTimeout()), "timeout")
+
+    def test_04_probe(self):
+        """測試探測：本機位址可綁定，本機沒有的位址失敗"""
+        self.assertTrue(probe("127.0.0.1"))
+        self.assertFalse(probe(UNASSIGNED_IP))
+
+
+class TestIpHealthMonitor(unittest.TestCase):
+    """IpHealthMonitor 與隔離流程單元測試類別"""
+
+    def setUp(self):
+        SourceIpManager._instance = None
+        IpHealthMonitor._instance = None
+        with patch.object(SourceIpManager, '_load_ips', return_value=list(TEST_IPS)), \
+                patch.object(SourceIpManager, '_load_limits', return_value=(None, {})):
+            self.manager = SourceIpManager()
+        with patch.object(IpHealthMonitor, '_load_config', return_value=dict(DEFAULT_HEALTH)):
+            self.monitor = IpHealthMonitor()
+
+    def tearDown(self):
+        SourceIpManager._instance = None
+        IpHealthMonitor._instance = None
+
+    def test_01_consecutive_bind_failures(self):
+        """測試連續綁定失敗達到上限時隔離，中間有成功則重新計算"""
+        bind_error = OSError(errno.EADDRNOTAVAIL, "Cannot assign requested address")
+        for _ in range(2):
+            self.monitor.record(TEST_IPS[0], bind_error)
+        self.monitor.record(TEST_IPS[0])
+        self.monitor.record(TEST_IPS[0], bind_error)
+        self.assertEqual(self.monitor.evaluate(), [])
+        for _ in range(3):
+            self.monitor.record(TEST_IPS[0], bind_error)
+        self.assertEqual(self.monitor.evaluate(), [TEST_IPS[0]])
+
+    def test_02_error_rate_outlier(self):
+        """測試只有單一 IP 失敗率偏高時隔離；所有 IP 都失敗時不隔離"""
+        timeout = dns.exception.Timeout(timeout=1)
+        for _ in range(20):
+            self.monitor.record(TEST_IPS[0], timeout)
+            self.monitor.record(TEST_IPS[1])
+            self.monitor.record(TEST_IPS[2])
+        self.assertEqual(self.monitor.evaluate(), [TEST_IPS[0]])
+        for _ in range(20):
+            for ip in TEST_IPS:
+                self.monitor.record(ip, timeout)
+        self.assertEqual(self.monitor.evaluate(), [])
+
+    def test_03_quarantine_migrates_users(self):
+        """測試隔離後使用該 IP 的 User 改綁，新的 User 不會分配到該 IP，重新加入後恢復分配"""
+        users = [SocialUser(self.manager.get_ip("SocialUser")) for _ in range(6)]
+        environment = SimpleNamespace(runner=SimpleNamespace(
+            user_greenlets=[SimpleNamespace(args=(user,)) for user in users]))
+
+        quarantine_ip(environment, TEST_IPS[0])
+        self.assertNotIn(TEST_IPS[0], [user.source_ip for user in users])
+        self.assertEqual(sum(len(user.changes) for user in users), 2)
+        self.assertNotIn(TEST_IPS[0], self.manager.allocation())
+        self.assertEqual({self.manager.get_ip("SocialUser") for _ in range(4)}, set(TEST_IPS[1:]))
+        self.assertEqual(self.monitor.quarantined(), [TEST_IPS[0]])
+
+        self.manager.readmit(TEST_IPS[0])
+        self.assertEqual(self.manager.get_ip("SocialUser"), TEST_IPS[0])
+
+    def test_04_migrate_without_healthy_ip(self):
+        """測試沒有健康的 IP 時保留原本的 IP"""
+        for ip in TEST_IPS[1:]:
+            self.manager.quarantine(ip)
+        user = SocialUser(self.manager.get_ip("SocialUser"))
+        self.manager.quarantine(TEST_IPS[0])
+        self.assertFalse(migrate_user(user, TEST_IPS[0]))
+        self.assertEqual(user.source_ip, TEST_IPS[0])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
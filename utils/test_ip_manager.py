@@ -0,0 +1,91 @@
+"""
+來源 IP 分配單元測試
+
+執行方式：python -m pytest utils/test_ip_manager.py -v
+或：python -m unittest utils/test_ip_manager.py
+"""
+
+import sys
+import unittest
+from collections import Counter
+from pathlib import Path
+from unittest.mock import patch
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.ip_manager import SourceIpManager
+
+
+TEST_IPS = ["10.60.100.1", "10.60.100.2", "10.60.100.3"]
+
+
+class TestSourceIpManager(unittest.TestCase):
+    """SourceIpManager 分配單元測試類別"""
+
+    def _create(self, max_users_per_ip=None, class_quotas=None):
+        SourceIpManager._instance = None
+        with patch.object(SourceIpManager, '_load_ips', return_value=list(TEST_IPS)), \
+                patch.object(SourceIpManager, '_load_limits', return_value=(max_users_per_ip, class_quotas or {})):
+            return SourceIpManager()
+
+    def tearDown(self):
+        SourceIpManager._instance = None
+
+    def test_01_round_robin_when_equal(self):
+        """測試負載相同時輪流分配"""
+        manager = self._create()
+        allocated = [manager.get_ip("SocialUser") for _ in range(6)]
+        self.assertEqual(allocated, TEST_IPS * 2)
+
+    def test_02_least_loaded_after_release(self):
+        """測試 User 停止後，新的 User 分配到負載最低的 IP"""
+        manager = self._create()
+        for _ in range(6):
+            manager.get_ip("SocialUser")
+        manager.release_ip("SocialUser", TEST_IPS[1])
+        manager.release_ip("SocialUser", TEST_IPS[1])
+        self.assertEqual(manager.get_ip("SocialUser"), TEST_IPS[1])
+        self.assertEqual(manager.get_ip("SocialUser"), TEST_IPS[1])
+        load = Counter({ip: sum(classes.values()) for ip, classes in manager.allocation().items()})
+        self.assertEqual(set(load.values()), {2})
+
+    def test_03_max_users_per_ip(self):
+        """測試每個 IP 達到上限後回傳 None，釋放後可再分配"""
+        manager = self._create(max_users_per_ip=2)
+        allocated = [manager.get_ip("VideoUser") for _ in range(6)]
+        self.assertEqual(Counter(allocated), Counter({ip: 2 for ip in TEST_IPS}))
+        self.assertIsNone(manager.get_ip("VideoUser"))
+        manager.release_ip("VideoUser", TEST_IPS[2])
+        self.assertEqual(manager.get_ip("VideoUser"), TEST_IPS[2])
+
+    def test_04_class_quota(self):
+        """測試單一 IP 上的 User 類型配額，其他類型不受影響"""
+        manager = self._create(class_quotas={"VideoUser": 1})
+        video = [manager.get_ip("VideoUser") for _ in range(3)]
+        self.assertEqual(sorted(video), TEST_IPS)
+        self.assertIsNone(manager.get_ip("VideoUser"))
+        self.assertIsNotNone(manager.get_ip("SocialUser"))
+
+    def test_05_allocation_snapshot(self):
+        """測試 allocation() 依 IP 與 User 類型統計存活 User"""
+        manager = self._create()
+        manager.get_ip("SocialUser")
+        manager.get_ip("VideoUser")
+        manager.get_ip("DnsLoad")
+        manager.get_ip("SocialUser")
+        self.assertEqual(manager.allocation(), {
+            TEST_IPS[0]: {"SocialUser": 2},
+            TEST_IPS[1]: {"VideoUser": 1},
+            TEST_IPS[2]: {"DnsLoad": 1},
+        })
+        manager.release_ip("VideoUser", TEST_IPS[1])
+        # 重複釋放或釋放 None 不影響其他記錄
+        manager.release_ip("VideoUser", TEST_IPS[1])
+        manager.release_ip("VideoUser", None)
+        self.assertNotIn(TEST_IPS[1], manager.allocation())
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
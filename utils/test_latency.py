@@ -0,0 +1,106 @@
+"""
+IntendedSchedule 與 LatencyRecorder（coordinated omission 修正）單元測試
+
+執行方式：python -m pytest utils/test_latency.py -v
+或：python -m unittest utils/test_latency.py
+"""
+
+import sys
+import time
+import unittest
+from pathlib import Path
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.latency import FLUSH_SIZE, IntendedSchedule, LatencyRecorder
+
+MS = 1_000_000
+
+
+class TestIntendedSchedule(unittest.TestCase):
+    """IntendedSchedule 單元測試類別"""
+
+    def test_01_advances_from_intended_time(self):
+        """測試預定時間依間隔累加，落後時不等待，追上後恢復等待"""
+        schedule = IntendedSchedule()
+        first = schedule.intended()
+        wait = schedule.advance(0.05)
+        self.assertGreater(wait, 0.04)
+        self.assertEqual(schedule.intended(), first + 50 * MS)
+
+        # 請求花了比間隔更久：下一個預定時間已過，立即送出
+        time.sleep(0.17)
+        self.assertEqual(schedule.advance(0.05), 0.0)
+        self.assertEqual(schedule.intended(), first + 100 * MS)
+        self.assertEqual(schedule.advance(0.05), 0.0)
+        self.assertGreater(schedule.advance(0.2), 0.0)
+
+    def test_02_without_advance_intended_is_now(self):
+        """測試沒有呼叫 advance（wait_time 被換掉）時預定時間就是現在，不會累積落後"""
+        schedule = IntendedSchedule()
+        first = schedule.intended()
+        time.sleep(0.01)
+        self.assertGreaterEqual(schedule.intended() - first, 10 * MS)
+
+
+class TestLatencyRecorder(unittest.TestCase):
+    """LatencyRecorder 單元測試類別"""
+
+    def setUp(self):
+        LatencyRecorder._instance = None
+        self.recorder = LatencyRecorder()
+
+    def tearDown(self):
+        LatencyRecorder._instance = None
+
+    def _simulate_stall(self, recorder, name):
+        """每 10 ms 預定一個請求，平常 1 ms 完成；第 100 個請求停頓 1 秒，其後的請求延後送出"""
+        now = 0
+        for i in range(1000):
+            intended = i * 10 * MS
+            sent = max(intended, now)
+            done = sent + (1000 * MS if i == 100 else 1 * MS)
+            recorder.record(name, intended, sent, done)
+            now = done
+
+    def test_03_corrected_tail_includes_stall(self):
+        """測試停頓時未修正的 p99 只有一筆慢請求，修正後的 p99 反映延後送出的請求"""
+        self._simulate_stall(self.recorder, "DNS:A")
+        row = self.recorder.rows()[0]
+        self.assertEqual(row['count'], 1000)
+        self.assertLess(row['p99'], 2)
+        self.assertGreater(row['p99_corrected'], 500)
+        self.assertAlmostEqual(row['max'], row['max_corrected'], delta=1)
+        self.assertLessEqual(row['p50'], row['p50_corrected'])
+
+    def test_04_snapshot_merge(self):
+        """測試 worker 的快照合併後與直接記錄的結果相同"""
+        worker = LatencyRecorder()
+        self._simulate_stall(worker, "DNS:A")
+        expected = worker.rows()
+        snapshot = worker.snapshot_and_reset()
+        self.assertEqual(worker.rows(), [])
+
+        worker.merge_snapshot(snapshot)
+        self.assertEqual(worker.rows(), expected)
+        worker.merge_snapshot(snapshot)
+        self.assertEqual(worker.rows()[0]['count'], 2000)
+        self.assertEqual(worker.rows()[0]['p99_corrected'], expected[0]['p99_corrected'])
+
+    def test_05_batched_flush(self):
+        """測試累積超過 FLUSH_SIZE 時分批寫入，讀取時寫入剩下的請求，reset 一併清掉未寫入的部分"""
+        for i in range(FLUSH_SIZE + 10):
+            self.recorder.record("DNS:A" if i % 2 else "DNS:AAAA", 0, 0, (i % 50 + 1) * MS)
+        self.assertEqual(len(self.recorder._pending), 10)
+        rows = {row['name']: row for row in self.recorder.rows()}
+        self.assertEqual(rows['DNS:A']['count'] + rows['DNS:AAAA']['count'], FLUSH_SIZE + 10)
+        self.assertEqual(rows['DNS:A']['max'], 50)
+        self.recorder.record("DNS:A", 0, 0, MS)
+        self.recorder.reset()
+        self.assertEqual(self.recorder.rows(), [])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
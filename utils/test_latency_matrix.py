@@ -0,0 +1,192 @@
+"""
+LatencyMatrix（來源 IP × 目標 × 名稱的延遲矩陣）單元測試
+
+執行方式：python -m pytest utils/test_latency_matrix.py -v
+或：python -m unittest utils/test_latency_matrix.py
+"""
+
+import csv
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import msgpack
+import numpy as np
+from locust.env import Environment
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.latency_matrix import (BUCKETS, UPPER_MS, LatencyMatrix, bucket_index, bucket_indices,
+                                  install_latency_matrix, percentiles)
+
+
+def _fresh_matrix() -> LatencyMatrix:
+    """單例之外另建一個獨立的矩陣（模擬 worker 與 master 各自的行程）。"""
+    matrix = object.__new__(LatencyMatrix)
+    matrix.__init__()
+    return matrix
+
+
+class TestBuckets(unittest.TestCase):
+    """對數分桶單元測試類別"""
+
+    def test_01_bucket_bounds_and_percentiles(self):
+        """測試數值落在所屬桶的範圍內，向量版本與純量版本一致，百分位數取桶的上界"""
+        values = np.concatenate([np.random.lognormal(2, 3, 5000), [0, 0.127, 0.128, 0.16, 1e9]])
+        indices = bucket_indices(values)
+        self.assertEqual(list(indices), [bucket_index(v) for v in values])
+        self.assertEqual(bucket_index(0.05), 0)
+        self.assertEqual(bucket_index(1e9), BUCKETS - 1)
+        for value in (0.2, 1.0, 12.3, 250.0, 4000.0):
+            index = bucket_index(value)
+            self.assertLess(value, UPPER_MS[index])
+            self.assertGreaterEqual(value, UPPER_MS[index - 1])
+            # 相對誤差在 25% 以內
+            self.assertLessEqual(UPPER_MS[index] / UPPER_MS[index - 1], 1.25 + 1e-9)
+
+        hist = np.zeros((2, BUCKETS), dtype=np.uint32)
+        hist[0, bucket_index(10.0)] = 99
+        hist[0, bucket_index(500.0)] = 1
+        p50, p99 = percentiles(hist, 50), percentiles(hist, 99.5)
+        self.assertEqual(p50[0], UPPER_MS[bucket_index(10.0)])
+        self.assertEqual(p99[0], UPPER_MS[bucket_index(500.0)])
+        self.assertTrue(np.isnan(p50[1]))
+
+
+class TestLatencyMatrix(unittest.TestCase):
+    """記錄、合併與輸出單元測試類別"""
+
+    def test_02_top_targets_and_sources(self):
+        """測試最慢的目標與來源 IP 依 p99 排序，失敗數與平均值正確"""
+        matrix = _fresh_matrix()
+        for i in range(200):
+            source = f"10.0.0.{i % 50}"
+            matrix.record(source, '10.1.0.1:80', 'SOCIAL:feed', 5.0)
+            matrix.record(source, '10.1.0.2:80', 'SOCIAL:feed', 80.0 if i % 50 == 7 else 5.0, failed=i % 50 == 7)
+        matrix.record('10.0.0.1', '10.1.0.3:80', 'WEB:index', 1.0)
+
+        rows = matrix.top_rows('target', limit=2)
+        feed = [row for row in rows if row['name'] == 'SOCIAL:feed']
+        self.assertEqual([row['target'] for row in feed], ['10.1.0.2:80', '10.1.0.1:80'])
+        self.assertEqual(feed[0]['count'], 200)
+        self.assertEqual(feed[0]['failures'], 4)
+        self.assertAlmostEqual(feed[0]['avg_ms'], (196 * 5.0 + 4 * 80.0) / 200)
+        self.assertEqual(feed[0]['p99_ms'], UPPER_MS[bucket_index(80.0)])
+
+        sources = matrix.top_rows('source', limit=1)
+        self.assertEqual([row['source'] for row in sources if row['name'] == 'SOCIAL:feed'], ['10.0.0.7'])
+
+        sources, targets, values = matrix.heatmap('SOCIAL:feed')
+        self.assertEqual(values.shape, (50, 2))
+        self.assertEqual(values[sources.index('10.0.0.7'), targets.index('10.1.0.2:80')],
+                         UPPER_MS[bucket_index(80.0)])
+        sources, targets, values = matrix.heatmap('WEB:index', targets=['10.1.0.3:80', '10.1.0.1:80'])
+        self.assertEqual(sources, ['10.0.0.1'])
+        self.assertEqual(values[0, 0], UPPER_MS[bucket_index(1.0)])
+        self.assertTrue(np.isnan(values[0, 1]))
+
+    def test_03_worker_snapshot_merge(self):
+        """測試 worker 的 snapshot 經 msgpack 傳送後，master 依標籤合併（索引順序不同也正確）"""
+        master, worker_a, worker_b = _fresh_matrix(), _fresh_matrix(), _fresh_matrix()
+        master.record('10.0.0.9', '10.1.0.9:80', 'WEB:index', 3.0)
+        for _ in range(3):
+            worker_a.record('10.0.0.1', '10.1.0.1:80', 'SOCIAL:feed', 10.0)
+        worker_b.record('10.0.0.2', '10.1.0.2:80', 'SOCIAL:feed', 20.0, failed=True)
+        worker_b.record('10.0.0.1', '10.1.0.1:80', 'SOCIAL:feed', 10.0)
+
+        for worker in (worker_a, worker_b):
+            snapshot = msgpack.unpackb(msgpack.packb(worker.snapshot_and_reset()))
+            master.merge_snapshot(snapshot)
+            # worker 取出後歸零，沒有新資料時不送
+            self.assertIsNone(worker.snapshot_and_reset())
+
+        rows = {(row['name'], row['target']): row for row in master.top_rows('target')}
+        self.assertEqual(rows[('SOCIAL:feed', '10.1.0.1:80')]['count'], 4)
+        self.assertEqual(rows[('SOCIAL:feed', '10.1.0.2:80')]['failures'], 1)
+        self.assertEqual(rows[('WEB:index', '10.1.0.9:80')]['count'], 1)
+        self.assertEqual(int(master.count.sum()), 6)
+
+    def test_04_capacity_limit_and_growth(self):
+        """測試容量依需要增加並保留資料，超過 max_cells 的新組合計入 dropped，既有的組合照常記錄"""
+        matrix = _fresh_matrix()
+        matrix.max_cells = 2000
+        for i in range(2000):
+            matrix.record(f"10.0.{i // 256}.{i % 256}", 'a:80', 'X', 1.0)
+        matrix.record('10.0.0.0', 'b:80', 'X', 1.0)
+        matrix.record('10.9.9.9', 'a:80', 'X', 1.0)
+        matrix.record('10.0.0.0', 'a:80', 'X', 1.0)
+        matrix.top_rows()
+        self.assertEqual(matrix.dropped, 2)
+        self.assertEqual(int(matrix.count.sum()), 2001)
+        self.assertEqual(matrix.size, 2000)
+        self.assertLessEqual(len(matrix.count), 2000)
+
+    def test_05_realistic_cardinality(self):
+        """測試數百個來源 IP × 數千個目標：不丟棄請求，記憶體只與實際出現的組合數成正比"""
+        rng = np.random.default_rng(1)
+        sources = [f"10.0.{i // 256}.{i % 256}" for i in range(300)]
+        targets = [f"172.16.{i // 256}.{i % 256}:80" for i in range(5000)]
+        names = ['SOCIAL:feed', 'SOCIAL:react', 'WEB:index']
+        # 每個 User 從 /16 目標池隨機取 30 個目標（與 SocialUser 相同），兩個 User 共用一個來源 IP
+        users = [(sources[i // 2], rng.choice(len(targets), 30, replace=False)) for i in range(600)]
+        worker, master = _fresh_matrix(), _fresh_matrix()
+        cells = set()
+        for i in range(100_000):
+            source, picks = users[i % 600]
+            target, name = targets[picks[i % 30]], names[i % 3]
+            cells.add((source, target, name))
+            worker.record(source, target, name, 5.0 + i % 7, failed=i % 1000 == 0)
+        master.merge_snapshot(msgpack.unpackb(msgpack.packb(worker.snapshot_and_reset())))
+
+        self.assertEqual(master.dropped, 0)
+        self.assertEqual(master.size, len(cells))
+        self.assertEqual(int(master.count.sum()), 100_000)
+        self.assertEqual(int(master.failures.sum()), 100)
+        # 每格約 300 bytes：陣列大小與實際的格數成正比（容量最多多出 1.5 倍）
+        used_bytes = master.hist.nbytes + master.count.nbytes + master.failures.nbytes + master.total_ms.nbytes
+        self.assertLess(used_bytes, len(cells) * 1.5 * 400)
+        self.assertLess(used_bytes, 50 * 1024 * 1024)
+        self.assertEqual(len(master.top_rows('target', limit=5)), 15)
+
+    def test_06_reports_and_listener(self):
+        """測試 request 事件依 URL 或 context 的 target 記錄，結束時輸出 npz、前 N 名與熱圖 CSV"""
+        matrix = LatencyMatrix()
+        matrix.reset()
+        env = Environment()
+        env.create_local_runner()
+        install_latency_matrix(env)
+        fire = env.events.request.fire
+        fire(request_type='GET', name='SOCIAL:feed', response_time=12.0, response_length=0, exception=None,
+             context={'source_ip': '10.0.0.1'}, url='http://10.1.0.1:8080/feed?since=1')
+        fire(request_type='DNS', name='DNS:A@10.2.0.1', response_time=3.0, response_length=0, exception=None,
+             context={'source_ip': '10.0.0.1', 'target': '10.2.0.1'})
+        # 沒有來源 IP 或目標時略過
+        fire(request_type='GET', name='WEB:index', response_time=1.0, response_length=0, exception=None,
+             context={}, url='http://10.1.0.1:8080/')
+
+        rows = matrix.top_rows('target')
+        self.assertEqual({(row['name'], row['target']) for row in rows},
+                         {('SOCIAL:feed', '10.1.0.1:8080'), ('DNS:A', '10.2.0.1')})
+
+        with tempfile.TemporaryDirectory() as directory:
+            prefix = str(Path(directory) / 'run')
+            matrix.write_reports(prefix)
+            with open(f"{prefix}_heatmap_SOCIAL_feed.csv") as f:
+                heatmap = list(csv.reader(f))
+            self.assertEqual(heatmap[0], ['source_ip', '10.1.0.1:8080'])
+            self.assertEqual(heatmap[1], ['10.0.0.1', f'{UPPER_MS[bucket_index(12.0)]:g}'])
+            with open(f"{prefix}_matrix_top.csv") as f:
+                top = list(csv.DictReader(f))
+            self.assertEqual({row['kind'] for row in top}, {'target', 'source'})
+
+            restored = _fresh_matrix()
+            restored.load(f"{prefix}_latency_matrix.npz")
+            self.assertEqual(restored.top_rows('target'), rows)
+        matrix.reset()
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
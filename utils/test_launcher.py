@@ -0,0 +1,56 @@
+"""
+多核心啟動器（main.py）單元測試
+
+執行方式：python -m pytest utils/test_launcher.py -v
+或：python -m unittest utils/test_launcher.py
+"""
+
+import os
+import sys
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import main
+
+
+class TestLauncher(unittest.TestCase):
+    """main.py 啟動參數與 CPU 分配單元測試類別"""
+
+    def test_01_assign_cpus(self):
+        """測試 worker 依序綁定 CPU，worker 比 CPU 多時輪流分配"""
+        self.assertEqual(main.assign_cpus(3, [2, 5, 7, 9]), [2, 5, 7])
+        self.assertEqual(main.assign_cpus(5, [0, 1]), [0, 1, 0, 1, 0])
+
+    def test_02_commands(self):
+        """測試 master 等待所有 worker，worker 不輸出 CSV / HTML 且日誌各自一個檔案"""
+        master = main.master_command('/conf/locust.conf', 4, 5600, ['--headless', '-t', '1m'])
+        self.assertIn('--master', master)
+        self.assertEqual(master[master.index('--expect-workers') + 1], '4')
+        self.assertEqual(master[-3:], ['--headless', '-t', '1m'])
+
+        worker = main.worker_command('/conf/locust.conf', 2, 5600, '/results')
+        self.assertIn('--worker', worker)
+        self.assertEqual(worker[worker.index('--master-port') + 1], '5600')
+        self.assertIn('--csv=', worker)
+        self.assertIn('--html=', worker)
+        self.assertEqual(worker[worker.index('--logfile') + 1], os.path.join('/results', 'worker-2.log'))
+
+    def test_03_main_arguments(self):
+        """測試 -- 之後的參數傳給 master，預設 worker 數為可用的 CPU 數"""
+        with patch.object(main, 'run', return_value=0) as run, \
+                patch.object(main, 'available_cpus', return_value=[0, 1, 2]):
+            self.assertEqual(main.main(['--no-pin', '--', '-u', '10']), 0)
+        config, workers, _, _, pin_workers, extra = run.call_args.args
+        self.assertEqual(config, os.path.abspath('./locust.conf'))
+        self.assertEqual(workers, 3)
+        self.assertFalse(pin_workers)
+        self.assertEqual(extra, ['-u', '10'])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
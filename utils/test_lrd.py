@@ -0,0 +1,87 @@
+"""
+LRD 取樣器與 Hurst 估計單元測試
+
+執行方式：python -m pytest utils/test_lrd.py -v
+或：python -m unittest utils/test_lrd.py
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.lrd import (LrdSampler, expected_hurst, fgn, hurst_aggregated_variance,
+                       hurst_rescaled_range, truncated_pareto)
+
+
+class TestDistributions(unittest.TestCase):
+    """截斷 Pareto 與 fGn 單元測試類別"""
+
+    def test_01_truncated_pareto_bounds(self):
+        """測試樣本落在 [scale, upper] 內，且不會在上限堆積"""
+        rng = np.random.default_rng(1)
+        samples = truncated_pareto(rng, 1.4, 5.0, 300.0, 100000)
+        self.assertGreaterEqual(samples.min(), 5.0)
+        self.assertLessEqual(samples.max(), 300.0)
+        self.assertLess(np.count_nonzero(samples == 300.0), 10)
+        # 中位數：scale * (1 - 0.5 * (1 - (scale/upper)^alpha))^(-1/alpha)
+        expected_median = 5.0 * (1 - 0.5 * (1 - (5.0 / 300.0) ** 1.4)) ** (-1 / 1.4)
+        self.assertAlmostEqual(np.median(samples), expected_median, delta=0.1)
+
+    def test_02_fgn_hurst(self):
+        """測試 fGn 的變異數為 1，且兩種估計法都接近指定的 Hurst 參數"""
+        rng = np.random.default_rng(0)
+        noise = fgn(rng, 0.8, 8192)
+        self.assertAlmostEqual(noise.var(), 1.0, delta=0.15)
+        self.assertAlmostEqual(hurst_aggregated_variance(noise), 0.8, delta=0.1)
+        self.assertAlmostEqual(hurst_rescaled_range(noise), 0.8, delta=0.1)
+
+        white = np.random.default_rng(0).standard_normal(8192)
+        self.assertAlmostEqual(hurst_aggregated_variance(white), 0.5, delta=0.1)
+
+    def test_03_expected_hurst(self):
+        """測試 ON/OFF 疊加的理論 Hurst 參數"""
+        self.assertAlmostEqual(expected_hurst(1.4, 1.6), 0.8)
+        self.assertEqual(expected_hurst(2.5, 2.5), 0.5)
+
+
+class TestLrdSampler(unittest.TestCase):
+    """LrdSampler 單元測試類別"""
+
+    def setUp(self):
+        LrdSampler._instance = None
+        self.sampler = LrdSampler(block_size=64)
+
+    def tearDown(self):
+        LrdSampler._instance = None
+
+    def test_01_seeded_per_worker(self):
+        """測試相同 (seed, worker_index) 可重現，不同 worker 的序列不同"""
+        self.sampler.seed(42, worker_index=0)
+        first = [self.sampler.pareto(1.4, 5.0, 300.0) for _ in range(100)]
+        self.sampler.seed(42, worker_index=0)
+        again = [self.sampler.pareto(1.4, 5.0, 300.0) for _ in range(100)]
+        self.sampler.seed(42, worker_index=1)
+        other = [self.sampler.pareto(1.4, 5.0, 300.0) for _ in range(100)]
+        self.assertEqual(first, again)
+        self.assertNotEqual(first, other)
+        self.assertTrue(all(isinstance(value, float) for value in first))
+
+    def test_02_envelope(self):
+        """測試未設定包絡時倍率為 1，設定後倍率為正且隨時間循環"""
+        self.assertEqual(self.sampler.envelope_factor(123.0), 1.0)
+        self.sampler.seed(7)
+        self.sampler.configure_envelope(hurst=0.8, sigma=0.3, duration=100, origin=1000.0)
+        factors = [self.sampler.envelope_factor(1000.0 + t) for t in range(100)]
+        self.assertTrue(all(factor >= 0.05 for factor in factors))
+        self.assertGreater(len(set(factors)), 1)
+        self.assertEqual(self.sampler.envelope_factor(1000.5), self.sampler.envelope_factor(1100.5))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
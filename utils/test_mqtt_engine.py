@@ -0,0 +1,191 @@
+"""
+MqttEngine 與 publish 排程單元測試
+
+使用本機的簡易 MQTT broker（echo 服務：topic → topic/reply），不需要實際的 broker
+執行方式：python -m pytest utils/test_mqtt_engine.py -v
+或：python -m unittest utils/test_mqtt_engine.py
+"""
+
+import itertools
+import json
+import struct
+import sys
+import unittest
+from pathlib import Path
+
+import gevent
+from gevent.server import StreamServer
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.mqtt_engine import (CONNACK, CONNECT, DISCONNECT, PINGREQ, PINGRESP, PUBACK, PUBLISH, SUBACK,
+                               SUBSCRIBE, MqttEngine, MqttError, MqttTimeout, burst_gaps, decode_publish,
+                               encode_packet, encode_publish, make_schedule, parse_packets)
+
+
+class LocalEchoBroker:
+    """
+    在 127.0.0.1 上執行的簡易 MQTT broker：轉送訂閱的 topic，
+    並像測試環境的 echo 服務一樣，把送到 topic 的訊息以 JSON 回覆到 topic/reply。
+    """
+
+    def __init__(self, echo=True):
+        self.echo = echo
+        self.peers = []
+        self.client_ids = []
+        self._sockets = []
+        self._subscribers = {}  # {topic: [(socket, qos)]}
+        self._server = StreamServer(('127.0.0.1', 0), self._handle)
+        self._server.start()
+        self.port = self._server.server_port
+
+    def _deliver(self, topic, payload, publisher_qos):
+        for sock, qos in list(self._subscribers.get(topic, ())):
+            qos = min(qos, publisher_qos)
+            try:
+                sock.sendall(encode_publish(topic, payload, qos, 1 if qos else 0))
+            except OSError:
+                pass
+
+    def _handle(self, sock, address):
+        self.peers.append(address)
+        self._sockets.append(sock)
+        buffer = bytearray()
+        try:
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    return
+                buffer += data
+                packets, used = parse_packets(buffer)
+                del buffer[:used]
+                for first, body in packets:
+                    kind = first >> 4
+                    if kind == CONNECT:
+                        self.client_ids.append(body[12:].decode())
+                        sock.sendall(encode_packet(CONNACK << 4, b'\x00\x00'))
+                    elif kind == SUBSCRIBE:
+                        topic_length = struct.unpack_from('!H', body, 2)[0]
+                        topic = body[4:4 + topic_length].decode()
+                        self._subscribers.setdefault(topic, []).append((sock, body[4 + topic_length]))
+                        sock.sendall(encode_packet(SUBACK << 4, body[:2] + bytes([body[4 + topic_length]])))
+                    elif kind == PUBLISH:
+                        topic, qos, packet_id, payload = decode_publish(first, body)
+                        if qos:
+                            sock.sendall(encode_packet(PUBACK << 4, struct.pack('!H', packet_id)))
+                        self._deliver(topic, payload, qos)
+                        if self.echo and not topic.endswith('/reply'):
+                            reply = json.dumps({"ok": True, "echo": topic, "original_message": payload.decode()})
+                            self._deliver(f"{topic}/reply", reply.encode(), qos)
+                    elif kind == PINGREQ:
+                        sock.sendall(encode_packet(PINGRESP << 4, b''))
+                    elif kind == DISCONNECT:
+                        return
+        finally:
+            for subscribers in self._subscribers.values():
+                subscribers[:] = [entry for entry in subscribers if entry[0] is not sock]
+            sock.close()
+
+    def close(self):
+        """停止接受連線並中斷所有用戶端。"""
+        self._server.stop(timeout=0)
+        for sock in self._sockets:
+            sock.close()
+
+
+class TestMqttEngine(unittest.TestCase):
+    """MqttEngine 單元測試類別"""
+
+    def setUp(self):
+        self.broker = LocalEchoBroker()
+        self.results = []
+
+    def tearDown(self):
+        MqttEngine.close_all()
+        self.broker.close()
+
+    def _record(self, response_time, length, exception):
+        self.results.append((response_time, length, exception))
+
+    def _wait_for(self, count, timeout=5.0):
+        with gevent.Timeout(timeout):
+            while len(self.results) < count:
+                gevent.sleep(0.01)
+
+    def test_01_packet_encoding(self):
+        """測試 remaining length 超過 127 的封包可完整解析，不完整的封包留在緩衝區"""
+        packet = encode_publish("t/1", b'x' * 300, qos=1, packet_id=7)
+        buffer = bytearray(packet + packet[:5])
+        packets, used = parse_packets(buffer)
+        self.assertEqual(used, len(packet))
+        self.assertEqual(decode_publish(*packets[0]), ("t/1", 1, 7, b'x' * 300))
+
+    def test_02_pipelined_echo_qos0_and_qos1(self):
+        """測試一次送出多則訊息後，echo 依相關 ID 全部配對成功，QoS 1 的 PUBACK 都已收到"""
+        engine = MqttEngine.acquire("127.0.0.2", "127.0.0.1", self.broker.port)
+        for qos in (0, 1):
+            for _ in range(100):
+                engine.request("hello world", "hello world/reply", self._record, qos=qos, payload_size=128)
+        self._wait_for(200)
+        self.assertEqual([exception for _, _, exception in self.results if exception], [])
+        self.assertTrue(all(length > 128 for _, length, _ in self.results))
+        self.assertEqual(engine.in_flight, 0)
+        self.assertEqual(engine._unacked, {})
+        self.assertEqual({host for host, _ in self.broker.peers}, {"127.0.0.2"})
+
+    def test_03_shared_and_per_user_connections(self):
+        """測試共用連線的參照計數；共用回覆 topic 時只配對自己的訊息"""
+        shared = MqttEngine.acquire("127.0.0.1", "127.0.0.1", self.broker.port)
+        self.assertIs(MqttEngine.acquire("127.0.0.1", "127.0.0.1", self.broker.port), shared)
+        own = MqttEngine.acquire("127.0.0.1", "127.0.0.1", self.broker.port, shared=False)
+        self.assertIsNot(own, shared)
+
+        shared.request("hello world", "hello world/reply", self._record)
+        own.request("hello world", "hello world/reply", self._record)
+        self._wait_for(2)
+        gevent.sleep(0.05)
+        self.assertEqual(len(self.results), 2)
+        self.assertEqual(shared.unmatched + own.unmatched, 1)
+
+        shared.release()
+        self.assertFalse(shared.closed)
+        shared.release()
+        self.assertTrue(shared.closed)
+        self.assertIsNot(MqttEngine.acquire("127.0.0.1", "127.0.0.1", self.broker.port), shared)
+        own.release()
+        self.assertTrue(own.closed)
+
+    def test_04_timeout_and_disconnect(self):
+        """測試沒有 echo 時由計時輪回報逾時，連線中斷時等待中的訊息以錯誤回報"""
+        self.broker.echo = False
+        engine = MqttEngine.acquire("127.0.0.1", "127.0.0.1", self.broker.port, max_in_flight=2)
+        engine.request("hello world", "hello world/reply", self._record, timeout=0.1)
+        self._wait_for(1)
+        self.assertIsInstance(self.results[0][2], MqttTimeout)
+        self.assertGreaterEqual(self.results[0][0], 100)
+
+        engine.request("hello world", "hello world/reply", self._record, timeout=30)
+        engine.request("hello world", "hello world/reply", self._record, timeout=30)
+        with self.assertRaises(MqttError):
+            engine.request("hello world", "hello world/reply", self._record)
+        self.broker.close()
+        self._wait_for(3)
+        self.assertTrue(engine.closed)
+        self.assertTrue(all(isinstance(exception, MqttError) for _, _, exception in self.results))
+        self.assertEqual(MqttEngine._engines, {})
+
+    def test_05_schedules(self):
+        """測試 burst 與 pareto 排程的間隔"""
+        self.assertEqual(list(itertools.islice(burst_gaps(3, 10.0), 6)), [0.0, 0.0, 10.0, 0.0, 0.0, 10.0])
+        self.assertEqual(next(make_schedule({"type": "constant", "rate": 4})), 0.25)
+        gaps = list(itertools.islice(make_schedule({"type": "pareto", "rate": 10, "off_scale": 5}), 1000))
+        self.assertEqual(min(gaps), 0.1)
+        self.assertGreaterEqual(max(gaps), 5.1)
+        with self.assertRaises(ValueError):
+            make_schedule({"type": "poisson"})
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,172 @@
+"""
+分散式 IP 區段分配單元測試
+
+執行方式：python -m pytest utils/test_partition.py -v
+或：python -m unittest utils/test_partition.py
+"""
+
+import ipaddress
+import json
+import os
+import socket
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import gevent
+from locust.env import Environment
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.ip_manager import SourceIpManager
+from utils.partition import assign_partitions, install_partitioning, worker_partition
+from utils.target_server import TargetServerManager
+from utils.trace import iter_trace
+
+
+TEST_IPS = [f"10.60.100.{i}" for i in range(1, 11)]
+
+TEST_SUBNETS = [
+    {"subnet": "10.201.0.0/28", "weight": 1, "user_types": ["SocialUser"]},
+    {"subnet": "10.201.1.0/30", "weight": 1, "user_types": []},
+]
+
+
+class TestAssignPartitions(unittest.TestCase):
+    """assign_partitions 單元測試類別"""
+
+    def test_01_ordered_by_worker_index(self):
+        """測試區段依 worker index 排序，count 為 worker 數量"""
+        indexes = {"b": 1, "a": 2, "c": 0}
+        assignments = assign_partitions(["a", "b", "c"], indexes.get)
+        self.assertEqual(assignments["c"], {"index": 0, "count": 3})
+        self.assertEqual(assignments["b"], {"index": 1, "count": 3})
+        self.assertEqual(assignments["a"], {"index": 2, "count": 3})
+
+    def test_02_rebalance_after_leave(self):
+        """測試 worker 離開後其餘 worker 重新分成較少的區段"""
+        indexes = {"a": 0, "b": 1, "c": 2}
+        assignments = assign_partitions(["a", "c"], indexes.get)
+        self.assertEqual(assignments, {"a": {"index": 0, "count": 2}, "c": {"index": 1, "count": 2}})
+
+
+class TestSourceIpPartition(unittest.TestCase):
+    """SourceIpManager.set_partition 單元測試類別"""
+
+    def setUp(self):
+        SourceIpManager._instance = None
+        with patch.object(SourceIpManager, '_load_ips', return_value=list(TEST_IPS)):
+            self.manager = SourceIpManager()
+
+    def tearDown(self):
+        SourceIpManager._instance = None
+
+    def test_01_disjoint_slices(self):
+        """測試各 worker 的 IP 區段互不重疊且涵蓋全部 IP"""
+        slices = []
+        for index in range(3):
+            self.manager.set_partition(index, 3)
+            slices.append(list(self.manager.active_ips))
+        self.assertEqual(sum(slices, []), TEST_IPS)
+        self.assertEqual(sorted(len(s) for s in slices), [3, 3, 4])
+
+    def test_02_cycler_uses_slice(self):
+        """測試設定區段後只分配區段內的 IP"""
+        self.manager.get_ip("VideoUser")
+        self.manager.set_partition(1, 2)
+        allocated = {self.manager.get_ip("VideoUser") for _ in range(20)}
+        self.assertEqual(allocated, set(TEST_IPS[5:]))
+
+    def test_03_more_workers_than_ips(self):
+        """測試 worker 多於 IP 時每個 worker 至少分到一個 IP"""
+        self.manager.set_partition(12, 15)
+        self.assertEqual(self.manager.active_ips, [TEST_IPS[2]])
+
+
+class TestTargetPartition(unittest.TestCase):
+    """TargetServerManager.set_partition 單元測試類別"""
+
+    def setUp(self):
+        TargetServerManager._instance = None
+        with patch.object(TargetServerManager, '_load_subnets', return_value=TEST_SUBNETS):
+            self.manager = TargetServerManager()
+
+    def tearDown(self):
+        TargetServerManager._instance = None
+
+    def _all_hosts(self, pool_index):
+        pool = self.manager.ip_pools[pool_index]
+        return {TargetServerManager._host_address(pool, offset) for offset in range(pool['num_hosts'])}
+
+    def test_01_stride_partition(self):
+        """測試子網主機以 stride / phase 切分，各 worker 互不重疊且涵蓋全部主機"""
+        full = {str(ip) for ip in ipaddress.ip_network("10.201.0.0/28").hosts()}
+        parts = []
+        for index in range(3):
+            self.manager.set_partition(index, 3)
+            parts.append(self._all_hosts(0))
+        self.assertEqual(set().union(*parts), full)
+        self.assertEqual(sum(len(p) for p in parts), len(full))
+
+    def test_02_small_subnet_shared(self):
+        """測試主機數少於 worker 數的子網不切分"""
+        self.manager.set_partition(1, 3)
+        self.assertEqual(self._all_hosts(1), {"10.201.1.1", "10.201.1.2"})
+
+    def test_03_allocation_within_partition(self):
+        """測試分配結果只包含該 worker 的主機"""
+        self.manager.set_partition(0, 2)
+        allowed = self._all_hosts(0)
+        servers = self.manager.get_target_servers("SocialUser", 7)
+        self.assertEqual(len(set(servers) - allowed - {"10.201.1.1", "10.201.1.2"}), 0)
+
+
+class TestWorkerPartition(unittest.TestCase):
+    """master 送出的區段在 worker 上的使用（TraceReplayUser 分片）單元測試類別"""
+
+    def test_01_trace_shards_from_master(self):
+        """測試兩個 worker 從 master 取得 (index, 2)，各自重播的 trace 分片不重疊且合起來是整份 trace"""
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        with tempfile.TemporaryDirectory() as directory, patch('utils.partition.apply_partition'):
+            path = os.path.join(directory, 'trace.jsonl')
+            with open(path, 'w') as f:
+                for i in range(200):
+                    f.write(json.dumps({"ts": i, "path": f"/{i}", "source_ip": f"10.60.{i // 50}.{i % 50}"}) + "\n")
+
+            master = Environment()
+            master.create_master_runner('127.0.0.1', port)
+            install_partitioning(master)
+            # 與 main.py 相同，worker 不知道 --expect-workers
+            workers = [Environment(), Environment()]
+            try:
+                self.assertEqual(worker_partition(master), (0, 1))
+                for worker in workers:
+                    worker.create_worker_runner('127.0.0.1', port)
+                    install_partitioning(worker)
+                    self.assertIsNone(worker_partition(worker))
+                for _ in range(100):
+                    partitions = [worker_partition(worker) for worker in workers]
+                    if all(partition and partition[1] == 2 for partition in partitions):
+                        break
+                    gevent.sleep(0.05)
+                self.assertEqual(sorted(partitions), [(0, 2), (1, 2)])
+
+                shards = [{record.path for record in iter_trace(path, *partition)} for partition in partitions]
+                self.assertTrue(shards[0] and shards[1])
+                self.assertEqual(shards[0] & shards[1], set())
+                self.assertEqual(len(shards[0] | shards[1]), 200)
+            finally:
+                for worker in workers:
+                    if worker.runner:
+                        worker.runner.quit()
+                master.runner.quit()
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,116 @@
+"""
+ProfileRegistry 單元測試
+
+執行方式：python -m pytest utils/test_profiles.py -v
+或：python -m unittest utils/test_profiles.py
+"""
+
+import json
+import os
+import signal
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import gevent
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.profiles import ProfileRegistry
+
+
+class TestProfileRegistry(unittest.TestCase):
+    """ProfileRegistry 單元測試類別"""
+
+    def setUp(self):
+        """每個測試前建立暫存的 profiles 目錄並重置單例"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.profiles_dir = Path(self.tmpdir.name)
+        self._write(ProfileRegistry.USER_CONFIG_FILE, [
+            {"user_class_name": "SocialUser", "target_server_count": 30},
+            {"user_class_name": "DnsLoad", "dns_server": "10.201.0.180", "dns_port": 53},
+        ])
+        self._write(ProfileRegistry.SOURCE_IPS_FILE, {"source_ips": ["10.60.100.1"]})
+        self._write(ProfileRegistry.TARGET_FILE, {"target_subnets": []})
+
+        ProfileRegistry._instance = None
+        self.registry = ProfileRegistry()
+        self.registry.profiles_dir = self.profiles_dir
+        self.registry.reload()
+
+    def tearDown(self):
+        ProfileRegistry._instance = None
+        self.tmpdir.cleanup()
+
+    def _write(self, filename, data, mtime=None):
+        path = self.profiles_dir / filename
+        with open(path, 'w') as f:
+            json.dump(data, f)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def test_01_indexed_by_user_class_name(self):
+        """測試 User 設定依類別名稱索引"""
+        self.assertEqual(self.registry.get_user_profile("SocialUser")["target_server_count"], 30)
+        self.assertEqual(self.registry.get_user_profile("DnsLoad")["dns_server"], "10.201.0.180")
+        self.assertEqual(self.registry.get_user_profile("UnknownUser"), {})
+
+    def test_02_shared_documents(self):
+        """測試 ips.json / target.json 內容可被共用"""
+        ips = self.registry.get_document(ProfileRegistry.SOURCE_IPS_FILE)
+        self.assertEqual(ips["source_ips"], ["10.60.100.1"])
+        self.assertEqual(self.registry.get_document(ProfileRegistry.TARGET_FILE), {"target_subnets": []})
+
+    def test_03_no_reload_without_change(self):
+        """測試設定檔未變更時不重新讀檔"""
+        listener = MagicMock()
+        self.registry.add_reload_listener(listener)
+        self.assertFalse(self.registry.reload_if_changed())
+        listener.assert_not_called()
+
+    def test_04_reload_on_mtime_change(self):
+        """測試 mtime 變更時重新載入並通知監聽者"""
+        listener = MagicMock()
+        self.registry.add_reload_listener(listener)
+        self._write(ProfileRegistry.USER_CONFIG_FILE,
+                    [{"user_class_name": "SocialUser", "target_server_count": 5}],
+                    mtime=1_000_000_000)
+        self.assertTrue(self.registry.reload_if_changed())
+        listener.assert_called_once()
+        self.assertEqual(self.registry.get_user_profile("SocialUser")["target_server_count"], 5)
+        self.assertEqual(self.registry.get_user_profile("DnsLoad"), {})
+
+    def test_05_invalid_json(self):
+        """測試格式錯誤的設定檔回傳空設定"""
+        with open(self.profiles_dir / ProfileRegistry.USER_CONFIG_FILE, 'w') as f:
+            f.write("{not json")
+        self.registry.reload()
+        self.assertEqual(self.registry.get_user_profile("SocialUser"), {})
+        self.assertIsNone(self.registry.get_document(ProfileRegistry.USER_CONFIG_FILE))
+
+    @unittest.skipUnless(hasattr(signal, 'SIGUSR1'), "requires POSIX signals")
+    def test_06_reload_signal_runs_in_greenlet(self):
+        """測試收到訊號時不在訊號處理的上下文中重新載入，而是在另一個 greenlet 中執行"""
+        calls = []
+        self.registry.add_reload_listener(lambda: calls.append(gevent.getcurrent()))
+        self.assertTrue(self.registry.install_reload_signal(signal.SIGUSR1))
+        try:
+            os.kill(os.getpid(), signal.SIGUSR1)
+            # 訊號處理器只排程 greenlet，送出訊號的程式碼不會被打斷
+            self.assertEqual(calls, [])
+            for _ in range(50):
+                if calls:
+                    break
+                gevent.sleep(0.01)
+            self.assertEqual(len(calls), 1)
+            self.assertIsNot(calls[0], gevent.getcurrent())
+        finally:
+            self.registry._signal_watcher.cancel()
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
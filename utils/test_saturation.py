@@ -0,0 +1,167 @@
+"""
+產生器飽和監測（事件迴圈延遲、待執行佇列、各 User 類別 CPU）單元測試
+
+執行方式：python -m pytest utils/test_saturation.py -v
+或：python -m unittest utils/test_saturation.py
+"""
+
+import csv
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+import gevent
+from gevent import monkey
+from locust import User
+from locust.env import Environment
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.saturation import GreenletCpuTracer, SaturationLog, SaturationMonitor, evaluate
+from utils.side_metrics import SideMetrics
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class BusyUser(User):
+    abstract = True
+
+
+class TestEvaluate(unittest.TestCase):
+    """飽和判斷單元測試類別"""
+
+    def _row(self, **kwargs):
+        row = {'cpu_percent': 50.0, 'lag_mean_ms': 1.0, 'lag_p99_ms': 2.0, 'response_mean_ms': 20.0}
+        row.update(kwargs)
+        return row
+
+    def test_01_flags_only_when_lag_and_cause(self):
+        """測試延遲 p99 未達門檻時不標記，達到門檻且 CPU 滿載或延遲佔比過高時標記"""
+        self.assertEqual(evaluate(self._row(cpu_percent=99.0), 10, 90)['saturated'], 0)
+
+        row = evaluate(self._row(lag_p99_ms=30.0, cpu_percent=99.0), 10, 90)
+        self.assertEqual(row['saturated'], 1)
+        self.assertIn('cpu 99%', row['reason'])
+
+        row = evaluate(self._row(lag_p99_ms=30.0, lag_mean_ms=15.0), 10, 90)
+        self.assertEqual(row['saturated'], 1)
+        self.assertEqual(row['generator_share'], 0.75)
+
+        # 延遲高但 CPU 未滿、延遲只佔回應時間的一小部分：慢的是目標
+        row = evaluate(self._row(lag_p99_ms=30.0, lag_mean_ms=2.0, response_mean_ms=500.0), 10, 90)
+        self.assertEqual(row['saturated'], 0)
+        self.assertEqual(row['reason'], '')
+
+        # 回應在 1 ms 以下時單次 GC 停頓拉高 p99，但延遲平均值很小：不標記
+        row = evaluate(self._row(lag_p99_ms=10.1, lag_mean_ms=0.2, response_mean_ms=0.04), 10, 90)
+        self.assertEqual(row['saturated'], 0)
+
+
+class TestGreenletCpuTracer(unittest.TestCase):
+    """各 User 類別 CPU 歸屬單元測試類別"""
+
+    def test_02_attributes_cpu_to_user_class(self):
+        """測試 User greenlet 與其衍生的 greenlet 使用的 CPU 記到 User 類別"""
+        user = BusyUser(Environment())
+
+        def child():
+            _busy(0.02)
+
+        def run(user):
+            _busy(0.03)
+            gevent.spawn(child).join()
+
+        tracer = GreenletCpuTracer()
+        tracer.install()
+        try:
+            gevent.spawn(run, user).join()
+        finally:
+            tracer.uninstall()
+        cpu_ns = tracer.snapshot_and_reset()
+        self.assertGreaterEqual(cpu_ns.get('BusyUser', 0), 40_000_000)
+        self.assertLess(cpu_ns.get('other', 0), 20_000_000)
+        self.assertEqual(tracer.cpu_ns, {})
+
+
+class TestSaturationMonitor(unittest.TestCase):
+    """取樣、發布與 CSV 輸出單元測試類別"""
+
+    def test_03_blocked_loop_is_flagged(self):
+        """測試阻塞事件迴圈的區間被標記，取樣記在 side metrics，不寫入 Locust stats"""
+        env = Environment()
+        env.create_local_runner()
+        SideMetrics().reset()
+        monitor = SaturationMonitor(env, interval=0.2, lag_threshold_ms=10, cpu_threshold=90, class_cpu=True)
+        env.events.request.add_listener(monitor.on_request)
+        monitor.start()
+        try:
+            gevent.sleep(0.05)
+            env.events.request.fire(request_type='DNS', name='q', response_time=5.0, response_length=0,
+                                    exception=None, context={})
+            monkey.get_original('time', 'sleep')(0.1)
+            _busy(0.05)
+            gevent.sleep(0.15)
+        finally:
+            monitor.stop()
+
+        rows = monitor.take_pending()
+        self.assertTrue(rows)
+        row = rows[0]
+        self.assertGreaterEqual(row['lag_max_ms'], 90)
+        self.assertEqual(row['requests'], 1)
+        self.assertEqual(row['saturated'], 1)
+        self.assertIn('cpu_by_class', row)
+        self.assertEqual(monitor.take_pending(), [])
+
+        # 只有測試送出的一筆請求，沒有失敗
+        self.assertEqual(env.stats.total.num_requests, 1)
+        self.assertEqual(env.stats.total.num_failures, 0)
+        self.assertEqual([key for key in env.stats.entries if key[1] == 'GENERATOR'], [])
+        metrics = {row['key']: row for row in SideMetrics().rows('generator')}
+        self.assertIn('cpu (%)', metrics)
+        self.assertIn('run queue (max)', metrics)
+        self.assertGreaterEqual(metrics['loop lag p99 (ms)']['failures'], 1)
+        SideMetrics().reset()
+
+    def test_04_log_csv_columns(self):
+        """測試 CSV 包含固定欄位與各 User 類別的 CPU 欄位，表格顯示各 worker 最新一列"""
+        log = SaturationLog()
+        base = {'cpu_percent': 95.0, 'lag_mean_ms': 1.0, 'lag_p99_ms': 20.0, 'lag_max_ms': 25.0,
+                'run_queue_mean': 3.0, 'run_queue_max': 9, 'requests': 10, 'response_mean_ms': 5.0}
+        log.add([evaluate(dict(base, time=1.0, worker=0, cpu_by_class={'DnsLoad': 80.0}), 10, 90),
+                 evaluate(dict(base, time=1.0, worker=1, cpu_percent=10.0, cpu_by_class={'SocialUser': 5.0}),
+                          10, 90),
+                 evaluate(dict(base, time=2.0, worker=0, cpu_by_class={'DnsLoad': 85.0}), 10, 90)])
+        self.assertEqual(log.saturated_count(), 2)
+
+        table = log.table_rows()
+        self.assertEqual([row['worker'] for row in table], [0, 1])
+        self.assertEqual(table[0]['saturated_intervals'], 2)
+        self.assertEqual(table[0]['cpu_by_class'], 'DnsLoad 85.0%')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = str(Path(directory) / 'run_saturation.csv')
+            log.write_csv(path)
+            with open(path) as f:
+                reader = csv.DictReader(f)
+                rows = list(reader)
+            self.assertIn('cpu_DnsLoad_percent', reader.fieldnames)
+            self.assertIn('cpu_SocialUser_percent', reader.fieldnames)
+            self.assertEqual(len(rows), 3)
+            self.assertEqual(rows[1]['cpu_DnsLoad_percent'], '')
+            self.assertEqual(rows[2]['cpu_DnsLoad_percent'], '85.0')
+
+        log.reset()
+        self.assertEqual(log.table_rows(), [])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
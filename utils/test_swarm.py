@@ -0,0 +1,93 @@
+"""
+UeTable 與 SwarmScheduler 單元測試
+
+執行方式：python -m pytest utils/test_swarm.py -v
+或：python -m unittest utils/test_swarm.py
+"""
+
+import sys
+import time
+import unittest
+from pathlib import Path
+
+import gevent
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.swarm import STOPPED, SwarmScheduler, UeTable
+
+
+class TestUeTable(unittest.TestCase):
+    """UeTable 單元測試類別"""
+
+    def test_01_interned_state(self):
+        """測試來源 IP 與目標伺服器只保存一份，UE 只記錄索引"""
+        table = UeTable(["SocialUser", "DnsLoad"], capacity=3, max_targets=2)
+        a = table.add(0, "10.0.0.1", ["10.201.0.1", "10.201.0.2", "10.201.0.3"])
+        b = table.add(0, "10.0.0.1", ["10.201.0.2"])
+        c = table.add(1, "10.0.0.2", [])
+        self.assertEqual(table.ips, ["10.0.0.1", "10.0.0.2"])
+        self.assertEqual(table.hosts, ["10.201.0.1", "10.201.0.2"])
+        self.assertEqual(int(table.target_count[a]), 2)
+        self.assertEqual(table.random_target(b), "10.201.0.2")
+        self.assertIsNone(table.random_target(c))
+        self.assertEqual(table.kind_name(c), "DnsLoad")
+        with self.assertRaises(IndexError):
+            table.add(0, "10.0.0.3", [])
+
+    def test_02_migrate_and_running(self):
+        """測試依來源 IP 找出執行中的 UE，已停止的 UE 不列入"""
+        table = UeTable(["SocialUser", "DnsLoad"], capacity=4, max_targets=1)
+        for kind, ip in ((0, "10.0.0.1"), (1, "10.0.0.1"), (1, "10.0.0.1"), (0, "10.0.0.2")):
+            table.add(kind, ip, [])
+        table.kind[2] = STOPPED
+        self.assertEqual(table.ues_on_ip("10.0.0.1").tolist(), [0, 1])
+        self.assertEqual(table.ues_on_ip("10.9.9.9").tolist(), [])
+        table.set_source_ip(0, "10.0.0.2")
+        self.assertEqual(table.source_ip(0), "10.0.0.2")
+        self.assertEqual(table.running(), {"SocialUser": 2, "DnsLoad": 1})
+
+
+class TestSwarmScheduler(unittest.TestCase):
+    """SwarmScheduler 單元測試類別"""
+
+    def test_03_fires_in_time_order(self):
+        """測試到期的 UE 依時間順序執行，已停止的 UE 略過，未到期的留在 heap"""
+        table = UeTable(["SocialUser"], capacity=4, max_targets=1)
+        for _ in range(4):
+            table.add(0, "10.0.0.1", [])
+        fired = []
+        scheduler = SwarmScheduler(table, lambda ue, when: fired.append(ue))
+        now = 100.0
+        for ue, delay in ((0, 3.0), (1, 1.0), (2, 2.0), (3, 10.0)):
+            scheduler.schedule(ue, delay, now)
+        table.kind[2] = STOPPED
+        self.assertEqual(scheduler.run_due(now + 5), 2)
+        self.assertEqual(fired, [1, 0])
+        self.assertEqual(len(scheduler), 1)
+        self.assertEqual(table.next_fire[3], 110.0)
+
+    def test_04_run_loop_reschedules(self):
+        """測試執行迴圈：dispatch 後重新排程的 UE 會持續執行，並回報排程延誤"""
+        table = UeTable(["DnsLoad"], capacity=100, max_targets=1)
+        lags = []
+
+        def dispatch(ue, when):
+            scheduler.schedule(ue, 0.01)
+
+        scheduler = SwarmScheduler(table, dispatch, on_lag=lags.append)
+        for _ in range(100):
+            scheduler.schedule(table.add(0, "10.0.0.1", []), 0.0)
+        runner = gevent.spawn(scheduler.run)
+        gevent.sleep(0.2)
+        runner.kill()
+        # 100 個 UE 每 10ms 執行一次，0.2 秒內至少執行數輪
+        self.assertGreater(scheduler.fired, 500)
+        self.assertTrue(all(lag >= 0 for lag in lags))
+        self.assertLess(time.perf_counter() - max(table.next_fire), 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
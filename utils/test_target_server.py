@@ -11,6 +11,8 @@ import sys
 from pathlib import Path
 from collections import Counter
 import threading
+import time
+import ipaddress
 from unittest.mock import patch, MagicMock
 
 # 添加專案根目錄到 Python 路徑
@@ -49,6 +51,12 @@ TEST_SUBNETS = [
 ]
 
 
+def make_manager(subnets):
+    """以指定的子網設定建立 TargetServerManager（呼叫前需重置單例）"""
+    with patch.object(TargetServerManager, '_load_subnets', return_value=subnets):
+        return TargetServerManager()
+
+
 class TestTargetServerManager(unittest.TestCase):
     """TargetServerManager 單元測試類別"""
     
@@ -58,8 +66,7 @@ class TestTargetServerManager(unittest.TestCase):
         TargetServerManager._instance = None
         
         # Mock _load_subnets 方法返回測試配置
-        with patch.object(TargetServerManager, '_load_subnets', return_value=TEST_SUBNETS):
-            self.manager = TargetServerManager()
+        self.manager = make_manager(TEST_SUBNETS)
     
     def tearDown(self):
         """測試後清理"""
@@ -80,12 +87,16 @@ class TestTargetServerManager(unittest.TestCase):
             self.assertGreater(subnet_config['weight'], 0, "配重應該大於 0")
     
     def test_03_ip_pool_structure(self):
-        """測試 IP 池結構"""
-        for ip_info in self.manager.ip_pools:
-            self.assertIn('ip', ip_info)
-            self.assertIn('weight', ip_info)
-            self.assertIn('user_types', ip_info)
-            self.assertIsInstance(ip_info['user_types'], list)
+        """測試 IP 池結構（每個子網一筆記錄）"""
+        self.assertEqual(len(self.manager.ip_pools), len(TEST_SUBNETS))
+        for pool in self.manager.ip_pools:
+            self.assertIn('first_host', pool)
+            self.assertIn('num_hosts', pool)
+            self.assertIn('weight', pool)
+            self.assertIn('user_types', pool)
+            self.assertIsInstance(pool['user_types'], frozenset)
+            self.assertEqual(pool['num_hosts'], 14, "/28 子網應該有 14 個可用主機")
+        self.assertEqual(self.manager.total_hosts, 14 * len(TEST_SUBNETS))
     
     def test_04_get_target_servers_social_user(self):
         """測試 SocialUser 獲取目標伺服器"""
@@ -252,7 +263,19 @@ class TestTargetServerManager(unittest.TestCase):
         # 數量應該符合請求
         self.assertEqual(len(servers), 1000)
     
-    def test_16_singleton_pattern(self):
+    def test_16_sampling_tables_prebuilt(self):
+        """測試每種 User 類型的抽樣表在載入時預先建立"""
+        tables = self.manager._sampling_tables
+        self.assertEqual(set(tables), {"SocialUser", "VideoUser", "DnsLoad"})
+        self.assertEqual(len(tables["SocialUser"]['pools']), 3)
+        self.assertEqual(len(tables["VideoUser"]['pools']), 2)
+        self.assertEqual(len(tables["DnsLoad"]['pools']), 1)
+        # SocialUser: 3*14 + 3*14 + 1*14
+        self.assertEqual(tables["SocialUser"]['cum_weights'][-1], 98)
+        # 沒有不限類型的子網，未知類型沒有抽樣表
+        self.assertIsNone(self.manager._get_sampling_table("UnknownUser"))
+    
+    def test_17_singleton_pattern(self):
         """測試單例模式"""
         # 注意：由於我們在 setUp 中重置單例，這裡測試的是正常運行時的單例行為
         with patch.object(TargetServerManager, '_load_subnets', return_value=TEST_SUBNETS):
@@ -261,6 +284,138 @@ class TestTargetServerManager(unittest.TestCase):
             self.assertIs(manager1, manager2, "應該返回同一個實例")
 
 
+class TestLazyIpPools(unittest.TestCase):
+    """大型子網的延遲展開 IP 池測試"""
+    
+    def setUp(self):
+        TargetServerManager._instance = None
+    
+    def tearDown(self):
+        TargetServerManager._instance = None
+    
+    def test_01_large_subnet_is_not_materialized(self):
+        """/12 子網只應該產生一筆池記錄"""
+        manager = make_manager([
+            {"subnet": "10.192.0.0/12", "weight": 1, "user_types": []}
+        ])
+        self.assertEqual(len(manager.ip_pools), 1)
+        self.assertEqual(manager.total_hosts, 2 ** 20 - 2)
+        
+        network = ipaddress.ip_network("10.192.0.0/12")
+        servers = manager.get_target_servers("SocialUser", 30)
+        self.assertEqual(len(servers), 30)
+        self.assertEqual(len(set(servers)), 30, "不應該有重複的 IP")
+        for ip in servers:
+            address = ipaddress.ip_address(ip)
+            self.assertIn(address, network)
+            self.assertNotEqual(address, network.network_address)
+            self.assertNotEqual(address, network.broadcast_address)
+    
+    def test_02_small_prefixes_match_hosts(self):
+        """/31、/32 與 IPv6 子網的主機範圍應與 ipaddress.hosts() 一致"""
+        for cidr in ["10.0.0.0/30", "10.0.0.0/31", "10.0.0.1/32", "fd00::/126"]:
+            manager = make_manager([{"subnet": cidr, "weight": 1}])
+            expected = {str(ip) for ip in ipaddress.ip_network(cidr).hosts()}
+            servers = manager.get_target_servers("SocialUser", len(expected))
+            self.assertEqual(set(servers), expected, f"{cidr} 的主機範圍不正確")
+            TargetServerManager._instance = None
+    
+    def test_03_weight_is_per_host(self):
+        """子網被選中的機率應與 weight * 主機數成正比"""
+        manager = make_manager([
+            {"subnet": "10.0.0.0/24", "weight": 1},   # 254 hosts
+            {"subnet": "10.1.0.0/28", "weight": 1},   # 14 hosts
+        ])
+        big = ipaddress.ip_network("10.0.0.0/24")
+        hits = sum(ipaddress.ip_address(manager.get_random_target_server("SocialUser")) in big
+                   for _ in range(2000))
+        # 期望值約 254 / 268 ≈ 0.948
+        self.assertGreater(hits / 2000, 0.9)
+
+    def test_04_port_suffix(self):
+        """子網設定 port 時回傳 host:port，其他子網不受影響"""
+        manager = make_manager([
+            {"subnet": "127.0.1.0/30", "weight": 1, "port": 18080, "user_types": ["SocialUser"]},
+            {"subnet": "10.0.0.0/30", "weight": 1, "user_types": ["VideoUser"]},
+        ])
+        self.assertEqual(set(manager.get_target_servers("SocialUser", 2)), {"127.0.1.1:18080", "127.0.1.2:18080"})
+        self.assertEqual(set(manager.get_target_servers("VideoUser", 2)), {"10.0.0.1", "10.0.0.2"})
+
+
+class TestWeightedSampling(unittest.TestCase):
+    """加權不重複抽樣測試"""
+    
+    def setUp(self):
+        TargetServerManager._instance = None
+    
+    def tearDown(self):
+        TargetServerManager._instance = None
+    
+    def test_01_full_pool_is_permutation(self):
+        """請求數量等於可用 IP 數量時，應該剛好取出所有主機"""
+        manager = make_manager([
+            {"subnet": "10.0.0.0/28", "weight": 1000},
+            {"subnet": "10.0.1.0/28", "weight": 1},
+        ])
+        servers = manager.get_target_servers("SocialUser", 28)
+        self.assertEqual(len(servers), 28)
+        self.assertEqual(len(set(servers)), 28)
+    
+    def test_02_first_pick_follows_weights(self):
+        """第一個被選中的主機應依配重分布（等同依序加權抽樣）"""
+        manager = make_manager([
+            {"subnet": "10.0.0.1/32", "weight": 3},
+            {"subnet": "10.0.0.2/32", "weight": 1},
+        ])
+        trials = 4000
+        first = Counter(manager.get_target_servers("SocialUser", 2)[0] for _ in range(trials))
+        self.assertAlmostEqual(first["10.0.0.1"] / trials, 0.75, delta=0.04)
+    
+    @staticmethod
+    def _best_time(function, repeat=3):
+        """執行 repeat 次取最短時間，降低排程雜訊"""
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            best = min(best, time.perf_counter() - start)
+        return best
+    
+    def _time_allocations(self, manager, count, rounds):
+        table = manager._get_sampling_table("SocialUser")
+        
+        def allocate():
+            for _ in range(rounds):
+                servers = manager._sample_without_replacement(table, count)
+                self.assertEqual(len({pool['first_host'] + offset for pool, offset in servers}), count)
+        return self._best_time(allocate)
+    
+    def test_03_allocation_time_independent_of_skew_and_size(self):
+        """分配時間與配重偏斜程度、子網大小無關：與均勻配重的小型分配比較每個目標的時間"""
+        uniform = make_manager([
+            {"subnet": "10.0.0.0/27", "weight": 1, "user_types": ["SocialUser"]},
+            {"subnet": "10.0.1.0/28", "weight": 1, "user_types": ["SocialUser"]},
+        ])
+        uniform_elapsed = self._time_allocations(uniform, 44, 200)
+        TargetServerManager._instance = None
+        
+        # 高度偏斜的配重，請求數量等於池大小（舊的重試法在此情況下重試次數沒有上限）
+        skewed = make_manager([
+            {"subnet": "10.0.0.0/27", "weight": 10000, "user_types": ["SocialUser"]},
+            {"subnet": "10.0.1.0/28", "weight": 1, "user_types": ["SocialUser"]},
+        ])
+        skewed_elapsed = self._time_allocations(skewed, 44, 200)
+        TargetServerManager._instance = None
+        
+        # /16 子網中一次分配 20000 個不重複的目標（與上面相同的目標總數量級）
+        large = make_manager([{"subnet": "10.201.0.0/16", "weight": 1}])
+        large_elapsed = self._time_allocations(large, 20000, 1)
+        
+        per_target = uniform_elapsed / (44 * 200)
+        self.assertLess(skewed_elapsed / (44 * 200), per_target * 3)
+        self.assertLess(large_elapsed / 20000, per_target * 3)
+
+
 class TestTargetServerIntegration(unittest.TestCase):
     """整合測試"""
     
@@ -270,8 +425,7 @@ class TestTargetServerIntegration(unittest.TestCase):
         TargetServerManager._instance = None
         
         # Mock _load_subnets 方法返回測試配置
-        with patch.object(TargetServerManager, '_load_subnets', return_value=TEST_SUBNETS):
-            self.manager = TargetServerManager()
+        self.manager = make_manager(TEST_SUBNETS)
     
     def tearDown(self):
         """測試後清理"""
@@ -308,6 +462,8 @@ def run_tests(verbosity=2):
     
     # 載入所有測試
     suite.addTests(loader.loadTestsFromTestCase(TestTargetServerManager))
+    suite.addTests(loader.loadTestsFromTestCase(TestLazyIpPools))
+    suite.addTests(loader.loadTestsFromTestCase(TestWeightedSampling))
     suite.addTests(loader.loadTestsFromTestCase(TestTargetServerIntegration))
     
     # 執行測試
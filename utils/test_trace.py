@@ -0,0 +1,97 @@
+"""
+trace 讀取與重播排程單元測試
+
+執行方式：python -m pytest utils/test_trace.py -v
+或：python -m unittest utils/test_trace.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+# 添加專案根目錄到 Python 路徑
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.trace import ReplayClock, convert_jsonl_to_binary, iter_trace, shard_of
+
+
+RECORDS = [
+    {"ts": 1000.0, "method": "get", "path": "/feed", "target": "10.201.0.1", "source_ip": "10.60.100.1"},
+    {"ts": 1000.5, "method": "POST", "path": "/upload", "target": "10.201.0.2",
+     "source_ip": "10.60.100.2", "body_size": 512, "name": "UPLOAD"},
+    {"ts": 1001.25, "path": "/video/720p/seg-1.ts", "source_ip": "10.60.100.3"},
+    {"ts": 1002.0, "method": "GET", "path": "/feed", "target": "10.201.0.1", "source_ip": "10.60.100.1"},
+]
+
+
+class TestTraceReader(unittest.TestCase):
+    """iter_trace 單元測試類別"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.jsonl = os.path.join(self.tmpdir.name, "trace.jsonl")
+        with open(self.jsonl, "w") as f:
+            for record in RECORDS:
+                f.write(json.dumps(record) + "\n")
+            f.write("\n")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_01_jsonl(self):
+        """測試 JSONL 讀取：offset 相對於第一筆，預設值與大小寫正規化"""
+        records = list(iter_trace(self.jsonl))
+        self.assertEqual([r.offset for r in records], [0.0, 0.5, 1.25, 2.0])
+        self.assertEqual(records[0].method, "GET")
+        self.assertEqual(records[1].body_size, 512)
+        self.assertEqual(records[1].name, "UPLOAD")
+        self.assertIsNone(records[2].target)
+
+    def test_02_binary_roundtrip(self):
+        """測試轉成二進位格式後內容相同"""
+        binary = os.path.join(self.tmpdir.name, "trace.bin")
+        self.assertEqual(convert_jsonl_to_binary(self.jsonl, binary), len(RECORDS))
+        self.assertEqual(list(iter_trace(binary)), list(iter_trace(self.jsonl)))
+
+    def test_03_sharding(self):
+        """測試依來源 IP 分片：各分片互不重疊、合起來是完整 trace，offset 以整個 trace 為基準"""
+        shards = [list(iter_trace(self.jsonl, index, 3)) for index in range(3)]
+        merged = sorted((r for shard in shards for r in shard), key=lambda r: r.offset)
+        self.assertEqual(merged, list(iter_trace(self.jsonl)))
+        for index, shard in enumerate(shards):
+            for record in shard:
+                self.assertEqual(shard_of(record.source_ip, 3), index)
+
+    def test_04_empty_file(self):
+        """測試空檔案"""
+        empty = os.path.join(self.tmpdir.name, "empty.jsonl")
+        open(empty, "w").close()
+        self.assertEqual(list(iter_trace(empty)), [])
+
+
+class TestReplayClock(unittest.TestCase):
+    """ReplayClock 單元測試類別"""
+
+    def test_01_speed_scaling(self):
+        """測試倍速重播時等待時間依 speed 縮短，且誤差很小"""
+        clock = ReplayClock(speed=10)
+        lag = clock.wait_until(0.5)
+        elapsed = time.perf_counter() - clock.start
+        self.assertGreaterEqual(elapsed, 0.05)
+        self.assertLess(lag, 0.01)
+        # 已經過了的時間點不等待
+        self.assertGreater(clock.wait_until(0.0), 0)
+
+    def test_02_invalid_speed(self):
+        """測試 speed 必須為正數"""
+        with self.assertRaises(ValueError):
+            ReplayClock(speed=0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,142 @@
+import json
+import mmap
+import struct
+import time
+import zlib
+from collections import namedtuple
+from typing import Iterable, Iterator
+
+import gevent
+
+# 一筆 trace 記錄：offset 為相對於 trace 第一筆記錄的秒數
+TraceRecord = namedtuple('TraceRecord', ['offset', 'method', 'path', 'target', 'source_ip', 'body_size', 'name'])
+
+BINARY_MAGIC = b'LTRACE1\n'
+# ts, body_size, 以及 method / path / target / source_ip / name 的 UTF-8 長度
+_BINARY_HEADER = struct.Struct('<dQBHHHH')
+
+
+def shard_of(source_ip: str, shard_count: int) -> int:
+    """依來源 IP 的 crc32 決定所屬分片，同一個 IP 的請求永遠落在同一個 worker。"""
+    if shard_count <= 1:
+        return 0
+    return zlib.crc32((source_ip or '').encode()) % shard_count
+
+
+def _iter_jsonl(mm: mmap.mmap) -> Iterator[tuple]:
+    line_no = 0
+    while True:
+        line = mm.readline()
+        if not line:
+            return
+        line_no += 1
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid trace record at line {line_no}: {e}") from None
+        yield (float(item['ts']), item.get('method', 'GET').upper(), item['path'],
+               item.get('target'), item.get('source_ip'), int(item.get('body_size', 0)),
+               item.get('name'))
+
+
+def _iter_binary(mm: mmap.mmap) -> Iterator[tuple]:
+    pos = len(BINARY_MAGIC)
+    size = len(mm)
+    header_size = _BINARY_HEADER.size
+    while pos + header_size <= size:
+        ts, body_size, *lengths = _BINARY_HEADER.unpack_from(mm, pos)
+        pos += header_size
+        fields = []
+        for length in lengths:
+            fields.append(mm[pos:pos + length].decode() if length else None)
+            pos += length
+        method, path, target, source_ip, name = fields
+        yield ts, method, path, target, source_ip, body_size, name
+
+
+def iter_trace(path: str, shard_index: int = 0, shard_count: int = 1) -> Iterator[TraceRecord]:
+    """
+    以 mmap 逐筆讀取 trace 檔（JSONL 或二進位格式，依檔頭判斷），不把整個檔案載入記憶體。
+
+    JSONL 每行一筆：{"ts", "method", "path", "target", "source_ip", "body_size", "name"}，
+    只有 ts 與 path 為必填。offset 以整個 trace 的第一筆為基準（不是分片的第一筆），
+    因此各 worker 的分片在時間上對齊。
+
+    Args:
+        path: trace 檔路徑
+        shard_index: 這個行程負責的分片
+        shard_count: 分片總數（通常為 worker 數量）
+    """
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(BINARY_MAGIC)] == BINARY_MAGIC:
+                rows = _iter_binary(mm)
+            else:
+                rows = _iter_jsonl(mm)
+            start = None
+            for ts, method, req_path, target, source_ip, body_size, name in rows:
+                if start is None:
+                    start = ts
+                if shard_count > 1 and shard_of(source_ip, shard_count) != shard_index:
+                    continue
+                yield TraceRecord(ts - start, method, req_path, target, source_ip, body_size, name)
+
+
+def write_binary_trace(records: Iterable, path: str) -> int:
+    """
+    把記錄寫成二進位 trace 檔，回傳寫入筆數。
+    records 的每個項目為 (ts, method, path, target, source_ip, body_size, name)。
+    """
+    count = 0
+    with open(path, 'wb') as f:
+        f.write(BINARY_MAGIC)
+        for ts, method, req_path, target, source_ip, body_size, name in records:
+            encoded = [(value or '').encode() for value in (method, req_path, target, source_ip, name)]
+            f.write(_BINARY_HEADER.pack(ts, body_size, *(len(value) for value in encoded)))
+            for value in encoded:
+                f.write(value)
+            count += 1
+    return count
+
+
+def convert_jsonl_to_binary(source: str, destination: str) -> int:
+    """把 JSONL trace 轉成二進位格式（保留原始 ts）。"""
+    with open(source, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return write_binary_trace([], destination)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return write_binary_trace(_iter_jsonl(mm), destination)
+
+
+class ReplayClock:
+    """
+    依 trace 的 offset 決定送出時間，speed 為重播倍速（2 表示兩倍速）。
+
+    先以 sleep 等到接近目標時間，最後 spin_threshold 秒以讓出 CPU 的方式逐次檢查，
+    避免 sleep 的排程誤差累積在每個請求上。
+    """
+
+    def __init__(self, speed: float = 1.0, spin_threshold: float = 0.002):
+        if speed <= 0:
+            raise ValueError(f"speed must be positive, got {speed}")
+        self.speed = speed
+        self.spin_threshold = spin_threshold
+        self.start = time.perf_counter()
+
+    def due(self, offset: float) -> float:
+        return self.start + offset / self.speed
+
+    def wait_until(self, offset: float) -> float:
+        """等到 offset 對應的時間，回傳實際送出時間比預定晚了幾秒（lag）。"""
+        due = self.due(offset)
+        delay = due - time.perf_counter()
+        if delay > self.spin_threshold:
+            gevent.sleep(delay - self.spin_threshold)
+        while time.perf_counter() < due:
+            gevent.sleep(0)
+        return time.perf_counter() - due
@@ -0,0 +1,53 @@
+import json
+import logging
+from typing import Callable, Dict, List
+
+from flask import jsonify, request
+
+logger = logging.getLogger(__name__)
+
+
+def register_web_table(environment, key: str, title: str, structure: List[Dict[str, str]],
+                       rows: Callable[[], List[Dict]]):
+    """
+    在 Locust web UI 加入一個分頁表格，並提供 /tables/<key> 的 JSON 端點。
+
+    Args:
+        environment: Locust Environment（沒有 web UI 時不做任何事）
+        key: 分頁識別字
+        title: 分頁標題
+        structure: 欄位定義 [{'key': 欄位名稱, 'title': 顯示名稱}, ...]
+        rows: 回傳目前表格資料的函數，每列為 {欄位名稱: 值}
+    """
+    web_ui = environment.web_ui
+    if web_ui is None:
+        return
+
+    tables = getattr(web_ui, '_extra_tables', None)
+    if tables is None:
+        tables = web_ui._extra_tables = {}
+        _install_hooks(web_ui, tables)
+    tables[key] = rows
+
+    web_ui.template_args.setdefault('extended_tabs', []).append({'title': title, 'key': key})
+    web_ui.template_args.setdefault('extended_tables', []).append({'key': key, 'structure': structure})
+
+    def table_json():
+        return jsonify(rows())
+    web_ui.app.add_url_rule(f"/tables/{key}", f"table_{key}", web_ui.auth_required_if_enabled(table_json))
+
+
+def _install_hooks(web_ui, tables: Dict[str, Callable[[], List[Dict]]]):
+    """web UI 定期讀取 /stats/requests，把各表格的資料附在 extended_stats 中。"""
+
+    @web_ui.app.after_request
+    def _extend_stats_response(response):
+        if not request.path.endswith('/stats/requests') or response.status_code != 200:
+            return response
+        try:
+            data = json.loads(response.get_data())
+            data['extended_stats'] = [{'key': key, 'data': rows()} for key, rows in tables.items()]
+            response.set_data(json.dumps(data))
+        except Exception:
+            logger.exception("[WebTables] Failed to extend stats response")
+        return response